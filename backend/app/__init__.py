@@ -1,13 +1,19 @@
+import time
 from flask import Flask
 from flask_cors import CORS
 from .routes.chat import chat_bp
 from .routes.providers import providers_bp
 from .config import Config, configure_logging
-from .services.monitoring import MonitoringService
+from .models import init_db
+from .services.monitoring import get_monitoring
+from .services.tracing import get_tracer
+from .services.usage_ledger import get_usage_ledger
 from app.services.ai_providers.registry_singleton import provider_registry
+from app.services.model_refresh_scheduler import get_model_refresh_scheduler
 
 def create_app(config_class=Config):
     """Create and configure the Flask application"""
+    started = time.perf_counter()
     app = Flask(__name__)
 
     # Apply configuration
@@ -19,17 +25,30 @@ def create_app(config_class=Config):
     # Configure logging
     configure_logging(app)
 
-    # Initialize monitoring service - commented out to avoid port conflict
-    monitoring_service = MonitoringService()
-    # monitoring_service.start_server()
+    # Request and provider metrics, served at /metrics on the app itself
+    if config_class.METRICS_ENABLED:
+        get_monitoring().init_app(app)
+
+    # Trace ids in every response; spans are recorded for a sample of requests
+    get_tracer().init_app(app)
+
+    # Conversation history; sessions are released at the end of each request
+    init_db(app)
+
+    # Usage of each request is attributed to the user named in USAGE_USER_HEADER
+    if config_class.USAGE_LEDGER_ENABLED:
+        get_usage_ledger().init_app(app)
 
     # Register blueprints
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
     app.register_blueprint(providers_bp, url_prefix='/api')
 
-    # --- Auto-register providers with API keys from .env ---
-    # (Now handled in registry_singleton.py)
-    # --- End auto-registration ---
+    # Providers are discovered and registered lazily by the shared registry;
+    # API keys are validated in the background on first use.
+
+    # Every worker runs the scheduler; only the lease holder refreshes models
+    if config_class.MODEL_REFRESH_ENABLED:
+        get_model_refresh_scheduler().start()
 
     # Error handlers
     @app.errorhandler(404)
@@ -42,4 +61,14 @@ def create_app(config_class=Config):
         app.logger.error(f'Server Error: {error}')
         return {'error': 'Internal server error'}, 500
 
+    app.logger.info(f"Application created in {(time.perf_counter() - started) * 1000:.1f}ms")
     return app
+
+def create_asgi_app(config_class=Config):
+    """
+    Create the ASGI application.
+    Chat completion and streaming routes run on the event loop; all other
+    routes are served by the Flask app from create_app.
+    """
+    from .asgi import AsyncChatApp
+    return AsyncChatApp(create_app(config_class))
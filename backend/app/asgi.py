@@ -0,0 +1,234 @@
+"""
+ASGI front end for the chat API.
+
+The latency-bound routes (/api/chat/completions, /api/chat/stream and
+/api/chat/batch) are served
+natively on the event loop through the providers' async interface, so a single
+process can hold thousands of upstream calls open without pinning a thread per
+request. Every other route is delegated to the Flask app through a WSGI adapter.
+"""
+import json
+import logging
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app.services.ai_providers.http_transport import get_http_transport
+from app.services.ai_providers.registry_singleton import provider_registry
+from app.services.completion_service import CompletionService
+from app.services.batch import BatchRunner, parse_batch, summary
+from app.config import Config
+from app.services.monitoring import get_monitoring
+from app.services.tracing import get_tracer, trace_span
+from app.services.usage_ledger import set_current_user
+from app.services.resilience import CircuitOpenError
+from app.services.ai_providers.rate_limiter import RateLimitExceeded
+from app.utils.utils import stream_event_to_sse, sse_event, SSE_HEADERS
+
+logger = logging.getLogger(__name__)
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+STREAM_HEADERS = [(b'content-type', b'text/event-stream')] + [
+    (name.lower().encode(), value.encode()) for name, value in SSE_HEADERS.items()
+] + CORS_HEADERS
+NDJSON_HEADERS = [(b'content-type', b'application/x-ndjson')] + STREAM_HEADERS[1:]
+
+
+async def _read_json(receive):
+    """Read the full request body and decode it as JSON"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return json.loads(body) if body else {}
+
+
+async def _read_object(receive):
+    """
+    Read a request body that must be a JSON object
+
+    :raises ValueError: If the body is not valid JSON or not an object
+    """
+    data = await _read_json(receive)
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    return data
+
+
+async def _send_json(send, data, status=200):
+    """Send a complete JSON response"""
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())] + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AsyncChatApp:
+    """
+    ASGI application serving chat routes natively and everything else via Flask
+    """
+
+    def __init__(self, flask_app, registry=provider_registry):
+        """
+        :param flask_app: Flask application handling the remaining routes
+        :param registry: Provider registry used to resolve providers
+        """
+        self.flask_app = flask_app
+        self.registry = registry
+        self.completion_service = CompletionService(registry)
+        self.batch_runner = BatchRunner(self.completion_service)
+        self._wsgi = WsgiToAsgi(flask_app)
+        self._routes = {
+            ('POST', '/api/chat/completions'): self.generate_completion,
+            ('POST', '/api/chat/stream'): self.stream_completion,
+            ('POST', '/api/chat/batch'): self.batch_completion,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http':
+            handler = self._routes.get((scope['method'], scope['path']))
+            if handler is not None:
+                await self._observed(handler, scope, receive, send)
+                return
+
+        await self._wsgi(scope, receive, send)
+
+    async def _observed(self, handler, scope, receive, send):
+        """Serve a native route, recording it in the request metrics, traces and usage like Flask routes"""
+        tracer = get_tracer()
+        headers = dict(scope.get('headers') or [])
+        traceparent = headers.get(b'traceparent', b'').decode('latin-1')
+        # Each request runs in its own task, so the user does not outlive it
+        set_current_user(headers.get(Config.USAGE_USER_HEADER.lower().encode('latin-1'), b'').decode('latin-1') or None)
+        span = tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent,
+                                  **{'http.method': scope['method'], 'http.route': scope['path']})
+        error = None
+        with get_monitoring().track_http(scope['method'], scope['path']) as outcome:
+            async def send_and_record(message):
+                if message['type'] == 'http.response.start':
+                    outcome['status'] = message['status']
+                    span.set_attribute('http.status_code', message['status'])
+                    message = dict(message, headers=list(message.get('headers') or []) + [
+                        (b'traceparent', span.traceparent.encode()), (b'x-trace-id', span.trace_id.encode())])
+                await send(message)
+            try:
+                await handler(scope, receive, send_and_record)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                tracer.finish_trace(span, error)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await get_http_transport().aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def generate_completion(self, scope, receive, send):
+        """Generate a chat completion"""
+        with trace_span('parse_request'):
+            try:
+                data = await _read_object(receive)
+            except ValueError as ve:
+                await _send_json(send, {'error': f"Invalid request body: {ve}"}, 400)
+                return
+        try:
+            response = await self.completion_service.agenerate_completion(
+                data.get('provider'), data.get('model'), data.get('messages', []),
+                data.get('options', {}), data.get('cache'), data.get('hedge')
+            )
+        except ValueError as ve:
+            await _send_json(send, {'error': str(ve)}, 400)
+            return
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            await _send_json(send, {'error': str(e)}, e.status_code)
+            return
+        except Exception as e:
+            logger.error(f"Server Error: {e}")
+            await _send_json(send, {'error': 'Internal server error'}, 500)
+            return
+
+        if isinstance(response, dict) and response.get('error'):
+            await _send_json(send, {'error': response['error']}, 400)
+            return
+        with trace_span('serialize'):
+            await _send_json(send, response)
+
+    async def stream_completion(self, scope, receive, send):
+        """Generate a streaming chat completion as Server-Sent Events"""
+        with trace_span('parse_request'):
+            try:
+                data = await _read_object(receive)
+            except ValueError as ve:
+                await _send_json(send, {'error': f"Invalid request body: {ve}"}, 400)
+                return
+        try:
+            events = self.completion_service.astream_completion(
+                data.get('provider'), data.get('model'), data.get('messages', []),
+                data.get('options', {}), data.get('cache'), data.get('hedge')
+            )
+        except ValueError as ve:
+            await _send_json(send, {'error': str(ve)}, 400)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': STREAM_HEADERS
+        })
+        with trace_span('stream') as span:
+            serialize = 0.0
+            try:
+                async for chunk in events:
+                    started = time.perf_counter()
+                    body = stream_event_to_sse(chunk).encode('utf-8')
+                    serialize += time.perf_counter() - started
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            except Exception as e:
+                logger.error(f"Error streaming response: {e}")
+                await send({'type': 'http.response.body',
+                            'body': sse_event({'error': str(e)}, event='error').encode('utf-8'),
+                            'more_body': True})
+            finally:
+                if span is not None:
+                    span.set_attribute('serialize_ms', round(serialize * 1000, 3))
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def batch_completion(self, scope, receive, send):
+        """Run a list of chat completions concurrently, streaming each result as an NDJSON line"""
+        with trace_span('parse_request'):
+            try:
+                items = parse_batch(await _read_json(receive), Config.BATCH_MAX_ITEMS)
+            except ValueError as ve:
+                await _send_json(send, {'error': str(ve)}, 400)
+                return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': NDJSON_HEADERS
+        })
+        started, total, failed = time.perf_counter(), 0, 0
+        with trace_span('batch', items=len(items)):
+            async for result in self.batch_runner.arun(items):
+                total += 1
+                failed += result['status'] != 200
+                await send({'type': 'http.response.body', 'body': (json.dumps(result) + '\n').encode('utf-8'),
+                            'more_body': True})
+        await send({'type': 'http.response.body',
+                    'body': (json.dumps(summary(total, failed, started)) + '\n').encode('utf-8')})
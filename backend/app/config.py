@@ -19,6 +19,125 @@ class Config:
     DEFAULT_PROVIDER = os.getenv('DEFAULT_PROVIDER', 'deepseek')
     DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', 'deepseek-chat')
 
+    # Shared HTTP transport used by all providers
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 32))  # Per-host pools kept alive
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 50))  # Keep-alive connections per host
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+    HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'
+
+    # API key validation
+    KEY_VALIDATION_TIMEOUT = float(os.getenv('KEY_VALIDATION_TIMEOUT', 5))  # Seconds per validation request
+    KEY_VALIDATION_CACHE_TTL = int(os.getenv('KEY_VALIDATION_CACHE_TTL', 30)) * 60  # Minutes, stored in seconds
+    KEY_VALIDATION_CACHE_FILE = os.getenv(
+        'KEY_VALIDATION_CACHE_FILE',
+        os.path.join(os.path.dirname(__file__), 'services', 'key_validation_cache.json')
+    )
+
+    # Completion response cache (opt-in)
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000))  # In-memory LRU size
+    RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR', '')  # Empty disables the disk tier
+    RESPONSE_CACHE_DISK_MAX_MB = int(os.getenv('RESPONSE_CACHE_DISK_MAX_MB', 100))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 0))  # Seconds, 0 keeps entries until evicted
+
+    # Semantic (near-duplicate) completion cache (opt-in)
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92))  # Minimum cosine similarity
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 5000))  # Per provider/model
+    SEMANTIC_CACHE_DIM = int(os.getenv('SEMANTIC_CACHE_DIM', 512))
+
+    # Discovered model lists, one row per provider
+    MODEL_STORE_PATH = os.getenv('MODEL_STORE_PATH') or os.path.join(
+        os.path.dirname(__file__), 'services', 'model_cache.db'
+    )
+    MODEL_CACHE_SOFT_TTL = int(os.getenv('MODEL_CACHE_SOFT_TTL', 60 * 60))  # Seconds, then refreshed in the background
+    MODEL_CACHE_HARD_TTL = int(os.getenv('MODEL_CACHE_HARD_TTL', 24 * 60 * 60))  # Seconds, then refreshed before answering
+    MODEL_CACHE_FAILURE_TTL = int(os.getenv('MODEL_CACHE_FAILURE_TTL', 60))  # Seconds a failed or empty fetch is not retried
+
+    # Periodic model refresh, run by one worker per deployment
+    MODEL_REFRESH_ENABLED = os.getenv('MODEL_REFRESH_ENABLED', 'true').lower() == 'true'
+    MODEL_REFRESH_INTERVAL = int(os.getenv('MODEL_REFRESH_INTERVAL', 60 * 60))  # Seconds
+    MODEL_REFRESH_INTERVALS = os.getenv('MODEL_REFRESH_INTERVALS', '')  # Per provider, e.g. "groq=1800,openai=86400"
+    MODEL_REFRESH_JITTER = float(os.getenv('MODEL_REFRESH_JITTER', 0.1))  # Fraction of the interval
+    MODEL_REFRESH_WORKERS = int(os.getenv('MODEL_REFRESH_WORKERS', 4))
+    MODEL_REFRESH_TICK = int(os.getenv('MODEL_REFRESH_TICK', 30))  # Seconds between scheduler checks
+
+    # Share one upstream call between concurrent identical requests
+    COALESCE_REQUESTS = os.getenv('COALESCE_REQUESTS', 'true').lower() == 'true'
+
+    # Hedged requests: race a backup provider/model when the primary is slow
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() == 'true'
+    HEDGE_TARGETS = os.getenv('HEDGE_TARGETS', '')  # e.g. "groq=openai:gpt-4o-mini,openai:gpt-4o=groq:llama-3.3-70b-versatile"
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))  # Of the primary's time to first token
+    HEDGE_MIN_DELAY_MS = int(os.getenv('HEDGE_MIN_DELAY_MS', 250))
+    HEDGE_MAX_DELAY_MS = int(os.getenv('HEDGE_MAX_DELAY_MS', 10000))
+    HEDGE_DEFAULT_DELAY_MS = int(os.getenv('HEDGE_DEFAULT_DELAY_MS', 2000))  # Until enough latency samples exist
+
+    # Retries and circuit breakers around every provider call
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 3))  # Including the first call
+    RETRY_BASE_DELAY_MS = int(os.getenv('RETRY_BASE_DELAY_MS', 250))
+    RETRY_MAX_DELAY_MS = int(os.getenv('RETRY_MAX_DELAY_MS', 8000))  # A longer Retry-After is not waited for
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+    BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', 30))
+    BREAKER_HALF_OPEN_TRIALS = int(os.getenv('BREAKER_HALF_OPEN_TRIALS', 1))
+
+    # Client-side rate limits per provider key; learned from x-ratelimit-* headers when not set
+    PROVIDER_RATE_LIMITS = os.getenv('PROVIDER_RATE_LIMITS', '')  # e.g. "groq=30/6000,openai=500/200000" (requests/tokens per minute)
+    RATE_LIMIT_MAX_WAIT_MS = int(os.getenv('RATE_LIMIT_MAX_WAIT_MS', 5000))  # Longer waits are rejected with a 429
+
+    # Base URL overrides for OpenAI-compatible providers, e.g. "groq=http://127.0.0.1:9100/v1" for a proxy or mock
+    PROVIDER_BASE_URLS = os.getenv('PROVIDER_BASE_URLS', '')
+
+    # Several API keys per provider (comma-separated PROVIDER_API_KEY or repeated registrations)
+    KEY_POOL_MAX_RATE_LIMITED = int(os.getenv('KEY_POOL_MAX_RATE_LIMITED', 3))  # Consecutive 429s before a key is rested
+    KEY_POOL_COOLDOWN_SECONDS = float(os.getenv('KEY_POOL_COOLDOWN_SECONDS', 60))
+
+    # Prometheus metrics at /metrics; set PROMETHEUS_MULTIPROC_DIR to aggregate several workers
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+    # Request tracing; spans are exported as JSON lines to TRACE_FILE ('file') or to an OTLP/HTTP collector ('otlp')
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', '').lower()  # Empty only propagates trace ids
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))  # Share of new traces recorded
+    TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+    TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318')
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'omnichat-backend')
+
+    # Batch completions (POST /api/chat/batch)
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+    BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 32))  # Items of one batch in flight at once
+    BATCH_PROVIDER_CONCURRENCY = os.getenv('BATCH_PROVIDER_CONCURRENCY', '')  # e.g. "groq=4,openai=16"
+    BATCH_DEFAULT_PROVIDER_CONCURRENCY = int(os.getenv('BATCH_DEFAULT_PROVIDER_CONCURRENCY', 8))
+
+    # Conversation history stored server-side
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or 'sqlite:///' + os.path.join(
+        os.path.dirname(__file__), 'omnichat.db'
+    )
+    CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 1000))  # Histories kept in memory
+
+    # Context-window management: older turns of over-long requests are replaced by a rolling summary
+    CONTEXT_MANAGEMENT_ENABLED = os.getenv('CONTEXT_MANAGEMENT_ENABLED', 'true').lower() == 'true'
+    CONTEXT_WINDOWS = os.getenv('CONTEXT_WINDOWS', '')  # e.g. "anthropic:claude-3-5-sonnet-latest=200000"; adds to the router's profiles
+    CONTEXT_MAX_INPUT_TOKENS = int(os.getenv('CONTEXT_MAX_INPUT_TOKENS', 0))  # Cap for every model, 0 for the window only
+    CONTEXT_KEEP_RATIO = float(os.getenv('CONTEXT_KEEP_RATIO', 0.5))  # Share of the budget left to recent turns
+    CONTEXT_SUMMARY_MODEL = os.getenv('CONTEXT_SUMMARY_MODEL', '')  # provider:model; empty for the request's own model
+    CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv('CONTEXT_SUMMARY_MAX_TOKENS', 512))
+    CONTEXT_SUMMARY_CHUNK_TOKENS = int(os.getenv('CONTEXT_SUMMARY_CHUNK_TOKENS', 6000))  # Turns folded in per call
+    CONTEXT_SUMMARY_CACHE_SIZE = int(os.getenv('CONTEXT_SUMMARY_CACHE_SIZE', 2000))
+
+    # Usage ledger: tokens, latency and cost of every upstream call, with per-minute/hour/day rollups
+    USAGE_LEDGER_ENABLED = os.getenv('USAGE_LEDGER_ENABLED', 'true').lower() == 'true'
+    USAGE_USER_HEADER = os.getenv('USAGE_USER_HEADER', 'X-User-Id')  # Request header naming the user to bill
+    USAGE_PRICES = os.getenv('USAGE_PRICES', '')  # e.g. "openai:gpt-4o=2.5/10" USD per million prompt/completion tokens
+    USAGE_BATCH_SIZE = int(os.getenv('USAGE_BATCH_SIZE', 500))
+    USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', 2.0))  # Seconds a partial batch waits
+    USAGE_MAX_QUEUE = int(os.getenv('USAGE_MAX_QUEUE', 50000))
+    USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', 90))  # Raw rows only, 0 keeps them forever
+
+    # Automatic routing for requests sent to the "auto" provider
+    AUTO_ROUTE_CANDIDATES = os.getenv('AUTO_ROUTE_CANDIDATES', '')  # e.g. "groq:llama-3.3-70b-versatile,openai:gpt-4o-mini"; empty for all known chat models
+    AUTO_ROUTE_EWMA_ALPHA = float(os.getenv('AUTO_ROUTE_EWMA_ALPHA', 0.2))  # Weight of the newest latency/error sample
+
     # Provider API Keys
     PROVIDER_KEYS = {
         'openai': os.getenv('OPENAI_API_KEY'),
@@ -1,27 +1,42 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.ext.declarative import declarative_base
-from backend.app.models.db_models import Base
+from app.models.db_models import Base
 
 # This will be set from the app's config
 engine = None
 db_session = None
 
+def init_engine(database_uri):
+    """
+    Create the engine, the session registry and any missing tables, once per process
+
+    :param database_uri: SQLAlchemy database URL
+    :return: Thread-local scoped_session
+    """
+    global engine, db_session
+    if engine is None:
+        # SQLite connections are handed between the threads of the pool
+        connect_args = {'check_same_thread': False} if database_uri.startswith('sqlite') else {}
+        engine = create_engine(database_uri, connect_args=connect_args)
+        db_session = scoped_session(
+            sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        )
+        Base.query = db_session.query_property()
+
+        # Create all tables if they don't exist
+        Base.metadata.create_all(bind=engine)
+        # create_all skips tables that exist, so add indexes introduced since they were created
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+    return db_session
+
 def init_db(app):
     """Initialize the database connection"""
-    global engine, db_session
-    
-    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
-    db_session = scoped_session(
-        sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    )
-    Base.query = db_session.query_property()
-    
-    # Create all tables if they don't exist
-    Base.metadata.create_all(bind=engine)
+    session = init_engine(app.config['SQLALCHEMY_DATABASE_URI'])
     
     @app.teardown_appcontext
     def shutdown_session(exception=None):
-        db_session.remove()
+        session.remove()
         
-    return db_session
+    return session
@@ -1,6 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON, Boolean, Index, Float
+from sqlalchemy.orm import declarative_base, relationship
 import datetime
 
 Base = declarative_base()
@@ -47,7 +46,7 @@ class Conversation(Base):
     __tablename__ = 'conversations'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'))  # None until accounts exist
     title = Column(String(256), default='New Conversation')
     provider_id = Column(String(64))  # The provider used for this conversation
     model_id = Column(String(128))    # The model used for this conversation
@@ -56,7 +55,8 @@ class Conversation(Base):
     
     # Relationships
     user = relationship('User', back_populates='conversations')
-    messages = relationship('Message', back_populates='conversation', order_by='Message.created_at')
+    messages = relationship('Message', back_populates='conversation', order_by='Message.id',
+                            cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Conversation {self.title}>'
@@ -65,6 +65,8 @@ class Conversation(Base):
 class Message(Base):
     """Model for storing message content"""
     __tablename__ = 'messages'
+    # A conversation's history is read in id order, or from the last message id a reader has seen
+    __table_args__ = (Index('ix_messages_conversation_id_id', 'conversation_id', 'id'),)
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False)
@@ -73,12 +75,12 @@ class Message(Base):
     model = Column(String(128))  # The model that generated this message (for assistant messages)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
-    # Metadata about the message
-    metadata = Column(JSON, default={})  # For storing things like tokens used, etc.
+    # Metadata about the message; 'metadata' is reserved by the declarative base, so it is mapped as meta
+    meta = Column('metadata', JSON, default=dict)  # For storing things like tokens used, etc.
     
     # Relationships
     conversation = relationship('Conversation', back_populates='messages')
-    attachments = relationship('Attachment', back_populates='message')
+    attachments = relationship('Attachment', back_populates='message', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Message {self.id}: {self.role}>'
@@ -101,3 +103,51 @@ class Attachment(Base):
     
     def __repr__(self):
         return f'<Attachment {self.file_name}>'
+
+
+class UsageRecord(Base):
+    """One upstream completion call: its tokens, latency and estimated cost"""
+    __tablename__ = 'usage_records'
+    __table_args__ = (Index('ix_usage_records_created_at', 'created_at'),)
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    provider_id = Column(String(64), nullable=False)
+    model = Column(String(128), nullable=False)
+    user_id = Column(String(128), nullable=False, default='')  # Caller-supplied id from USAGE_USER_HEADER
+    key_id = Column(String(16), nullable=False, default='')  # Fingerprint prefix of the provider API key
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    latency_ms = Column(Float, nullable=False, default=0.0)
+    cost = Column(Float, nullable=False, default=0.0)  # USD
+    estimated = Column(Boolean, nullable=False, default=False)  # Tokens counted locally, not reported by the vendor
+    error = Column(Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<UsageRecord {self.provider_id}:{self.model} {self.created_at}>'
+
+
+class UsageRollup(Base):
+    """Usage summed per minute, hour or day for one provider, model, user and key"""
+    __tablename__ = 'usage_rollups'
+    # Also serves range queries, which always name the granularity and a bucket range
+    __table_args__ = (Index('ux_usage_rollups_bucket', 'granularity', 'bucket', 'provider_id', 'model', 'user_id',
+                            'key_id', unique=True),)
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String(8), nullable=False)  # 'minute', 'hour' or 'day'
+    bucket = Column(DateTime, nullable=False)  # Start of the period, UTC
+    provider_id = Column(String(64), nullable=False)
+    model = Column(String(128), nullable=False)
+    user_id = Column(String(128), nullable=False, default='')
+    key_id = Column(String(16), nullable=False, default='')
+    requests = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    estimated = Column(Integer, nullable=False, default=0)  # Requests whose tokens were estimated
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    latency_ms = Column(Float, nullable=False, default=0.0)  # Sum; divide by requests for the mean
+    cost = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<UsageRollup {self.granularity} {self.bucket} {self.provider_id}:{self.model}>'
@@ -1,17 +1,26 @@
 import sys
 import os
 from flask import Blueprint, request, jsonify, Response, stream_with_context
-from app.utils.utils import error_response, success_response
-from app.services.ai_providers.provider_registry import ProviderRegistry
+from app.utils.utils import error_response, success_response, stream_event_to_sse, sse_event, SSE_HEADERS
 from app.services.ai_providers.registry_singleton import provider_registry
 from app.services.model_discovery import ModelDiscoveryService
+from app.services.completion_service import CompletionService
+from app.services.batch import BatchRunner, parse_batch, summary
+from app.services.conversation_store import get_conversation_store
+from app.config import Config
+from app.services.resilience import CircuitOpenError
+from app.services.ai_providers.rate_limiter import RateLimitExceeded
+from app.services.tracing import trace_span
 import base64
 import json
 import logging
+import time
 from io import BytesIO
 
 chat_bp = Blueprint('chat', __name__)
 model_discovery = ModelDiscoveryService()
+completion_service = CompletionService(provider_registry)
+batch_runner = BatchRunner(completion_service)
 logger = logging.getLogger(__name__)
 
 @chat_bp.route('/providers', methods=['GET'])
@@ -35,40 +44,197 @@ def list_models(provider_id):
 @chat_bp.route('/completions', methods=['POST'])
 def generate_completion():
     """Generate a chat completion"""
+    with trace_span('parse_request'):
+        data = request.json
+        provider_id = data.get('provider')
+        model = data.get('model')
+        messages = data.get('messages', [])
+        options = data.get('options', {})
+    try:
+        response = completion_service.generate_completion(
+            provider_id, model, messages, options, data.get('cache'), data.get('hedge')
+        )
+    except ValueError as ve:
+        return error_response(str(ve))
+    except (CircuitOpenError, RateLimitExceeded) as e:
+        return error_response(str(e), e.status_code)
+    if isinstance(response, dict) and response.get("error"):
+        return error_response(response["error"])
+    with trace_span('serialize'):
+        return success_response(response)
+
+@chat_bp.route('/stream', methods=['POST'])
+def stream_completion():
+  """Generate a streaming chat completion as Server-Sent Events"""
+  with trace_span('parse_request'):
     data = request.json
     provider_id = data.get('provider')
     model = data.get('model')
     messages = data.get('messages', [])
     options = data.get('options', {})
-    provider = provider_registry.get_provider(provider_id)
-    if not provider:
-        return error_response("Provider not configured")
-    response = provider.generate_completion(messages, model, options)
+  try:
+    events = completion_service.stream_completion(
+        provider_id, model, messages, options, data.get('cache'), data.get('hedge')
+    )
+  except ValueError as ve:
+    return error_response(str(ve))
+
+  def generate():
+    # Serialization is summed over the frames rather than given a span per frame
+    with trace_span('stream') as span:
+      serialize = 0.0
+      try:
+        for chunk in events:
+          started = time.perf_counter()
+          frame = stream_event_to_sse(chunk)
+          serialize += time.perf_counter() - started
+          yield frame
+      except Exception as e:
+        logger.error(f"Error streaming response: {e}")
+        yield sse_event({"error": str(e)}, event="error")
+      finally:
+        if span is not None:
+          span.set_attribute('serialize_ms', round(serialize * 1000, 3))
+
+  return Response(stream_with_context(generate()), content_type='text/event-stream', headers=SSE_HEADERS)
+
+@chat_bp.route('/batch', methods=['POST'])
+def batch_completion():
+    """Run a list of chat completions concurrently, streaming each result as an NDJSON line"""
+    with trace_span('parse_request'):
+        try:
+            items = parse_batch(request.get_json(silent=True), Config.BATCH_MAX_ITEMS)
+        except ValueError as ve:
+            return error_response(str(ve))
+
+    def generate():
+        started, total, failed = time.perf_counter(), 0, 0
+        with trace_span('batch', items=len(items)):
+            for result in batch_runner.run(items):
+                total += 1
+                failed += result['status'] != 200
+                yield json.dumps(result) + '\n'
+        yield json.dumps(summary(total, failed, started)) + '\n'
+
+    return Response(stream_with_context(generate()), content_type='application/x-ndjson',
+                    headers=SSE_HEADERS)
+
+@chat_bp.route('/conversations', methods=['POST'])
+def create_conversation():
+    """Start a server-side conversation"""
+    data = request.get_json(silent=True) or {}
+    conversation = get_conversation_store().create(
+        data.get('provider'), data.get('model'), data.get('title'), data.get('system')
+    )
+    return success_response(conversation, 201)
+
+@chat_bp.route('/conversations/<int:conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    """Get a conversation with all its messages"""
+    conversation = get_conversation_store().get(conversation_id)
+    if conversation is None:
+        return error_response("Conversation not found", 404)
+    return success_response(conversation)
+
+@chat_bp.route('/conversations/<int:conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Delete a conversation and its messages"""
+    if not get_conversation_store().delete(conversation_id):
+        return error_response("Conversation not found", 404)
+    return success_response({"deleted": conversation_id})
+
+def _conversation_turn(conversation_id, data):
+    """
+    Assemble a conversation request: the stored history plus the new user message
+
+    :return: (user message, history messages to send, provider id, model), or None if the conversation does not exist
+    :raises ValueError: If the request has no user message
+    """
+    message = data.get('message')
+    if isinstance(message, str):
+        message = {"role": "user", "content": message}
+    if not isinstance(message, dict) or not isinstance(message.get('content'), str) or not message['content'].strip():
+        raise ValueError("message is required")
+    message = {"role": "user", "content": message['content']}
+    history = get_conversation_store().history(conversation_id)
+    if history is None:
+        return None
+    return (message, history.messages + [message], data.get('provider') or history.provider_id,
+            data.get('model') or history.model)
+
+def _reply(model, text, final):
+    metadata = {key: final[key] for key in ('usage', 'finish_reason', 'cached') if final.get(key) is not None}
+    return {"role": "assistant", "content": text, "model": model, "metadata": metadata}
+
+@chat_bp.route('/conversations/<int:conversation_id>/completions', methods=['POST'])
+def conversation_completion(conversation_id):
+    """Continue a conversation with a new message; the history is read from and the reply saved to the server"""
+    with trace_span('parse_request'):
+        data = request.get_json(silent=True) or {}
+        try:
+            turn = _conversation_turn(conversation_id, data)
+        except ValueError as ve:
+            return error_response(str(ve))
+    if turn is None:
+        return error_response("Conversation not found", 404)
+    message, messages, provider_id, model = turn
+    try:
+        response = completion_service.generate_completion(
+            provider_id, model, messages, data.get('options', {}), data.get('cache'), data.get('hedge')
+        )
+    except ValueError as ve:
+        return error_response(str(ve))
+    except (CircuitOpenError, RateLimitExceeded) as e:
+        return error_response(str(e), e.status_code)
     if isinstance(response, dict) and response.get("error"):
         return error_response(response["error"])
-    return success_response(response)
-
-@chat_bp.route('/stream', methods=['POST'])
-def stream_completion():
-  """Generate a streaming chat completion"""
-  data = request.json
-  provider_id = data.get('provider')
-  model = data.get('model')
-  messages = data.get('messages', [])
-  options = data.get('options', {})
-  provider = provider_registry.get_provider(provider_id)
-  if not provider:
-    return error_response("Provider not configured")
+    # Saved only once answered, so a failed turn can simply be sent again
+    stored = get_conversation_store().append(
+        conversation_id, [message, _reply(model, response.get("text") or "", response)], provider_id, model
+    )
+    with trace_span('serialize'):
+        return success_response(dict(response, conversation_id=conversation_id,
+                                     message_ids=[m["id"] for m in stored]))
 
-  def generate():
+@chat_bp.route('/conversations/<int:conversation_id>/stream', methods=['POST'])
+def conversation_stream(conversation_id):
+    """Continue a conversation as Server-Sent Events; the reply is saved once the stream completes"""
+    with trace_span('parse_request'):
+        data = request.get_json(silent=True) or {}
+        try:
+            turn = _conversation_turn(conversation_id, data)
+        except ValueError as ve:
+            return error_response(str(ve))
+    if turn is None:
+        return error_response("Conversation not found", 404)
+    message, messages, provider_id, model = turn
     try:
-      for chunk in provider.stream_completion(messages, model, options):
-        yield chunk
-    except Exception as e:
-      logger.error(f"Error streaming response: {e}")
-      yield f"Error: {str(e)}"
+        events = completion_service.stream_completion(
+            provider_id, model, messages, data.get('options', {}), data.get('cache'), data.get('hedge')
+        )
+    except ValueError as ve:
+        return error_response(str(ve))
+
+    def generate():
+        parts, final = [], None
+        try:
+            for chunk in events:
+                if isinstance(chunk, dict) and chunk.get("type") == "delta":
+                    parts.append(chunk["text"])
+                elif isinstance(chunk, dict) and chunk.get("type") == "usage":
+                    final = chunk
+                yield stream_event_to_sse(chunk)
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield sse_event({"error": str(e)}, event="error")
+            return
+        stored = get_conversation_store().append(
+            conversation_id, [message, _reply(model, "".join(parts), final or {})], provider_id, model
+        )
+        yield sse_event({"conversation_id": conversation_id, "message_ids": [m["id"] for m in stored]},
+                        event="conversation")
 
-  return Response(stream_with_context(generate()), content_type='text/plain')
+    return Response(stream_with_context(generate()), content_type='text/event-stream', headers=SSE_HEADERS)
 
 @chat_bp.route('/upload', methods=['POST'])
 def upload_file():
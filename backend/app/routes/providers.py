@@ -1,10 +1,19 @@
 from flask import Blueprint, jsonify, request
 from app.services.model_discovery import ModelDiscoveryService
-from app.services.ai_providers.provider_registry import ProviderRegistry
 from app.middleware.error_handler import handle_provider_errors
 import logging
-from app.services.ai_providers.models import get_models_for_provider
+from app.services.ai_providers.models import PROVIDER_MODELS
 from app.services.ai_providers.registry_singleton import provider_registry
+from app.services.ai_providers.http_transport import get_http_transport
+from app.services.ai_providers.rate_limiter import rate_limit_stats
+from app.services.response_cache import get_response_cache
+from app.services.semantic_cache import get_semantic_cache
+from app.services.single_flight import single_flight
+from app.services.hedging import get_hedger
+from app.services.resilience import get_resilience
+from app.services.context_manager import get_context_manager
+from app.services.usage_ledger import get_usage_ledger, parse_time, DIMENSIONS
+from app.services.model_refresh_scheduler import get_model_refresh_scheduler
 
 providers_bp = Blueprint('providers', __name__)
 model_discovery = ModelDiscoveryService()
@@ -28,19 +37,13 @@ def get_models(provider_id):
     """
     Get supported models for a specific provider
     """
-    # First try to fetch latest models
-    models = model_discovery.fetch_latest_models(provider_id)
-    logger.info(f"Fetched latest models for {provider_id}: {models}")
-    
-    # If no models found, try cached models
-    if not models:
-        models = model_discovery.get_supported_models(provider_id)
-        logger.info(f"Cached models for {provider_id}: {models}")
-    
-    # If still no models, try static models from models.py
+    # Served from the model store; stale entries are refreshed in the background
+    models = model_discovery.get_supported_models(provider_id)
+
+    # If no models found, fall back to the static list from models.py
     if not models:
-        models = get_models_for_provider(provider_id)
-        logger.info(f"Static models for {provider_id}: {models}")
+        models = PROVIDER_MODELS.get(provider_id, [])
+        logger.debug(f"Using {len(models)} static models for {provider_id}")
     
     # If still no models, return an error
     if not models:
@@ -52,6 +55,14 @@ def get_models(provider_id):
     
     return jsonify(models), 200
 
+@providers_bp.route('/models/refresh/status', methods=['GET'])
+@handle_provider_errors
+def get_model_refresh_status():
+    """
+    Get the last model refresh time and duration of every provider
+    """
+    return jsonify(get_model_refresh_scheduler().status()), 200
+
 @providers_bp.route('/providers/register', methods=['POST'])
 @handle_provider_errors
 def register_provider():
@@ -94,6 +105,16 @@ def register_provider():
             "details": str(e)
         }), 500
 
+@providers_bp.route('/providers/revalidate', methods=['POST'])
+@handle_provider_errors
+def revalidate_providers():
+    """
+    Re-check registered API keys now, bypassing cached verdicts
+    """
+    data = request.get_json(silent=True) or {}
+    results = provider_registry.revalidate(data.get('provider_id'))
+    return jsonify({"results": results}), 200
+
 @providers_bp.route('/providers/default', methods=['GET'])
 @handle_provider_errors
 def get_default_provider():
@@ -107,3 +128,130 @@ def get_default_provider():
         "provider": default_provider.name if default_provider else "deepseek",
         "model": default_model
     }), 200
+
+@providers_bp.route('/transport/stats', methods=['GET'])
+@handle_provider_errors
+def get_transport_stats():
+    """
+    Get connection pool statistics for the shared provider HTTP transport
+    """
+    return jsonify(get_http_transport().stats()), 200
+
+@providers_bp.route('/cache/stats', methods=['GET'])
+@handle_provider_errors
+def get_cache_stats():
+    """
+    Get completion response cache and semantic cache statistics
+    """
+    response_cache = get_response_cache()
+    semantic_cache = get_semantic_cache()
+    stats = {"enabled": False} if response_cache is None else {"enabled": True, **response_cache.stats()}
+    stats["semantic"] = {"enabled": False} if semantic_cache is None else {"enabled": True, **semantic_cache.stats()}
+    return jsonify(stats), 200
+
+@providers_bp.route('/coalescing/stats', methods=['GET'])
+@handle_provider_errors
+def get_coalescing_stats():
+    """
+    Get statistics on identical requests that shared an upstream call
+    """
+    return jsonify(single_flight.stats()), 200
+
+@providers_bp.route('/hedging/stats', methods=['GET'])
+@handle_provider_errors
+def get_hedging_stats():
+    """
+    Get hedge rate, backup win rate and the extra requests and tokens hedging cost
+    """
+    return jsonify(get_hedger().stats()), 200
+
+@providers_bp.route('/routing/stats', methods=['GET'])
+@handle_provider_errors
+def get_routing_stats():
+    """
+    Get the latency, throughput and error averages the "auto" provider routes on
+    """
+    router = provider_registry.router
+    return jsonify({
+        "candidates": [f"{provider_id}:{model}" for provider_id, model in router.candidates],
+        "stats": router.stats.snapshot()
+    }), 200
+
+@providers_bp.route('/resilience/breakers', methods=['GET'])
+@handle_provider_errors
+def get_circuit_breakers():
+    """
+    Get the circuit breaker state of every provider/model and how often calls were retried or rejected
+    """
+    return jsonify(get_resilience().stats()), 200
+
+@providers_bp.route('/context/stats', methods=['GET'])
+@handle_provider_errors
+def get_context_stats():
+    """
+    Get how many requests were cut to fit their context window, the tokens saved and the summary reuse
+    """
+    return jsonify(get_context_manager().stats()), 200
+
+def _usage_query():
+    """Time range, group_by and dimension filters of a usage request's query string"""
+    group_by = [name.strip() for name in request.args.get('group_by', '').split(',') if name.strip()]
+    filters = {name: request.args[name] for name in DIMENSIONS if name in request.args}
+    return parse_time(request.args.get('since')), parse_time(request.args.get('until')), group_by, filters
+
+@providers_bp.route('/usage', methods=['GET'])
+@handle_provider_errors
+def get_usage():
+    """
+    Get token, request and cost totals from the usage ledger.
+    Query: since/until (ISO 8601 or an age such as 24h), group_by (provider,model,user,key)
+    and provider/model/user/key filters.
+    """
+    since, until, group_by, filters = _usage_query()
+    return jsonify({
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "group_by": group_by,
+        "usage": get_usage_ledger().totals(since, until, group_by, **filters)
+    }), 200
+
+@providers_bp.route('/usage/series', methods=['GET'])
+@handle_provider_errors
+def get_usage_series():
+    """
+    Get usage per minute, hour or day, e.g. for a dashboard chart.
+    Query: granularity (default: hour), since (default: 24h) and the filters of /usage.
+    """
+    since, until, group_by, filters = _usage_query()
+    granularity = request.args.get('granularity', 'hour')
+    return jsonify({
+        "granularity": granularity,
+        "usage": get_usage_ledger().series(granularity, since or parse_time('24h'), until, group_by, **filters)
+    }), 200
+
+@providers_bp.route('/usage/stats', methods=['GET'])
+@handle_provider_errors
+def get_usage_stats():
+    """
+    Get how many calls the usage ledger recorded, wrote, dropped or failed to write
+    """
+    return jsonify(get_usage_ledger().stats()), 200
+
+@providers_bp.route('/rate-limits', methods=['GET'])
+@handle_provider_errors
+def get_rate_limits():
+    """
+    Get the learned limits and queue wait times of every provider key's rate limiter
+    """
+    return jsonify(rate_limit_stats()), 200
+
+@providers_bp.route('/providers/keys', methods=['GET'])
+@handle_provider_errors
+def get_provider_keys():
+    """
+    Get request counts, token usage and health of every registered provider's API keys
+    """
+    providers = provider_registry.get_all_providers()
+    return jsonify({
+        provider_id: provider.key_pool.stats(provider_id) for provider_id, provider in providers.items()
+    }), 200
@@ -1,5 +1,10 @@
+import asyncio
 from abc import ABC, abstractmethod
 import requests
+from .http_transport import get_http_transport
+from .errors import UpstreamError, parse_retry_after  # noqa: F401 (re-exported for existing imports)
+from .key_pool import KeyPool, split_keys
+
 
 class BaseProvider(ABC):
     """
@@ -8,14 +13,26 @@ class BaseProvider(ABC):
     """
     def __init__(self, api_key):
         """
-        Initialize the provider with an API key
-        
-        :param api_key: API key for authentication
+        Initialize the provider with one or more API keys
+
+        :param api_key: API key for authentication, or several separated by commas
         """
-        self._api_key = api_key
+        keys = split_keys(api_key)
+        # The first key is used for validation and by providers that do not rotate keys
+        self._api_key = keys[0] if keys else api_key
+        self.key_pool = KeyPool(keys)
         self.name = None  # To be set by child classes
         self.supported_models = []  # To be set by child classes
 
+    @property
+    def transport(self):
+        """
+        Shared pooled HTTP transport used for all upstream calls
+
+        :return: HttpTransport instance
+        """
+        return get_http_transport()
+
     @abstractmethod
     def get_supported_models(self):
         """
@@ -25,25 +42,83 @@ class BaseProvider(ABC):
         """
         pass
 
+    def fetch_models(self, etag=None, last_modified=None, timeout=None):
+        """
+        Fetch the provider's model catalog, conditionally where the vendor supports it.
+        Providers without a catalog endpoint return their static model list.
+
+        :param etag: ETag of the previously fetched catalog, if any
+        :param last_modified: Last-Modified value of the previously fetched catalog, if any
+        :param timeout: None, read timeout in seconds, or a (connect, read) tuple
+        :return: Dictionary with 'models' (None when not modified), 'not_modified', 'etag' and 'last_modified'
+        :raises requests.RequestException: If the catalog could not be fetched
+        """
+        return {"models": self.get_supported_models(), "not_modified": False, "etag": None, "last_modified": None}
+
     def validate_api_key(self):
         """
         Validate the API key for the provider
         
         :return: Boolean indicating if the API key is valid
         """
+        try:
+            return self.check_api_key()
+        except requests.RequestException:
+            return False
+
+    def check_api_key(self, timeout=None, api_key=None):
+        """
+        Check an API key against the provider, distinguishing a rejected key
+        from a request that could not be completed
+
+        :param timeout: None, read timeout in seconds, or a (connect, read) tuple
+        :param api_key: Key to check, defaults to the provider's first key
+        :return: Boolean indicating if the API key is valid
+        :raises requests.RequestException: If the provider could not be reached in time
+        """
+        api_key = api_key or self._api_key
         # Basic validation, can be overridden by specific providers
-        if not self._api_key or not isinstance(self._api_key, str):
+        if not api_key or not isinstance(api_key, str):
             return False
 
         # Check if the API key is valid by making a test request
-        try:
-            response = requests.get(
-                self.get_api_endpoint(),
-                headers={'Authorization': f'Bearer {self._api_key}'}
-            )
-            return response.status_code == 200
-        except requests.RequestException:
-            return False
+        response = self.transport.get(
+            self.get_api_endpoint(),
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=timeout
+        )
+        return response.status_code == 200
+
+    async def agenerate_completion(self, messages, model, options=None):
+        """
+        Async variant of generate_completion.
+        Providers without a native async implementation run the sync call
+        in a worker thread so they still work from the event loop.
+
+        :param messages: List of message dictionaries with 'role' and 'content' keys
+        :param model: Model name
+        :param options: Optional parameters like temperature, max_tokens
+        :return: Dictionary with the completion result
+        """
+        return await asyncio.to_thread(self.generate_completion, messages, model, options)
+
+    async def astream_completion(self, messages, model, options=None):
+        """
+        Async variant of stream_completion.
+        Falls back to pulling chunks from the sync generator in a worker thread.
+
+        :param messages: List of message dictionaries with 'role' and 'content' keys
+        :param model: Model name
+        :param options: Optional parameters like temperature, max_tokens
+        :return: Async iterator of response chunks
+        """
+        iterator = iter(self.stream_completion(messages, model, options))
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, done)
+            if chunk is done:
+                break
+            yield chunk
 
     def get_api_endpoint(self):
         """
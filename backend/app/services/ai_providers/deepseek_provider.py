@@ -1,9 +1,13 @@
-from .base_provider import BaseProvider
+from .openai_compatible import OpenAICompatibleProvider
 
-class DeepseekProvider(BaseProvider):
+import logging
+
+class DeepseekProvider(OpenAICompatibleProvider):
     def __init__(self, api_key):
         super().__init__(api_key)
         self.name = "deepseek"
+        self.logger = logging.getLogger(__name__)
+        self._api_base_url = "https://api.deepseek.com/v1"
         self.supported_models = [
             # Current main models
             "deepseek-chat",    # DeepSeek-V3
@@ -16,6 +20,3 @@ class DeepseekProvider(BaseProvider):
             "deepseek-coder-v2",
             "deepseek-math-7b"
         ]
-
-    def get_supported_models(self):
-        return self.supported_models
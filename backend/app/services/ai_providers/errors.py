@@ -0,0 +1,40 @@
+"""
+Errors raised by provider calls.
+"""
+import time
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header given either as seconds or as an HTTP date
+
+    :param value: Header value or None
+    :return: Seconds to wait, or None if the header is missing or malformed
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamError(Exception):
+    """
+    A provider answered a request with an error status
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        """
+        :param message: Error message
+        :param status_code: HTTP status returned by the provider
+        :param retry_after: Seconds the provider asked callers to wait, from Retry-After
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
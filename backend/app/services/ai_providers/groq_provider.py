@@ -1,8 +1,8 @@
-from .base_provider import BaseProvider
+from .openai_compatible import OpenAICompatibleProvider
 
 import logging
 
-class GroqProvider(BaseProvider):
+class GroqProvider(OpenAICompatibleProvider):
     def __init__(self, api_key):
         super().__init__(api_key)
         self.name = "groq"
@@ -47,25 +47,15 @@ class GroqProvider(BaseProvider):
     def get_supported_models(self):
         """
         Retrieve the list of supported models for this provider.
-        Uses cached results if available, otherwise fetches from API.
+        Fetches from the API, falling back to the static lists of every category.
         
         Returns:
             list: List of supported model names.
         """
-        if hasattr(self, '_cached_models') and self._cached_models is not None:
-            return self._cached_models
-            
-        import requests
-        headers = {
-            "Authorization": f"Bearer {self._api_key}"
-        }
         try:
-            response = requests.get(self.get_api_endpoint(), headers=headers, timeout=10)
-            if response.status_code == 200:
-                models_data = response.json().get('data', [])
-                self._cached_models = [model['id'] for model in models_data]
-                self.logger.info(f"Successfully fetched {len(self._cached_models)} models from Groq API")
-                return self._cached_models
+            models = self.fetch_models()["models"]
+            self.logger.info(f"Successfully fetched {len(models)} models from Groq API")
+            return models
         except Exception as e:
             self.logger.error(f"Error fetching Groq models: {str(e)}")
         return self._flat_supported_models
@@ -77,55 +67,4 @@ class GroqProvider(BaseProvider):
         Returns:
             str: API endpoint URL.
         """
-        return f"{self._api_base_url}/models"
-
-    def generate_completion(self, messages, model, options=None):
-        """
-        Generate a chat completion using the Groq API.
-        
-        Args:
-            messages (list): List of message dictionaries with 'role' and 'content' keys.
-            model (str): String specifying the model to use.
-            options (dict, optional): Dictionary of optional parameters like temperature, max_tokens.
-            
-        Returns:
-            dict: Dictionary with the completion result.
-            
-        Raises:
-            Exception: If the API request fails.
-        """
-        import requests
-        options = options or {}
-        endpoint = f"{self._api_base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self._api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": options.get("temperature", 0.7),
-            "max_tokens": options.get("max_tokens", 1000),
-            "stream": options.get("stream", False)
-        }
-        
-        try:
-            response = requests.post(endpoint, headers=headers, json=payload, timeout=30)
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "text": result["choices"][0]["message"]["content"],
-                    "finish_reason": result["choices"][0]["finish_reason"],
-                    "usage": {
-                        "prompt_tokens": result["usage"]["prompt_tokens"],
-                        "completion_tokens": result["usage"]["completion_tokens"],
-                        "total_tokens": result["usage"]["total_tokens"]
-                    }
-                }
-            else:
-                error_msg = f"Error generating completion: {response.status_code} - {response.text}"
-                self.logger.error(error_msg)
-                raise Exception(error_msg)
-        except Exception as e:
-            self.logger.error(f"Unexpected error in generate_completion: {str(e)}")
-            raise
+        return f"{self._base_url()}/models"
@@ -0,0 +1,422 @@
+"""
+Shared HTTP transport for AI providers.
+
+Every provider talks to its vendor through one process-wide transport that keeps
+per-host keep-alive connection pools, so a chat turn reuses an already
+established TCP/TLS connection instead of paying for a new handshake.
+HTTP/2 is used when enabled and ``httpx`` (with ``h2``) is installed.
+
+Async callers (the ASGI app) use the ``a*`` methods, which run on an
+``httpx.AsyncClient`` owned by the current event loop.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import Config
+
+
+class StreamedResponse:
+    """
+    Backend-neutral view of a streaming response.
+
+    ``iter_lines`` yields decoded lines as soon as they arrive from the socket.
+    """
+
+    def __init__(self, status_code, iter_lines, read_text, headers=None):
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self._iter_lines = iter_lines
+        self._read_text = read_text
+
+    def iter_lines(self):
+        return self._iter_lines()
+
+    def read_text(self):
+        """Read the remaining body, e.g. to report an error"""
+        return self._read_text()
+
+
+class HttpTransport:
+    """
+    Pooled, keep-alive HTTP client shared by all providers.
+
+    Timeouts are split per phase: ``connect_timeout`` bounds connection setup and
+    ``read_timeout`` bounds the wait for each chunk of the response.
+    """
+
+    def __init__(self, pool_connections=32, pool_maxsize=50, connect_timeout=5.0,
+                 read_timeout=30.0, http2=False):
+        """
+        :param pool_connections: Number of per-host pools kept alive
+        :param pool_maxsize: Maximum keep-alive connections per host
+        :param connect_timeout: Default connect timeout in seconds
+        :param read_timeout: Default read timeout in seconds
+        :param http2: Use HTTP/2 when httpx and h2 are available
+        """
+        self.logger = logging.getLogger(__name__)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._lock = threading.Lock()
+        self._host_stats = {}
+        self._http2_client = None
+        self._http2 = http2
+        # Loops that are garbage collected drop out on their own; closed ones are evicted on lookup
+        self._async_clients = weakref.WeakKeyDictionary()
+
+        if http2:
+            self._http2_client = self._create_http2_client()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._adapter = adapter
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def _create_http2_client(self):
+        """Create an HTTP/2 capable client, or None if the optional packages are missing"""
+        try:
+            import httpx
+            import h2  # noqa: F401  (required by httpx for HTTP/2)
+        except ImportError:
+            self.logger.warning("HTTP/2 requested but httpx[http2] is not installed; using HTTP/1.1")
+            return None
+
+        return httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.pool_connections * self.pool_maxsize,
+                max_keepalive_connections=self.pool_maxsize
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        )
+
+    @property
+    def backend(self):
+        """Name of the HTTP backend in use"""
+        return 'httpx-h2' if self._http2_client is not None else 'requests'
+
+    def _resolve_timeout(self, timeout):
+        """
+        Normalise a timeout argument into a (connect, read) tuple.
+        A single number overrides only the read timeout.
+        """
+        if timeout is None:
+            return (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, (tuple, list)):
+            return (timeout[0], timeout[1])
+        return (self.connect_timeout, timeout)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send an HTTP request over a pooled connection.
+
+        :param method: HTTP method
+        :param url: Absolute URL
+        :param timeout: None, read timeout in seconds, or a (connect, read) tuple
+        :return: Response object exposing status_code, headers, text and json()
+        :raises requests.RequestException: On connection errors and timeouts
+        """
+        connect_timeout, read_timeout = self._resolve_timeout(timeout)
+        if self._http2_client is not None:
+            return self._request_http2(method, url, connect_timeout, read_timeout, **kwargs)
+        return self._session.request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, timeout=None, **kwargs):
+        """
+        Send an HTTP request and stream the response body.
+
+        :param method: HTTP method
+        :param url: Absolute URL
+        :param timeout: None, read timeout in seconds, or a (connect, read) tuple.
+                        The read timeout applies between chunks, not to the whole body.
+        :return: Context manager yielding a StreamedResponse
+        :raises requests.RequestException: On connection errors and timeouts
+        """
+        connect_timeout, read_timeout = self._resolve_timeout(timeout)
+        if self._http2_client is not None:
+            import httpx
+
+            host = _host_key(url)
+            opened = []
+
+            def trace(event_name, info):
+                if event_name == 'connection.connect_tcp.complete':
+                    opened.append(True)
+
+            try:
+                with self._http2_client.stream(
+                    method, url,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                    extensions={'trace': trace},
+                    **kwargs
+                ) as response:
+                    yield StreamedResponse(
+                        response.status_code,
+                        response.iter_lines,
+                        lambda: response.read().decode('utf-8', errors='replace'),
+                        response.headers
+                    )
+            except httpx.TimeoutException as e:
+                raise requests.Timeout(str(e)) from e
+            except httpx.HTTPError as e:
+                raise requests.ConnectionError(str(e)) from e
+            finally:
+                self._record(host, opened=bool(opened))
+            return
+
+        with self._session.request(method, url, timeout=(connect_timeout, read_timeout),
+                                   stream=True, **kwargs) as response:
+            # SSE bodies are UTF-8; requests would otherwise guess ISO-8859-1 for text/*
+            response.encoding = 'utf-8'
+            yield StreamedResponse(
+                response.status_code,
+                # chunk_size=None hands over data as soon as each chunk arrives
+                lambda: response.iter_lines(chunk_size=None, decode_unicode=True),
+                lambda: response.text,
+                response.headers
+            )
+
+    def _request_http2(self, method, url, connect_timeout, read_timeout, **kwargs):
+        import httpx
+
+        host = _host_key(url)
+        opened = []
+
+        def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                opened.append(True)
+
+        try:
+            response = self._http2_client.request(
+                method, url,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                extensions={'trace': trace},
+                **kwargs
+            )
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+        finally:
+            self._record(host, opened=bool(opened))
+        return response
+
+    def _get_async_client(self):
+        """
+        Get the httpx.AsyncClient bound to the running event loop.
+        Async connections cannot be shared across loops, so each loop gets its own pool.
+        Pools of closed loops (e.g. one asyncio.run() per call) are dropped when a new pool is created.
+        """
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            http2 = False
+            if self._http2:
+                try:
+                    import h2  # noqa: F401
+                    http2 = True
+                except ImportError:
+                    pass
+            client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=self.pool_connections * self.pool_maxsize,
+                    max_keepalive_connections=self.pool_maxsize
+                ),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+            )
+            with self._lock:
+                for stale in [other for other in self._async_clients.keys() if other.is_closed()]:
+                    # Their connections belong to a dead loop and cannot be closed gracefully
+                    del self._async_clients[stale]
+                self._async_clients[loop] = client
+        return client
+
+    async def arequest(self, method, url, timeout=None, **kwargs):
+        """
+        Send an HTTP request from a coroutine over a pooled async connection.
+
+        :param method: HTTP method
+        :param url: Absolute URL
+        :param timeout: None, read timeout in seconds, or a (connect, read) tuple
+        :return: httpx.Response exposing status_code, headers, text and json()
+        :raises requests.RequestException: On connection errors and timeouts
+        """
+        import httpx
+
+        connect_timeout, read_timeout = self._resolve_timeout(timeout)
+        host = _host_key(url)
+        opened = []
+
+        def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                opened.append(True)
+
+        async def atrace(event_name, info):
+            trace(event_name, info)
+
+        try:
+            return await self._get_async_client().request(
+                method, url,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                extensions={'trace': atrace},
+                **kwargs
+            )
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+        finally:
+            self._record(host, opened=bool(opened))
+
+    @asynccontextmanager
+    async def astream(self, method, url, timeout=None, **kwargs):
+        """
+        Send an HTTP request from a coroutine and stream the response body.
+
+        :param method: HTTP method
+        :param url: Absolute URL
+        :param timeout: None, read timeout in seconds, or a (connect, read) tuple
+        :return: Async context manager yielding an httpx.Response; use aiter_lines() and aread()
+        :raises requests.RequestException: On connection errors and timeouts
+        """
+        import httpx
+
+        connect_timeout, read_timeout = self._resolve_timeout(timeout)
+        host = _host_key(url)
+        opened = []
+
+        async def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                opened.append(True)
+
+        try:
+            async with self._get_async_client().stream(
+                method, url,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                extensions={'trace': trace},
+                **kwargs
+            ) as response:
+                yield response
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+        finally:
+            self._record(host, opened=bool(opened))
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest('POST', url, **kwargs)
+
+    def _record(self, host, opened):
+        with self._lock:
+            stats = self._host_stats.setdefault(host, {'requests': 0, 'connections_opened': 0})
+            stats['requests'] += 1
+            if opened:
+                stats['connections_opened'] += 1
+
+    def stats(self):
+        """
+        Get connection pool statistics per host.
+        A pool hit is a request served on a reused keep-alive connection.
+
+        :return: Dictionary with backend name, per-host and total counters
+        """
+        hosts = {}
+        with self._lock:
+            for host, stats in self._host_stats.items():
+                hosts[host] = dict(stats)
+        if self._http2_client is None:
+            pools = self._adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+                stats = hosts.setdefault(host, {'requests': 0, 'connections_opened': 0})
+                stats['requests'] += pool.num_requests
+                stats['connections_opened'] += pool.num_connections
+                stats['idle_connections'] = pool.pool.qsize() if pool.pool is not None else 0
+
+        totals = {'requests': 0, 'pool_hits': 0, 'pool_misses': 0}
+        for stats in hosts.values():
+            stats['pool_misses'] = min(stats['connections_opened'], stats['requests'])
+            stats['pool_hits'] = stats['requests'] - stats['pool_misses']
+            totals['requests'] += stats['requests']
+            totals['pool_hits'] += stats['pool_hits']
+            totals['pool_misses'] += stats['pool_misses']
+        totals['hit_ratio'] = totals['pool_hits'] / totals['requests'] if totals['requests'] else 0.0
+
+        return {
+            'backend': self.backend,
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'timeouts': {'connect': self.connect_timeout, 'read': self.read_timeout},
+            'hosts': hosts,
+            'totals': totals
+        }
+
+    def close(self):
+        """Close all pooled connections"""
+        self._session.close()
+        if self._http2_client is not None:
+            self._http2_client.close()
+
+    async def aclose(self):
+        """Close the async connection pool of the running event loop"""
+        with self._lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+def _host_key(url):
+    """Format a URL's host as host:port, matching urllib3 pool keys"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return f"{parts.hostname}:{port}"
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_http_transport():
+    """
+    Get the process-wide HTTP transport, creating it from Config on first use.
+
+    :return: Shared HttpTransport instance
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport(
+                    pool_connections=Config.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+                    connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+                    read_timeout=Config.HTTP_READ_TIMEOUT,
+                    http2=Config.HTTP2_ENABLED
+                )
+    return _transport
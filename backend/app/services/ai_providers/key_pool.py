@@ -0,0 +1,244 @@
+"""
+Pools of API keys per provider.
+
+A provider can hold several API keys, from a comma-separated PROVIDER_API_KEY
+or from repeated registrations. Each request leases the usable key with the
+fewest requests in flight, preferring the one with the most rate limit
+capacity left. Keys rejected as unauthorized, or rate limited several times in
+a row, are taken out of rotation; the last usable key always stays in.
+"""
+import threading
+import time
+
+from app.config import Config
+from .errors import UpstreamError
+from .key_validation_cache import key_fingerprint
+
+AUTH_ERROR_CODES = frozenset({401, 403})
+
+
+def split_keys(value):
+    """
+    :param value: One API key, comma-separated keys, or a list of keys
+    :return: List of distinct keys in their original order
+    """
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = (value or '').split(',')
+    keys = []
+    for item in items:
+        key = (item or '').strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class _KeyState:
+    def __init__(self, key):
+        self.key = key
+        self.outstanding = 0
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+        self.transport_errors = 0
+        self.rate_limited = 0
+        self.consecutive_rate_limited = 0
+        self.disabled = None
+        self.cooldown_until = 0.0
+
+    def usable(self, now):
+        return self.disabled is None and self.cooldown_until <= now
+
+
+class KeyLease:
+    """
+    A key handed out for one request; release it when the request is finished
+    """
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.pool._release(self.key)
+
+
+class KeyPool:
+    """
+    API keys of one provider with their health and usage
+    """
+
+    def __init__(self, keys=(), max_rate_limited=None, cooldown=None):
+        """
+        :param keys: Initial API keys
+        :param max_rate_limited: Consecutive 429 responses after which a key is rested
+        :param cooldown: Seconds a rested key stays out of rotation, unless Retry-After asks for longer
+        """
+        self.max_rate_limited = max_rate_limited or Config.KEY_POOL_MAX_RATE_LIMITED
+        self.cooldown = cooldown if cooldown is not None else Config.KEY_POOL_COOLDOWN_SECONDS
+        self._states = {}
+        self._lock = threading.Lock()
+        for key in split_keys(keys):
+            self.add(key)
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def keys(self):
+        return list(self._states)
+
+    def add(self, key):
+        """
+        Add a key, or bring a disabled one back into rotation
+
+        :return: True if the key was not in the pool yet
+        """
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                state.disabled = None
+                state.cooldown_until = 0.0
+                return False
+            self._states[key] = _KeyState(key)
+            return True
+
+    def disable(self, key, reason):
+        """
+        Take a key out of rotation, unless it is the last usable one
+
+        :param reason: Why the key was disabled, shown in stats
+        :return: True if the key was disabled
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None or not self._others_usable(state, now):
+                return False
+            state.disabled = reason
+            return True
+
+    def is_disabled(self, key):
+        """
+        :return: True if the key is in the pool but out of rotation
+        """
+        with self._lock:
+            state = self._states.get(key)
+            return state is not None and state.disabled is not None
+
+    def acquire(self, quota=None, exclude=()):
+        """
+        Lease the key with the fewest requests in flight
+
+        :param quota: Optional callable returning the fraction of a key's rate limit left, to break ties
+        :param exclude: Keys not to hand out, e.g. ones whose rate limiter is already full
+        :return: KeyLease
+        :raises UpstreamError: If no key is usable
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [state for state in self._states.values()
+                          if state.usable(now) and state.key not in exclude]
+            if not candidates:
+                resting = [state.cooldown_until for state in self._states.values()
+                           if state.disabled is None and state.key not in exclude]
+                retry_after = max(0.0, min(resting) - now) if resting else None
+                raise UpstreamError("No usable API key", 503, retry_after)
+            if len(candidates) == 1:
+                best = candidates[0]
+            else:
+                best = min(candidates, key=lambda state: (
+                    state.outstanding, -(quota(state.key) if quota else 1.0), state.requests))
+            best.outstanding += 1
+            best.requests += 1
+            return KeyLease(self, best.key)
+
+    def peek(self):
+        """
+        :return: A usable key for calls outside the rotation (e.g. catalog fetches), or None
+        """
+        now = time.monotonic()
+        states = [state for state in self._states.values() if state.usable(now)] or list(self._states.values())
+        return min(states, key=lambda state: state.outstanding).key if states else None
+
+    def _release(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None and state.outstanding > 0:
+                state.outstanding -= 1
+
+    def _others_usable(self, state, now):
+        return any(other.usable(now) for other in self._states.values() if other is not state)
+
+    def record(self, key, status_code, tokens=0, retry_after=None):
+        """
+        Record the outcome of a request made with a key
+
+        :param status_code: HTTP status of the response
+        :param tokens: Tokens the request used
+        :param retry_after: Seconds from the response's Retry-After header, if any
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return
+            state.tokens += tokens or 0
+            if status_code < 400:
+                state.consecutive_rate_limited = 0
+                return
+            state.errors += 1
+            if status_code in AUTH_ERROR_CODES:
+                if self._others_usable(state, now):
+                    state.disabled = f"rejected with {status_code}"
+                return
+            if status_code == 429:
+                state.rate_limited += 1
+                state.consecutive_rate_limited += 1
+                if state.consecutive_rate_limited >= self.max_rate_limited and self._others_usable(state, now):
+                    state.cooldown_until = now + max(self.cooldown, retry_after or 0)
+                    state.consecutive_rate_limited = 0
+
+    def record_failure(self, key):
+        """
+        Record a request made with a key that got no response (connect error, timeout).
+        The key stays in rotation; network failures are rarely specific to one key.
+        """
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                state.errors += 1
+                state.transport_errors += 1
+
+    def stats(self, provider_id):
+        """
+        :param provider_id: Provider the keys belong to, used for their fingerprints
+        :return: Usage and health per key, labelled by fingerprint
+        """
+        now = time.monotonic()
+        with self._lock:
+            states = list(self._states.values())
+            result = {}
+            for state in states:
+                if state.disabled:
+                    health = 'disabled'
+                elif state.cooldown_until > now:
+                    health = 'cooling_down'
+                else:
+                    health = 'healthy'
+                result[key_fingerprint(provider_id, state.key)[:8]] = {
+                    'state': health,
+                    'reason': state.disabled,
+                    'outstanding': state.outstanding,
+                    'requests': state.requests,
+                    'tokens': state.tokens,
+                    'errors': state.errors,
+                    'transport_errors': state.transport_errors,
+                    'rate_limited': state.rate_limited,
+                    'cooldown_remaining': round(max(0.0, state.cooldown_until - now), 1)
+                }
+        return result
@@ -0,0 +1,110 @@
+"""
+Persisted cache of API key validation verdicts.
+
+Keys are identified by a SHA-256 fingerprint of provider id and key, so the raw
+key never reaches the disk. Verdicts expire after a TTL; within it, restarts and
+other worker processes reuse the verdict instead of calling the vendor again.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+def key_fingerprint(provider_id, api_key):
+    """
+    Fingerprint an API key for use as a cache key
+
+    :param provider_id: Lowercase provider identifier
+    :param api_key: Raw API key
+    :return: Hex digest that does not reveal the key
+    """
+    return hashlib.sha256(f"{provider_id}:{api_key}".encode('utf-8')).hexdigest()
+
+
+class KeyValidationCache:
+    """
+    TTL cache of key verdicts backed by a JSON file shared between processes
+    """
+
+    def __init__(self, cache_file, ttl_seconds):
+        """
+        :param cache_file: Path of the JSON file holding verdicts
+        :param ttl_seconds: How long a verdict stays valid
+        """
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_seconds
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, entries):
+        # Write to a temporary file and rename it so readers never see a partial file
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.key_validation_', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, self.cache_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, provider_id, api_key):
+        """
+        Get a cached verdict
+
+        :param provider_id: Lowercase provider identifier
+        :param api_key: Raw API key
+        :return: True or False if a fresh verdict is cached, otherwise None
+        """
+        entry = self._read().get(key_fingerprint(provider_id, api_key))
+        if entry and time.time() - entry.get('checked_at', 0) < self.ttl_seconds:
+            return entry.get('valid')
+        return None
+
+    def set(self, provider_id, api_key, valid):
+        """
+        Store a verdict and drop expired entries
+
+        :param provider_id: Lowercase provider identifier
+        :param api_key: Raw API key
+        :param valid: Whether the key was accepted
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                entries = {
+                    fingerprint: entry for fingerprint, entry in self._read().items()
+                    if now - entry.get('checked_at', 0) < self.ttl_seconds
+                }
+                entries[key_fingerprint(provider_id, api_key)] = {
+                    'provider': provider_id,
+                    'valid': bool(valid),
+                    'checked_at': now
+                }
+                self._write(entries)
+        except Exception as e:
+            self.logger.error(f"Error updating key validation cache: {e}")
+
+    def invalidate(self, provider_id, api_key):
+        """
+        Forget the verdict for one key
+        """
+        try:
+            with self._lock:
+                entries = self._read()
+                if entries.pop(key_fingerprint(provider_id, api_key), None) is not None:
+                    self._write(entries)
+        except Exception as e:
+            self.logger.error(f"Error updating key validation cache: {e}")
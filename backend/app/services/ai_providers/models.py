@@ -4,10 +4,7 @@ This file contains a structured dictionary of providers and their associated mod
 """
 
 from app.config import Config
-from .provider_registry import ProviderRegistry
-
-# Initialize provider registry to access available providers
-provider_registry = ProviderRegistry()
+from .provider_registry import provider_registry
 
 # Define a dictionary of providers and their models
 # This can be used as a fallback or for quick reference
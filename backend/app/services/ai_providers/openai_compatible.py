@@ -0,0 +1,422 @@
+import json
+from functools import lru_cache
+
+from app.config import Config
+from .base_provider import BaseProvider
+from .errors import UpstreamError, parse_retry_after
+from .rate_limiter import get_rate_limiter, estimate_tokens, RateLimitExceeded
+from .key_validation_cache import key_fingerprint
+from app.services.tracing import trace_event
+from app.services.usage_ledger import note_key
+
+
+@lru_cache(maxsize=8)
+def parse_base_urls(spec):
+    """
+    Parse base URL overrides such as "groq=http://127.0.0.1:9100/v1,openai=http://127.0.0.1:9100/v1"
+
+    :return: Dictionary of provider id to base URL without a trailing slash
+    """
+    urls = {}
+    for item in (spec or '').split(','):
+        provider_id, _, url = item.partition('=')
+        if provider_id.strip() and url.strip():
+            urls[provider_id.strip().lower()] = url.strip().rstrip('/')
+    return urls
+
+class OpenAICompatibleProvider(BaseProvider):
+    """
+    Base class for providers exposing an OpenAI-compatible /chat/completions API.
+    Subclasses set ``self._api_base_url``, which PROVIDER_BASE_URLS can override
+    (e.g. to point a provider at a proxy or a mock server); request building and
+    response parsing are shared by the sync and async code paths.
+
+    Every request leases one of the provider's API keys from its key pool and
+    reserves capacity on that key's rate limiter before it is sent.
+
+    Streaming methods yield event dictionaries: ``{"type": "delta", "text": ...}``
+    for every content delta as it arrives, then one final
+    ``{"type": "usage", "finish_reason": ..., "usage": ...}``.
+    """
+
+    def get_supported_models(self):
+        return self.supported_models
+
+    def _base_url(self):
+        return parse_base_urls(Config.PROVIDER_BASE_URLS).get(getattr(self, 'name', None)) or self._api_base_url
+
+    def get_api_endpoint(self):
+        return f"{self._base_url()}/models"
+
+    def _include_model(self, model_id):
+        """Whether a model from the catalog endpoint should be offered"""
+        return True
+
+    def fetch_models(self, etag=None, last_modified=None, timeout=10):
+        """
+        Fetch the /models catalog, sending If-None-Match / If-Modified-Since
+        so an unchanged catalog costs a 304 with no body.
+        """
+        headers = {"Authorization": f"Bearer {self.key_pool.peek() or self._api_key}"}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = self.transport.get(self.get_api_endpoint(), headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            return {"models": None, "not_modified": True, "etag": etag, "last_modified": last_modified}
+        response.raise_for_status()
+        models = [model['id'] for model in response.json().get('data', []) if self._include_model(model['id'])]
+        return {
+            "models": models,
+            "not_modified": False,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+
+    def _chat_endpoint(self):
+        return f"{self._base_url()}/chat/completions"
+
+    def _chat_headers(self, api_key=None):
+        return {
+            "Authorization": f"Bearer {api_key or self._api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _limiter(self, api_key):
+        """
+        Request and token buckets of one of this provider's API keys
+
+        :return: RateLimiter instance
+        """
+        return get_rate_limiter(self.name, api_key)
+
+    def _lease_key(self, exclude):
+        return self.key_pool.acquire(quota=lambda key: self._limiter(key).remaining_fraction(), exclude=exclude)
+
+    def _admit(self, payload):
+        """
+        Lease an API key and wait for rate limit capacity on it.
+        A key whose limits cannot admit the request in time is skipped while other keys remain.
+
+        :param payload: Request body, used to estimate its tokens
+        :return: (KeyLease, reserved tokens); release the lease once the request is finished
+        :raises RateLimitExceeded: If no key can admit the request in time
+        """
+        tokens, tried, limited = estimate_tokens(payload), set(), None
+        while True:
+            try:
+                lease = self._lease_key(tried)
+            except UpstreamError:
+                if limited is not None:
+                    raise limited
+                raise
+            try:
+                reserved = self._limiter(lease.key).acquire(tokens)
+            except RateLimitExceeded as e:
+                lease.release()
+                tried.add(lease.key)
+                limited = e
+                continue
+            trace_event('admitted', tokens=tokens)
+            return lease, reserved
+
+    async def _aadmit(self, payload):
+        """
+        Async variant of _admit
+        """
+        tokens, tried, limited = estimate_tokens(payload), set(), None
+        while True:
+            try:
+                lease = self._lease_key(tried)
+            except UpstreamError:
+                if limited is not None:
+                    raise limited
+                raise
+            try:
+                reserved = await self._limiter(lease.key).aacquire(tokens)
+            except RateLimitExceeded as e:
+                lease.release()
+                tried.add(lease.key)
+                limited = e
+                continue
+            trace_event('admitted', tokens=tokens)
+            return lease, reserved
+
+    @staticmethod
+    def _used_tokens(usage):
+        return (usage or {}).get("total_tokens") or 0
+
+    def _settle(self, lease, reserved, response, usage=None):
+        """
+        Report a finished request to its key's rate limiter, to the key pool and to the usage ledger
+
+        :param lease: KeyLease the request was sent with
+        :param reserved: Tokens reserved before sending
+        :param response: Upstream response, for its status and x-ratelimit-* headers
+        :param usage: Usage reported by the vendor; the reservation is refunded without it
+        """
+        limiter = self._limiter(lease.key)
+        used = self._used_tokens(usage)
+        limiter.observe(response.headers)
+        limiter.reconcile(reserved, used)
+        self.key_pool.record(lease.key, response.status_code, used,
+                             parse_retry_after(response.headers.get("Retry-After")))
+        note_key(self.name, key_fingerprint(self.name, lease.key)[:8])
+
+    def _settle_completion(self, lease, reserved, response):
+        """
+        Parse a 200 completion response and settle it. A malformed body is still settled, with the
+        reservation refunded, before its parse error propagates
+
+        :param lease: KeyLease the request was sent with
+        :param reserved: Tokens reserved before sending
+        :param response: Upstream 200 response
+        :return: Completion result from _parse_completion
+        """
+        try:
+            result = self._parse_completion(response.json())
+        except Exception:
+            self._settle(lease, reserved, response)
+            raise
+        self._settle(lease, reserved, response, result["usage"])
+        return result
+
+    def _fail(self, lease, reserved):
+        """
+        Report a request that got no response: refund its reservation, count the failure against its key
+        and attribute it to the key in the usage ledger
+
+        :param lease: KeyLease the request was sent with
+        :param reserved: Tokens reserved before sending
+        """
+        self._limiter(lease.key).reconcile(reserved, 0)
+        self.key_pool.record_failure(lease.key)
+        note_key(self.name, key_fingerprint(self.name, lease.key)[:8])
+
+    def _build_payload(self, messages, model, options, stream=False):
+        """
+        Build the request body for a chat completion
+
+        :param messages: List of message dictionaries
+        :param model: Model name
+        :param options: Dictionary of optional parameters
+        :param stream: Request an SSE stream, with usage reported in the last chunk
+        :return: JSON payload dictionary
+        """
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": options.get("temperature", 0.7),
+            "max_tokens": options.get("max_tokens", 1000),
+            "stream": stream
+        }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _parse_completion(self, result):
+        """
+        Convert an OpenAI-style response body into the app's completion format
+
+        :param result: Decoded JSON response
+        :return: Dictionary with text, finish_reason and usage
+        """
+        return {
+            "text": result["choices"][0]["message"]["content"],
+            "finish_reason": result["choices"][0]["finish_reason"],
+            "usage": {
+                "prompt_tokens": result["usage"]["prompt_tokens"],
+                "completion_tokens": result["usage"]["completion_tokens"],
+                "total_tokens": result["usage"]["total_tokens"]
+            }
+        }
+
+    def _completion_error(self, status_code, text, headers=None):
+        error_msg = f"Error generating completion: {status_code} - {text}"
+        self.logger.error(error_msg)
+        return UpstreamError(error_msg, status_code, parse_retry_after((headers or {}).get("Retry-After")))
+
+    def _parse_stream_line(self, line, state):
+        """
+        Translate one upstream SSE line into stream events
+
+        :param line: Decoded line of the upstream body
+        :param state: Dictionary accumulating finish_reason and usage across lines
+        :return: List of delta events carried by the line
+        :raises UpstreamError: If the line carries an error chunk
+        """
+        if not line or not line.startswith("data:"):
+            return []
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return []
+
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            error = chunk["error"]
+            # Vendors put the HTTP status of an in-stream error in "code" or "status", when they give one
+            status_code = next((value for value in (error.get("code"), error.get("status"))
+                                if isinstance(value, int)), None) if isinstance(error, dict) else None
+            raise UpstreamError(f"Error streaming completion: {error}", status_code)
+        if chunk.get("usage"):
+            state["usage"] = chunk["usage"]
+
+        events = []
+        for choice in chunk.get("choices") or []:
+            text = (choice.get("delta") or {}).get("content")
+            if text:
+                events.append({"type": "delta", "text": text})
+            if choice.get("finish_reason"):
+                state["finish_reason"] = choice["finish_reason"]
+        return events
+
+    def _usage_event(self, state):
+        return {
+            "type": "usage",
+            "finish_reason": state.get("finish_reason"),
+            "usage": state.get("usage")
+        }
+
+    def generate_completion(self, messages, model, options=None):
+        """
+        Generate a chat completion.
+
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content' keys.
+            model (str): String specifying the model to use.
+            options (dict, optional): Dictionary of optional parameters like temperature, max_tokens.
+
+        Returns:
+            dict: Dictionary with the completion result.
+
+        Raises:
+            Exception: If the API request fails.
+        """
+        payload = self._build_payload(messages, model, options or {})
+        lease, reserved = self._admit(payload)
+        response = None
+        try:
+            response = self.transport.post(self._chat_endpoint(), headers=self._chat_headers(lease.key), json=payload)
+            if response.status_code == 200:
+                return self._settle_completion(lease, reserved, response)
+            self._settle(lease, reserved, response)
+            raise self._completion_error(response.status_code, response.text, response.headers)
+        except Exception as e:
+            if response is None:
+                self._fail(lease, reserved)
+            self.logger.error(f"Unexpected error in generate_completion: {str(e)}")
+            raise
+        finally:
+            lease.release()
+
+    async def agenerate_completion(self, messages, model, options=None):
+        """
+        Generate a chat completion without blocking the event loop.
+
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content' keys.
+            model (str): String specifying the model to use.
+            options (dict, optional): Dictionary of optional parameters like temperature, max_tokens.
+
+        Returns:
+            dict: Dictionary with the completion result.
+
+        Raises:
+            Exception: If the API request fails.
+        """
+        payload = self._build_payload(messages, model, options or {})
+        lease, reserved = await self._aadmit(payload)
+        response = None
+        try:
+            response = await self.transport.apost(self._chat_endpoint(), headers=self._chat_headers(lease.key),
+                                                  json=payload)
+            if response.status_code == 200:
+                return self._settle_completion(lease, reserved, response)
+            self._settle(lease, reserved, response)
+            raise self._completion_error(response.status_code, response.text, response.headers)
+        except Exception as e:
+            if response is None:
+                self._fail(lease, reserved)
+            self.logger.error(f"Unexpected error in agenerate_completion: {str(e)}")
+            raise
+        finally:
+            lease.release()
+
+    def stream_completion(self, messages, model, options=None):
+        """
+        Stream a chat completion, relaying each delta as soon as it is received.
+
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content' keys.
+            model (str): String specifying the model to use.
+            options (dict, optional): Dictionary of optional parameters like temperature, max_tokens.
+
+        Yields:
+            dict: Delta events followed by a final usage event.
+
+        Raises:
+            Exception: If the API request fails.
+        """
+        payload = self._build_payload(messages, model, options or {}, stream=True)
+        lease, reserved = self._admit(payload)
+        state, response = {}, None
+        try:
+            with self.transport.stream("POST", self._chat_endpoint(), headers=self._chat_headers(lease.key),
+                                       json=payload) as response:
+                trace_event('response_headers', status=response.status_code)
+                if response.status_code != 200:
+                    self._settle(lease, reserved, response)
+                    raise self._completion_error(response.status_code, response.read_text(), response.headers)
+                try:
+                    for line in response.iter_lines():
+                        yield from self._parse_stream_line(line, state)
+                finally:
+                    self._settle(lease, reserved, response, state.get("usage") or {"total_tokens": reserved})
+            yield self._usage_event(state)
+        except Exception:
+            if response is None:
+                self._fail(lease, reserved)
+            raise
+        finally:
+            lease.release()
+
+    async def astream_completion(self, messages, model, options=None):
+        """
+        Stream a chat completion from the event loop, relaying each delta as soon as it is received.
+
+        Args:
+            messages (list): List of message dictionaries with 'role' and 'content' keys.
+            model (str): String specifying the model to use.
+            options (dict, optional): Dictionary of optional parameters like temperature, max_tokens.
+
+        Yields:
+            dict: Delta events followed by a final usage event.
+
+        Raises:
+            Exception: If the API request fails.
+        """
+        payload = self._build_payload(messages, model, options or {}, stream=True)
+        lease, reserved = await self._aadmit(payload)
+        state, response = {}, None
+        try:
+            async with self.transport.astream("POST", self._chat_endpoint(), headers=self._chat_headers(lease.key),
+                                              json=payload) as response:
+                trace_event('response_headers', status=response.status_code)
+                if response.status_code != 200:
+                    self._settle(lease, reserved, response)
+                    await response.aread()
+                    raise self._completion_error(response.status_code, response.text, response.headers)
+                try:
+                    async for line in response.aiter_lines():
+                        for event in self._parse_stream_line(line, state):
+                            yield event
+                finally:
+                    self._settle(lease, reserved, response, state.get("usage") or {"total_tokens": reserved})
+            yield self._usage_event(state)
+        except Exception:
+            if response is None:
+                self._fail(lease, reserved)
+            raise
+        finally:
+            lease.release()
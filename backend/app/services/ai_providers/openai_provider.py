@@ -1,14 +1,14 @@
-from .base_provider import BaseProvider
+from .openai_compatible import OpenAICompatibleProvider
+from app.services.model_store import get_model_store
 
 import logging
 
-class OpenaiProvider(BaseProvider):
+class OpenaiProvider(OpenAICompatibleProvider):
     def __init__(self, api_key):
         super().__init__(api_key)
         self.name = "openai"
         self.logger = logging.getLogger(__name__)
         self._api_base_url = "https://api.openai.com/v1"
-        self._cached_models = None
         self.supported_models = [
             # GPT-4o (Omni)
             "gpt-4o-2024-05-13",
@@ -32,29 +32,22 @@ class OpenaiProvider(BaseProvider):
     def get_supported_models(self):
         """
         Retrieve the list of supported models for this provider.
-        Uses cached results if available, otherwise fetches from API.
+        Fetches GPT models from the API, falling back to the static list.
         
         Returns:
             list: List of supported model names.
         """
-        if self._cached_models is not None:
-            return self._cached_models
-            
-        import requests
-        headers = {
-            "Authorization": f"Bearer {self._api_key}"
-        }
         try:
-            response = requests.get(self.get_api_endpoint(), headers=headers, timeout=10)
-            if response.status_code == 200:
-                models_data = response.json().get('data', [])
-                self._cached_models = [model['id'] for model in models_data if 'gpt' in model['id'].lower()]
-                self.logger.info(f"Successfully fetched {len(self._cached_models)} models from OpenAI API")
-                return self._cached_models
+            models = self.fetch_models()["models"]
+            self.logger.info(f"Successfully fetched {len(models)} models from OpenAI API")
+            return models
         except Exception as e:
             self.logger.error(f"Error fetching OpenAI models: {str(e)}")
         return self.supported_models
 
+    def _include_model(self, model_id):
+        return 'gpt' in model_id.lower()
+
     def get_api_endpoint(self):
         """
         Get the API endpoint for fetching models.
@@ -62,7 +55,27 @@ class OpenaiProvider(BaseProvider):
         Returns:
             str: API endpoint URL.
         """
-        return f"{self._api_base_url}/models"
+        return f"{self._base_url()}/models"
+
+    def _is_model_incompatible(self, response):
+        """
+        Check whether a failed response means the model cannot be used for chat
+        """
+        return response.status_code in [403, 404, 400] and any(
+            error in response.text.lower() for error in ["model_not_found", "not supported", "audio"]
+        )
+
+    def _fallback_models(self, model):
+        """
+        Known compatible chat models to retry with, in order of preference.
+        Reads the stored catalog so a failed completion never lists models upstream.
+        """
+        entry = get_model_store().get(self.name)
+        supported_models = entry[0] if entry else self.supported_models
+        return [
+            fallback_model for fallback_model in ["gpt-4o-mini", "gpt-4o", "gpt-4"]
+            if fallback_model != model and fallback_model in supported_models
+        ]
 
     def generate_completion(self, messages, model, options=None):
         """
@@ -79,63 +92,75 @@ class OpenaiProvider(BaseProvider):
         Raises:
             Exception: If the API request fails.
         """
-        import requests
-        options = options or {}
-        endpoint = f"{self._api_base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self._api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": options.get("temperature", 0.7),
-            "max_tokens": options.get("max_tokens", 1000),
-            "stream": options.get("stream", False)
-        }
-        
+        endpoint = self._chat_endpoint()
+        payload = self._build_payload(messages, model, options or {})
+        lease, reserved = self._admit(payload)
+        headers = self._chat_headers(lease.key)
+        response = None
         try:
-            response = requests.post(endpoint, headers=headers, json=payload, timeout=30)
+            response = self.transport.post(endpoint, headers=headers, json=payload)
             if response.status_code == 200:
-                result = response.json()
-                return {
-                    "text": result["choices"][0]["message"]["content"],
-                    "finish_reason": result["choices"][0]["finish_reason"],
-                    "usage": {
-                        "prompt_tokens": result["usage"]["prompt_tokens"],
-                        "completion_tokens": result["usage"]["completion_tokens"],
-                        "total_tokens": result["usage"]["total_tokens"]
-                    }
-                }
-            elif (response.status_code in [403, 404, 400]) and any(error in response.text.lower() for error in ["model_not_found", "not supported", "audio"]):
+                return self._settle_completion(lease, reserved, response)
+            self._settle(lease, reserved, response)
+            if self._is_model_incompatible(response):
                 error_msg = f"Model {model} not compatible: {response.status_code} - {response.text}"
                 self.logger.error(error_msg)
-                # Fallback to a list of known compatible chat models
-                fallback_models = ["gpt-4o-mini", "gpt-4o", "gpt-4"]
-                supported_models = self.get_supported_models()
-                for fallback_model in fallback_models:
-                    if model != fallback_model and fallback_model in supported_models:
-                        self.logger.info(f"Falling back to {fallback_model} due to compatibility issue with {model}")
-                        payload["model"] = fallback_model
-                        response = requests.post(endpoint, headers=headers, json=payload, timeout=30)
-                        if response.status_code == 200:
-                            result = response.json()
-                            return {
-                                "text": result["choices"][0]["message"]["content"],
-                                "finish_reason": result["choices"][0]["finish_reason"],
-                                "usage": {
-                                    "prompt_tokens": result["usage"]["prompt_tokens"],
-                                    "completion_tokens": result["usage"]["completion_tokens"],
-                                    "total_tokens": result["usage"]["total_tokens"]
-                                }
-                            }
-                        else:
-                            self.logger.error(f"Error with fallback model {fallback_model}: {response.status_code} - {response.text}")
+                for fallback_model in self._fallback_models(model):
+                    self.logger.info(f"Falling back to {fallback_model} due to compatibility issue with {model}")
+                    payload["model"] = fallback_model
+                    reserved = self._limiter(lease.key).acquire(reserved)
+                    response = None
+                    response = self.transport.post(endpoint, headers=headers, json=payload)
+                    if response.status_code == 200:
+                        return self._settle_completion(lease, reserved, response)
+                    self._settle(lease, reserved, response)
+                    self.logger.error(f"Error with fallback model {fallback_model}: {response.status_code} - {response.text}")
                 raise Exception(error_msg)
             else:
-                error_msg = f"Error generating completion: {response.status_code} - {response.text}"
+                raise self._completion_error(response.status_code, response.text, response.headers)
+        except Exception as e:
+            if response is None:
+                self._fail(lease, reserved)
+            self.logger.error(f"Unexpected error in generate_completion: {str(e)}")
+            raise
+        finally:
+            lease.release()
+
+    async def agenerate_completion(self, messages, model, options=None):
+        """
+        Generate a chat completion using the OpenAI API without blocking the event loop.
+        Applies the same model fallback as generate_completion.
+        """
+        endpoint = self._chat_endpoint()
+        payload = self._build_payload(messages, model, options or {})
+        lease, reserved = await self._aadmit(payload)
+        headers = self._chat_headers(lease.key)
+        response = None
+        try:
+            response = await self.transport.apost(endpoint, headers=headers, json=payload)
+            if response.status_code == 200:
+                return self._settle_completion(lease, reserved, response)
+            self._settle(lease, reserved, response)
+            if self._is_model_incompatible(response):
+                error_msg = f"Model {model} not compatible: {response.status_code} - {response.text}"
                 self.logger.error(error_msg)
+                for fallback_model in self._fallback_models(model):
+                    self.logger.info(f"Falling back to {fallback_model} due to compatibility issue with {model}")
+                    payload["model"] = fallback_model
+                    reserved = await self._limiter(lease.key).aacquire(reserved)
+                    response = None
+                    response = await self.transport.apost(endpoint, headers=headers, json=payload)
+                    if response.status_code == 200:
+                        return self._settle_completion(lease, reserved, response)
+                    self._settle(lease, reserved, response)
+                    self.logger.error(f"Error with fallback model {fallback_model}: {response.status_code} - {response.text}")
                 raise Exception(error_msg)
+            else:
+                raise self._completion_error(response.status_code, response.text, response.headers)
         except Exception as e:
-            self.logger.error(f"Unexpected error in generate_completion: {str(e)}")
+            if response is None:
+                self._fail(lease, reserved)
+            self.logger.error(f"Unexpected error in agenerate_completion: {str(e)}")
             raise
+        finally:
+            lease.release()
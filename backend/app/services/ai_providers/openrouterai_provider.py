@@ -1,9 +1,13 @@
-from .base_provider import BaseProvider
+from .openai_compatible import OpenAICompatibleProvider
 
-class OpenrouteraiProvider(BaseProvider):
+import logging
+
+class OpenrouteraiProvider(OpenAICompatibleProvider):
     def __init__(self, api_key):
         super().__init__(api_key)
         self.name = "openrouterai"
+        self.logger = logging.getLogger(__name__)
+        self._api_base_url = "https://openrouter.ai/api/v1"
         self.supported_models = [
             "anthropic/claude-2",
             "anthropic/claude-instant-v1",
@@ -11,6 +15,3 @@ class OpenrouteraiProvider(BaseProvider):
             "openai/gpt-3.5-turbo",
             "openai/gpt-4"
         ]
-
-    def get_api_endpoint(self):
-        return "https://api.openrouterai.com/v1/models"
@@ -1,105 +1,372 @@
 import os
+import glob
 import importlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from app.config import Config
+from .key_validation_cache import KeyValidationCache
+from .provider_router import ProviderRouter, parse_candidates
+
+# Environment variables that do not follow the PROVIDER_API_KEY convention
+PROVIDER_ENV_VARS = {
+    'google': 'GOOGLE_AI_API_KEY'
+}
 
 class ProviderRegistry:
-    """Registry for AI providers"""
-    
+    """
+    Registry for AI providers.
+
+    Nothing is loaded at construction time. On first use the registry discovers
+    provider modules, registers every provider whose API key is set in the
+    environment without contacting the vendor, and validates those keys
+    concurrently on a background thread. Providers whose key turns out to be
+    invalid are removed once their verdict is known.
+
+    Every validation request is bounded by KEY_VALIDATION_TIMEOUT, and verdicts
+    are cached on disk per key fingerprint for KEY_VALIDATION_CACHE_TTL, so
+    restarts and other workers skip keys that were checked recently.
+
+    Requests for the "auto" provider are routed to one of the registered
+    providers by the registry's ProviderRouter.
+    """
+
     def __init__(self):
         self.providers = {}
-        self.provider_classes = {}
+        self._provider_classes = {}
+        self._provider_ids = None
+        self.validation_status = {}
+        self.startup_timings = {}
         self.logger = logging.getLogger(__name__)
-        
-        # Dynamically discover and load providers
-        self._load_providers()
-        # Auto-register providers based on environment variables
-        self._auto_register_providers()
+        self._lock = threading.RLock()
+        self._initialized = False
+        self.router = ProviderRouter(self, parse_candidates(Config.AUTO_ROUTE_CANDIDATES))
+        self._validation_done = threading.Event()
+        self._validation_done.set()
+        self.validation_timeout = Config.KEY_VALIDATION_TIMEOUT
+        self.key_cache = KeyValidationCache(Config.KEY_VALIDATION_CACHE_FILE, Config.KEY_VALIDATION_CACHE_TTL)
+        self._executor = None
 
-    def _load_providers(self):
+    def _get_executor(self):
+        """Thread pool shared by all key validations"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='key-validation')
+            return self._executor
+
+    def _ensure_initialized(self, validate=True):
         """
-        Dynamically discover and import provider classes from the ai_providers directory.
-        Handles import errors gracefully to ensure robustness.
+        Discover providers and auto-register keys from the environment on first use
+
+        :param validate: Check the registered keys in the background
         """
-        import glob
-        import os.path
+        if self._initialized:
+            return
+        with self._lock:
+            if self._initialized:
+                return
+            self._discover_providers()
+            self._auto_register_providers(validate)
+            self._initialized = True
+            if self._validation_done.is_set():
+                self.logger.info(f"Provider startup timings: {self.format_startup_timings()}")
 
+    def _discover_providers(self):
+        """
+        Find provider modules in the ai_providers directory without importing them.
+        """
+        started = time.perf_counter()
         provider_dir = os.path.dirname(os.path.abspath(__file__))
         provider_files = glob.glob(os.path.join(provider_dir, "*_provider.py"))
-        
-        for provider_file in provider_files:
+
+        provider_ids = []
+        for provider_file in sorted(provider_files):
             provider_id = os.path.basename(provider_file).replace('_provider.py', '')
             if provider_id in ['base']:  # Skip base provider or other non-specific files
                 continue
-                
-            try:
-                # Convert provider_id to PascalCase for class name
-                provider_class_name = ''.join(word.capitalize() for word in provider_id.split('_')) + 'Provider'
-                
-                # Dynamically import the provider module
-                module_name = f'app.services.ai_providers.{provider_id}_provider'
-                module = importlib.import_module(module_name)
-                
-                # Get the provider class dynamically
-                provider_class = getattr(module, provider_class_name)
-                self.provider_classes[provider_id] = provider_class
-                
-                self.logger.info(f"Loaded provider: {provider_id}")
-            except (ImportError, AttributeError) as e:
-                self.logger.warning(f"Could not load provider {provider_id}: {str(e)}")
-            except Exception as e:
-                self.logger.error(f"Unexpected error loading provider {provider_id}: {str(e)}")
+            provider_ids.append(provider_id)
+
+        self._provider_ids = provider_ids
+        self._record_timing('discover', started)
+
+    def _load_provider_class(self, provider_id):
+        """
+        Import a provider module on demand and return its provider class.
+        Handles import errors gracefully to ensure robustness.
 
-    def _auto_register_providers(self):
+        :param provider_id: Lowercase provider identifier
+        :return: Provider class or None if it could not be loaded
         """
-        Automatically register providers based on API keys found in environment variables.
+        if provider_id in self._provider_classes:
+            return self._provider_classes[provider_id]
+
+        started = time.perf_counter()
+        provider_class = None
+        try:
+            # Convert provider_id to PascalCase for class name
+            provider_class_name = ''.join(word.capitalize() for word in provider_id.split('_')) + 'Provider'
+
+            # Dynamically import the provider module
+            module_name = f'app.services.ai_providers.{provider_id}_provider'
+            module = importlib.import_module(module_name)
+
+            # Get the provider class dynamically
+            provider_class = getattr(module, provider_class_name)
+            self.logger.info(f"Loaded provider: {provider_id}")
+        except (ImportError, AttributeError) as e:
+            self.logger.warning(f"Could not load provider {provider_id}: {str(e)}")
+        except Exception as e:
+            self.logger.error(f"Unexpected error loading provider {provider_id}: {str(e)}")
+
+        self._provider_classes[provider_id] = provider_class
+        self._record_timing('import', started, accumulate=True)
+        return provider_class
+
+    @property
+    def provider_classes(self):
+        """
+        All loadable provider classes, importing any that are not loaded yet
+
+        :return: Dictionary of provider_id to provider class
+        """
+        self._ensure_initialized()
+        classes = {}
+        for provider_id in self._provider_ids:
+            provider_class = self._load_provider_class(provider_id)
+            if provider_class is not None:
+                classes[provider_id] = provider_class
+        return classes
+
+    def _auto_register_providers(self, validate=True):
+        """
+        Register providers based on API keys found in environment variables.
         The expected format for API keys in environment variables is PROVIDER_API_KEY.
+        Keys are not checked here; validation is deferred to a background thread unless disabled.
         Skips providers that are not fully implemented or are abstract.
         """
-        for provider_id in self.provider_classes.keys():
-            env_var_name = f"{provider_id.upper()}_API_KEY"
+        started = time.perf_counter()
+        pending = []
+        for provider_id in self._provider_ids:
+            env_var_name = PROVIDER_ENV_VARS.get(provider_id, f"{provider_id.upper()}_API_KEY")
             api_key = os.getenv(env_var_name)
-            if api_key:
-                try:
-                    # Check if the provider class can be instantiated (not abstract)
-                    provider_class = self.provider_classes[provider_id]
-                    if hasattr(provider_class, '__abstractmethods__') and provider_class.__abstractmethods__:
-                        self.logger.warning(f"Skipping auto-registration of abstract provider {provider_id}")
-                        continue
-                    self.register_provider(provider_id, api_key)
-                    self.logger.info(f"Auto-registered provider {provider_id} using environment variable {env_var_name}")
-                except ValueError as ve:
-                    self.logger.warning(f"Failed to auto-register {provider_id}: {str(ve)}")
-                except NotImplementedError as nie:
-                    self.logger.warning(f"Skipping auto-registration of {provider_id} due to unimplemented features: {str(nie)}")
-                except Exception as e:
-                    self.logger.error(f"Unexpected error during auto-registration of {provider_id}: {str(e)}")
-
-    def register_provider(self, provider_id, api_key):
+            if not api_key:
+                continue
+            try:
+                provider_class = self._load_provider_class(provider_id)
+                if provider_class is None:
+                    continue
+                # Check if the provider class can be instantiated (not abstract)
+                if hasattr(provider_class, '__abstractmethods__') and provider_class.__abstractmethods__:
+                    self.logger.warning(f"Skipping auto-registration of abstract provider {provider_id}")
+                    continue
+                provider = self._register(provider_id, api_key, validate=False)
+                pending.append((provider_id, provider))
+                self.logger.info(f"Auto-registered provider {provider_id} using environment variable {env_var_name}")
+            except ValueError as ve:
+                self.logger.warning(f"Failed to auto-register {provider_id}: {str(ve)}")
+            except NotImplementedError as nie:
+                self.logger.warning(f"Skipping auto-registration of {provider_id} due to unimplemented features: {str(nie)}")
+            except Exception as e:
+                self.logger.error(f"Unexpected error during auto-registration of {provider_id}: {str(e)}")
+        self._record_timing('register', started)
+
+        if pending and validate:
+            self._start_background_validation(pending)
+
+    def _start_background_validation(self, pending):
+        """
+        Validate auto-registered API keys concurrently without blocking callers.
+
+        :param pending: List of (provider_id, provider) tuples to validate
+        """
+        self._validation_done.clear()
+        for provider_id, _ in pending:
+            self.validation_status[provider_id] = 'pending'
+
+        def validate_all():
+            started = time.perf_counter()
+            try:
+                self._validate_concurrently(pending)
+            finally:
+                self._record_timing('validate', started)
+                self._validation_done.set()
+                self.logger.info(f"Provider startup timings: {self.format_startup_timings()}")
+
+        thread = threading.Thread(target=validate_all, name='provider-validation', daemon=True)
+        thread.start()
+
+    def _check_key(self, provider_id, provider, force=False):
+        """
+        Get the verdict for a provider's API keys, from the cache unless forced.
+        Every pooled key is checked; rejected keys are taken out of the provider's rotation.
+
+        :param provider_id: Lowercase provider identifier
+        :param provider: Provider instance holding the keys
+        :param force: Skip the cache and ask the provider
+        :return: True if any key is valid, False if every key was rejected,
+                 or None if no key was accepted and some could not be checked in time
+        """
+        keys = provider.key_pool.keys or [provider._api_key]
+        if len(keys) == 1:
+            verdicts = [self._check_one_key(provider_id, provider, keys[0], force)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(8, len(keys)), thread_name_prefix='key-validation') as pool:
+                verdicts = list(pool.map(lambda key: self._check_one_key(provider_id, provider, key, force), keys))
+
+        if True not in verdicts:
+            return False if all(valid is False for valid in verdicts) else None
+        for key, valid in zip(keys, verdicts):
+            if valid is False and provider.key_pool.disable(key, "failed validation"):
+                self.logger.warning(f"Disabled an API key of {provider_id}: failed validation")
+        return True
+
+    def _check_one_key(self, provider_id, provider, api_key, force):
+        if not force:
+            cached = self.key_cache.get(provider_id, api_key)
+            if cached is not None:
+                return cached
+
+        try:
+            valid = provider.check_api_key(timeout=(self.validation_timeout, self.validation_timeout),
+                                           api_key=api_key)
+        except NotImplementedError as nie:
+            self.logger.warning(f"Cannot validate {provider_id}, keeping it registered: {str(nie)}")
+            return True
+        except Exception as e:
+            self.logger.warning(f"Could not validate {provider_id}: {str(e)}")
+            return None
+
+        self.key_cache.set(provider_id, api_key, valid)
+        return valid
+
+    def _apply_verdict(self, provider_id, provider, valid):
+        """
+        Record a verdict for a registered provider and drop it if its key is rejected
+        """
+        with self._lock:
+            self.validation_status[provider_id] = {True: 'valid', False: 'invalid'}.get(valid, 'unknown')
+            if valid is False and self.providers.get(provider_id) is provider:
+                del self.providers[provider_id]
+                self.logger.warning(f"Unregistered {provider_id}: API key failed validation")
+
+    def _validate_concurrently(self, pending, force=False):
+        """
+        Validate several providers in parallel within one overall deadline.
+        Providers still running at the deadline keep their registration with an 'unknown' status.
+
+        :param pending: List of (provider_id, provider) tuples to validate
+        :param force: Skip cached verdicts
+        """
+        executor = self._get_executor()
+        futures = {
+            executor.submit(self._check_key, provider_id, provider, force): (provider_id, provider)
+            for provider_id, provider in pending
+        }
+        # Connect and read are bounded separately, so allow both phases before giving up
+        done, not_done = wait(futures, timeout=self.validation_timeout * 2)
+        for future, (provider_id, provider) in futures.items():
+            valid = future.result() if future in done else None
+            self._apply_verdict(provider_id, provider, valid)
+
+    def revalidate(self, provider_id=None):
+        """
+        Re-check API keys now, ignoring cached verdicts
+
+        :param provider_id: Provider to re-check, or None for every registered provider
+        :return: Dictionary of provider_id to 'valid', 'invalid' or 'unknown'
+        :raises ValueError: If the provider is not registered
+        """
+        self._ensure_initialized()
+        with self._lock:
+            if provider_id is not None:
+                if provider_id not in self.providers:
+                    raise ValueError(f"Provider not registered: {provider_id}")
+                pending = [(provider_id, self.providers[provider_id])]
+            else:
+                pending = list(self.providers.items())
+
+        self._validate_concurrently(pending, force=True)
+        return {pid: self.validation_status.get(pid) for pid, _ in pending}
+
+    def wait_for_validation(self, timeout=None):
+        """
+        Block until background key validation has finished
+
+        :param timeout: Maximum seconds to wait, or None to wait indefinitely
+        :return: True if validation finished within the timeout
+        """
+        self._ensure_initialized()
+        return self._validation_done.wait(timeout)
+
+    def _record_timing(self, phase, started, accumulate=False):
+        elapsed = time.perf_counter() - started
+        if accumulate:
+            elapsed += self.startup_timings.get(phase, 0.0)
+        self.startup_timings[phase] = elapsed
+
+    def format_startup_timings(self):
+        """
+        Format the time spent in each startup phase for logging
+
+        :return: String such as "discover=1.2ms, import=35.0ms, ..."
+        """
+        return ', '.join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in self.startup_timings.items())
+
+    def register_provider(self, provider_id, api_key, validate=True):
         """
         Register a provider with the given API key.
-        
+
         Args:
             provider_id (str): Lowercase provider identifier.
             api_key (str): API key for authentication.
-            
+            validate (bool): Check the key against the provider API (or a cached verdict)
+                before registering.
+
         Returns:
             object: Registered provider instance.
-            
+
         Raises:
-            ValueError: If the provider is unknown or the API key is invalid.
+            ValueError: If the provider is unknown, the API key is invalid, or it
+                could not be validated within the timeout.
             Exception: For other unexpected errors during registration.
         """
-        if provider_id not in self.provider_classes:
+        self._ensure_initialized()
+        return self._register(provider_id, api_key, validate)
+
+    def _register(self, provider_id, api_key, validate):
+        if provider_id not in self._provider_ids:
             raise ValueError(f"Unknown provider: {provider_id}")
-        
-        provider_class = self.provider_classes[provider_id]
-        
+
+        provider_class = self._load_provider_class(provider_id)
+        if provider_class is None:
+            raise ValueError(f"Unknown provider: {provider_id}")
+
         try:
             provider = provider_class(api_key)
-            if not provider.validate_api_key():
-                raise ValueError(f"Invalid API key for {provider_id}")
-            
-            self.providers[provider_id] = provider
+            if validate:
+                future = self._get_executor().submit(self._check_key, provider_id, provider)
+                try:
+                    valid = future.result(timeout=self.validation_timeout * 2)
+                except TimeoutError:
+                    valid = None
+                if valid is None:
+                    raise ValueError(f"Timed out validating API key for {provider_id}")
+                if not valid:
+                    raise ValueError(f"Invalid API key for {provider_id}")
+
+            with self._lock:
+                existing = self.providers.get(provider_id)
+                if existing is not None:
+                    # Another key for a registered provider joins its rotation
+                    added = [key for key in provider.key_pool.keys
+                             if not provider.key_pool.is_disabled(key) and existing.key_pool.add(key)]
+                    self.logger.info(f"Added {len(added)} API key(s) to provider: {provider_id}")
+                    return existing
+                self.providers[provider_id] = provider
+                if validate:
+                    self.validation_status[provider_id] = 'valid'
             self.logger.info(f"Successfully registered provider: {provider_id}")
             return provider
         except ValueError as ve:
@@ -112,32 +379,49 @@ class ProviderRegistry:
     def get_provider(self, provider_id):
         """
         Get the registered provider instance
-        
+
         :param provider_id: Lowercase provider identifier
         :return: Provider instance or None
         """
+        self._ensure_initialized()
         return self.providers.get(provider_id)
 
-    def get_all_providers(self):
+    def route(self, messages, options=None, exclude=()):
+        """
+        Resolve the "auto" provider for a request
+
+        :param messages: List of message dictionaries with 'role' and 'content' keys
+        :param options: Optional parameters like max_tokens
+        :param exclude: (provider id, model) pairs that must not be chosen
+        :return: (provider id, provider, model, decision), see ProviderRouter.route
+        :raises ValueError: If no registered provider meets the request's requirements
+        """
+        return self.router.route(messages, options, exclude)
+
+    def get_all_providers(self, validate=True):
         """
         Get all registered providers
-        
+
+        :param validate: If this call initializes the registry, whether to validate the keys in the background;
+                         one-off scripts pass False to avoid the extra vendor calls
         :return: Dictionary of registered providers
         """
+        self._ensure_initialized(validate)
         return self.providers
 
     def get_available_provider_ids(self):
         """
         Get a list of all available provider IDs
-        
+
         :return: List of provider identifiers
         """
-        return list(self.provider_classes.keys())
+        self._ensure_initialized()
+        return list(self._provider_ids)
 
     def get_default_provider(self):
         """
         Get the default provider (Groq)
-        
+
         :return: Default provider instance
         """
         default_provider = os.getenv('DEFAULT_PROVIDER', 'groq')
@@ -146,10 +430,10 @@ class ProviderRegistry:
     def get_default_model(self):
         """
         Get the default model
-        
+
         :return: Default model name
         """
         return os.getenv('DEFAULT_MODEL', 'llama-3.1-8b-instant')
 
-# Create a global ProviderRegistry instance for the whole app
+# The single ProviderRegistry instance for the whole process; it initialises itself on first use
 provider_registry = ProviderRegistry()
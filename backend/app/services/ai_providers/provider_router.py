@@ -0,0 +1,241 @@
+"""
+Automatic provider routing.
+
+Requests sent to the "auto" provider go to the registered provider/model that
+meets the request's requirements (context size, vision) and is expected to
+finish soonest. The estimate comes from exponentially-weighted moving averages
+of time to first token, throughput and error rate, updated from every
+completion the service runs. A decision is a loop over a few precomputed
+candidates, so it costs microseconds.
+"""
+import threading
+import time
+
+from app.config import Config
+
+AUTO_PROVIDER_ID = 'auto'
+
+# (context window in tokens, accepts images) of the chat models the router may pick
+MODEL_PROFILES = {
+    ('groq', 'llama-3.1-8b-instant'): (131072, False),
+    ('groq', 'llama-3.3-70b-versatile'): (131072, False),
+    ('openai', 'gpt-4o-mini'): (128000, True),
+    ('openai', 'gpt-4o'): (128000, True),
+    ('openai', 'gpt-4.1-mini'): (1047576, True),
+    ('deepseek', 'deepseek-chat'): (65536, False),
+    ('alibaba', 'qwen-turbo'): (131072, False),
+    ('alibaba', 'qwen-plus'): (131072, False),
+    ('xai', 'grok-2-latest'): (131072, False),
+    ('xai', 'grok-2-vision-latest'): (32768, True),
+}
+
+# Context window assumed for configured models without a profile
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Estimates used until a candidate has served traffic; optimistic so new candidates get tried
+PRIOR_TTFT = 1.0
+PRIOR_THROUGHPUT = 50.0
+
+# Output tokens assumed when a request does not set max_tokens
+DEFAULT_OUTPUT_TOKENS = 512
+
+
+def parse_candidates(spec):
+    """
+    Parse routing candidates such as "groq:llama-3.3-70b-versatile,openai:gpt-4o-mini"
+
+    :param spec: Comma separated provider:model pairs
+    :return: List of (provider id, model) tuples
+    """
+    candidates = []
+    for item in (spec or '').split(','):
+        provider_id, _, model = item.strip().partition(':')
+        if provider_id and model:
+            candidates.append((provider_id.lower(), model))
+    return candidates
+
+
+def _has_image(message):
+    content = message.get('content') if isinstance(message, dict) else None
+    if not isinstance(content, list):
+        return False
+    return any(isinstance(part, dict) and part.get('type') in ('image_url', 'image') for part in content)
+
+
+def _content_length(message):
+    content = message.get('content') if isinstance(message, dict) else None
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(len(part.get('text') or '') for part in content if isinstance(part, dict))
+    return 0
+
+
+def requirements_for(messages, options=None):
+    """
+    Derive what a model needs to serve a request
+
+    :param messages: List of message dictionaries with 'role' and 'content' keys
+    :param options: Optional parameters like max_tokens
+    :return: Dictionary with 'context' (tokens needed, roughly four characters per token),
+             'output_tokens' and 'vision'
+    """
+    output_tokens = (options or {}).get('max_tokens') or DEFAULT_OUTPUT_TOKENS
+    prompt_tokens = sum(_content_length(message) for message in messages) // 4
+    return {
+        'context': prompt_tokens + output_tokens,
+        'output_tokens': output_tokens,
+        'vision': any(_has_image(message) for message in messages)
+    }
+
+
+class RouteStats:
+    """
+    EWMAs of time to first token, throughput and error rate per provider/model.
+    Entries are replaced as tuples, so readers never need the lock.
+    """
+
+    def __init__(self, alpha=0.2, error_half_life=60.0):
+        """
+        :param alpha: Weight of the newest sample
+        :param error_half_life: Seconds after which an idle candidate's error rate has halved,
+                                so a provider that failed earlier is eventually tried again
+        """
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        # (provider id, model) -> (ttft, throughput, error rate, samples, updated at)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _update(self, key, ttft, throughput, failed):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = (ttft, throughput, 1.0 if failed else 0.0, 1, time.monotonic())
+                return
+            old_ttft, old_throughput, error_rate, samples, _ = entry
+            a = self.alpha
+            if ttft is not None:
+                ttft = ttft if old_ttft is None else old_ttft + a * (ttft - old_ttft)
+            else:
+                ttft = old_ttft
+            if throughput is not None:
+                throughput = throughput if old_throughput is None else old_throughput + a * (throughput - old_throughput)
+            else:
+                throughput = old_throughput
+            error_rate += a * ((1.0 if failed else 0.0) - error_rate)
+            self._entries[key] = (ttft, throughput, error_rate, samples + 1, time.monotonic())
+
+    def record_success(self, provider_id, model, ttft=None, tokens=None, duration=None):
+        """
+        Record a completed call
+
+        :param ttft: Seconds until the first token, None when the response was not streamed
+        :param tokens: Completion tokens produced
+        :param duration: Seconds spent producing those tokens
+        """
+        throughput = tokens / duration if tokens and duration and duration > 0 else None
+        self._update((provider_id, model), ttft, throughput, False)
+
+    def record_error(self, provider_id, model):
+        self._update((provider_id, model), None, None, True)
+
+    def estimate(self, key, now=None):
+        """
+        :return: (ttft, throughput, error rate, samples) with priors filled in for missing values
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return PRIOR_TTFT, PRIOR_THROUGHPUT, 0.0, 0
+        ttft, throughput, error_rate, samples, updated_at = entry
+        if error_rate:
+            idle = (now or time.monotonic()) - updated_at
+            error_rate *= 0.5 ** (idle / self.error_half_life)
+        return (PRIOR_TTFT if ttft is None else ttft,
+                PRIOR_THROUGHPUT if throughput is None else throughput,
+                error_rate, samples)
+
+    def snapshot(self):
+        now = time.monotonic()
+        result = {}
+        for key in list(self._entries):
+            ttft, throughput, error_rate, samples = self.estimate(key, now)
+            result[f'{key[0]}:{key[1]}'] = {
+                'ttft_ms': round(ttft * 1000, 1),
+                'tokens_per_second': round(throughput, 1),
+                'error_rate': round(error_rate, 4),
+                'samples': samples
+            }
+        return result
+
+
+class ProviderRouter:
+    """
+    Picks the provider/model for requests sent to the "auto" provider
+    """
+
+    def __init__(self, registry, candidates=None, stats=None):
+        """
+        :param registry: ProviderRegistry whose registered providers are eligible
+        :param candidates: (provider id, model) pairs to choose from; defaults to every profiled model
+        :param stats: RouteStats fed by the completion service
+        """
+        self.registry = registry
+        self.candidates = candidates or list(MODEL_PROFILES)
+        self.stats = stats or RouteStats(alpha=Config.AUTO_ROUTE_EWMA_ALPHA)
+        self._eligible = ()
+        self._eligible_for = None
+
+    def _eligible_candidates(self):
+        """
+        Candidates whose provider is registered, as (key, provider, context window, vision) tuples.
+        Rebuilt only when the set of registered providers changes.
+        """
+        providers = self.registry.get_all_providers()
+        registered = tuple(providers)
+        if registered != self._eligible_for:
+            eligible = []
+            for key in self.candidates:
+                provider = providers.get(key[0])
+                if provider is not None:
+                    context, vision = MODEL_PROFILES.get(key, (DEFAULT_CONTEXT_WINDOW, False))
+                    eligible.append((key, provider, context, vision))
+            self._eligible, self._eligible_for = tuple(eligible), registered
+        return self._eligible
+
+    def route(self, messages, options=None, exclude=()):
+        """
+        Choose the provider/model expected to complete the request soonest
+
+        :param messages: List of message dictionaries with 'role' and 'content' keys
+        :param options: Optional parameters like max_tokens
+        :param exclude: (provider id, model) pairs that must not be chosen, e.g. open circuits
+        :return: (provider id, provider, model, decision) where decision describes the choice
+        :raises ValueError: If no registered provider meets the request's requirements
+        """
+        started = time.perf_counter()
+        needs = requirements_for(messages, options)
+        now = time.monotonic()
+        best, best_cost, considered = None, None, 0
+        for key, provider, context, vision in self._eligible_candidates():
+            if context < needs['context'] or (needs['vision'] and not vision) or key in exclude:
+                continue
+            considered += 1
+            ttft, throughput, error_rate, _ = self.stats.estimate(key, now)
+            # Expected seconds to finish, inflated by the retries a failure rate implies
+            cost = (ttft + needs['output_tokens'] / throughput) / max(1.0 - error_rate, 0.05)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = (key, provider), cost
+        if best is None:
+            raise ValueError("No configured provider meets the request's requirements")
+
+        (provider_id, model), provider = best
+        decision = {
+            'provider': provider_id,
+            'model': model,
+            'expected_ms': round(best_cost * 1000, 1),
+            'candidates': considered,
+            'requirements': needs,
+            'decision_us': round((time.perf_counter() - started) * 1e6, 1)
+        }
+        return provider_id, provider, model, decision
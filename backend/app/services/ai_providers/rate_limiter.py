@@ -0,0 +1,283 @@
+"""
+Client-side rate limiting per provider key.
+
+Each API key gets a request bucket and a token bucket that refill continuously
+at the key's requests-per-minute and tokens-per-minute limits. Limits come from
+PROVIDER_RATE_LIMITS and are learned from the x-ratelimit-* headers vendors
+return. A call reserves one request and its estimated tokens up front. If the
+buckets cannot cover that within RATE_LIMIT_MAX_WAIT_MS, the call fails before
+it is sent; otherwise it waits its turn. The estimate is reconciled against the
+usage the vendor reports.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+from app.config import Config
+from .errors import UpstreamError
+from .key_validation_cache import key_fingerprint
+
+# Completion tokens assumed when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# Providers whose x-ratelimit-limit-requests counts requests per day rather than per minute
+DAILY_REQUEST_LIMIT_PROVIDERS = frozenset({'groq'})
+
+
+class RateLimitExceeded(UpstreamError):
+    """
+    Raised instead of sending a request the key's limits cannot admit in time
+    """
+
+    def __init__(self, name, wait):
+        super().__init__(f"Rate limit for {name} reached, capacity frees up in {wait:.1f}s", 429, wait)
+
+
+def parse_limits(spec):
+    """
+    Parse per-provider limits such as "groq=30/6000,openai=500/200000"
+
+    :param spec: Comma separated provider=requests_per_minute/tokens_per_minute pairs;
+                 either number may be left empty
+    :return: Dictionary of provider id to (rpm or None, tpm or None)
+    """
+    limits = {}
+    for item in (spec or '').split(','):
+        provider_id, _, values = item.partition('=')
+        rpm, _, tpm = values.partition('/')
+        try:
+            parsed = (float(rpm) if rpm.strip() else None, float(tpm) if tpm.strip() else None)
+        except ValueError:
+            continue
+        if provider_id.strip() and parsed != (None, None):
+            limits[provider_id.strip().lower()] = parsed
+    return limits
+
+
+def estimate_tokens(payload):
+    """
+    Estimate the tokens a chat request counts against a TPM limit:
+    the prompt at roughly four characters per token plus max_tokens
+
+    :param payload: OpenAI-style request body
+    :return: Estimated token count
+    """
+    chars = 0
+    for message in payload.get('messages') or []:
+        content = message.get('content') if isinstance(message, dict) else None
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get('text') or '') for part in content if isinstance(part, dict))
+    return chars // 4 + (payload.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    """
+    Bucket holding up to one minute of capacity, refilled continuously.
+    The level may go negative: reservations queue behind each other.
+    """
+
+    def __init__(self, per_minute=None):
+        """
+        :param per_minute: Capacity per minute, None for no limit until one is learned
+        """
+        self.per_minute = per_minute
+        self.level = per_minute or 0.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def wait_for(self, amount):
+        """
+        :return: Seconds until the bucket can cover amount, 0 if it can now
+        """
+        if not self.per_minute or self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+    def set_limit(self, per_minute):
+        if per_minute and per_minute != self.per_minute:
+            if not self.per_minute:
+                self.level = per_minute
+            self.per_minute = per_minute
+
+
+class RateLimiter:
+    """
+    Request and token buckets of one provider key
+    """
+
+    def __init__(self, name, rpm=None, tpm=None, max_wait=5.0, window=256, learn_request_limit=True):
+        """
+        :param name: Label used in errors and statistics
+        :param rpm: Requests per minute, None until learned
+        :param tpm: Tokens per minute, None until learned
+        :param max_wait: Seconds a call may queue before it is rejected
+        :param window: Recent wait times kept for percentiles
+        :param learn_request_limit: Take rpm from x-ratelimit-limit-requests; off for vendors
+                                    that report requests per day there
+        """
+        self.name = name
+        self.learn_request_limit = learn_request_limit
+        self.max_wait = max_wait
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._waits = deque(maxlen=window)
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'wait_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        """
+        Take one request and the tokens from the buckets
+
+        :return: Seconds the caller must wait before sending
+        :raises RateLimitExceeded: If the wait would exceed max_wait; nothing is reserved then
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_for(1), self.tokens.wait_for(tokens))
+            if wait > self.max_wait:
+                self._counters['rejected'] += 1
+                raise RateLimitExceeded(self.name, wait)
+            if self.requests.per_minute:
+                self.requests.level -= 1
+            if self.tokens.per_minute:
+                self.tokens.level -= tokens
+            self._counters['admitted'] += 1
+            if wait > 0:
+                self._counters['queued'] += 1
+                self._counters['wait_seconds'] += wait
+            self._waits.append(wait)
+        return wait
+
+    def acquire(self, tokens):
+        """
+        Wait until the request can be sent
+
+        :param tokens: Estimated tokens of the request
+        :return: The tokens reserved, to pass to reconcile
+        :raises RateLimitExceeded: If the request cannot be admitted within max_wait
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return tokens
+
+    async def aacquire(self, tokens):
+        """
+        Async variant of acquire
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return tokens
+
+    def remaining_fraction(self):
+        """
+        :return: Share of the tighter of the two limits still available, 1.0 while no limit is known
+        """
+        now = time.monotonic()
+        with self._lock:
+            fractions = []
+            for bucket in (self.requests, self.tokens):
+                if bucket.per_minute:
+                    bucket.refill(now)
+                    fractions.append(bucket.level / bucket.per_minute)
+        return min(fractions) if fractions else 1.0
+
+    def reconcile(self, reserved, used):
+        """
+        Correct the token bucket once the actual usage is known
+
+        :param reserved: Tokens reserved by acquire
+        :param used: Tokens the vendor reported, 0 if the request was not served
+        """
+        if used is None:
+            return
+        with self._lock:
+            if self.tokens.per_minute:
+                self.tokens.level = min(self.tokens.per_minute, self.tokens.level + reserved - used)
+
+    def observe(self, headers):
+        """
+        Learn limits and remaining capacity from x-ratelimit-* response headers
+        """
+        if not headers:
+            return
+        with self._lock:
+            now = time.monotonic()
+            for kind, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+                limit = _header_number(headers, f'x-ratelimit-limit-{kind}')
+                if kind == 'requests' and not self.learn_request_limit:
+                    limit = None
+                remaining = _header_number(headers, f'x-ratelimit-remaining-{kind}')
+                bucket.refill(now)
+                bucket.set_limit(limit)
+                # The vendor also counts other clients of the key; never report more than it does
+                if remaining is not None and bucket.per_minute:
+                    bucket.level = min(bucket.level, remaining)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            waits = sorted(self._waits)
+            stats['rpm'] = self.requests.per_minute
+            stats['tpm'] = self.tokens.per_minute
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['wait_ms_p50'] = round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0
+        stats['wait_ms_p95'] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0
+        return stats
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider_id, api_key):
+    """
+    Get the rate limiter of a provider key, created with the configured limits on first use
+
+    :param provider_id: Lowercase provider identifier
+    :param api_key: API key the limits apply to
+    :return: RateLimiter shared by every caller using the key
+    """
+    key = (provider_id, api_key)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                rpm, tpm = parse_limits(Config.PROVIDER_RATE_LIMITS).get(provider_id, (None, None))
+                # Named by fingerprint so statistics never reveal the key
+                name = f"{provider_id}:{key_fingerprint(provider_id, api_key or '')[:8]}"
+                limiter = RateLimiter(name, rpm, tpm,
+                                      max_wait=Config.RATE_LIMIT_MAX_WAIT_MS / 1000,
+                                      learn_request_limit=provider_id not in DAILY_REQUEST_LIMIT_PROVIDERS)
+                _limiters[key] = limiter
+    return limiter
+
+
+def rate_limit_stats():
+    """
+    :return: Dictionary of limiter name to its statistics
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -1,9 +1,13 @@
-from .base_provider import BaseProvider
+from .openai_compatible import OpenAICompatibleProvider
 
-class XaiProvider(BaseProvider):
+import logging
+
+class XaiProvider(OpenAICompatibleProvider):
     def __init__(self, api_key):
         super().__init__(api_key)
         self.name = "xai"
+        self.logger = logging.getLogger(__name__)
+        self._api_base_url = "https://api.x.ai/v1"
         self.supported_models = [
             # Latest Grok models
             "grok-3",  # Updated to full release if available by May 2025
@@ -19,6 +23,3 @@ class XaiProvider(BaseProvider):
             "grok-1.5",
             "grok-1"
         ]
-
-    def get_api_endpoint(self):
-        return "https://api.xai.com/v1/models"
@@ -0,0 +1,245 @@
+"""
+Batched chat completions.
+
+A batch is a list of independent completion requests. They run concurrently,
+at most BATCH_MAX_CONCURRENCY at a time and at most the provider's cap from
+BATCH_PROVIDER_CONCURRENCY against any one provider, so the items for one
+vendor neither starve those for the others nor queue up behind its rate
+limits all at once. Results are
+yielded as each item finishes, tagged with the item's index; a failing item
+yields an error result instead of failing the batch.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.config import Config
+from app.services.ai_providers.errors import UpstreamError
+
+
+def parse_concurrency(spec):
+    """
+    Parse per-provider concurrency caps such as "groq=4,openai=16"
+
+    :param spec: Comma separated provider=limit pairs
+    :return: Dictionary of provider id to its cap
+    """
+    limits = {}
+    for item in (spec or '').split(','):
+        provider_id, _, value = item.partition('=')
+        try:
+            limit = int(value)
+        except ValueError:
+            continue
+        if provider_id.strip() and limit > 0:
+            limits[provider_id.strip().lower()] = limit
+    return limits
+
+
+def parse_batch(data, max_items):
+    """
+    Extract the items of a batch request
+
+    :param data: Decoded request body, a list of items or {"items": [...]}
+    :param max_items: Largest batch accepted
+    :return: List of items
+    :raises ValueError: If the body is not a non-empty list of at most max_items items
+    """
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError("Expected a non-empty list of items")
+    if len(items) > max_items:
+        raise ValueError(f"A batch may hold at most {max_items} items, got {len(items)}")
+    return items
+
+
+class BatchRunner:
+    """
+    Runs batches of completion requests through a CompletionService
+    """
+
+    def __init__(self, completion_service, max_concurrency=None, provider_limits=None, default_limit=None):
+        """
+        :param completion_service: CompletionService the items are sent through
+        :param max_concurrency: Items of one batch in flight at once
+        :param provider_limits: Dictionary of provider id to the items in flight against it at once
+        :param default_limit: Cap for providers missing from provider_limits
+        """
+        self.logger = logging.getLogger(__name__)
+        self.completion_service = completion_service
+        self.max_concurrency = max_concurrency or Config.BATCH_MAX_CONCURRENCY
+        self.provider_limits = (provider_limits if provider_limits is not None
+                                else parse_concurrency(Config.BATCH_PROVIDER_CONCURRENCY))
+        self.default_limit = default_limit or Config.BATCH_DEFAULT_PROVIDER_CONCURRENCY
+
+    @staticmethod
+    def _provider(item):
+        provider_id = item.get('provider') if isinstance(item, dict) else None
+        return provider_id.lower() if isinstance(provider_id, str) else ''
+
+    def _limit(self, provider_id):
+        return self.provider_limits.get(provider_id, self.default_limit)
+
+    @staticmethod
+    def _arguments(item):
+        if not isinstance(item, dict):
+            raise ValueError("Batch item must be an object")
+        return (item.get('provider'), item.get('model'), item.get('messages', []), item.get('options', {}),
+                item.get('cache'), item.get('hedge'))
+
+    def _result(self, index, response=None, error=None):
+        """Shape the outcome of one item the way the single completion route answers"""
+        if error is None and isinstance(response, dict) and response.get('error'):
+            return {'index': index, 'status': 400, 'error': response['error']}
+        if error is None:
+            return {'index': index, 'status': 200, 'response': response}
+        if isinstance(error, ValueError):
+            return {'index': index, 'status': 400, 'error': str(error)}
+        if isinstance(error, UpstreamError) and error.status_code:
+            return {'index': index, 'status': error.status_code, 'error': str(error)}
+        self.logger.error(f"Batch item {index} failed: {error}")
+        return {'index': index, 'status': 500, 'error': 'Internal server error'}
+
+    def run_item(self, index, item):
+        """
+        Run one item
+
+        :return: Result dictionary tagged with index, never raises
+        """
+        try:
+            return self._result(index, self.completion_service.generate_completion(*self._arguments(item)))
+        except Exception as e:
+            return self._result(index, error=e)
+
+    async def arun_item(self, index, item):
+        """
+        Async variant of run_item
+        """
+        try:
+            return self._result(index, await self.completion_service.agenerate_completion(*self._arguments(item)))
+        except Exception as e:
+            return self._result(index, error=e)
+
+    def run(self, items):
+        """
+        Run a batch on worker threads
+
+        :param items: Item dictionaries with provider, model, messages and optionally options, cache, hedge
+        :return: Iterator of result dictionaries in completion order, each with the item's index and
+                 HTTP-style status plus either the response or an error message. Closing it early
+                 cancels the items not started yet.
+        """
+        return self.run_indexed(enumerate(items))
+
+    def run_indexed(self, pairs, backlog=None):
+        """
+        Run items pulled lazily from an iterator, so the batch never has to be held in memory
+
+        :param pairs: Iterable of (index, item) tuples
+        :param backlog: Items read ahead while their provider is at its cap, 4 x max_concurrency by default
+        :return: Iterator of result dictionaries, as from run
+        """
+        schedule = _Schedule(self, pairs, backlog or self.max_concurrency * 4)
+        futures = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='batch')
+        try:
+            while True:
+                while len(futures) < self.max_concurrency:
+                    picked = schedule.next_ready()
+                    if picked is None:
+                        break
+                    provider_id, index, item = picked
+                    # Items run in the caller's context so their spans join its trace
+                    future = executor.submit(contextvars.copy_context().run, self.run_item, index, item)
+                    futures[future] = provider_id
+                if not futures:
+                    return
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    schedule.finished(futures.pop(future))
+                    yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def arun(self, items):
+        """
+        Async variant of run; items run as tasks on the event loop
+        """
+        schedule = _Schedule(self, enumerate(items), max(1, len(items)))
+        tasks = {}
+        try:
+            while True:
+                while len(tasks) < self.max_concurrency:
+                    picked = schedule.next_ready()
+                    if picked is None:
+                        break
+                    provider_id, index, item = picked
+                    tasks[asyncio.ensure_future(self.arun_item(index, item))] = provider_id
+                if not tasks:
+                    return
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    schedule.finished(tasks.pop(task))
+                    yield task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class _Schedule:
+    """
+    Items waiting to run, queued per provider and read from their source as room frees up
+    """
+
+    def __init__(self, runner, pairs, backlog):
+        self.runner = runner
+        self.source = iter(pairs)
+        self.backlog = backlog
+        self.queues = {}
+        self.in_flight = {}
+        self.queued = 0
+
+    def _fill(self):
+        while self.source is not None and self.queued < self.backlog:
+            try:
+                index, item = next(self.source)
+            except StopIteration:
+                self.source = None
+                break
+            self.queues.setdefault(self.runner._provider(item), deque()).append((index, item))
+            self.queued += 1
+
+    def next_ready(self):
+        """
+        Take the next item whose provider is below its cap, favouring the provider with the fewest in flight
+
+        :return: (provider id, index, item), or None if every queued item has to wait
+        """
+        self._fill()
+        in_flight = self.in_flight
+        ready = [provider_id for provider_id, queue in self.queues.items()
+                 if queue and in_flight.get(provider_id, 0) < self.runner._limit(provider_id)]
+        if not ready:
+            return None
+        provider_id = min(ready, key=lambda p: in_flight.get(p, 0))
+        in_flight[provider_id] = in_flight.get(provider_id, 0) + 1
+        self.queued -= 1
+        index, item = self.queues[provider_id].popleft()
+        return provider_id, index, item
+
+    def finished(self, provider_id):
+        self.in_flight[provider_id] -= 1
+
+
+def summary(total, failed, started):
+    """
+    :param total: Items finished
+    :param failed: Items that finished with an error
+    :param started: time.perf_counter() when the batch started
+    :return: Closing line of a batch response
+    """
+    return {'done': True, 'total': total, 'succeeded': total - failed, 'failed': failed,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1)}
@@ -0,0 +1,731 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+
+from app.config import Config
+from app.services.ai_providers.registry_singleton import provider_registry
+from app.services.ai_providers.provider_router import AUTO_PROVIDER_ID
+from app.services.response_cache import (
+    get_response_cache, completion_cache_key, CACHE_DEFAULT, CACHE_BYPASS, CACHE_REFRESH, CACHE_MODES
+)
+from app.services.semantic_cache import get_semantic_cache
+from app.services.single_flight import single_flight
+from app.services.hedging import get_hedger
+from app.services.resilience import get_resilience
+from app.services.monitoring import get_monitoring
+from app.services.tracing import trace_span
+from app.services.context_manager import get_context_manager, parse_model, summary_prompt
+from app.services.usage_ledger import get_usage_ledger, estimate_usage
+
+# A provider instance together with the id and model it is called with,
+# and the routing decision that chose it for "auto" requests
+Target = namedtuple('Target', 'provider_id provider model route', defaults=(None,))
+
+
+class CompletionService:
+    """
+    Runs chat completions on behalf of the routes.
+    Resolves the provider and serves repeated requests from the exact-match
+    response cache, then from the semantic cache for near-duplicate questions,
+    when they are enabled. Identical requests that are in flight at the same
+    time share one upstream call, which can be hedged against a backup
+    provider/model. Requests for the "auto" provider are routed by the
+    registry, and every upstream call feeds the router's latency and error
+    statistics. Requests too long for the model's context window have their
+    older turns replaced by a rolling summary before they are sent. Provider
+    calls are retried and guarded by circuit breakers, and each attempt is
+    recorded in the Prometheus metrics and as a trace span. The tokens,
+    latency and cost of every upstream call go to the usage ledger, with usage
+    the vendor did not report estimated locally.
+    Sync and async entry points behave identically.
+    """
+
+    def __init__(self, registry=provider_registry, coalescer=single_flight, hedger=None, resilience=None,
+                 monitoring=None, context_manager=None, usage_ledger=None):
+        self.registry = registry
+        self.coalescer = coalescer
+        self._hedger = hedger
+        self._resilience = resilience
+        self._monitoring = monitoring
+        self._context_manager = context_manager
+        self._usage_ledger = usage_ledger
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def hedger(self):
+        return self._hedger or get_hedger()
+
+    @property
+    def resilience(self):
+        return self._resilience or get_resilience()
+
+    @property
+    def monitoring(self):
+        return self._monitoring or get_monitoring()
+
+    @property
+    def context_manager(self):
+        if not Config.CONTEXT_MANAGEMENT_ENABLED:
+            return None
+        return self._context_manager or get_context_manager()
+
+    @property
+    def usage_ledger(self):
+        if not Config.USAGE_LEDGER_ENABLED:
+            return None
+        return self._usage_ledger or get_usage_ledger()
+
+    @property
+    def response_cache(self):
+        return get_response_cache()
+
+    @property
+    def semantic_cache(self):
+        return get_semantic_cache()
+
+    def _semantic_lookup(self, provider_id, model, messages, options, cache_mode):
+        """
+        Find a cached answer to a near-identical question
+
+        :return: Response marked as cached, or None
+        """
+        if self.semantic_cache is None or (cache_mode or CACHE_DEFAULT) != CACHE_DEFAULT:
+            return None
+        match = self.semantic_cache.lookup(provider_id, model, messages, options)
+        self.monitoring.record_cache('semantic', match is not None)
+        if match is None:
+            return None
+        response, similarity = match
+        return dict(response, cached=True, similarity=round(similarity, 4))
+
+    def _semantic_store(self, provider_id, model, messages, options, cache_mode, response):
+        if self.semantic_cache is not None and cache_mode != CACHE_BYPASS and self._is_cacheable(response):
+            self.semantic_cache.store(provider_id, model, messages, options, response)
+
+    def _resolve_provider(self, provider_id):
+        provider = self.registry.get_provider(provider_id)
+        if not provider:
+            raise ValueError("Provider not configured")
+        return provider
+
+    def _target(self, provider_id, model, messages, options):
+        """
+        Resolve the provider/model that serves a request, routing "auto" requests
+
+        :raises ValueError: If the provider is not configured or no provider can serve the request
+        """
+        with trace_span('resolve_provider', provider=provider_id or '', model=model or '') as span:
+            if provider_id == AUTO_PROVIDER_ID:
+                routed_id, provider, routed_model, decision = self.registry.route(
+                    messages, options, exclude=self.resilience.open_circuits())
+                if span is not None:
+                    span.set_attribute('routed_to', f"{routed_id}:{routed_model}")
+                return Target(routed_id, provider, routed_model, decision)
+            return Target(provider_id, self._resolve_provider(provider_id), model)
+
+    def _backup_target(self, provider_id, model, hedge):
+        """
+        Resolve the provider/model a request is hedged against
+
+        :param hedge: None to follow HEDGE_ENABLED, True/False to force hedging on/off,
+                      or a dictionary with the backup 'provider' and optional 'model'
+        :return: Target or None if the request is not hedged
+        """
+        if hedge is False or (hedge is None and not Config.HEDGE_ENABLED):
+            return None
+        if isinstance(hedge, dict):
+            backup = (hedge.get('provider'), hedge.get('model'))
+        else:
+            backup = self.hedger.target_for(provider_id, model)
+        if not backup or not backup[0]:
+            return None
+        backup_provider = self.registry.get_provider(backup[0])
+        if backup_provider is None:
+            self.logger.warning(f"Hedge provider {backup[0]} is not configured, sending {provider_id} unhedged")
+            return None
+        return Target(backup[0], backup_provider, backup[1] or model)
+
+    @staticmethod
+    def _hedge_metadata(outcome, target, backup):
+        """Describe who answered a hedged request"""
+        winner = backup if outcome.get('winner') == 'secondary' else target
+        return dict(outcome, provider=winner.provider_id, model=winner.model)
+
+    @property
+    def route_stats(self):
+        return self.registry.router.stats
+
+    @staticmethod
+    def _metadata(target, hedged):
+        """Routing and hedging details attached to a response"""
+        metadata = {}
+        if target.route is not None:
+            metadata['route'] = target.route
+        if hedged:
+            metadata['hedge'] = hedged
+        return metadata
+
+    def _record(self, target, hedged, response, elapsed):
+        """
+        Feed a non-streamed call into the routing statistics.
+        Time spent by a backup that won a hedge is not comparable, so only its outcome is kept.
+        """
+        provider_id, model = (hedged['provider'], hedged['model']) if hedged else (target.provider_id, target.model)
+        if isinstance(response, dict) and response.get("error"):
+            self.route_stats.record_error(provider_id, model)
+            return
+        if hedged and hedged.get('winner') == 'secondary':
+            elapsed = None
+        usage = response.get("usage") if isinstance(response, dict) else None
+        self.route_stats.record_success(provider_id, model, tokens=(usage or {}).get("completion_tokens"),
+                                        duration=elapsed)
+
+    def _record_stream(self, target, timing, event):
+        """
+        Feed stream progress into the routing statistics
+
+        :param timing: Dictionary with 'started', 'first' (time of the first token) and 'chars' for this stream
+        """
+        now = time.perf_counter()
+        if event.get("type") == "delta":
+            if timing['first'] is None:
+                timing['first'] = now
+            timing['chars'] += len(event.get("text") or '')
+            return
+        hedged = event.get("hedge")
+        provider_id, model = (hedged['provider'], hedged['model']) if hedged else (target.provider_id, target.model)
+        if timing['first'] is None or (hedged and hedged.get('winner') == 'secondary'):
+            self.route_stats.record_success(provider_id, model)
+            return
+        tokens = (event.get("usage") or {}).get("completion_tokens") or timing['chars'] // 4
+        self.route_stats.record_success(provider_id, model, ttft=timing['first'] - timing['started'],
+                                        tokens=tokens, duration=now - timing['first'])
+
+    @staticmethod
+    def _trace_first_token(span, event):
+        """Mark the first streamed token on an attempt's span"""
+        if span is not None and 'ttft_ms' not in span.attributes \
+                and isinstance(event, dict) and event.get("type") == "delta":
+            span.set_attribute('ttft_ms', round(span.duration_ms, 3))
+            span.add_event('first_token')
+
+    def _attribute(self):
+        """Start collecting the API keys of an upstream call for the usage ledger"""
+        return self.usage_ledger.attribute() if self.usage_ledger is not None else None
+
+    def _account(self, target, hedged, messages, response, elapsed, keys):
+        """
+        Record a non-streamed call in the usage ledger
+
+        :return: The response, with usage estimated locally if the vendor reported none
+        """
+        provider_id, model = (hedged['provider'], hedged['model']) if hedged else (target.provider_id, target.model)
+        if not isinstance(response, dict) or response.get("error"):
+            if self.usage_ledger is not None:
+                self.usage_ledger.record(provider_id, model, latency=elapsed, error=True, keys=keys)
+            return response
+        usage, estimated = estimate_usage(messages, response.get("text") or '', response.get("usage"))
+        if not response.get("usage"):
+            response = dict(response, usage=usage, usage_estimated=True)
+        if self.usage_ledger is not None:
+            self.usage_ledger.record(provider_id, model, usage, elapsed, estimated, keys=keys)
+        return response
+
+    def _account_stream(self, target, messages, stream, event=None, error=False):
+        """
+        Record a stream in the usage ledger once it ends, is cut short or fails
+
+        :param stream: Dictionary with the stream's 'started' time, text 'parts' and 'keys'
+        :param event: Final usage event, or None if the stream did not finish
+        :return: The usage event, with usage estimated locally if the vendor reported none
+        """
+        hedged = (event or {}).get("hedge")
+        provider_id, model = (hedged['provider'], hedged['model']) if hedged else (target.provider_id, target.model)
+        elapsed = time.perf_counter() - stream['started']
+        stream['accounted'] = True
+        if error and not stream['parts']:
+            if self.usage_ledger is not None:
+                self.usage_ledger.record(provider_id, model, latency=elapsed, error=True, keys=stream['keys'])
+            return event
+        usage, estimated = estimate_usage(messages, "".join(stream['parts']), (event or {}).get("usage"))
+        if event is not None and not event.get("usage"):
+            event = dict(event, usage=usage, usage_estimated=True)
+        if self.usage_ledger is not None:
+            self.usage_ledger.record(provider_id, model, usage, elapsed, estimated, error, keys=stream['keys'])
+        return event
+
+    def _call(self, target, messages, options):
+        def attempt():
+            with trace_span('provider.call', provider=target.provider_id, model=target.model):
+                return self.monitoring.call(
+                    target.provider_id, target.model,
+                    lambda: target.provider.generate_completion(messages, target.model, options))
+        return self.resilience.call((target.provider_id, target.model), attempt)
+
+    def _acall(self, target, messages, options):
+        async def attempt():
+            with trace_span('provider.call', provider=target.provider_id, model=target.model):
+                return await self.monitoring.acall(
+                    target.provider_id, target.model,
+                    lambda: target.provider.agenerate_completion(messages, target.model, options))
+        return self.resilience.acall((target.provider_id, target.model), attempt)
+
+    def _open_stream(self, target, messages, options):
+        def attempt():
+            with trace_span('provider.stream', provider=target.provider_id, model=target.model) as span:
+                for event in self.monitoring.stream(
+                        target.provider_id, target.model,
+                        target.provider.stream_completion(messages, target.model, options)):
+                    self._trace_first_token(span, event)
+                    yield event
+        return self.resilience.stream((target.provider_id, target.model), attempt)
+
+    def _aopen_stream(self, target, messages, options):
+        async def attempt():
+            with trace_span('provider.stream', provider=target.provider_id, model=target.model) as span:
+                async for event in self.monitoring.astream(
+                        target.provider_id, target.model,
+                        target.provider.astream_completion(messages, target.model, options)):
+                    self._trace_first_token(span, event)
+                    yield event
+        return self.resilience.astream((target.provider_id, target.model), attempt)
+
+    def _summary_call(self, target, previous, messages):
+        """
+        Target and arguments of the call that folds messages into a summary.
+        CONTEXT_SUMMARY_MODEL writes it if set and configured, otherwise the request's own model.
+        """
+        provider_id, model = parse_model(Config.CONTEXT_SUMMARY_MODEL)
+        provider = self.registry.get_provider(provider_id) if provider_id else None
+        summarizer = Target(provider_id, provider, model) if provider is not None \
+            else Target(target.provider_id, target.provider, target.model)
+        max_tokens = self.context_manager.summary_max_tokens
+        return summarizer, summary_prompt(previous, messages, max_tokens), {'max_tokens': max_tokens,
+                                                                           'temperature': 0}
+
+    @staticmethod
+    def _summary_text(response):
+        """:raises RuntimeError: If the summarizing call failed or returned nothing"""
+        if not isinstance(response, dict):
+            raise RuntimeError("Unexpected summary response")
+        if response.get("error"):
+            raise RuntimeError(response["error"])
+        text = (response.get("text") or '').strip()
+        if not text:
+            raise RuntimeError("Empty summary")
+        return text
+
+    @staticmethod
+    def _fit_backup(backup):
+        return (backup.provider_id, backup.model) if backup is not None else None
+
+    def _fit_context(self, target, messages, options, backup=None):
+        """
+        Fit messages into the target model's context window, and the hedge backup's if it is smaller
+
+        :return: (messages to send, context report or None if they were sent unchanged)
+        """
+        if self.context_manager is None:
+            return messages, None
+
+        def summarize(previous, turns):
+            summarizer, prompt, summary_options = self._summary_call(target, previous, turns)
+            return self._summary_text(self._generate(summarizer, None, prompt, summary_options)[0])
+
+        with trace_span('fit_context', provider=target.provider_id, model=target.model) as span:
+            fitted, report = self.context_manager.fit(target.provider_id, target.model, messages, options, summarize,
+                                                      self._fit_backup(backup))
+            if span is not None and report is not None:
+                span.set_attribute('saved_tokens', report['saved_tokens'])
+            return fitted, report
+
+    async def _afit_context(self, target, messages, options, backup=None):
+        if self.context_manager is None:
+            return messages, None
+
+        async def asummarize(previous, turns):
+            summarizer, prompt, summary_options = self._summary_call(target, previous, turns)
+            return self._summary_text((await self._agenerate(summarizer, None, prompt, summary_options))[0])
+
+        with trace_span('fit_context', provider=target.provider_id, model=target.model) as span:
+            fitted, report = await self.context_manager.afit(target.provider_id, target.model, messages, options,
+                                                             asummarize, self._fit_backup(backup))
+            if span is not None and report is not None:
+                span.set_attribute('saved_tokens', report['saved_tokens'])
+            return fitted, report
+
+    def _fit_and_generate(self, target, backup, messages, options):
+        """_generate on the messages fitted into the context window, reporting the fit as 'context'"""
+        messages, context = self._fit_context(target, messages, options, backup)
+        response, metadata = self._generate(target, backup, messages, options)
+        if context is not None:
+            metadata = dict(metadata, context=context)
+        return response, metadata
+
+    async def _afit_and_generate(self, target, backup, messages, options):
+        messages, context = await self._afit_context(target, messages, options, backup)
+        response, metadata = await self._agenerate(target, backup, messages, options)
+        if context is not None:
+            metadata = dict(metadata, context=context)
+        return response, metadata
+
+    def _generate(self, target, backup, messages, options):
+        """
+        Call the provider, racing the backup when the request is hedged
+
+        :return: (response, metadata to attach to it)
+        """
+        started, keys = time.perf_counter(), self._attribute()
+        try:
+            if backup is None:
+                response, hedged = self._call(target, messages, options), None
+            else:
+                response, outcome = self.hedger.run(
+                    (target.provider_id, target.model),
+                    lambda: self._call(target, messages, options),
+                    (backup.provider_id, backup.model),
+                    lambda: self._call(backup, messages, options)
+                )
+                hedged = self._hedge_metadata(outcome, target, backup)
+        except Exception:
+            self.route_stats.record_error(target.provider_id, target.model)
+            self._account(target, None, messages, None, time.perf_counter() - started, keys)
+            raise
+        elapsed = time.perf_counter() - started
+        self._record(target, hedged, response, elapsed)
+        response = self._account(target, hedged, messages, response, elapsed, keys)
+        return response, self._metadata(target, hedged)
+
+    async def _agenerate(self, target, backup, messages, options):
+        started, keys = time.perf_counter(), self._attribute()
+        try:
+            if backup is None:
+                response, hedged = await self._acall(target, messages, options), None
+            else:
+                response, outcome = await self.hedger.arun(
+                    (target.provider_id, target.model),
+                    lambda: self._acall(target, messages, options),
+                    (backup.provider_id, backup.model),
+                    lambda: self._acall(backup, messages, options)
+                )
+                hedged = self._hedge_metadata(outcome, target, backup)
+        except Exception:
+            self.route_stats.record_error(target.provider_id, target.model)
+            self._account(target, None, messages, None, time.perf_counter() - started, keys)
+            raise
+        elapsed = time.perf_counter() - started
+        self._record(target, hedged, response, elapsed)
+        response = self._account(target, hedged, messages, response, elapsed, keys)
+        return response, self._metadata(target, hedged)
+
+    def _provider_stream(self, target, backup, messages, options):
+        timing = {'started': time.perf_counter(), 'first': None, 'chars': 0}
+        stream = {'started': timing['started'], 'parts': [], 'keys': self._attribute(), 'accounted': False}
+        try:
+            for event in self._hedged_stream(target, backup, messages, options):
+                if isinstance(event, dict):
+                    self._record_stream(target, timing, event)
+                    event = self._stream_event(target, messages, stream, event)
+                yield event
+        except Exception:
+            self.route_stats.record_error(target.provider_id, target.model)
+            self._account_stream(target, messages, stream, error=True)
+            raise
+        finally:
+            if not stream['accounted']:
+                # Closed before the usage event, e.g. by a client disconnect
+                self._account_stream(target, messages, stream)
+
+    def _stream_event(self, target, messages, stream, event):
+        """Collect a stream event's text, and account for the stream at its usage event"""
+        if event.get("type") == "delta":
+            stream['parts'].append(event.get("text") or '')
+        elif event.get("type") == "usage":
+            event = self._account_stream(target, messages, stream, event)
+            if target.route is not None:
+                event = dict(event, route=target.route)
+        return event
+
+    def _hedged_stream(self, target, backup, messages, options):
+        if backup is None:
+            yield from self._open_stream(target, messages, options)
+            return
+        events, outcome = self.hedger.stream(
+            (target.provider_id, target.model),
+            lambda: self._open_stream(target, messages, options),
+            (backup.provider_id, backup.model),
+            lambda: self._open_stream(backup, messages, options)
+        )
+        for event in events:
+            if isinstance(event, dict) and event.get("type") == "usage":
+                event = dict(event, hedge=self._hedge_metadata(outcome, target, backup))
+            yield event
+
+    async def _aprovider_stream(self, target, backup, messages, options):
+        timing = {'started': time.perf_counter(), 'first': None, 'chars': 0}
+        stream = {'started': timing['started'], 'parts': [], 'keys': self._attribute(), 'accounted': False}
+        try:
+            async for event in self._ahedged_stream(target, backup, messages, options):
+                if isinstance(event, dict):
+                    self._record_stream(target, timing, event)
+                    event = self._stream_event(target, messages, stream, event)
+                yield event
+        except Exception:
+            self.route_stats.record_error(target.provider_id, target.model)
+            self._account_stream(target, messages, stream, error=True)
+            raise
+        finally:
+            if not stream['accounted']:
+                self._account_stream(target, messages, stream)
+
+    async def _ahedged_stream(self, target, backup, messages, options):
+        if backup is None:
+            async for event in self._aopen_stream(target, messages, options):
+                yield event
+            return
+        events, outcome = self.hedger.astream(
+            (target.provider_id, target.model),
+            lambda: self._aopen_stream(target, messages, options),
+            (backup.provider_id, backup.model),
+            lambda: self._aopen_stream(backup, messages, options)
+        )
+        async for event in events:
+            if isinstance(event, dict) and event.get("type") == "usage":
+                event = dict(event, hedge=self._hedge_metadata(outcome, target, backup))
+            yield event
+
+    def _cache_key(self, provider_id, model, messages, options, cache_mode):
+        """
+        Get the response cache key for a request, or None if the cache is not used
+
+        :raises ValueError: If cache_mode is not one of CACHE_MODES
+        """
+        cache_mode = cache_mode or CACHE_DEFAULT
+        if cache_mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {cache_mode}. Expected one of {', '.join(CACHE_MODES)}")
+        if self.response_cache is None or cache_mode == CACHE_BYPASS:
+            return None
+        return completion_cache_key(provider_id, model, messages, options)
+
+    def _flight_key(self, provider_id, model, messages, options):
+        """
+        Get the single-flight key for a request, or None if coalescing is disabled
+        """
+        if not Config.COALESCE_REQUESTS or self.coalescer is None:
+            return None
+        return completion_cache_key(provider_id, model, messages, options)
+
+    @staticmethod
+    def _follower_response(response):
+        """Copy of a shared response, so callers cannot mutate each other's result"""
+        return dict(response, coalesced=True) if isinstance(response, dict) else response
+
+    @staticmethod
+    def _is_cacheable(response):
+        return isinstance(response, dict) and not response.get("error") and response.get("text") is not None
+
+    @staticmethod
+    def _replay(cached):
+        """Turn a cached response into stream events"""
+        if cached.get("text"):
+            yield {"type": "delta", "text": cached["text"]}
+        yield {"type": "usage", "finish_reason": cached.get("finish_reason"),
+               "usage": cached.get("usage"), "cached": True}
+
+    def generate_completion(self, provider_id, model, messages, options=None, cache_mode=None, hedge=None):
+        """
+        Generate a chat completion
+
+        :param provider_id: Lowercase provider identifier
+        :param model: Model name
+        :param messages: List of message dictionaries with 'role' and 'content' keys
+        :param options: Optional parameters like temperature, max_tokens
+        :param cache_mode: 'default', 'bypass' or 'refresh'
+        :param hedge: Hedging override, see _backup_target
+        :return: Dictionary with the completion result; cache hits carry "cached": True,
+                 hedged requests a "hedge" description of who answered, "auto"
+                 requests a "route" description of the routing decision and requests
+                 cut to fit the context window a "context" report of the tokens saved
+        :raises ValueError: If the provider is not configured, no provider can serve an
+                            "auto" request or cache_mode is invalid
+        """
+        options = options or {}
+        target = self._target(provider_id, model, messages, options)
+        key = self._cache_key(provider_id, model, messages, options, cache_mode)
+        if key is not None and cache_mode != CACHE_REFRESH:
+            cached = self.response_cache.get(key)
+            self.monitoring.record_cache('response', cached is not None)
+            if cached is not None:
+                return dict(cached, cached=True)
+        similar = self._semantic_lookup(provider_id, model, messages, options, cache_mode)
+        if similar is not None:
+            return similar
+
+        backup = self._backup_target(target.provider_id, target.model, hedge)
+        flight_key = self._flight_key(provider_id, model, messages, options)
+        if flight_key is None:
+            (response, metadata), leader = self._fit_and_generate(target, backup, messages, options), True
+        else:
+            (response, metadata), leader = self.coalescer.do(
+                flight_key, lambda: self._fit_and_generate(target, backup, messages, options)
+            )
+        if not leader:
+            response = self._follower_response(response)
+        else:
+            if key is not None and self._is_cacheable(response):
+                self.response_cache.put(key, response)
+            self._semantic_store(provider_id, model, messages, options, cache_mode, response)
+        if metadata and isinstance(response, dict):
+            response = dict(response, **metadata)
+        return response
+
+    def stream_completion(self, provider_id, model, messages, options=None, cache_mode=None, hedge=None):
+        """
+        Stream a chat completion.
+        The provider is resolved eagerly so configuration errors surface before streaming starts.
+
+        :return: Iterator of stream events (see OpenAICompatibleProvider)
+        :raises ValueError: If the provider is not configured or cache_mode is invalid
+        """
+        options = options or {}
+        target = self._target(provider_id, model, messages, options)
+        key = self._cache_key(provider_id, model, messages, options, cache_mode)
+        flight_key = self._flight_key(provider_id, model, messages, options)
+        backup = self._backup_target(target.provider_id, target.model, hedge)
+        return self._stream(target, backup, key, flight_key, messages, options, cache_mode)
+
+    def _stream(self, target, backup, key, flight_key, messages, options, cache_mode):
+        if key is not None and cache_mode != CACHE_REFRESH:
+            cached = self.response_cache.get(key)
+            self.monitoring.record_cache('response', cached is not None)
+            if cached is not None:
+                yield from self._replay(cached)
+                return
+
+        if flight_key is None:
+            yield from self._upstream_stream(target, backup, key, messages, options)
+            return
+        # The shared pump writes the cache, so it is filled even if this client disconnects
+        events, _ = self.coalescer.stream(
+            flight_key, lambda: self._upstream_stream(target, backup, key, messages, options)
+        )
+        yield from events
+
+    def _upstream_stream(self, target, backup, key, messages, options):
+        messages, context = self._fit_context(target, messages, options, backup)
+        if context is not None:
+            yield dict(context, type="context")
+        parts, final = [], None
+        for event in self._provider_stream(target, backup, messages, options):
+            if isinstance(event, dict):
+                if event.get("type") == "delta":
+                    parts.append(event["text"])
+                elif event.get("type") == "usage":
+                    final = event
+            yield event
+
+        if key is not None and final is not None:
+            self.response_cache.put(key, {
+                "text": "".join(parts),
+                "finish_reason": final.get("finish_reason"),
+                "usage": final.get("usage")
+            })
+
+    async def _acache_get(self, key):
+        # The disk tier does blocking file I/O, keep it off the event loop
+        if self.response_cache.has_disk_tier:
+            return await asyncio.to_thread(self.response_cache.get, key)
+        return self.response_cache.get(key)
+
+    async def _acache_put(self, key, response):
+        if self.response_cache.has_disk_tier:
+            await asyncio.to_thread(self.response_cache.put, key, response)
+        else:
+            self.response_cache.put(key, response)
+
+    async def agenerate_completion(self, provider_id, model, messages, options=None, cache_mode=None, hedge=None):
+        """
+        Async variant of generate_completion
+        """
+        options = options or {}
+        target = self._target(provider_id, model, messages, options)
+        key = self._cache_key(provider_id, model, messages, options, cache_mode)
+        if key is not None and cache_mode != CACHE_REFRESH:
+            cached = await self._acache_get(key)
+            self.monitoring.record_cache('response', cached is not None)
+            if cached is not None:
+                return dict(cached, cached=True)
+        similar = self._semantic_lookup(provider_id, model, messages, options, cache_mode)
+        if similar is not None:
+            return similar
+
+        backup = self._backup_target(target.provider_id, target.model, hedge)
+        flight_key = self._flight_key(provider_id, model, messages, options)
+        if flight_key is None:
+            (response, metadata), leader = await self._afit_and_generate(target, backup, messages, options), True
+        else:
+            (response, metadata), leader = await self.coalescer.ado(
+                flight_key, lambda: self._afit_and_generate(target, backup, messages, options)
+            )
+        if not leader:
+            response = self._follower_response(response)
+        else:
+            if key is not None and self._is_cacheable(response):
+                await self._acache_put(key, response)
+            self._semantic_store(provider_id, model, messages, options, cache_mode, response)
+        if metadata and isinstance(response, dict):
+            response = dict(response, **metadata)
+        return response
+
+    def astream_completion(self, provider_id, model, messages, options=None, cache_mode=None, hedge=None):
+        """
+        Async variant of stream_completion
+
+        :return: Async iterator of stream events
+        :raises ValueError: If the provider is not configured or cache_mode is invalid
+        """
+        options = options or {}
+        target = self._target(provider_id, model, messages, options)
+        key = self._cache_key(provider_id, model, messages, options, cache_mode)
+        flight_key = self._flight_key(provider_id, model, messages, options)
+        backup = self._backup_target(target.provider_id, target.model, hedge)
+        return self._astream(target, backup, key, flight_key, messages, options, cache_mode)
+
+    async def _astream(self, target, backup, key, flight_key, messages, options, cache_mode):
+        if key is not None and cache_mode != CACHE_REFRESH:
+            cached = await self._acache_get(key)
+            self.monitoring.record_cache('response', cached is not None)
+            if cached is not None:
+                for event in self._replay(cached):
+                    yield event
+                return
+
+        if flight_key is None:
+            events = self._aupstream_stream(target, backup, key, messages, options)
+        else:
+            events, _ = self.coalescer.astream(
+                flight_key, lambda: self._aupstream_stream(target, backup, key, messages, options)
+            )
+        async for event in events:
+            yield event
+
+    async def _aupstream_stream(self, target, backup, key, messages, options):
+        messages, context = await self._afit_context(target, messages, options, backup)
+        if context is not None:
+            yield dict(context, type="context")
+        parts, final = [], None
+        async for event in self._aprovider_stream(target, backup, messages, options):
+            if isinstance(event, dict):
+                if event.get("type") == "delta":
+                    parts.append(event["text"])
+                elif event.get("type") == "usage":
+                    final = event
+            yield event
+
+        if key is not None and final is not None:
+            await self._acache_put(key, {
+                "text": "".join(parts),
+                "finish_reason": final.get("finish_reason"),
+                "usage": final.get("usage")
+            })
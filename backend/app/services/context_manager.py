@@ -0,0 +1,311 @@
+"""
+Context-window management for chat requests.
+
+Before a request goes upstream its prompt tokens are estimated and compared
+with the model's input budget: its context window (from the router's model
+profiles or CONTEXT_WINDOWS) minus the reply's max_tokens, and at most
+CONTEXT_MAX_INPUT_TOKENS. A request over budget keeps its system prompt and
+as many of its most recent turns as fill CONTEXT_KEEP_RATIO of the budget; the
+older turns are replaced by a summary written by a cheap, fast model.
+
+Summaries are cached under a hash of the turns they cover, so a conversation
+reuses its summary on every following turn for as long as the summary plus the
+newer turns fit. When they no longer do, only the turns added since are folded
+into the cached summary, rather than summarizing the whole history again.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from app.config import Config
+from app.services.ai_providers.provider_router import MODEL_PROFILES, DEFAULT_OUTPUT_TOKENS
+from app.services.tokens import count_message_tokens, count_prompt_tokens, message_text, REPLY_PRIMING
+
+SUMMARY_PREFIX = 'Summary of the earlier conversation:\n'
+SUMMARY_INSTRUCTIONS = (
+    "You condense chat transcripts for an assistant that will continue the conversation without "
+    "seeing them. Keep facts, decisions, names, numbers, code identifiers, user preferences and "
+    "open questions; drop greetings and repetition. Answer with the summary only, in at most "
+    "{words} words."
+)
+
+# Share of the context window held back for estimation error
+SAFETY_MARGIN = 0.05
+
+# The summary that replaced the first `covers` turns of a request, and how it was obtained
+Compaction = namedtuple('Compaction', 'covers summary source')
+
+
+def parse_windows(spec):
+    """
+    Parse context windows such as "openai:gpt-4o=128000,anthropic:claude-3-5-sonnet=200000"
+
+    :param spec: Comma separated provider:model=tokens pairs
+    :return: Dictionary of (provider id, model) to context window in tokens
+    """
+    windows = {}
+    for item in (spec or '').split(','):
+        key, _, value = item.partition('=')
+        provider_id, _, model = key.strip().partition(':')
+        try:
+            tokens = int(value)
+        except ValueError:
+            continue
+        if provider_id and model and tokens > 0:
+            windows[(provider_id.lower(), model)] = tokens
+    return windows
+
+
+def parse_model(spec):
+    """
+    :param spec: "provider:model", e.g. CONTEXT_SUMMARY_MODEL
+    :return: (provider id, model), or (None, None) if spec is empty
+    """
+    provider_id, _, model = (spec or '').strip().partition(':')
+    return (provider_id.lower(), model) if provider_id and model else (None, None)
+
+
+def summary_prompt(previous, messages, max_tokens):
+    """
+    Build the request that folds messages into a running summary
+
+    :param previous: Summary of the turns before messages, or None
+    :param messages: Turns to add to the summary
+    :param max_tokens: Length limit of the summary
+    :return: Chat messages for the summarizing model
+    """
+    transcript = '\n\n'.join(f"{message.get('role', 'user')}: {message_text(message)}" for message in messages)
+    if previous:
+        content = f"Summary so far:\n{previous}\n\nNew messages:\n{transcript}\n\nUpdate the summary."
+    else:
+        content = f"Transcript:\n{transcript}\n\nSummarize it."
+    return [
+        {'role': 'system', 'content': SUMMARY_INSTRUCTIONS.format(words=max(50, max_tokens * 3 // 4))},
+        {'role': 'user', 'content': content}
+    ]
+
+
+def _prefix_keys(turns):
+    """
+    :return: List whose k-th entry identifies turns[:k], each hash chained from the previous one
+    """
+    keys = ['']
+    digest = hashlib.sha256()
+    for message in turns:
+        digest.update(json.dumps([message.get('role'), message.get('content')], sort_keys=True).encode('utf-8'))
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+class ContextManager:
+    """
+    Fits chat requests into their model's input budget, summarizing older turns
+    """
+
+    def __init__(self, windows=None, max_input_tokens=None, keep_ratio=None, summary_max_tokens=None,
+                 chunk_tokens=None, cache_size=None):
+        """
+        :param windows: Dictionary of (provider id, model) to context window, on top of the router's profiles
+        :param max_input_tokens: Prompt tokens allowed for any model, 0 for no limit beyond the window
+        :param keep_ratio: Share of the budget the recent turns may fill after older ones are summarized
+        :param summary_max_tokens: Length limit of a summary
+        :param chunk_tokens: Largest batch of turns folded into a summary with one call
+        :param cache_size: Summaries kept
+        """
+        self.logger = logging.getLogger(__name__)
+        self.windows = {key: profile[0] for key, profile in MODEL_PROFILES.items()}
+        self.windows.update(windows if windows is not None else parse_windows(Config.CONTEXT_WINDOWS))
+        self.max_input_tokens = (max_input_tokens if max_input_tokens is not None
+                                 else Config.CONTEXT_MAX_INPUT_TOKENS)
+        self.keep_ratio = keep_ratio or Config.CONTEXT_KEEP_RATIO
+        self.summary_max_tokens = summary_max_tokens or Config.CONTEXT_SUMMARY_MAX_TOKENS
+        self.chunk_tokens = chunk_tokens or Config.CONTEXT_SUMMARY_CHUNK_TOKENS
+        self.cache_size = cache_size or Config.CONTEXT_SUMMARY_CACHE_SIZE
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'compacted': 0, 'summaries_reused': 0, 'summaries_updated': 0, 'summary_failures': 0,
+                          'tokens_saved': 0}
+
+    def budget(self, provider_id, model, options=None):
+        """
+        :return: Prompt tokens a request to the model may use, or None if neither its window nor a cap is known
+        """
+        window = self.windows.get((provider_id, model))
+        budget = None
+        if window:
+            output_tokens = (options or {}).get('max_tokens') or DEFAULT_OUTPUT_TOKENS
+            budget = int(window * (1 - SAFETY_MARGIN)) - output_tokens
+        if self.max_input_tokens:
+            budget = min(budget, self.max_input_tokens) if budget is not None else self.max_input_tokens
+        return budget
+
+    def _budget(self, provider_id, model, options, backup):
+        budgets = [budget for budget in (self.budget(provider_id, model, options),
+                                         self.budget(*backup, options) if backup else None) if budget is not None]
+        return min(budgets) if budgets else None
+
+    def _cached(self, key):
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def _remember(self, key, summary):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+
+    @staticmethod
+    def _summary_message(summary):
+        return {'role': 'system', 'content': SUMMARY_PREFIX + summary}
+
+    def _plan(self, messages, budget):
+        """
+        Decide which turns to replace with a summary
+
+        :return: (head, turns, counts, keys, base, cut) where head holds the leading system messages,
+                 base is the newest cached Compaction, and cut is the number of turns to cover
+                 (equal to base.covers when the cached summary is enough)
+        """
+        head_length = 0
+        while head_length < len(messages) and messages[head_length].get('role') == 'system':
+            head_length += 1
+        head, turns = messages[:head_length], messages[head_length:]
+        counts = [count_message_tokens(message) for message in turns]
+        keys = _prefix_keys(turns)
+        fixed = REPLY_PRIMING + sum(count_message_tokens(message) for message in head)
+
+        base = Compaction(0, None, None)
+        for covers in range(len(turns) - 1, 0, -1):
+            summary = self._cached(keys[covers])
+            if summary is not None:
+                base = Compaction(covers, summary, 'cached')
+                break
+        if base.summary is not None:
+            used = fixed + count_message_tokens(self._summary_message(base.summary)) + sum(counts[base.covers:])
+            if used <= budget:
+                return head, turns, counts, keys, base, base.covers
+
+        # Keep the newest turns within the target, always at least the last one
+        target = budget * self.keep_ratio - fixed - self.summary_max_tokens
+        cut, kept = len(turns) - 1, counts[-1]
+        while cut > base.covers + 1 and kept + counts[cut - 1] <= target:
+            cut -= 1
+            kept += counts[cut]
+        return head, turns, counts, keys, base, max(cut, base.covers)
+
+    def _chunks(self, turns, counts):
+        chunk, size = [], 0
+        for message, tokens in zip(turns, counts):
+            if chunk and size + tokens > self.chunk_tokens:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(message)
+            size += tokens
+        if chunk:
+            yield chunk
+
+    def _result(self, messages, head, turns, compaction, original_tokens):
+        summary = [self._summary_message(compaction.summary)] if compaction.summary else []
+        fitted = head + summary + turns[compaction.covers:]
+        sent_tokens = count_prompt_tokens(fitted)
+        report = {
+            'input_tokens': original_tokens,
+            'sent_tokens': sent_tokens,
+            'saved_tokens': max(0, original_tokens - sent_tokens),
+            'summarized_messages': compaction.covers,
+            'summary': compaction.source
+        }
+        with self._lock:
+            self._counters['compacted'] += 1
+            self._counters['tokens_saved'] += report['saved_tokens']
+            counter = {'cached': 'summaries_reused', 'updated': 'summaries_updated',
+                       'dropped': 'summary_failures'}.get(compaction.source)
+            if counter:
+                self._counters[counter] += 1
+        return fitted, report
+
+    def _prepare(self, provider_id, model, messages, options, backup):
+        """
+        :return: None if the request fits as it is, else the plan from _plan plus the original token count
+        """
+        budget = self._budget(provider_id, model, options, backup)
+        if budget is None or len(messages) < 2:
+            return None
+        original_tokens = count_prompt_tokens(messages)
+        if original_tokens <= budget:
+            return None
+        plan = self._plan(messages, budget)
+        # A single turn is never summarized away
+        return plan + (original_tokens,) if plan[-1] else None
+
+    def fit(self, provider_id, model, messages, options, summarize, backup=None):
+        """
+        Fit a request into the model's input budget
+
+        :param summarize: Callable (previous summary or None, messages) returning the updated summary text
+        :param backup: (provider id, model) the request may also be sent to; the smaller budget applies
+        :return: (messages to send, report with input/sent/saved tokens, or None if nothing was changed)
+        """
+        prepared = self._prepare(provider_id, model, messages, options, backup)
+        if prepared is None:
+            return messages, None
+        head, turns, counts, keys, base, cut, original_tokens = prepared
+        if cut == base.covers:
+            return self._result(messages, head, turns, base, original_tokens)
+        summary = base.summary
+        try:
+            for chunk in self._chunks(turns[base.covers:cut], counts[base.covers:cut]):
+                summary = summarize(summary, chunk)
+        except Exception as e:
+            self.logger.warning(f"Could not summarize {cut} messages for {provider_id}:{model}, dropping them: {e}")
+            return self._result(messages, head, turns, Compaction(cut, None, 'dropped'), original_tokens)
+        self._remember(keys[cut], summary)
+        return self._result(messages, head, turns, Compaction(cut, summary, 'updated'), original_tokens)
+
+    async def afit(self, provider_id, model, messages, options, asummarize, backup=None):
+        """
+        Async variant of fit; asummarize returns a coroutine
+        """
+        prepared = self._prepare(provider_id, model, messages, options, backup)
+        if prepared is None:
+            return messages, None
+        head, turns, counts, keys, base, cut, original_tokens = prepared
+        if cut == base.covers:
+            return self._result(messages, head, turns, base, original_tokens)
+        summary = base.summary
+        try:
+            for chunk in self._chunks(turns[base.covers:cut], counts[base.covers:cut]):
+                summary = await asummarize(summary, chunk)
+        except Exception as e:
+            self.logger.warning(f"Could not summarize {cut} messages for {provider_id}:{model}, dropping them: {e}")
+            return self._result(messages, head, turns, Compaction(cut, None, 'dropped'), original_tokens)
+        self._remember(keys[cut], summary)
+        return self._result(messages, head, turns, Compaction(cut, summary, 'updated'), original_tokens)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, cached_summaries=len(self._summaries))
+
+
+_context_manager = None
+_context_manager_lock = threading.Lock()
+
+
+def get_context_manager():
+    """
+    Get the process-wide context manager, configured from the CONTEXT_* settings
+
+    :return: Shared ContextManager instance
+    """
+    global _context_manager
+    if _context_manager is None:
+        with _context_manager_lock:
+            if _context_manager is None:
+                _context_manager = ContextManager()
+    return _context_manager
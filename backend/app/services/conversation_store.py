@@ -0,0 +1,236 @@
+"""
+Server-side conversation history.
+
+Conversations and their messages are stored with SQLAlchemy, so a client
+sends only the new user message and the server assembles the history. The
+histories of recently used conversations are kept in an in-memory LRU. A cached
+history is brought up to date by reading only the messages added after the
+last one it holds, which the (conversation_id, id) index answers without
+touching older rows; writes from other workers are picked up the same way.
+Messages are ordered by id rather than timestamp, so workers with skewed
+clocks cannot hide a message from the cache.
+"""
+import datetime
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from sqlalchemy import select
+
+from app.config import Config
+from app.models import init_engine
+from app.models.db_models import Conversation, Message
+
+DEFAULT_TITLE = 'New Conversation'
+TITLE_LENGTH = 80
+
+# Messages as role/content dictionaries plus the provider and model the conversation last used
+ConversationHistory = namedtuple('ConversationHistory', ['messages', 'provider_id', 'model'])
+
+
+def _message_dict(message):
+    return {
+        'id': message.id,
+        'role': message.role,
+        'content': message.content,
+        'model': message.model,
+        'metadata': message.meta or {},
+        'created_at': message.created_at.isoformat() if message.created_at else None
+    }
+
+
+def _conversation_dict(conversation):
+    return {
+        'id': conversation.id,
+        'title': conversation.title,
+        'provider': conversation.provider_id,
+        'model': conversation.model_id,
+        'created_at': conversation.created_at.isoformat() if conversation.created_at else None,
+        'updated_at': conversation.updated_at.isoformat() if conversation.updated_at else None
+    }
+
+
+class _History:
+    """Cached messages of one conversation, as role/content dictionaries in order"""
+    __slots__ = ('messages', 'last_id', 'provider_id', 'model')
+
+    def __init__(self, provider_id=None, model=None):
+        self.messages = []
+        self.last_id = 0
+        self.provider_id = provider_id
+        self.model = model
+
+
+class ConversationStore:
+    """
+    Conversations persisted in the database, with an LRU of recent histories
+    """
+
+    def __init__(self, sessions, cache_size=None):
+        """
+        :param sessions: Session factory, such as the scoped_session from app.models.init_engine
+        :param cache_size: Conversations whose history is kept in memory
+        """
+        self.logger = logging.getLogger(__name__)
+        self.sessions = sessions
+        self.cache_size = cache_size if cache_size is not None else Config.CONVERSATION_CACHE_SIZE
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    @contextmanager
+    def _session(self):
+        session = self.sessions()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def create(self, provider_id=None, model=None, title=None, system_prompt=None):
+        """
+        Start a conversation
+
+        :param system_prompt: Optional system message the history starts with
+        :return: Conversation dictionary
+        """
+        with self._session() as session:
+            conversation = Conversation(title=title or DEFAULT_TITLE, provider_id=provider_id, model_id=model)
+            if system_prompt:
+                conversation.messages.append(Message(role='system', content=system_prompt))
+            session.add(conversation)
+            session.flush()
+            return _conversation_dict(conversation)
+
+    def get(self, conversation_id):
+        """
+        :return: Conversation dictionary with all its 'messages', or None if it does not exist
+        """
+        with self._session() as session:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None:
+                return None
+            return dict(_conversation_dict(conversation),
+                        messages=[_message_dict(message) for message in conversation.messages])
+
+    def delete(self, conversation_id):
+        """
+        :return: True if the conversation existed
+        """
+        with self._lock:
+            self._cache.pop(conversation_id, None)
+        with self._session() as session:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None:
+                return False
+            session.delete(conversation)
+            return True
+
+    @staticmethod
+    def _messages_after_query(conversation_id, last_id):
+        return (select(Message.id, Message.role, Message.content)
+                .where(Message.conversation_id == conversation_id, Message.id > last_id)
+                .order_by(Message.id))
+
+    def _messages_after(self, session, conversation_id, last_id):
+        return session.execute(self._messages_after_query(conversation_id, last_id)).all()
+
+    def _remember(self, conversation_id, history, rows):
+        """Add rows read after history.last_id to the cached history. Caller holds self._lock."""
+        for row in rows:
+            # Another request may have added the same rows while these were read
+            if row.id > history.last_id:
+                history.messages.append({'role': row.role, 'content': row.content})
+                history.last_id = row.id
+        self._cache[conversation_id] = history
+        self._cache.move_to_end(conversation_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def history(self, conversation_id):
+        """
+        Messages of a conversation in order, ready to send to a provider
+
+        :return: ConversationHistory, or None if the conversation does not exist
+        """
+        with self._lock:
+            history = self._cache.get(conversation_id)
+            last_id = history.last_id if history is not None else 0
+            self._counters['hits' if history is not None else 'misses'] += 1
+        with self._session() as session:
+            if history is None:
+                conversation = session.get(Conversation, conversation_id)
+                if conversation is None:
+                    return None
+                history = _History(conversation.provider_id, conversation.model_id)
+            rows = self._messages_after(session, conversation_id, last_id)
+        with self._lock:
+            history = self._cache.get(conversation_id) or history
+            self._remember(conversation_id, history, rows)
+            return ConversationHistory(list(history.messages), history.provider_id, history.model)
+
+    def append(self, conversation_id, messages, provider_id=None, model=None):
+        """
+        Add messages to a conversation in one transaction, e.g. a user message and the reply to it
+
+        :param messages: Dictionaries with 'role' and 'content', optionally 'model' and 'metadata'
+        :param provider_id: Provider that answered, remembered as the conversation's default
+        :param model: Model that answered, remembered as the conversation's default
+        :return: Message dictionaries as stored
+        :raises KeyError: If the conversation does not exist
+        """
+        with self._lock:
+            history = self._cache.get(conversation_id)
+            last_id = history.last_id if history is not None else None
+        with self._session() as session:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None:
+                raise KeyError(conversation_id)
+            rows = [Message(conversation_id=conversation_id, role=message['role'], content=message['content'],
+                            model=message.get('model'), meta=message.get('metadata') or {})
+                    for message in messages]
+            session.add_all(rows)
+            first_user = next((message['content'] for message in messages if message['role'] == 'user'), '')
+            if conversation.title == DEFAULT_TITLE and first_user.strip():
+                conversation.title = first_user.strip().splitlines()[0][:TITLE_LENGTH]
+            conversation.provider_id = provider_id or conversation.provider_id
+            conversation.model_id = model or conversation.model_id
+            conversation.updated_at = datetime.datetime.utcnow()
+            stored_defaults = (conversation.provider_id, conversation.model_id)
+            session.flush()
+            stored = [_message_dict(row) for row in rows]
+            # Keep a cached history current, including anything other workers added since it was read
+            newer = self._messages_after(session, conversation_id, last_id) if last_id is not None else None
+        if newer is not None:
+            with self._lock:
+                history = self._cache.get(conversation_id)
+                if history is not None:
+                    history.provider_id, history.model = stored_defaults
+                    self._remember(conversation_id, history, newer)
+        return stored
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, cached=len(self._cache), capacity=self.cache_size)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """
+    Get the process-wide conversation store, connecting to SQLALCHEMY_DATABASE_URI on first use
+
+    :return: Shared ConversationStore instance
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore(init_engine(Config.SQLALCHEMY_DATABASE_URI))
+    return _store
@@ -0,0 +1,419 @@
+"""
+Hedged requests.
+
+A request goes to its primary provider first. If the primary has not produced
+a first token (or, without streaming, a response) within a delay taken from a
+percentile of its recent latency, the same request is also sent to a secondary
+provider/model. Whichever answers first wins and the other is cancelled.
+"""
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+
+from app.config import Config
+
+PRIMARY = 'primary'
+SECONDARY = 'secondary'
+
+
+def parse_targets(spec):
+    """
+    Parse hedge targets such as "groq=openai:gpt-4o-mini,openai:gpt-4o=groq:llama-3.3-70b-versatile"
+
+    :param spec: Comma separated primary=secondary pairs; the primary is a provider id or provider:model,
+                 the secondary is provider:model, or a provider id to reuse the requested model
+    :return: Dictionary of primary to (provider id, model or None)
+    """
+    targets = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        primary, secondary = (part.strip() for part in item.split('=', 1))
+        provider_id, _, model = secondary.partition(':')
+        if primary and provider_id:
+            targets[primary.lower()] = (provider_id.lower(), model or None)
+    return targets
+
+
+def _is_error(result):
+    return isinstance(result, dict) and bool(result.get('error'))
+
+
+def _total_tokens(result):
+    usage = result.get('usage') if isinstance(result, dict) else None
+    return (usage or {}).get('total_tokens') or 0
+
+
+class LatencyTracker:
+    """
+    Rolling window of time-to-first-token samples per provider/model
+    """
+
+    def __init__(self, window=256):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, provider_id, model, seconds):
+        with self._lock:
+            self._samples[(provider_id, model)].append(seconds)
+
+    def percentile(self, provider_id, model, q, min_samples=1):
+        """
+        :param q: Percentile between 0 and 100
+        :param min_samples: Samples needed before an estimate is returned
+        :return: Latency in seconds, or None without enough samples
+        """
+        with self._lock:
+            samples = sorted(self._samples.get((provider_id, model), ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class Hedger:
+    """
+    Races a primary call against a delayed secondary call
+    """
+
+    def __init__(self, targets=None, percentile=95, min_delay=0.25, max_delay=10.0, default_delay=2.0,
+                 min_samples=20, max_workers=32):
+        """
+        :param targets: Dictionary from parse_targets
+        :param percentile: Primary latency percentile after which the secondary is started
+        :param min_delay: Lower bound of the hedge delay in seconds
+        :param max_delay: Upper bound of the hedge delay in seconds
+        :param default_delay: Delay used until enough latency samples exist
+        :param min_samples: Samples needed before the percentile is trusted
+        :param max_workers: Threads available to synchronous calls
+        """
+        self.logger = logging.getLogger(__name__)
+        self.targets = targets or {}
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.tracker = LatencyTracker()  # Full response latency of completions
+        self.stream_tracker = LatencyTracker()  # Time to first token of streams
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'hedged': 0, 'primary_wins': 0, 'secondary_wins': 0,
+                          'extra_requests': 0, 'extra_tokens': 0, 'cancelled_losers': 0}
+
+    def target_for(self, provider_id, model):
+        """
+        :return: (provider id, model or None) of the configured secondary, or None
+        """
+        return self.targets.get(f"{provider_id}:{model}".lower()) or self.targets.get(provider_id.lower())
+
+    def delay_for(self, provider_id, model, stream=False):
+        """
+        :param stream: Use the time to first token of streams rather than the latency of completions
+        :return: Seconds to wait for the primary before starting the secondary
+        """
+        tracker = self.stream_tracker if stream else self.tracker
+        delay = tracker.percentile(provider_id, model, self.percentile, self.min_samples)
+        if delay is None:
+            delay = self.default_delay
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def _count(self, hedged, winner):
+        with self._lock:
+            self._counters['requests'] += 1
+            if hedged:
+                self._counters['hedged'] += 1
+                self._counters['extra_requests'] += 1
+            self._counters['primary_wins' if winner == PRIMARY else 'secondary_wins'] += 1
+
+    def _count_loser_spend(self, result):
+        tokens = _total_tokens(result)
+        if tokens:
+            with self._lock:
+                self._counters['extra_tokens'] += tokens
+
+    def _count_cancelled(self, losers):
+        if losers:
+            with self._lock:
+                self._counters['cancelled_losers'] += losers
+
+    def _outcome(self, hedged, winner, delay):
+        return {'hedged': hedged, 'winner': winner, 'delay_ms': round(delay * 1000, 1)}
+
+    def run(self, primary_key, primary, secondary_key, secondary):
+        """
+        Run a blocking call with a hedge
+
+        :param primary_key: (provider id, model) of the primary
+        :param primary: Zero-argument callable calling the primary
+        :param secondary_key: (provider id, model) of the secondary
+        :param secondary: Zero-argument callable calling the secondary
+        :return: (result, outcome) where outcome has 'hedged', 'winner' and 'delay_ms'
+        :raises Exception: The primary's error if no call succeeded
+        """
+        delay = self.delay_for(*primary_key)
+        started = time.perf_counter()
+        # Calls run in the caller's context so their trace spans join the request's trace
+        futures = {self._executor.submit(contextvars.copy_context().run, primary): PRIMARY}
+        try:
+            result = next(iter(futures)).result(timeout=delay)
+            self.tracker.record(*primary_key, time.perf_counter() - started)
+            self._count(False, PRIMARY)
+            return result, self._outcome(False, PRIMARY, delay)
+        except FutureTimeoutError:
+            pass
+
+        futures[self._executor.submit(contextvars.copy_context().run, secondary)] = SECONDARY
+        pending, failed = set(futures), {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                label = futures[future]
+                if future.exception() is None and not _is_error(future.result()):
+                    elapsed = time.perf_counter() - started
+                    self.tracker.record(*(primary_key if label == PRIMARY else secondary_key),
+                                        elapsed if label == PRIMARY else elapsed - delay)
+                    for loser in pending:
+                        # A running thread cannot be interrupted; its answer is discarded and its usage counted
+                        if not loser.cancel():
+                            loser.add_done_callback(
+                                lambda f: f.exception() is None and self._count_loser_spend(f.result()))
+                    self._count(True, label)
+                    return future.result(), self._outcome(True, label, delay)
+                failed[label] = future
+
+        self._count(True, PRIMARY)
+        return failed[PRIMARY].result(), self._outcome(True, PRIMARY, delay)
+
+    async def arun(self, primary_key, primary, secondary_key, secondary):
+        """
+        Async variant of run; the losing call is cancelled
+
+        :param primary: Zero-argument callable returning the primary coroutine
+        :param secondary: Zero-argument callable returning the secondary coroutine
+        """
+        delay = self.delay_for(*primary_key)
+        started = time.perf_counter()
+        tasks = {asyncio.ensure_future(primary()): PRIMARY}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                result = next(iter(done)).result()
+                self.tracker.record(*primary_key, time.perf_counter() - started)
+                self._count(False, PRIMARY)
+                return result, self._outcome(False, PRIMARY, delay)
+
+            tasks[asyncio.ensure_future(secondary())] = SECONDARY
+            pending, failed = set(tasks), {}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    label = tasks[task]
+                    if task.exception() is None and not _is_error(task.result()):
+                        elapsed = time.perf_counter() - started
+                        self.tracker.record(*(primary_key if label == PRIMARY else secondary_key),
+                                            elapsed if label == PRIMARY else elapsed - delay)
+                        self._count(True, label)
+                        self._count_cancelled(len(pending))
+                        return task.result(), self._outcome(True, label, delay)
+                    failed[label] = task
+
+            self._count(True, PRIMARY)
+            return failed[PRIMARY].result(), self._outcome(True, PRIMARY, delay)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stream(self, primary_key, primary, secondary_key, secondary):
+        """
+        Stream with a hedge. The race is decided by the first event of either stream.
+
+        :param primary: Zero-argument callable returning the primary event iterator
+        :param secondary: Zero-argument callable returning the secondary event iterator
+        :return: (iterator, outcome) where outcome is filled in once the race is decided
+        """
+        outcome = {}
+        return self._stream(primary_key, primary, secondary_key, secondary, outcome), outcome
+
+    def _stream(self, primary_key, primary, secondary_key, secondary, outcome):
+        delay = self.delay_for(*primary_key, stream=True)
+        events = queue.Queue()
+        cancels = {}
+
+        def start(label, factory):
+            cancel = cancels[label] = threading.Event()
+
+            def pump():
+                iterator = None
+                try:
+                    iterator = factory()
+                    for event in iterator:
+                        if cancel.is_set():
+                            return
+                        events.put((label, 'event', event))
+                    events.put((label, 'end', None))
+                except Exception as e:
+                    events.put((label, 'error', e))
+                finally:
+                    # Closing the generator closes the upstream HTTP stream
+                    if hasattr(iterator, 'close'):
+                        iterator.close()
+
+            threading.Thread(target=contextvars.copy_context().run, args=(pump,), name=f'hedge-{label}',
+                             daemon=True).start()
+
+        started = time.perf_counter()
+        start(PRIMARY, primary)
+        winner, first, errors = None, None, {}
+        try:
+            while winner is None:
+                timeout = None if SECONDARY in cancels else max(0.0, started + delay - time.perf_counter())
+                try:
+                    label, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    start(SECONDARY, secondary)
+                    continue
+                if kind == 'error':
+                    errors[label] = payload
+                    if SECONDARY not in cancels or len(errors) == 2:
+                        self._count(SECONDARY in cancels, PRIMARY)
+                        raise errors.get(PRIMARY, payload)
+                    continue
+                winner, first = label, (kind, payload)
+
+            hedged = SECONDARY in cancels
+            elapsed = time.perf_counter() - started
+            self.stream_tracker.record(*(primary_key if winner == PRIMARY else secondary_key),
+                                elapsed if winner == PRIMARY else elapsed - delay)
+            self._count(hedged, winner)
+            outcome.update(self._outcome(hedged, winner, delay))
+            for label, cancel in cancels.items():
+                if label != winner:
+                    cancel.set()
+            self._count_cancelled(len(cancels) - 1 - len(errors))
+
+            kind, payload = first
+            while kind == 'event':
+                yield payload
+                label, kind, payload = events.get()
+                while label != winner:
+                    label, kind, payload = events.get()
+            if kind == 'error':
+                raise payload
+        finally:
+            for cancel in cancels.values():
+                cancel.set()
+
+    def astream(self, primary_key, primary, secondary_key, secondary):
+        """
+        Async variant of stream; the losing stream is cancelled
+
+        :param primary: Zero-argument callable returning the primary async event iterator
+        :param secondary: Zero-argument callable returning the secondary async event iterator
+        :return: (async iterator, outcome)
+        """
+        outcome = {}
+        return self._astream(primary_key, primary, secondary_key, secondary, outcome), outcome
+
+    async def _astream(self, primary_key, primary, secondary_key, secondary, outcome):
+        delay = self.delay_for(*primary_key, stream=True)
+        events = asyncio.Queue()
+        tasks = {}
+
+        def start(label, factory):
+            async def pump():
+                try:
+                    async for event in factory():
+                        events.put_nowait((label, 'event', event))
+                    events.put_nowait((label, 'end', None))
+                except Exception as e:
+                    events.put_nowait((label, 'error', e))
+
+            tasks[label] = asyncio.ensure_future(pump())
+
+        started = time.perf_counter()
+        start(PRIMARY, primary)
+        winner, first, errors = None, None, {}
+        try:
+            while winner is None:
+                timeout = None if SECONDARY in tasks else max(0.0, started + delay - time.perf_counter())
+                try:
+                    label, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    start(SECONDARY, secondary)
+                    continue
+                if kind == 'error':
+                    errors[label] = payload
+                    if SECONDARY not in tasks or len(errors) == 2:
+                        self._count(SECONDARY in tasks, PRIMARY)
+                        raise errors.get(PRIMARY, payload)
+                    continue
+                winner, first = label, (kind, payload)
+
+            hedged = SECONDARY in tasks
+            elapsed = time.perf_counter() - started
+            self.stream_tracker.record(*(primary_key if winner == PRIMARY else secondary_key),
+                                elapsed if winner == PRIMARY else elapsed - delay)
+            self._count(hedged, winner)
+            outcome.update(self._outcome(hedged, winner, delay))
+            for label, task in tasks.items():
+                if label != winner:
+                    task.cancel()
+            self._count_cancelled(len(tasks) - 1 - len(errors))
+
+            kind, payload = first
+            while kind == 'event':
+                yield payload
+                label, kind, payload = await events.get()
+                while label != winner:
+                    label, kind, payload = await events.get()
+            if kind == 'error':
+                raise payload
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    def stats(self):
+        """
+        Get hedging counters
+
+        extra_tokens is the usage reported by losing calls that ran to completion. Losers
+        stopped part way (async calls and streams) cannot report usage; they are counted in
+        cancelled_losers instead.
+
+        :return: Dictionary with hedge rate, secondary win rate and extra spend
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['hedge_rate'] = stats['hedged'] / stats['requests'] if stats['requests'] else 0.0
+        stats['win_rate'] = stats['secondary_wins'] / stats['hedged'] if stats['hedged'] else 0.0
+        stats['extra_request_ratio'] = stats['extra_requests'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger():
+    """
+    Get the process-wide hedger
+
+    :return: Shared Hedger instance
+    """
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger(
+                    targets=parse_targets(Config.HEDGE_TARGETS),
+                    percentile=Config.HEDGE_PERCENTILE,
+                    min_delay=Config.HEDGE_MIN_DELAY_MS / 1000,
+                    max_delay=Config.HEDGE_MAX_DELAY_MS / 1000,
+                    default_delay=Config.HEDGE_DEFAULT_DELAY_MS / 1000
+                )
+    return _hedger
@@ -1,128 +1,151 @@
-import os
-import json
 import threading
 import time
 import logging
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
-from app.services.ai_providers.provider_registry import ProviderRegistry
+from app.config import Config
+from app.services.ai_providers.models import PROVIDER_MODELS
+from app.services.ai_providers.provider_registry import ProviderRegistry, provider_registry
+from app.services.model_store import get_model_store
+from app.services.single_flight import single_flight
+
+# Background revalidation is shared by every ModelDiscoveryService instance
+_revalidation_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='model-revalidate')
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+# Lists served after a failed or empty fetch: {provider_id: (models, expires_at)}
+_fallbacks = {}
+_fallbacks_lock = threading.Lock()
 
 class ModelDiscoveryService:
     def __init__(self):
-        self.provider_registry = ProviderRegistry()
-        self.cache_file = os.path.join(os.path.dirname(__file__), 'model_cache.json')
-        self.cache_expiry_hours = 24  # Cache models for 24 hours
+        self.provider_registry = provider_registry
+        self.model_store = get_model_store()
+        self.soft_ttl = Config.MODEL_CACHE_SOFT_TTL  # Older entries are served and refreshed in the background
+        self.hard_ttl = Config.MODEL_CACHE_HARD_TTL  # Older entries are refreshed before answering
+        self.failure_ttl = Config.MODEL_CACHE_FAILURE_TTL  # Fallbacks are served this long after a failed or empty fetch
         self.logger = logging.getLogger(__name__)
-        self._start_periodic_model_refresh()
 
-    def _start_periodic_model_refresh(self):
-        """
-        Start a background thread to periodically refresh models from all providers
+    def get_supported_models(self, provider_id: str) -> List[str]:
         """
-        def refresh_models():
-            while True:
-                try:
-                    self._refresh_all_models()
-                except Exception as e:
-                    self.logger.error(f"Error in periodic model refresh: {e}")
-
-                # Sleep for 24 hours between refreshes
-                time.sleep(24 * 60 * 60)
-
-        # Start the thread as a daemon so it doesn't block application shutdown
-        thread = threading.Thread(target=refresh_models, daemon=True)
-        thread.start()
+        Get supported models for a specific provider (stale-while-revalidate)
 
-    def _refresh_all_models(self):
+        Entries younger than the soft TTL are returned as they are. Entries between
+        the soft and hard TTL are returned immediately and refreshed in the background.
+        Missing entries, or entries past the hard TTL, are refreshed before returning,
+        unless a fetch failed within the failure TTL.
         """
-        Refresh models for all registered providers
-        """
-        provider_ids = self.provider_registry.get_available_provider_ids()
-
-        for provider_id in provider_ids:
+        entry = self.model_store.get(provider_id)
+        if entry is not None:
+            models, updated_at = entry
+            age = time.time() - updated_at
+            if age < self.soft_ttl:
+                return models
+            if age < self.hard_ttl:
+                self._revalidate_in_background(provider_id)
+                return models
+        with _fallbacks_lock:
+            fallback = _fallbacks.get(provider_id)
+        if fallback is not None and fallback[1] > time.time():
+            return fallback[0]
+        return self.fetch_latest_models(provider_id)
+
+    def _revalidate_in_background(self, provider_id: str):
+        with _revalidating_lock:
+            if provider_id in _revalidating:
+                return
+            _revalidating.add(provider_id)
+
+        def revalidate():
             try:
-                # Attempt to fetch latest models
-                models = self.fetch_latest_models(provider_id)
-
-                # Log the refresh
-                if models:
-                    self.logger.info(f"Refreshed models for {provider_id}: {len(models)} models found")
-                else:
-                    self.logger.warning(f"No models found for {provider_id}")
-
+                self.fetch_latest_models(provider_id)
             except Exception as e:
-                self.logger.error(f"Failed to refresh models for {provider_id}: {e}")
-
-    def get_supported_models(self, provider_id: str) -> List[str]:
-        """
-        Get supported models for a specific provider
-        Attempts to fetch from provider, falls back to cached models
-        """
-        provider = self.provider_registry.get_provider(provider_id)
-        if provider:
-            return provider.get_supported_models()
-
-        # Fallback to cached models if provider not registered
-        return self._get_cached_models(provider_id)
+                self.logger.error(f"Background model refresh failed for {provider_id}: {e}")
+            finally:
+                with _revalidating_lock:
+                    _revalidating.discard(provider_id)
 
-    def _get_cached_models(self, provider_id: str) -> List[str]:
-        """
-        Retrieve cached models for a provider
-        """
-        try:
-            with open(self.cache_file, 'r') as f:
-                cache = json.load(f)
-
-            # Check if cache is valid and not expired
-            if (provider_id in cache and
-                'timestamp' in cache[provider_id] and
-                'models' in cache[provider_id]):
-
-                cached_time = datetime.fromisoformat(cache[provider_id]['timestamp'])
-                if datetime.now() - cached_time < timedelta(hours=self.cache_expiry_hours):
-                    return cache[provider_id]['models']
-        except (FileNotFoundError, json.JSONDecodeError):
-            # If cache file doesn't exist or is invalid, return empty list
-            return []
+        _revalidation_executor.submit(revalidate)
 
-        return []
-
-    def update_model_cache(self, provider_id: str, models: List[str]):
+    def update_model_cache(self, provider_id: str, models: List[str], etag=None, last_modified=None):
         """
         Update the model cache for a specific provider
         """
         try:
-            # Read existing cache or create new
-            try:
-                with open(self.cache_file, 'r') as f:
-                    cache = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                cache = {}
-
-            # Update cache for this provider
-            cache[provider_id] = {
-                'models': models,
-                'timestamp': datetime.now().isoformat()
-            }
-
-            # Write updated cache
-            with open(self.cache_file, 'w') as f:
-                json.dump(cache, f, indent=2)
+            self.model_store.put(provider_id, models, etag, last_modified)
         except Exception as e:
             self.logger.error(f"Error updating model cache for {provider_id}: {e}")
 
+    def refresh_catalog(self, provider_id: str, provider=None, timeout=10) -> Dict:
+        """
+        Conditionally fetch a provider's catalog and store it if it changed
+
+        :param provider_id: Lowercase provider identifier
+        :param provider: Provider instance, looked up in the registry if omitted
+        :param timeout: Request timeout in seconds
+        :return: Dictionary with 'models', 'previous' (stored list before the refresh, or None)
+                 and 'not_modified'
+        :raises ValueError: If the provider is not registered
+        :raises requests.RequestException: If the catalog could not be fetched
+        """
+        provider = provider or self.provider_registry.get_provider(provider_id)
+        if not provider:
+            raise ValueError(f"Provider {provider_id} is not registered")
+
+        entry = self.model_store.get(provider_id)
+        previous = entry[0] if entry else None
+        # Only send validators when there is a stored list a 304 can refer to
+        validators = self.model_store.get_validators(provider_id) if entry else {}
+        catalog = provider.fetch_models(timeout=timeout, **validators)
+
+        if catalog["not_modified"] and self.model_store.touch(provider_id):
+            return {"models": previous, "previous": previous, "not_modified": True}
+        models = catalog["models"] or []
+        if models:
+            self.update_model_cache(provider_id, models, catalog.get("etag"), catalog.get("last_modified"))
+        return {"models": models, "previous": previous, "not_modified": False}
+
     def fetch_latest_models(self, provider_id: str) -> List[str]:
         """
-        Fetch the latest supported models for a provider
-        This method would ideally scrape or call the provider's API to get the most recent models
-        For now, it uses the provider's predefined models
+        Fetch the latest supported models from the provider and store them
+        Concurrent refreshes of the same provider share one upstream call. If the
+        catalog cannot be fetched or comes back empty, the stored list is returned,
+        or the provider's static list without one, and remembered for the failure TTL.
+
+        :return: List of model names, or an empty list if the provider is not registered
         """
         provider = self.provider_registry.get_provider(provider_id)
-        if provider:
-            models = provider.get_supported_models()
-            self.update_model_cache(provider_id, models)
-            return models
-        return []
+        if not provider:
+            return []
+
+        try:
+            result, _ = single_flight.do(f"models:{provider_id}", lambda: self.refresh_catalog(provider_id, provider))
+        except Exception as e:
+            self.logger.warning(f"Could not fetch the model catalog of {provider_id}: {e}")
+            return self._back_off(provider_id, provider)
+        models = result["models"]
+        if not models:
+            self.logger.warning(f"The model catalog of {provider_id} is empty")
+            return self._back_off(provider_id, provider)
+        with _fallbacks_lock:
+            _fallbacks.pop(provider_id, None)
+        self.logger.debug(f"Refreshed {len(models)} models for {provider_id}")
+        return models
+
+    def _back_off(self, provider_id: str, provider) -> List[str]:
+        # Serve the stored list, or the static one without it, and skip fetching for the failure TTL
+        entry = self.model_store.get(provider_id)
+        models = entry[0] if entry else self._static_models(provider_id, provider)
+        with _fallbacks_lock:
+            _fallbacks[provider_id] = (models, time.time() + self.failure_ttl)
+        return models
+
+    def _static_models(self, provider_id: str, provider) -> List[str]:
+        # The built-in list, without asking the vendor again
+        models = provider.supported_models
+        if isinstance(models, dict):
+            models = [model for category in models.values() for model in category]
+        return list(models) or PROVIDER_MODELS.get(provider_id, [])
 
     def get_all_providers(self) -> List[Dict[str, str]]:
         """
@@ -0,0 +1,214 @@
+"""
+Deployment-wide scheduler for periodic model list refreshes.
+
+Every worker process runs the scheduler loop, but only the holder of a lease in
+the shared model store refreshes anything, so a deployment refreshes each
+provider once per interval no matter how many workers it has. Due providers are
+refreshed concurrently on a bounded pool. Intervals are jittered so providers
+drift apart, and failing providers back off exponentially.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import Config
+from app.services.model_discovery import ModelDiscoveryService
+
+LEASE_NAME = 'model-refresh'
+
+
+def parse_intervals(spec):
+    """
+    Parse per-provider intervals such as "groq=3600,openai=86400"
+
+    :param spec: Comma separated provider=seconds pairs
+    :return: Dictionary of provider id to interval in seconds
+    """
+    intervals = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        provider_id, seconds = item.split('=', 1)
+        try:
+            intervals[provider_id.strip().lower()] = float(seconds)
+        except ValueError:
+            logging.getLogger(__name__).warning(f"Ignoring invalid model refresh interval: {item}")
+    return intervals
+
+
+class ModelRefreshScheduler:
+    """
+    Refreshes provider model lists on a schedule while holding the deployment lease
+    """
+
+    def __init__(self, discovery=None, interval=None, intervals=None, jitter=None, max_workers=None,
+                 tick_seconds=None, max_backoff=None):
+        """
+        :param discovery: ModelDiscoveryService used to fetch and store models
+        :param interval: Default seconds between refreshes of a provider
+        :param intervals: Dictionary of per-provider intervals overriding the default
+        :param jitter: Fraction by which each interval is randomly stretched or shrunk
+        :param max_workers: Maximum providers refreshed at the same time
+        :param tick_seconds: How often the loop checks for due providers and renews the lease
+        :param max_backoff: Upper bound in seconds of the delay after repeated failures
+        """
+        self.discovery = discovery or ModelDiscoveryService()
+        self.store = self.discovery.model_store
+        self.interval = interval if interval is not None else Config.MODEL_REFRESH_INTERVAL
+        self.intervals = intervals if intervals is not None else parse_intervals(Config.MODEL_REFRESH_INTERVALS)
+        self.jitter = jitter if jitter is not None else Config.MODEL_REFRESH_JITTER
+        self.tick_seconds = tick_seconds if tick_seconds is not None else Config.MODEL_REFRESH_TICK
+        self.max_backoff = max_backoff if max_backoff is not None else self.interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.logger = logging.getLogger(__name__)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.MODEL_REFRESH_WORKERS, thread_name_prefix='model-refresh'
+        )
+        self._lock = threading.Lock()
+        self._due = {}
+        self._failures = {}
+        self._running = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _jittered(self, seconds):
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _interval_for(self, provider_id):
+        return self.intervals.get(provider_id, self.interval)
+
+    def _first_due(self, provider_id, now):
+        """Schedule a provider seen for the first time based on the age of its stored list"""
+        entry = self.store.get(provider_id)
+        if entry is None:
+            # Spread the initial refreshes over the first tick instead of firing them together
+            return now + random.uniform(0, self.tick_seconds)
+        return entry[1] + self._jittered(self._interval_for(provider_id))
+
+    def start(self):
+        """Start the scheduler loop; calling it again is a no-op"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='model-refresh-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the loop and give up the lease"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.tick_seconds)
+        self._executor.shutdown(wait=False)
+        self.store.release_lease(LEASE_NAME, self.owner)
+
+    def _run(self):
+        # Start at a random point within the tick so workers booting together do not contend
+        self._stop.wait(random.uniform(0, self.tick_seconds))
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                self.logger.error(f"Error in model refresh scheduler: {e}")
+            self._stop.wait(self.tick_seconds)
+
+    def tick(self, now=None):
+        """
+        Renew the lease and submit every due provider for refresh
+
+        :param now: Current time, for tests
+        :return: List of provider ids submitted for refresh
+        """
+        if not self.store.acquire_lease(LEASE_NAME, self.owner, self.tick_seconds * 3):
+            return []
+
+        now = now if now is not None else time.time()
+        submitted = []
+        for provider_id, provider in self.discovery.provider_registry.get_all_providers().items():
+            with self._lock:
+                if provider_id not in self._due:
+                    self._due[provider_id] = self._first_due(provider_id, now)
+                if provider_id in self._running or self._due[provider_id] > now:
+                    continue
+                self._running.add(provider_id)
+            self._executor.submit(self._refresh, provider_id, provider)
+            submitted.append(provider_id)
+        return submitted
+
+    def _refresh(self, provider_id, provider):
+        started = time.time()
+        error = None
+        models = []
+        try:
+            # refresh_catalog raises on fetch failures so they drive the backoff below
+            models = self.discovery.refresh_catalog(provider_id, provider)["models"]
+            if not models:
+                error = "No models returned"
+        except Exception as e:
+            error = str(e)
+        duration_ms = (time.time() - started) * 1000
+
+        with self._lock:
+            if error is None:
+                self._failures[provider_id] = 0
+                delay = self._jittered(self._interval_for(provider_id))
+            else:
+                self._failures[provider_id] = self._failures.get(provider_id, 0) + 1
+                delay = self._jittered(min(self.max_backoff, self.tick_seconds * 2 ** self._failures[provider_id]))
+            self._due[provider_id] = time.time() + delay
+            failures = self._failures[provider_id]
+
+        if error is None:
+            self.logger.info(f"Refreshed {len(models)} models for {provider_id} in {duration_ms:.0f}ms")
+        else:
+            self.logger.warning(f"Model refresh failed for {provider_id} ({failures} in a row): {error}")
+        self.store.put_refresh_status(provider_id, {
+            'last_refresh': started,
+            'duration_ms': round(duration_ms, 1),
+            'ok': error is None,
+            'error': error,
+            'models': len(models or []),
+            'consecutive_failures': failures,
+            'next_refresh': started + delay
+        })
+        with self._lock:
+            self._running.discard(provider_id)
+
+    def status(self):
+        """
+        Get the deployment-wide refresh status
+
+        :return: Dictionary with the lease holder and the last refresh of every provider
+        """
+        holder = self.store.lease_holder(LEASE_NAME)
+        return {
+            'scheduler': {
+                'owner': self.owner,
+                'leader': holder[0] if holder else None,
+                'is_leader': bool(holder) and holder[0] == self.owner,
+                'running': self._thread is not None and self._thread.is_alive()
+            },
+            'providers': self.store.refresh_statuses()
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_model_refresh_scheduler():
+    """
+    Get the process-wide model refresh scheduler
+
+    :return: Shared ModelRefreshScheduler instance
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ModelRefreshScheduler()
+    return _scheduler
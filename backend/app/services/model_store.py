@@ -0,0 +1,251 @@
+"""
+Per-provider store of discovered model lists.
+
+Each provider is one row in a SQLite database in WAL mode, so writers upsert a
+single row atomically and readers in other workers are never blocked or shown
+a half-written file. Rows are read through an in-process memory layer that is
+dropped whenever SQLite reports that another connection has committed.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app.config import Config
+
+
+class ModelStore:
+    """
+    SQLite-backed, process-safe store of model lists keyed by provider
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        """
+        :param db_path: Path of the SQLite database file
+        :param legacy_json_path: Optional model_cache.json to import when the store is empty
+        """
+        self.db_path = db_path
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._memory = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # One connection shared by all threads; every use is serialised by self._lock
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS models ("
+                "provider_id TEXT PRIMARY KEY, models TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS catalog_validators ("
+                "provider_id TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS refresh_status (provider_id TEXT PRIMARY KEY, status TEXT NOT NULL)"
+            )
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if legacy_json_path:
+            self._import_legacy(legacy_json_path)
+
+    def _sync_memory(self):
+        """Drop the memory layer if another process committed since we last looked. Caller holds self._lock."""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._memory.clear()
+            self._data_version = data_version
+
+    def _import_legacy(self, path):
+        try:
+            with open(path, 'r') as f:
+                legacy = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        rows = []
+        for provider_id, entry in legacy.items():
+            if isinstance(entry, dict) and isinstance(entry.get('models'), list):
+                try:
+                    updated_at = time.mktime(time.strptime(entry['timestamp'][:19], '%Y-%m-%dT%H:%M:%S'))
+                except (KeyError, TypeError, ValueError):
+                    updated_at = 0.0
+                rows.append((provider_id, json.dumps(entry['models']), updated_at))
+        with self._lock:
+            if self._conn.execute("SELECT COUNT(*) FROM models").fetchone()[0]:
+                return
+            with self._conn:
+                # OR IGNORE: another worker may be importing at the same time
+                self._conn.executemany("INSERT OR IGNORE INTO models VALUES (?, ?, ?)", rows)
+        self.logger.info(f"Imported {len(rows)} provider model lists from {path}")
+
+    def get(self, provider_id):
+        """
+        Get the stored model list of a provider
+
+        :param provider_id: Lowercase provider identifier
+        :return: (models, updated_at) with updated_at as a Unix timestamp, or None
+        """
+        with self._lock:
+            self._sync_memory()
+            if provider_id in self._memory:
+                return self._memory[provider_id]
+            row = self._conn.execute(
+                "SELECT models, updated_at FROM models WHERE provider_id = ?", (provider_id,)
+            ).fetchone()
+            entry = (json.loads(row[0]), row[1]) if row else None
+            self._memory[provider_id] = entry
+            return entry
+
+    def put(self, provider_id, models, etag=None, last_modified=None):
+        """
+        Atomically insert or replace the model list of a provider
+
+        :param provider_id: Lowercase provider identifier
+        :param models: List of model names
+        :param etag: ETag of the fetched catalog, for conditional refreshes
+        :param last_modified: Last-Modified value of the fetched catalog
+        """
+        updated_at = time.time()
+        with self._lock:
+            # Pick up other processes' writes first; our own commit does not change data_version
+            self._sync_memory()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO models (provider_id, models, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(provider_id) DO UPDATE SET "
+                    "models = excluded.models, updated_at = excluded.updated_at",
+                    (provider_id, json.dumps(models), updated_at)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO catalog_validators (provider_id, etag, last_modified) VALUES (?, ?, ?)",
+                    (provider_id, etag, last_modified)
+                )
+            self._memory[provider_id] = (list(models), updated_at)
+
+    def touch(self, provider_id):
+        """
+        Mark a provider's stored list as fresh without rewriting it, e.g. after a 304
+
+        :return: True if the provider had a stored list
+        """
+        updated_at = time.time()
+        with self._lock:
+            self._sync_memory()
+            with self._conn:
+                changed = self._conn.execute(
+                    "UPDATE models SET updated_at = ? WHERE provider_id = ?", (updated_at, provider_id)
+                ).rowcount
+            self._memory.pop(provider_id, None)
+        return bool(changed)
+
+    def get_validators(self, provider_id):
+        """
+        :return: Dictionary with the 'etag' and 'last_modified' of the stored catalog (values may be None)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified FROM catalog_validators WHERE provider_id = ?", (provider_id,)
+            ).fetchone()
+        return {'etag': row[0] if row else None, 'last_modified': row[1] if row else None}
+
+    def delete(self, provider_id):
+        """Remove a provider's model list"""
+        with self._lock:
+            self._sync_memory()
+            with self._conn:
+                self._conn.execute("DELETE FROM models WHERE provider_id = ?", (provider_id,))
+                self._conn.execute("DELETE FROM catalog_validators WHERE provider_id = ?", (provider_id,))
+            self._memory.pop(provider_id, None)
+
+    def provider_ids(self):
+        """List providers that have a stored model list"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT provider_id FROM models ORDER BY provider_id")]
+
+    def acquire_lease(self, name, owner, ttl_seconds):
+        """
+        Take or renew a named lease shared by every process using this database
+
+        :param name: Lease name
+        :param owner: Unique identifier of the caller
+        :param ttl_seconds: How long the lease is held without renewal
+        :return: True if the caller holds the lease
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, owner, now + ttl_seconds, now)
+            )
+            row = self._conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name, owner):
+        """Give up a lease if the caller holds it"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def lease_holder(self, name):
+        """
+        :return: (owner, expires_at) of a lease, or None if nobody holds it
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0], row[1]
+
+    def put_refresh_status(self, provider_id, status):
+        """
+        Record the outcome of a provider's last model refresh
+
+        :param provider_id: Lowercase provider identifier
+        :param status: JSON-serialisable dictionary
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO refresh_status (provider_id, status) VALUES (?, ?) "
+                "ON CONFLICT(provider_id) DO UPDATE SET status = excluded.status",
+                (provider_id, json.dumps(status))
+            )
+
+    def refresh_statuses(self):
+        """
+        :return: Dictionary of provider id to the last recorded refresh status
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT provider_id, status FROM refresh_status ORDER BY provider_id").fetchall()
+        return {provider_id: json.loads(status) for provider_id, status in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_model_store = None
+_model_store_lock = threading.Lock()
+
+
+def get_model_store():
+    """
+    Get the process-wide model store
+
+    :return: Shared ModelStore instance
+    """
+    global _model_store
+    if _model_store is None:
+        with _model_store_lock:
+            if _model_store is None:
+                _model_store = ModelStore(
+                    Config.MODEL_STORE_PATH,
+                    legacy_json_path=os.path.join(os.path.dirname(__file__), 'model_cache.json')
+                )
+    return _model_store
@@ -1,49 +1,271 @@
+"""
+Prometheus metrics for the API and its upstream provider calls.
+
+Every Flask and native ASGI request is timed per route, and every provider
+call attempt per provider/model: upstream latency, time to first token and
+completion tokens per second, along with in-flight gauges, error counters by
+exception class and cache hit counters. The metrics are served at /metrics on
+the application itself. When PROMETHEUS_MULTIPROC_DIR is set before the app is
+imported, each worker writes its samples there and /metrics aggregates all
+workers; gunicorn's child_exit hook should then call mark_process_dead.
+"""
+import os
 import time
 import logging
-from typing import Dict, Any
-from prometheus_client import start_http_server, Summary, Gauge, Counter
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+)
+
+# Seconds; completions range from sub-second cache-warm replies to minute-long generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0)
+THROUGHPUT_BUCKETS = (5, 10, 25, 50, 75, 100, 150, 250, 500, 1000)
+
+
+def multiprocess_enabled() -> bool:
+    return bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def mark_process_dead(pid: int):
+    """Drop the live gauges of an exited worker; call from gunicorn's child_exit hook"""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
+
 
 class MonitoringService:
-    def __init__(self, port: int = 65000):
+    def __init__(self, registry: Optional[CollectorRegistry] = None):
+        """
+        :param registry: Registry the metrics are created in, the process-wide default if None
+        """
         self.logger = logging.getLogger(__name__)
-        self.port = port
+        self.registry = registry or REGISTRY
+        self.custom_metrics = {}
         self._initialize_metrics()
 
     def _initialize_metrics(self):
-        # Create a metric to track time spent and requests made.
-        self.REQUEST_TIME = Summary('request_processing_seconds', 'Time spent processing request')
-        self.REQUEST_COUNT = Counter('request_count', 'Total request count')
-        self.ACTIVE_REQUESTS = Gauge('active_requests', 'Number of active requests')
+        registry = self.registry
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Time spent serving API requests',
+            ['method', 'route', 'status'], buckets=LATENCY_BUCKETS, registry=registry)
+        self.requests_in_flight = Gauge(
+            'http_requests_in_flight', 'API requests being served',
+            registry=registry, multiprocess_mode='livesum')
+        self.upstream_latency = Histogram(
+            'provider_request_duration_seconds', 'Duration of provider call attempts',
+            ['provider', 'model'], buckets=LATENCY_BUCKETS, registry=registry)
+        self.time_to_first_token = Histogram(
+            'provider_time_to_first_token_seconds', 'Time until a provider stream sent its first token',
+            ['provider', 'model'], buckets=TTFT_BUCKETS, registry=registry)
+        self.tokens_per_second = Histogram(
+            'provider_tokens_per_second', 'Completion tokens generated per second',
+            ['provider', 'model'], buckets=THROUGHPUT_BUCKETS, registry=registry)
+        self.provider_in_flight = Gauge(
+            'provider_requests_in_flight', 'Provider calls awaiting a response',
+            ['provider'], registry=registry, multiprocess_mode='livesum')
+        self.errors = Counter(
+            'errors', 'Errors by where they were raised and their exception class',
+            ['source', 'error'], registry=registry)
+        self.cache_lookups = Counter(
+            'cache_lookups', 'Completion cache lookups',
+            ['cache', 'result'], registry=registry)
+
+    def init_app(self, app):
+        """
+        Time every request of a Flask app and serve the metrics at /metrics.
+        Streamed responses are observed when the stream closes.
+        """
+        from flask import g, request
+
+        @app.before_request
+        def _start_timer():
+            g._monitoring_started = time.perf_counter()
+            self.requests_in_flight.inc()
+
+        @app.after_request
+        def _observe(response):
+            started = g.pop('_monitoring_started', None)
+            if started is not None:
+                method, route, status = request.method, self._route(request), response.status_code
+
+                # The server closes the response once the last chunk of the body is sent
+                def finish():
+                    self.requests_in_flight.dec()
+                    self.observe_request(method, route, status, time.perf_counter() - started)
+
+                response.call_on_close(finish)
+            return response
+
+        @app.teardown_request
+        def _observe_failure(exc):
+            # after_request is skipped when a view raises
+            started = g.pop('_monitoring_started', None)
+            if started is not None:
+                self.requests_in_flight.dec()
+                self.observe_request(request.method, self._route(request), 500, time.perf_counter() - started)
+            if exc is not None:
+                self.record_error('http', exc)
+
+        app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    @staticmethod
+    def _route(request):
+        # The URL rule rather than the path keeps the label set bounded
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def _metrics_view(self):
+        body, content_type = self.render()
+        return body, 200, {'Content-Type': content_type}
 
-    def start_server(self):
-        """Start the Prometheus metrics server."""
-        start_http_server(self.port)
-        self.logger.info(f"Prometheus metrics server started on port {self.port}")
+    def render(self):
+        """
+        :return: (exposition body, content type), aggregated over all workers in multiprocess mode
+        """
+        registry = self.registry
+        if multiprocess_enabled() and registry is REGISTRY:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self.request_latency.labels(method, route, str(status)).observe(seconds)
+
+    @contextmanager
+    def track_http(self, method: str, route: str):
+        """
+        Time a request served outside Flask; set 'status' on the yielded dictionary
+        """
+        outcome = {'status': 500}
+        started = time.perf_counter()
+        self.requests_in_flight.inc()
+        try:
+            yield outcome
+        finally:
+            self.requests_in_flight.dec()
+            self.observe_request(method, route, outcome['status'], time.perf_counter() - started)
 
     def track_request(self, func):
         """Decorator to track request metrics."""
+        @wraps(func)
         def wrapper(*args, **kwargs):
-            self.REQUEST_COUNT.inc()
-            self.ACTIVE_REQUESTS.inc()
-            start_time = time.time()
-            try:
-                return func(*args, **kwargs)
-            finally:
-                self.ACTIVE_REQUESTS.dec()
-                self.REQUEST_TIME.observe(time.time() - start_time)
+            with self.track_http('CALL', func.__name__) as outcome:
+                result = func(*args, **kwargs)
+                outcome['status'] = 200
+                return result
         return wrapper
 
+    def record_error(self, source: str, error: BaseException):
+        self.errors.labels(source, type(error).__name__).inc()
+
+    def record_cache(self, cache: str, hit: bool):
+        self.cache_lookups.labels(cache, 'hit' if hit else 'miss').inc()
+
+    def _observe_completion(self, provider: str, model: str, response, seconds: float):
+        usage = response.get('usage') if isinstance(response, dict) else None
+        tokens = (usage or {}).get('completion_tokens')
+        if tokens and seconds > 0:
+            self.tokens_per_second.labels(provider, model).observe(tokens / seconds)
+
+    @contextmanager
+    def _provider_call(self, provider: str, model: str):
+        in_flight = self.provider_in_flight.labels(provider)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            yield started
+        except Exception as e:
+            self.record_error('provider', e)
+            raise
+        finally:
+            in_flight.dec()
+            self.upstream_latency.labels(provider, model).observe(time.perf_counter() - started)
+
+    def call(self, provider: str, model: str, fn: Callable[[], Any]):
+        """
+        Run one blocking provider call attempt and record its latency and throughput
+        """
+        with self._provider_call(provider, model) as started:
+            response = fn()
+            self._observe_completion(provider, model, response, time.perf_counter() - started)
+            return response
+
+    async def acall(self, provider: str, model: str, fn: Callable[[], Any]):
+        """
+        Async variant of call; fn returns the coroutine making the call
+        """
+        with self._provider_call(provider, model) as started:
+            response = await fn()
+            self._observe_completion(provider, model, response, time.perf_counter() - started)
+            return response
+
+    def _observe_event(self, provider: str, model: str, timing: Dict[str, Any], event):
+        if not isinstance(event, dict):
+            return
+        now = time.perf_counter()
+        if event.get('type') == 'delta':
+            if timing['first'] is None:
+                timing['first'] = now
+                self.time_to_first_token.labels(provider, model).observe(now - timing['started'])
+            timing['chars'] += len(event.get('text') or '')
+        elif event.get('type') == 'usage' and timing['first'] is not None and now > timing['first']:
+            tokens = (event.get('usage') or {}).get('completion_tokens') or timing['chars'] // 4
+            if tokens:
+                self.tokens_per_second.labels(provider, model).observe(tokens / (now - timing['first']))
+
+    def stream(self, provider: str, model: str, events):
+        """
+        Relay one provider stream attempt, recording time to first token and throughput
+        """
+        with self._provider_call(provider, model) as started:
+            timing = {'started': started, 'first': None, 'chars': 0}
+            for event in events:
+                self._observe_event(provider, model, timing, event)
+                yield event
+
+    async def astream(self, provider: str, model: str, events):
+        """
+        Async variant of stream
+        """
+        with self._provider_call(provider, model) as started:
+            timing = {'started': started, 'first': None, 'chars': 0}
+            async for event in events:
+                self._observe_event(provider, model, timing, event)
+                yield event
+
     def track_custom_metric(self, name: str, value: Any):
         """Track a custom metric."""
         if name not in self.custom_metrics:
-            self.custom_metrics[name] = Gauge(name, f"Custom metric: {name}")
+            self.custom_metrics[name] = Gauge(name, f"Custom metric: {name}", registry=self.registry)
         self.custom_metrics[name].set(value)
 
     def get_metrics(self) -> Dict[str, Any]:
-        """Get all tracked metrics."""
-        return {
-            'request_count': self.REQUEST_COUNT._value.get(),
-            'active_requests': self.ACTIVE_REQUESTS._value.get(),
-            'request_time': self.REQUEST_TIME._sum.get(),
-            **{name: metric._value.get() for name, metric in self.custom_metrics.items()}
-        }
+        """Get all tracked metrics, summed over their label sets."""
+        totals = {}
+        for family in self.registry.collect():
+            for sample in family.samples:
+                if sample.name.endswith(('_bucket', '_created')):
+                    continue
+                totals[sample.name] = totals.get(sample.name, 0) + sample.value
+        return totals
+
+
+_monitoring = None
+_monitoring_lock = threading.Lock()
+
+
+def get_monitoring():
+    """
+    Get the process-wide monitoring service; its metrics live in the default registry
+
+    :return: Shared MonitoringService instance
+    """
+    global _monitoring
+    if _monitoring is None:
+        with _monitoring_lock:
+            if _monitoring is None:
+                _monitoring = MonitoringService()
+    return _monitoring
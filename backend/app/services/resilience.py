@@ -0,0 +1,384 @@
+"""
+Resilient provider calls.
+
+Every upstream call goes through a circuit breaker kept per provider/model.
+Transient failures (rate limits, 5xx responses, timeouts and dropped
+connections) are retried with jittered exponential backoff, waiting at least
+as long as the provider's Retry-After header asks. After repeated transient
+failures a breaker opens and rejects calls without contacting the provider;
+once its reset timeout has passed it lets a few half-open trial calls through
+and closes again when one of them succeeds.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from app.config import Config
+from app.services.ai_providers.errors import UpstreamError
+from app.services.ai_providers.rate_limiter import RateLimitExceeded
+
+# HTTP statuses worth retrying: timeouts, rate limits and server errors
+TRANSIENT_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    Raised instead of calling a provider/model whose circuit breaker is open
+    """
+
+    def __init__(self, provider_id, model, retry_after):
+        super().__init__(
+            f"{provider_id}:{model} is unavailable after repeated failures, retry in {retry_after:.0f}s",
+            503, retry_after
+        )
+
+
+def is_transient(error):
+    """
+    :return: True if the error is likely to go away when the call is repeated
+    """
+    if isinstance(error, (CircuitOpenError, RateLimitExceeded)):
+        # Raised locally without reaching the provider
+        return False
+    if isinstance(error, UpstreamError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Closed, open and half-open states of one provider/model
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_trials=1, on_change=None):
+        """
+        :param failure_threshold: Consecutive transient failures that open the breaker
+        :param reset_timeout: Seconds the breaker stays open before allowing trial calls
+        :param half_open_trials: Trial calls allowed at the same time while half-open
+        :param on_change: Called with the breaker whenever it changes state
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_trials = half_open_trials
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        changed = state != self.state
+        self.state = state
+        if changed and self.on_change is not None:
+            self.on_change(self)
+
+    def allow(self, now=None):
+        """
+        Admit a call, taking a trial slot while half-open
+
+        :return: False if the call must be rejected
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self._trials = 0
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_trials:
+                    return False
+                self._trials += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self._trials = 0
+                self._set_state(CLOSED)
+
+    def record_failure(self, now=None):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = now or time.monotonic()
+                self._trials = 0
+                self._set_state(OPEN)
+
+    def release(self):
+        """Give back a trial slot whose call ended without an outcome, e.g. an abandoned stream"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def retry_after(self, now=None):
+        """
+        :return: Seconds until an open breaker allows trial calls, 0 otherwise
+        """
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - ((now or time.monotonic()) - self.opened_at))
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'retry_in': round(self.retry_after(), 1)
+        }
+
+
+class Resilience:
+    """
+    Retries and circuit breakers around provider calls
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.25, max_delay=8.0,
+                 failure_threshold=5, reset_timeout=30.0, half_open_trials=1):
+        """
+        :param max_attempts: Calls made for one request, including the first
+        :param base_delay: Backoff ceiling in seconds before the first retry, doubled for every further retry
+        :param max_delay: Largest wait between attempts; a longer Retry-After fails the call instead
+        :param failure_threshold: See CircuitBreaker
+        :param reset_timeout: See CircuitBreaker
+        :param half_open_trials: See CircuitBreaker
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_trials = half_open_trials
+        self._breakers = {}
+        self._open = frozenset()
+        self._lock = threading.Lock()
+        self._counters = {'retries': 0, 'rejected': 0}
+
+    def breaker(self, provider_id, model):
+        """
+        :return: CircuitBreaker of the provider/model, created on first use
+        """
+        key = (provider_id, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout, self.half_open_trials,
+                                             on_change=lambda b, key=key: self._state_changed(key, b))
+                    self._breakers[key] = breaker
+        return breaker
+
+    def _state_changed(self, key, breaker):
+        if breaker.state != CLOSED:
+            self.logger.warning(f"Circuit breaker for {key[0]}:{key[1]} is {breaker.state}")
+        else:
+            self.logger.info(f"Circuit breaker for {key[0]}:{key[1]} closed")
+        with self._lock:
+            self._open = self._open | {key} if breaker.state == OPEN else self._open - {key}
+
+    def open_circuits(self):
+        """
+        :return: Frozen set of (provider id, model) whose breakers are rejecting calls
+        """
+        now = time.monotonic()
+        return frozenset(key for key in self._open if self._breakers[key].retry_after(now) > 0)
+
+    def _admit(self, key, breaker, last_error):
+        if breaker.allow():
+            return
+        with self._lock:
+            self._counters['rejected'] += 1
+        # A breaker that opened during our own retries reports the error that opened it
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpenError(key[0], key[1], breaker.retry_after())
+
+    def _retry_delay(self, key, breaker, error, attempt):
+        """
+        Record a failed attempt and decide whether to try again
+
+        :param attempt: Number of the attempt that failed, starting at 1
+        :return: Seconds to wait before the next attempt, or None to give up
+        """
+        if not is_transient(error):
+            # The provider answered; the request itself was at fault
+            breaker.record_success()
+            return None
+        breaker.record_failure()
+        if attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                return None
+            delay = max(delay, retry_after)
+        with self._lock:
+            self._counters['retries'] += 1
+        self.logger.warning(f"Retrying {key[0]}:{key[1]} in {delay:.2f}s after attempt {attempt}: {error}")
+        return delay
+
+    def call(self, key, fn):
+        """
+        Run a blocking provider call
+
+        :param key: (provider id, model) the call goes to
+        :param fn: Zero-argument callable making the call
+        :return: The call's result
+        :raises CircuitOpenError: If the breaker rejects the call
+        :raises Exception: The last error once retries are exhausted or the error is not transient
+        """
+        breaker = self.breaker(*key)
+        attempt, last_error = 0, None
+        while True:
+            attempt += 1
+            self._admit(key, breaker, last_error)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._retry_delay(key, breaker, e, attempt)
+                if delay is None:
+                    raise
+                last_error = e
+                time.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    async def acall(self, key, fn):
+        """
+        Async variant of call
+
+        :param fn: Zero-argument callable returning the coroutine making the call
+        """
+        breaker = self.breaker(*key)
+        attempt, last_error = 0, None
+        while True:
+            attempt += 1
+            self._admit(key, breaker, last_error)
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self._retry_delay(key, breaker, e, attempt)
+                if delay is None:
+                    raise
+                last_error = e
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    def stream(self, key, factory):
+        """
+        Relay a provider stream. Failures before the first event are retried;
+        once events have been relayed the error is passed on.
+
+        :param factory: Zero-argument callable returning the provider's event iterator
+        :return: Iterator of stream events
+        """
+        breaker = self.breaker(*key)
+        attempt, last_error = 0, None
+        while True:
+            attempt += 1
+            self._admit(key, breaker, last_error)
+            started = False
+            try:
+                for event in factory():
+                    started = True
+                    yield event
+            except Exception as e:
+                delay = self._retry_delay(key, breaker, e, attempt if not started else self.max_attempts)
+                if delay is None:
+                    raise
+                last_error = e
+                time.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return
+
+    async def astream(self, key, factory):
+        """
+        Async variant of stream
+
+        :param factory: Zero-argument callable returning the provider's async event iterator
+        """
+        breaker = self.breaker(*key)
+        attempt, last_error = 0, None
+        while True:
+            attempt += 1
+            self._admit(key, breaker, last_error)
+            started = False
+            try:
+                async for event in factory():
+                    started = True
+                    yield event
+            except Exception as e:
+                delay = self._retry_delay(key, breaker, e, attempt if not started else self.max_attempts)
+                if delay is None:
+                    raise
+                last_error = e
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return
+
+    def stats(self):
+        """
+        :return: Retry and rejection counts and the state of every breaker
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            breakers = dict(self._breakers)
+        counters['breakers'] = {
+            f'{provider_id}:{model}': breaker.snapshot()
+            for (provider_id, model), breaker in sorted(breakers.items())
+        }
+        return counters
+
+
+_resilience = None
+_resilience_lock = threading.Lock()
+
+
+def get_resilience():
+    """
+    Get the process-wide retry and circuit breaker layer
+
+    :return: Shared Resilience instance
+    """
+    global _resilience
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = Resilience(
+                    max_attempts=Config.RETRY_MAX_ATTEMPTS,
+                    base_delay=Config.RETRY_BASE_DELAY_MS / 1000,
+                    max_delay=Config.RETRY_MAX_DELAY_MS / 1000,
+                    failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=Config.BREAKER_RESET_SECONDS,
+                    half_open_trials=Config.BREAKER_HALF_OPEN_TRIALS
+                )
+    return _resilience
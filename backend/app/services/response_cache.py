@@ -0,0 +1,258 @@
+"""
+Exact-match cache for chat completion responses.
+
+Responses are keyed on a canonical hash of provider, model, messages and the
+options that affect the output. A bounded in-memory LRU tier sits in front of an
+optional on-disk tier whose total size is capped; the least recently used files
+are evicted first.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import Config
+
+# Options that change what the model returns; anything else (e.g. cache controls) is ignored
+RELEVANT_OPTIONS = (
+    'temperature', 'max_tokens', 'top_p', 'top_k', 'stop', 'seed',
+    'presence_penalty', 'frequency_penalty', 'response_format', 'tools', 'tool_choice'
+)
+
+# Per-request cache controls
+CACHE_DEFAULT = 'default'  # Read and write the cache
+CACHE_BYPASS = 'bypass'    # Neither read nor write
+CACHE_REFRESH = 'refresh'  # Skip the lookup but store the fresh response
+CACHE_MODES = (CACHE_DEFAULT, CACHE_BYPASS, CACHE_REFRESH)
+
+
+def completion_cache_key(provider_id, model, messages, options=None):
+    """
+    Build the canonical cache key for a completion request
+
+    :param provider_id: Lowercase provider identifier
+    :param model: Model name
+    :param messages: List of message dictionaries
+    :param options: Request options; only RELEVANT_OPTIONS are part of the key
+    :return: Hex digest identifying the request
+    """
+    options = options or {}
+    canonical = {
+        'provider': provider_id,
+        'model': model,
+        'messages': messages,
+        'options': {name: options[name] for name in RELEVANT_OPTIONS if options.get(name) is not None}
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU + optional disk) cache of completion responses
+    """
+
+    def __init__(self, max_entries=1000, cache_dir=None, max_disk_bytes=100 * 1024 * 1024, ttl_seconds=0):
+        """
+        :param max_entries: Maximum responses kept in memory
+        :param cache_dir: Directory for the disk tier, or None to keep responses in memory only
+        :param max_disk_bytes: Size limit of the disk tier
+        :param ttl_seconds: Entry lifetime in seconds, 0 to keep entries until evicted
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'bytes_saved': 0}
+        self._disk_bytes = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    @property
+    def has_disk_tier(self):
+        return bool(self.cache_dir)
+
+    def _expired(self, entry):
+        return self.ttl_seconds and time.time() - entry['stored_at'] > self.ttl_seconds
+
+    def get(self, key):
+        """
+        Look up a cached response
+
+        :param key: Key from completion_cache_key
+        :return: Cached response dictionary or None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._expired(entry):
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._count_hit('memory_hits', entry['size'])
+                return entry['response']
+
+        entry = self._read_disk(key) if self.cache_dir else None
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._store_memory(key, entry)
+            self._count_hit('disk_hits', entry['size'])
+        return entry['response']
+
+    def put(self, key, response):
+        """
+        Store a response in every tier
+
+        :param key: Key from completion_cache_key
+        :param response: JSON-serialisable response dictionary
+        """
+        encoded = json.dumps(response)
+        entry = {'response': response, 'size': len(encoded.encode('utf-8')), 'stored_at': time.time()}
+        with self._lock:
+            self._store_memory(key, entry)
+            self._counters['stores'] += 1
+        if self.cache_dir:
+            self._write_disk(key, entry)
+
+    def _count_hit(self, tier, size):
+        self._counters['hits'] += 1
+        self._counters[tier] += 1
+        self._counters['bytes_saved'] += size
+
+    def _store_memory(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if self._expired(entry):
+            self._remove_disk(path)
+            return None
+        # Refresh the modification time so eviction treats the file as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _write_disk(self, key, entry):
+        path = self._disk_path(key)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp_', suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path) - previous
+                over_limit = self._disk_bytes > self.max_disk_bytes
+            if over_limit:
+                self._evict_disk()
+        except Exception as e:
+            self.logger.error(f"Error writing response cache entry: {e}")
+
+    def _disk_entries(self):
+        """List (path, mtime, size) of every cache file"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json') or name.startswith('.tmp_'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _remove_disk(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier is under its size limit"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir:
+            for path, _, _ in self._disk_entries():
+                self._remove_disk(path)
+
+    def stats(self):
+        """
+        Get cache counters
+
+        :return: Dictionary with hit/miss counts, hit ratio, bytes saved and tier sizes
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes if self.cache_dir else 0
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Get the process-wide response cache, or None when caching is disabled
+
+    :return: Shared ResponseCache instance or None
+    """
+    global _response_cache
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+                    cache_dir=Config.RESPONSE_CACHE_DIR or None,
+                    max_disk_bytes=Config.RESPONSE_CACHE_DISK_MAX_MB * 1024 * 1024,
+                    ttl_seconds=Config.RESPONSE_CACHE_TTL
+                )
+    return _response_cache
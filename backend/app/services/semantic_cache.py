@@ -0,0 +1,255 @@
+"""
+Semantic (near-duplicate) cache for chat completion responses.
+
+The final user message is embedded with a cheap local hashed character n-gram
+embedding. Vectors are kept in one contiguous NumPy matrix per provider/model,
+so a lookup is a single matrix-vector product followed by a top-k selection.
+Rows also carry a fingerprint of the rest of the conversation (system prompt,
+earlier turns and options), and only rows with the same context can match.
+"""
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+
+from app.config import Config
+from app.services.response_cache import completion_cache_key
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class HashedNgramEmbedder:
+    """
+    Feature-hashing embedder over word unigrams and character n-grams
+    """
+
+    def __init__(self, dim=512, ngram_sizes=(3, 4, 5)):
+        """
+        :param dim: Number of hash buckets (embedding dimension)
+        :param ngram_sizes: Character n-gram lengths to hash
+        """
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+
+    def _features(self, text):
+        text = _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', text.lower())).strip()
+        features = text.split(' ')
+        padded = f" {text} "
+        for n in self.ngram_sizes:
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, text):
+        """
+        Embed text as an L2-normalised float32 vector
+
+        :param text: Text to embed
+        :return: NumPy array of shape (dim,)
+        """
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = zlib.crc32(feature.encode('utf-8'))
+            # The top bit picks the sign so colliding features tend to cancel out
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class _ModelIndex:
+    """
+    Vectors and responses for one provider/model, stored in preallocated rows
+    """
+
+    def __init__(self, dim, max_entries):
+        self.max_entries = max_entries
+        self.capacity = min(64, max_entries)
+        self.vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+        self.contexts = np.zeros(self.capacity, dtype=np.int64)
+        self.last_used = np.zeros(self.capacity, dtype=np.float64)
+        self.responses = [None] * self.capacity
+        self.count = 0
+
+    def _grow(self):
+        new_capacity = min(self.capacity * 2, self.max_entries)
+        vectors = np.zeros((new_capacity, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:self.capacity] = self.vectors
+        self.vectors = vectors
+        contexts = np.zeros(new_capacity, dtype=np.int64)
+        contexts[:self.capacity] = self.contexts
+        self.contexts = contexts
+        last_used = np.zeros(new_capacity, dtype=np.float64)
+        last_used[:self.capacity] = self.last_used
+        self.last_used = last_used
+        self.responses.extend([None] * (new_capacity - self.capacity))
+        self.capacity = new_capacity
+
+    def add(self, vector, context, response):
+        """Insert a row, evicting the least recently used one when full"""
+        if self.count == self.capacity and self.capacity < self.max_entries:
+            self._grow()
+        if self.count < self.capacity:
+            row = self.count
+            self.count += 1
+        else:
+            row = int(np.argmin(self.last_used[:self.count]))
+        self.vectors[row] = vector
+        self.contexts[row] = context
+        self.last_used[row] = time.monotonic()
+        self.responses[row] = response
+        return row
+
+    def search(self, vector, context, top_k):
+        """
+        Vectorised cosine top-k among rows with the same context
+
+        :return: List of (row, similarity) pairs, best first
+        """
+        if self.count == 0:
+            return []
+        scores = self.vectors[:self.count] @ vector
+        scores[self.contexts[:self.count] != context] = -np.inf
+        k = min(top_k, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+
+class SemanticCache:
+    """
+    Near-duplicate lookup of completion responses by final user message
+    """
+
+    def __init__(self, threshold=0.92, max_entries=5000, dim=512, top_k=5):
+        """
+        :param threshold: Minimum cosine similarity for a hit
+        :param max_entries: Maximum cached responses per provider/model
+        :param dim: Embedding dimension
+        :param top_k: Candidates returned by each lookup
+        """
+        self.logger = logging.getLogger(__name__)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.top_k = top_k
+        self.embedder = HashedNgramEmbedder(dim)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._counters = {'lookups': 0, 'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._latencies = deque(maxlen=1000)
+
+    @staticmethod
+    def _split(provider_id, model, messages, options):
+        """
+        Split a request into the text to embed and a fingerprint of its context
+
+        :return: (query text, context id) or None if the request cannot be cached
+        """
+        if not messages:
+            return None
+        last = messages[-1]
+        if last.get('role') != 'user' or not isinstance(last.get('content'), str) or not last['content'].strip():
+            return None
+        digest = completion_cache_key(provider_id, model, messages[:-1], options)
+        # Signed 64-bit so it fits the int64 context column
+        return last['content'], int.from_bytes(bytes.fromhex(digest[:16]), 'big', signed=True)
+
+    def lookup(self, provider_id, model, messages, options=None):
+        """
+        Find a cached response for a near-identical request
+
+        :return: (response, similarity) or None
+        """
+        split = self._split(provider_id, model, messages, options)
+        if split is None:
+            return None
+        query, context = split
+
+        started = time.perf_counter()
+        vector = self.embedder.embed(query)
+        with self._lock:
+            index = self._indexes.get((provider_id, model))
+            matches = index.search(vector, context, self.top_k) if index is not None else []
+            best = matches[0] if matches and matches[0][1] >= self.threshold else None
+            if best is not None:
+                index.last_used[best[0]] = time.monotonic()
+                response = index.responses[best[0]]
+            self._counters['lookups'] += 1
+            self._counters['hits' if best is not None else 'misses'] += 1
+            self._latencies.append(time.perf_counter() - started)
+
+        if best is None:
+            return None
+        return response, best[1]
+
+    def store(self, provider_id, model, messages, options, response):
+        """
+        Cache a response under the request's final user message
+        """
+        split = self._split(provider_id, model, messages, options)
+        if split is None:
+            return
+        query, context = split
+        vector = self.embedder.embed(query)
+        with self._lock:
+            index = self._indexes.get((provider_id, model))
+            if index is None:
+                index = self._indexes[(provider_id, model)] = _ModelIndex(self.embedder.dim, self.max_entries)
+            matches = index.search(vector, context, 1)
+            if matches and matches[0][1] >= 0.999:
+                # Same question asked again: refresh the existing row instead of duplicating it
+                row = matches[0][0]
+                index.responses[row] = response
+                index.last_used[row] = time.monotonic()
+            else:
+                if index.count == index.max_entries:
+                    self._counters['evictions'] += 1
+                index.add(vector, context, response)
+            self._counters['stores'] += 1
+
+    def stats(self):
+        """
+        Get cache counters and lookup latency
+
+        :return: Dictionary with hit/miss counts, entries and latency in milliseconds
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = sum(index.count for index in self._indexes.values())
+            latencies = np.array(self._latencies, dtype=np.float64) * 1000
+        stats['hit_ratio'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        stats['lookup_ms'] = {
+            'avg': float(latencies.mean()) if latencies.size else 0.0,
+            'p99': float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+            'max': float(latencies.max()) if latencies.size else 0.0
+        }
+        return stats
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """
+    Get the process-wide semantic cache, or None when it is disabled
+
+    :return: Shared SemanticCache instance or None
+    """
+    global _semantic_cache
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache(
+                    threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+                    max_entries=Config.SEMANTIC_CACHE_MAX_ENTRIES,
+                    dim=Config.SEMANTIC_CACHE_DIM
+                )
+    return _semantic_cache
@@ -0,0 +1,243 @@
+"""
+Single-flight coalescing of identical in-flight completions.
+
+Concurrent requests with the same key attach to one upstream call and share its
+result. For streams, a pump drains the upstream iterator into a buffer; each
+subscriber replays the buffered prefix and then follows the live tail, so late
+joiners see the whole response and a disconnecting client does not cut the
+stream short for the others.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+
+
+class _Flight:
+    """One in-flight synchronous call"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Buffered fan-out of one synchronous stream"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def pump(self, iterator):
+        try:
+            for event in iterator:
+                with self.condition:
+                    self.events.append(event)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.events) and not self.finished:
+                    self.condition.wait()
+                pending = self.events[index:]
+                finished = self.finished
+            for event in pending:
+                yield event
+            index += len(pending)
+            if finished and index >= len(self.events):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class _AsyncBroadcast:
+    """Buffered fan-out of one async stream"""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def pump(self, iterator):
+        try:
+            async for event in iterator:
+                self.events.append(event)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self._notify()
+
+    async def subscribe(self):
+        index = 0
+        while True:
+            if index < len(self.events):
+                yield self.events[index]
+                index += 1
+            elif self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls and streams by key
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._broadcasts = {}
+        self._async_flights = {}
+        self._async_broadcasts = {}
+        self._counters = {'calls': 0, 'coalesced': 0, 'streams': 0, 'stream_joins': 0}
+
+    def do(self, key, fn):
+        """
+        Run fn once for all concurrent callers with the same key
+
+        :param key: Request key, e.g. from completion_cache_key
+        :param fn: Zero-argument callable performing the upstream call
+        :return: (result, leader) where leader is False for coalesced callers
+        :raises Exception: Whatever fn raised, for every caller
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._counters['calls'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = fn()
+            return flight.result, True
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stream(self, key, factory):
+        """
+        Share one upstream stream between all concurrent subscribers with the same key
+
+        :param key: Request key
+        :param factory: Zero-argument callable returning the upstream iterator
+        :return: (iterator, leader) where leader is False for subscribers that joined a running stream
+        """
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._broadcasts[key] = _Broadcast()
+                self._counters['streams'] += 1
+            else:
+                self._counters['stream_joins'] += 1
+
+        if leader:
+            def run():
+                try:
+                    broadcast.pump(factory())
+                finally:
+                    with self._lock:
+                        del self._broadcasts[key]
+
+            # The leader's context goes along, so its trace spans cover the shared call
+            threading.Thread(target=contextvars.copy_context().run, args=(run,), name='single-flight-stream',
+                             daemon=True).start()
+        return broadcast.subscribe(), leader
+
+    async def ado(self, key, coro_factory):
+        """
+        Async variant of do. The upstream call runs as its own task, so a
+        cancelled caller does not cancel it for the others.
+
+        :param key: Request key
+        :param coro_factory: Zero-argument callable returning the upstream coroutine
+        :return: (result, leader)
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        with self._lock:
+            task = self._async_flights.get(flight_key)
+            leader = task is None
+            if leader:
+                task = self._async_flights[flight_key] = loop.create_task(coro_factory())
+                task.add_done_callback(lambda _: self._async_flights.pop(flight_key, None))
+                self._counters['calls'] += 1
+            else:
+                self._counters['coalesced'] += 1
+        return await asyncio.shield(task), leader
+
+    def astream(self, key, factory):
+        """
+        Async variant of stream
+
+        :param key: Request key
+        :param factory: Zero-argument callable returning the upstream async iterator
+        :return: (async iterator, leader)
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        with self._lock:
+            broadcast = self._async_broadcasts.get(flight_key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._async_broadcasts[flight_key] = _AsyncBroadcast()
+                self._counters['streams'] += 1
+            else:
+                self._counters['stream_joins'] += 1
+
+        if leader:
+            task = loop.create_task(broadcast.pump(factory()))
+            task.add_done_callback(lambda _: self._async_broadcasts.pop(flight_key, None))
+        return broadcast.subscribe(), leader
+
+    def stats(self):
+        """
+        Get coalescing counters
+
+        :return: Dictionary with upstream calls, coalesced requests and in-flight counts
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._flights) + len(self._async_flights)
+            stats['streams_in_flight'] = len(self._broadcasts) + len(self._async_broadcasts)
+        requests = stats['calls'] + stats['coalesced']
+        stats['coalesced_ratio'] = stats['coalesced'] / requests if requests else 0.0
+        return stats
+
+
+# Shared by the sync and async request paths
+single_flight = SingleFlight()
@@ -0,0 +1,65 @@
+"""
+Local token estimates.
+
+Vendor tokenizers are not available offline, so token counts are estimated
+from the text: short words count as one token, longer ones as one per four
+characters, and every punctuation mark, digit group and CJK character as one.
+That lands close to BPE tokenizers on English prose and code, erring high,
+the safe side for fitting a context window.
+"""
+import re
+
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'[{_CJK}]|[^\W\d_{_CJK}]+|\d{{1,3}}|[^\w\s]|_')
+
+# Role markers and separators each message adds, and the reply's priming
+MESSAGE_OVERHEAD = 4
+REPLY_PRIMING = 3
+# Low-detail estimate for an image part
+IMAGE_TOKENS = 85
+
+
+def count_tokens(text):
+    """
+    :param text: Any string
+    :return: Estimated number of tokens
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        tokens += 1 if len(piece) <= 6 else (len(piece) + 3) // 4
+    return tokens
+
+
+def message_text(message):
+    """
+    :return: The text of a chat message, joining the text parts of multi-part content
+    """
+    content = message.get('content') if isinstance(message, dict) else None
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return '\n'.join(part.get('text') or '' for part in content if isinstance(part, dict))
+    return ''
+
+
+def count_message_tokens(message):
+    """
+    :param message: Chat message dictionary with 'role' and 'content'
+    :return: Estimated tokens the message takes up in a prompt
+    """
+    tokens = MESSAGE_OVERHEAD + count_tokens(message_text(message))
+    content = message.get('content') if isinstance(message, dict) else None
+    if isinstance(content, list):
+        tokens += IMAGE_TOKENS * sum(1 for part in content
+                                     if isinstance(part, dict) and part.get('type') in ('image_url', 'image'))
+    return tokens
+
+
+def count_prompt_tokens(messages):
+    """
+    :param messages: List of chat message dictionaries
+    :return: Estimated prompt tokens of a chat request
+    """
+    return REPLY_PRIMING + sum(count_message_tokens(message) for message in messages)
@@ -0,0 +1,380 @@
+"""
+Lightweight request tracing.
+
+Each API request opens a root span, continuing the caller's trace when a W3C
+traceparent header is sent, and every response carries its trace id in the
+traceparent and X-Trace-Id headers. Work done for the request (parsing,
+provider resolution, cache lookups, key admission, each upstream attempt with
+its connection and first-token events, serialization) is recorded as child
+spans. Only a TRACE_SAMPLE_RATE share of new traces is recorded; unsampled
+requests still get ids but their spans cost a context variable lookup.
+Finished spans are handed to a background thread that exports them in batches
+as JSON lines to a file or as OTLP/HTTP JSON to a collector.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from app.config import Config
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    """
+    A timed operation within a trace
+    """
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'sampled',
+                 'start_ns', 'end_ns', 'attributes', 'events', 'error', '_token')
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, sampled=True, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.error = None
+        self._token = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        if self.sampled:
+            self.events.append((name, time.time_ns(), attributes))
+
+    def record_error(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                self.tracer.export(self)
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes,
+            'events': [{'name': name, 'time_ns': at, 'attributes': attrs} for name, at, attrs in self.events],
+            'error': self.error
+        }
+
+
+class JsonFileExporter:
+    """
+    Appends finished spans to a file, one JSON object per line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+class OTLPExporter:
+    """
+    Sends finished spans to an OpenTelemetry collector using OTLP/HTTP with JSON encoding
+    """
+
+    def __init__(self, endpoint, service_name='omnichat-backend', timeout=5.0):
+        """
+        :param endpoint: Collector base URL such as http://localhost:4318; /v1/traces is appended
+        """
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def _attributes(values):
+        attributes = []
+        for key, value in values.items():
+            if isinstance(value, bool):
+                wrapped = {'boolValue': value}
+            elif isinstance(value, int):
+                wrapped = {'intValue': str(value)}
+            elif isinstance(value, float):
+                wrapped = {'doubleValue': value}
+            else:
+                wrapped = {'stringValue': str(value)}
+            attributes.append({'key': key, 'value': wrapped})
+        return attributes
+
+    def _span(self, span):
+        encoded = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 2 if span.parent_id is None else 1,  # SERVER for roots, INTERNAL otherwise
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': self._attributes(span.attributes),
+            'events': [{'name': name, 'timeUnixNano': str(at), 'attributes': self._attributes(attrs)}
+                       for name, at, attrs in span.events],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+        }
+        if span.parent_id:
+            encoded['parentSpanId'] = span.parent_id
+        return encoded
+
+    def export(self, spans):
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': self._attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [self._span(span) for span in spans]}]
+        }]}
+        response = requests.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class Tracer:
+    """
+    Creates spans and exports the sampled ones from a background thread
+    """
+
+    def __init__(self, exporter=None, sample_rate=1.0, batch_size=256, flush_interval=2.0, max_queue=10000):
+        """
+        :param exporter: Object with export(spans), or None to record nothing
+        :param sample_rate: Share of new traces recorded, 0 to 1; incoming traceparent flags take precedence
+        :param batch_size: Spans sent to the exporter at once
+        :param flush_interval: Seconds a partial batch waits before it is exported
+        :param max_queue: Finished spans buffered before new ones are dropped
+        """
+        self.logger = logging.getLogger(__name__)
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @staticmethod
+    def current():
+        """
+        :return: The span active in this context, or None
+        """
+        return _current_span.get()
+
+    def start_trace(self, name, traceparent=None, **attributes):
+        """
+        Open the root span of a request and make it current
+
+        :param traceparent: Incoming W3C traceparent header to continue, if any
+        :return: Span; call finish_trace with it once the request is done
+        """
+        match = TRACEPARENT_RE.match((traceparent or '').strip().lower())
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            sampled = self.exporter is not None and bool(int(flags, 16) & 1)
+        else:
+            trace_id, parent_id = _new_id(16), None
+            sampled = self.exporter is not None and random.random() < self.sample_rate
+        span = Span(self, name, trace_id, parent_id, sampled, attributes)
+        span._token = _current_span.set(span)
+        return span
+
+    def finish_trace(self, span, error=None):
+        if error is not None:
+            span.record_error(error)
+        self._detach(span)
+        span.end()
+
+    @staticmethod
+    def _detach(span):
+        # Stop the span being current without ending it
+        if span._token is not None:
+            try:
+                _current_span.reset(span._token)
+            except ValueError:
+                # Finished from a different context, e.g. after a streamed response
+                pass
+            span._token = None
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Record a child of the current span; does nothing outside a sampled trace
+
+        :return: Context manager yielding the Span, or None when not recording
+        """
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            yield None
+            return
+        span = Span(self, name, parent.trace_id, parent.span_id, True, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            if isinstance(e, Exception):
+                span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            self.logger.warning(f"Could not export {len(batch)} spans: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until every queued span has been exported
+
+        :return: True if the queue drained within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def init_app(self, app):
+        """
+        Open a root span for every Flask request and return its trace id in the response headers.
+        Streamed responses end their span when the stream closes.
+        """
+        from flask import g, request
+
+        @app.before_request
+        def _start_trace():
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            g._trace_span = self.start_trace(f"{request.method} {rule}", request.headers.get('traceparent'),
+                                             **{'http.method': request.method, 'http.route': rule})
+
+        @app.after_request
+        def _trace_headers(response):
+            span = g.get('_trace_span')
+            if span is not None:
+                span.set_attribute('http.status_code', response.status_code)
+                response.headers['traceparent'] = span.traceparent
+                response.headers['X-Trace-Id'] = span.trace_id
+                # The server closes the response once the last chunk of the body is sent
+                response.call_on_close(span.end)
+                g._trace_ends_on_close = True
+            return response
+
+        @app.teardown_request
+        def _finish_trace(exc):
+            span = g.pop('_trace_span', None)
+            if span is None:
+                return
+            if exc is None and g.pop('_trace_ends_on_close', False):
+                self._detach(span)
+            else:
+                self.finish_trace(span, exc)
+
+
+def trace_span(name, **attributes):
+    """
+    Record a child span of the current request on the shared tracer
+
+    :return: Context manager yielding the Span, or None when not recording
+    """
+    return get_tracer().span(name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def trace_event(name, **attributes):
+    """Mark a point in time on the current span, if one is being recorded"""
+    span = _current_span.get()
+    if span is not None:
+        span.add_event(name, **attributes)
+
+
+def _configured_exporter():
+    if Config.TRACE_EXPORTER == 'file':
+        return JsonFileExporter(Config.TRACE_FILE)
+    if Config.TRACE_EXPORTER == 'otlp':
+        return OTLPExporter(Config.TRACE_OTLP_ENDPOINT, Config.TRACE_SERVICE_NAME)
+    return None
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    Get the process-wide tracer, exporting as TRACE_EXPORTER configures
+
+    :return: Shared Tracer instance
+    """
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(_configured_exporter(), sample_rate=Config.TRACE_SAMPLE_RATE)
+    return _tracer
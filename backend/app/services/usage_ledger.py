@@ -0,0 +1,492 @@
+"""
+Usage ledger.
+
+Every upstream completion call is recorded with its prompt and completion
+tokens, latency and estimated cost, keyed by provider, model, user (from the
+USAGE_USER_HEADER request header) and API key (by fingerprint). Calls whose
+vendor reports no usage, such as streams cut short, are counted with the
+local token estimator and flagged as estimated.
+
+Recording only appends to a queue; a background thread writes the raw rows in
+batches and, in the same transaction, adds them to per-minute, per-hour and
+per-day rollups. Range queries are split into whole days, then whole hours,
+then the minutes at either end, so a quota check or a dashboard over months
+reads a few hundred pre-aggregated rows rather than every raw one.
+"""
+import contextvars
+import datetime
+import logging
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from sqlalchemy import select, update, delete, func, and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from app.config import Config
+from app.models import init_engine
+from app.models.db_models import UsageRecord, UsageRollup
+from app.services.tokens import count_prompt_tokens, count_tokens
+
+GRANULARITIES = {
+    'minute': datetime.timedelta(minutes=1),
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1)
+}
+# Query names of the dimensions usage can be filtered and grouped by
+DIMENSIONS = {'provider': 'provider_id', 'model': 'model', 'user': 'user_id', 'key': 'key_id'}
+ROLLUP_FIELDS = ('requests', 'errors', 'estimated', 'prompt_tokens', 'completion_tokens', 'latency_ms', 'cost')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+_RELATIVE_RE = re.compile(r'^(\d+)([mhd])$')
+_RELATIVE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# USD per million (prompt, completion) tokens at list price; USAGE_PRICES overrides or adds models
+MODEL_PRICES = {
+    ('groq', 'llama-3.1-8b-instant'): (0.05, 0.08),
+    ('groq', 'llama-3.3-70b-versatile'): (0.59, 0.79),
+    ('openai', 'gpt-4o-mini'): (0.15, 0.60),
+    ('openai', 'gpt-4o'): (2.50, 10.00),
+    ('openai', 'gpt-4.1-mini'): (0.40, 1.60),
+    ('deepseek', 'deepseek-chat'): (0.27, 1.10),
+    ('alibaba', 'qwen-turbo'): (0.05, 0.20),
+    ('alibaba', 'qwen-plus'): (0.40, 1.20),
+    ('xai', 'grok-2-latest'): (2.00, 10.00),
+    ('xai', 'grok-2-vision-latest'): (2.00, 10.00),
+}
+
+# One call as queued for the writer
+UsageEntry = namedtuple('UsageEntry', 'created_at provider_id model user_id key_id prompt_tokens '
+                                      'completion_tokens latency_ms cost estimated error')
+
+_current_user = contextvars.ContextVar('usage_user', default=None)
+# Provider id to API key fingerprint of the upstream call being made in this context
+_call_keys = contextvars.ContextVar('usage_keys', default=None)
+
+
+def note_key(provider_id, key_id):
+    """
+    Attribute the current upstream call to an API key; called by providers once they know the key
+
+    :param key_id: Fingerprint prefix of the key, as listed by GET /api/providers/keys
+    """
+    keys = _call_keys.get()
+    if keys is not None:
+        keys[provider_id] = key_id
+
+
+def parse_prices(spec):
+    """
+    Parse prices such as "openai:gpt-4o=2.5/10,groq:llama-3.1-8b-instant=0.05/0.08"
+
+    :param spec: Comma separated provider:model=prompt/completion USD per million tokens
+    :return: Dictionary of (provider id, model) to (prompt, completion) prices
+    """
+    prices = {}
+    for item in (spec or '').split(','):
+        key, _, value = item.partition('=')
+        provider_id, _, model = key.strip().partition(':')
+        prompt, _, completion = value.partition('/')
+        try:
+            price = (float(prompt), float(completion or prompt))
+        except ValueError:
+            continue
+        if provider_id and model:
+            prices[(provider_id.lower(), model)] = price
+    return prices
+
+
+def truncate(moment, granularity):
+    """
+    :return: Start of the minute, hour or day moment falls in
+    """
+    if granularity == 'minute':
+        return moment.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil(moment, granularity):
+    start = truncate(moment, granularity)
+    return start if start == moment else start + GRANULARITIES[granularity]
+
+
+def cover(start, end, levels=('day', 'hour', 'minute')):
+    """
+    Split a minute-aligned range into the fewest rollup buckets: whole days, then whole hours, then minutes
+
+    :return: List of (granularity, start, end) ranges of bucket starts, end exclusive
+    """
+    if start >= end:
+        return []
+    granularity = levels[0]
+    if len(levels) == 1:
+        return [(granularity, start, end)]
+    first, last = _ceil(start, granularity), truncate(end, granularity)
+    if first >= last:
+        return cover(start, end, levels[1:])
+    return cover(start, first, levels[1:]) + [(granularity, first, last)] + cover(last, end, levels[1:])
+
+
+def parse_time(value, now=None):
+    """
+    :param value: ISO 8601 time, or a time ago such as "30m", "24h" or "7d"
+    :return: Naive UTC datetime, or None if value is empty
+    :raises ValueError: If value is neither
+    """
+    if not value:
+        return None
+    now = now or datetime.datetime.utcnow()
+    match = _RELATIVE_RE.match(value.strip())
+    if match:
+        return now - datetime.timedelta(**{_RELATIVE_UNITS[match.group(2)]: int(match.group(1))})
+    try:
+        moment = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}. Expected ISO 8601 or an age such as 24h")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def estimate_usage(messages, text, usage=None):
+    """
+    Fill in the token counts a vendor did not report.
+    A reported total is kept, split with the prompt estimate if the vendor gave no breakdown.
+
+    :param messages: Messages the call was sent
+    :param text: Completion text received
+    :param usage: Usage as reported, possibly None or partial
+    :return: (usage dictionary with prompt/completion/total tokens, True if any count was estimated)
+    """
+    usage = usage or {}
+    prompt_tokens = usage.get('prompt_tokens')
+    completion_tokens = usage.get('completion_tokens')
+    total_tokens = usage.get('total_tokens')
+    estimated = prompt_tokens is None or completion_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = count_prompt_tokens(messages)
+        if total_tokens is not None:
+            prompt_tokens = min(prompt_tokens, total_tokens - (completion_tokens or 0))
+    if completion_tokens is None:
+        completion_tokens = total_tokens - prompt_tokens if total_tokens is not None else count_tokens(text)
+    return dict(usage, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens), estimated
+
+
+def _row(row, names):
+    result = {name: getattr(row, name) for name in names}
+    for field in ROLLUP_FIELDS:
+        result[field] = getattr(row, field) or 0
+    result['total_tokens'] = result['prompt_tokens'] + result['completion_tokens']
+    result['avg_latency_ms'] = round(result['latency_ms'] / result['requests'], 1) if result['requests'] else None
+    result['latency_ms'] = round(result['latency_ms'], 1)
+    result['cost'] = round(result['cost'], 6)
+    return result
+
+
+class UsageLedger:
+    """
+    Records usage off the request path and answers aggregate queries from rollups
+    """
+
+    def __init__(self, sessions, prices=None, batch_size=None, flush_interval=None, max_queue=None,
+                 retention_days=None):
+        """
+        :param sessions: Session factory, such as the scoped_session from app.models.init_engine
+        :param prices: Dictionary of (provider id, model) to USD per million prompt/completion tokens,
+                       on top of MODEL_PRICES
+        :param batch_size: Calls written in one transaction
+        :param flush_interval: Seconds a partial batch waits before it is written
+        :param max_queue: Calls buffered before new ones are dropped
+        :param retention_days: Days raw rows are kept, 0 to keep them forever; rollups are always kept
+        """
+        self.logger = logging.getLogger(__name__)
+        self.sessions = sessions
+        self.prices = dict(MODEL_PRICES)
+        self.prices.update(prices if prices is not None else parse_prices(Config.USAGE_PRICES))
+        self.batch_size = batch_size or Config.USAGE_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else Config.USAGE_FLUSH_INTERVAL
+        self.retention_days = retention_days if retention_days is not None else Config.USAGE_RETENTION_DAYS
+        self._queue = queue.Queue(maxsize=max_queue or Config.USAGE_MAX_QUEUE)
+        self._worker = None
+        self._lock = threading.Lock()
+        self._pruned = 0.0
+        self._counters = {'recorded': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    @contextmanager
+    def _session(self):
+        session = self.sessions()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def cost(self, provider_id, model, prompt_tokens, completion_tokens):
+        """
+        :return: Estimated USD cost of a call, 0 for models without a known price
+        """
+        prompt_price, completion_price = self.prices.get((provider_id, model), (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    @staticmethod
+    def attribute():
+        """
+        Start collecting the API keys of an upstream call made in this context
+
+        :return: Dictionary of provider id to key fingerprint, filled in by note_key
+        """
+        keys = {}
+        _call_keys.set(keys)
+        return keys
+
+    def record(self, provider_id, model, usage=None, latency=0.0, estimated=False, error=False, keys=None):
+        """
+        Queue one upstream call for writing; never blocks
+
+        :param usage: Dictionary with prompt_tokens and completion_tokens
+        :param latency: Seconds the call took
+        :param estimated: The token counts were estimated locally
+        :param error: The call failed
+        :param keys: Dictionary from attribute()
+        """
+        usage = usage or {}
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        entry = UsageEntry(
+            datetime.datetime.utcnow(), provider_id, model or '', (_current_user.get() or '')[:128],
+            (keys or {}).get(provider_id, ''), prompt_tokens, completion_tokens, latency * 1000,
+            self.cost(provider_id, model, prompt_tokens, completion_tokens), estimated, error
+        )
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._counters['dropped'] += 1
+            return
+        with self._lock:
+            self._counters['recorded'] += 1
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='usage-ledger', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch, attempts=3):
+        """
+        Insert a batch of calls and add them to the rollups in one transaction.
+        Another worker creating the same rollup row first makes the insert conflict; the batch is then retried.
+        """
+        for attempt in range(attempts):
+            try:
+                with self._session() as session:
+                    session.add_all(UsageRecord(
+                        created_at=entry.created_at, provider_id=entry.provider_id, model=entry.model,
+                        user_id=entry.user_id, key_id=entry.key_id, prompt_tokens=entry.prompt_tokens,
+                        completion_tokens=entry.completion_tokens, latency_ms=entry.latency_ms, cost=entry.cost,
+                        estimated=entry.estimated, error=entry.error) for entry in batch)
+                    self._rollup(session, batch)
+                    self._prune(session)
+                with self._lock:
+                    self._counters['written'] += len(batch)
+                    self._counters['batches'] += 1
+                return
+            except IntegrityError:
+                if attempt + 1 < attempts:
+                    continue
+                error = "conflicting rollup writes"
+            except Exception as e:
+                error = e
+            self.logger.warning(f"Could not write {len(batch)} usage records: {error}")
+            with self._lock:
+                self._counters['failed'] += len(batch)
+            return
+
+    @staticmethod
+    def _rollup(session, batch):
+        sums = {}
+        for entry in batch:
+            values = (1, int(entry.error), int(entry.estimated), entry.prompt_tokens, entry.completion_tokens,
+                      entry.latency_ms, entry.cost)
+            dimensions = (entry.provider_id, entry.model, entry.user_id, entry.key_id)
+            for granularity in GRANULARITIES:
+                key = (granularity, truncate(entry.created_at, granularity)) + dimensions
+                totals = sums.setdefault(key, [0] * len(ROLLUP_FIELDS))
+                for i, value in enumerate(values):
+                    totals[i] += value
+
+        # Increment in SQL so concurrent writers add to the row instead of overwriting each other's sums
+        for key, totals in sums.items():
+            granularity, bucket, provider_id, model, user_id, key_id = key
+            updated = session.execute(update(UsageRollup).where(
+                UsageRollup.granularity == granularity, UsageRollup.bucket == bucket,
+                UsageRollup.provider_id == provider_id, UsageRollup.model == model,
+                UsageRollup.user_id == user_id, UsageRollup.key_id == key_id
+            ).values({getattr(UsageRollup, field): getattr(UsageRollup, field) + value
+                      for field, value in zip(ROLLUP_FIELDS, totals)}))
+            if updated.rowcount == 0:
+                session.add(UsageRollup(granularity=granularity, bucket=bucket, provider_id=provider_id, model=model,
+                                        user_id=user_id, key_id=key_id, **dict(zip(ROLLUP_FIELDS, totals))))
+
+    def _prune(self, session):
+        """Delete raw rows past the retention period, at most once an hour"""
+        now = time.monotonic()
+        if not self.retention_days or now - self._pruned < 3600:
+            return
+        self._pruned = now
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.retention_days)
+        session.execute(delete(UsageRecord).where(UsageRecord.created_at < cutoff))
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until every queued call has been written
+
+        :return: True if the queue drained within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    @staticmethod
+    def _dimensions(names, what):
+        names = [name for name in names or () if name]
+        unknown = [name for name in names if name not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Invalid {what}: {', '.join(unknown)}. Expected any of {', '.join(DIMENSIONS)}")
+        return names
+
+    def _query(self, segments, group_by, filters, by_bucket=False):
+        group_by = self._dimensions(group_by, 'group_by')
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        self._dimensions(filters, 'filter')
+        if not segments:
+            return []
+        columns = [getattr(UsageRollup, DIMENSIONS[name]).label(name) for name in group_by]
+        if by_bucket:
+            columns.insert(0, UsageRollup.bucket.label('bucket'))
+        statement = select(*columns, *(func.sum(getattr(UsageRollup, field)).label(field)
+                                       for field in ROLLUP_FIELDS))
+        statement = statement.where(or_(*(
+            and_(UsageRollup.granularity == granularity, UsageRollup.bucket >= start, UsageRollup.bucket < end)
+            for granularity, start, end in segments)))
+        for name, value in filters.items():
+            statement = statement.where(getattr(UsageRollup, DIMENSIONS[name]) == value)
+        if columns:
+            statement = statement.group_by(*columns).order_by(*columns)
+        names = (['bucket'] if by_bucket else []) + group_by
+        with self._session() as session:
+            rows = [_row(row, names) for row in session.execute(statement)]
+        if by_bucket:
+            for row in rows:
+                row['bucket'] = row['bucket'].isoformat()
+        return rows
+
+    @staticmethod
+    def _end(until, granularity):
+        """Exclusive end bucket of a range ending at until, or including the current bucket"""
+        if until is not None:
+            return _ceil(until, granularity)
+        return truncate(datetime.datetime.utcnow(), granularity) + GRANULARITIES[granularity]
+
+    def totals(self, since=None, until=None, group_by=(), **filters):
+        """
+        Usage summed over a time range, at minute precision
+
+        :param since: Start of the range (naive UTC datetime), or None for all recorded usage
+        :param until: End of the range, exclusive, or None for now
+        :param group_by: Dimension names from DIMENSIONS to break the totals down by
+        :param filters: Dimension names with the value to keep, e.g. user='alice'
+        :return: List of dictionaries with the group_by dimensions, requests, errors, estimated,
+                 prompt/completion/total tokens, latency_ms, avg_latency_ms and cost
+        :raises ValueError: If a dimension name is unknown
+        """
+        start = truncate(since, 'minute') if since is not None else EPOCH
+        end = self._end(until, 'minute')
+        return self._query(cover(start, end), group_by, filters)
+
+    def series(self, granularity, since, until=None, group_by=(), **filters):
+        """
+        Usage per minute, hour or day over a time range
+
+        :return: List of dictionaries like totals, with the 'bucket' start, ordered by bucket
+        :raises ValueError: If granularity or a dimension name is unknown
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Invalid granularity: {granularity}. Expected one of {', '.join(GRANULARITIES)}")
+        end = self._end(until, granularity)
+        return self._query([(granularity, truncate(since, granularity), end)], group_by, filters, by_bucket=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, queued=self._queue.qsize())
+
+    def init_app(self, app):
+        """
+        Attribute the usage of every Flask request to the user named in USAGE_USER_HEADER
+        """
+        from flask import g, request
+
+        @app.before_request
+        def _identify_user():
+            g._usage_user_token = _current_user.set(request.headers.get(Config.USAGE_USER_HEADER))
+
+        @app.teardown_request
+        def _forget_user(exc):
+            token = g.pop('_usage_user_token', None)
+            if token is not None:
+                try:
+                    _current_user.reset(token)
+                except ValueError:
+                    # Torn down from a different context, e.g. after a streamed response
+                    pass
+
+
+def set_current_user(user_id):
+    """
+    Attribute usage in this context to a user, for entry points that bypass Flask
+
+    :return: Token for contextvars reset
+    """
+    return _current_user.set(user_id)
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """
+    Get the process-wide usage ledger, connecting to SQLALCHEMY_DATABASE_URI on first use
+
+    :return: Shared UsageLedger instance
+    """
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger(init_engine(Config.SQLALCHEMY_DATABASE_URI))
+    return _ledger
@@ -1,6 +1,7 @@
 """
 utils.py - Common backend utility functions for error handling and response formatting
 """
+import json
 from flask import jsonify
 
 def error_response(message, status=400):
@@ -10,3 +11,22 @@ def error_response(message, status=400):
 def success_response(data, status=200):
     """Return a standardized success response."""
     return jsonify(data), status
+
+# Headers that stop proxies and the browser from buffering an SSE stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+def sse_event(data, event=None):
+    """Format data as a Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return f"{frame}data: {json.dumps(data)}\n\n"
+
+def stream_event_to_sse(chunk):
+    """Convert a provider stream event (or raw text chunk) into an SSE frame."""
+    if isinstance(chunk, dict):
+        if chunk.get("type") == "delta":
+            return sse_event({"text": chunk["text"]})
+        return sse_event({k: v for k, v in chunk.items() if k != "type"}, event=chunk.get("type"))
+    return sse_event({"text": chunk})
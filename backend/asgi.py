@@ -0,0 +1,7 @@
+from dotenv import load_dotenv
+load_dotenv() # Load environment variables from .env file
+
+from app import create_asgi_app
+
+# Serve with: uvicorn asgi:app --host 0.0.0.0 --port 5000
+app = create_asgi_app()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark.
+Starts the mock provider from mock_provider.py, starts the backend (gunicorn
+for the Flask app or uvicorn for the ASGI app) with groq, openai and alibaba
+pointed at the mock, then drives /api/chat/completions and /api/chat/stream at
+increasing concurrency. Each level reports requests per second, p50/p95/p99
+latency, time to first token, and the server's CPU and RSS. Results are
+written as JSON and CSV; --baseline compares them with an earlier run and fails
+on regressions.
+"""
+
+import os
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+import logging
+import platform
+import subprocess
+import threading
+from datetime import datetime, timezone
+
+import requests
+
+# Ensure the script can find the app module
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from scripts.mock_provider import MockProviderServer, MockSettings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDERS = ("groq", "openai", "alibaba")
+ENDPOINTS = {"completions": "/api/chat/completions", "stream": "/api/chat/stream"}
+SERVER_COMMANDS = {
+    "flask": ["gunicorn", "--bind", "127.0.0.1:{port}", "--workers", "{workers}",
+              "--worker-class", "gthread", "--threads", "{threads}", "run:app"],
+    "asgi": ["uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", "{port}", "--workers", "{workers}",
+             "--no-access-log"],
+}
+# Metrics where a higher value is worse, compared against a baseline
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "ttft_p95_ms", "cpu_percent", "rss_max_mb")
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile
+
+    :param values: Numbers, in any order
+    :param q: Percentile between 0 and 100
+    :return: The percentile, or None for no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class ProcessSampler:
+    """
+    Samples CPU time and resident memory of a process and its descendants from /proc.
+    Reports None on platforms without /proc.
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._rss_max = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def available():
+        return os.path.isdir("/proc/self")
+
+    def _processes(self):
+        """Map of pid to (parent pid, cpu seconds, rss bytes) for every readable process"""
+        processes = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces; fields resume after its closing parenthesis
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            cpu = (int(fields[11]) + int(fields[12])) / self._ticks
+            processes[int(entry)] = (int(fields[1]), cpu, int(fields[21]) * self._page_size)
+        return processes
+
+    def snapshot(self):
+        """
+        :return: (cpu seconds, rss bytes) summed over the process tree, or (None, None)
+        """
+        if not self.available():
+            return None, None
+        processes = self._processes()
+        tree, frontier = set(), {self.pid}
+        while frontier:
+            tree |= frontier
+            frontier = {pid for pid, (ppid, _, _) in processes.items() if ppid in frontier} - tree
+        members = [processes[pid] for pid in tree if pid in processes]
+        return sum(cpu for _, cpu, _ in members), sum(rss for _, _, rss in members)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            _, rss = self.snapshot()
+            if rss:
+                self._rss_max = max(self._rss_max, rss)
+
+    def start(self):
+        self._rss_max = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="process-sampler", daemon=True)
+        self._thread.start()
+        return self.snapshot()[0]
+
+    def stop(self):
+        """
+        :return: Highest RSS in bytes seen since start, or None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        _, rss = self.snapshot()
+        return max(self._rss_max, rss or 0) or None
+
+
+def build_payload(index, providers, model, max_tokens):
+    """Request body for the index-th request; prompts differ so requests are not coalesced"""
+    return {
+        "provider": providers[index % len(providers)],
+        "model": model,
+        "messages": [{"role": "user", "content": f"Benchmark request {index}: say something."}],
+        "options": {"max_tokens": max_tokens},
+        "cache": "bypass",
+        "hedge": False
+    }
+
+
+def _completion(session, url, payload, timeout):
+    started = time.perf_counter()
+    response = session.post(url, json=payload, timeout=timeout)
+    latency = time.perf_counter() - started
+    return {"ok": response.status_code == 200, "status": response.status_code, "latency": latency, "ttft": None}
+
+
+def _stream(session, url, payload, timeout):
+    started = time.perf_counter()
+    ttft, ok = None, False
+    with session.post(url, json=payload, timeout=timeout, stream=True) as response:
+        ok = response.status_code == 200
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                if event == "error":
+                    ok = False
+                elif ttft is None and event is None:
+                    ttft = time.perf_counter() - started
+            elif not line:
+                event = None
+        status = response.status_code
+    return {"ok": ok and ttft is not None, "status": status, "latency": time.perf_counter() - started, "ttft": ttft}
+
+
+def run_level(base_url, endpoint, concurrency, duration, providers, model, max_tokens, timeout=60.0):
+    """
+    Keep `concurrency` requests in flight against one endpoint for `duration` seconds
+
+    :return: (list of per-request results, wall-clock seconds)
+    """
+    url = base_url + ENDPOINTS[endpoint]
+    send = _stream if endpoint == "stream" else _completion
+    results, lock = [], threading.Lock()
+    counter = iter(range(10 ** 9))
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                with lock:
+                    index = next(counter)
+                try:
+                    result = send(session, url, build_payload(index, providers, model, max_tokens), timeout)
+                except requests.RequestException as e:
+                    result = {"ok": False, "status": type(e).__name__, "latency": None, "ttft": None}
+                with lock:
+                    results.append(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall, cpu_seconds=None, rss_max=None):
+    """
+    :return: Dictionary of throughput, latency percentiles, error counts and resource use for one level
+    """
+    latencies = [r["latency"] * 1000 for r in results if r["ok"]]
+    ttfts = [r["ttft"] * 1000 for r in results if r["ok"] and r["ttft"] is not None]
+    errors = {}
+    for result in results:
+        if not result["ok"]:
+            errors[str(result["status"])] = errors.get(str(result["status"]), 0) + 1
+
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    return {
+        "requests": len(results),
+        "errors": sum(errors.values()),
+        "errors_by_status": errors,
+        "rps": rounded(len(latencies) / wall if wall else 0.0),
+        "p50_ms": rounded(percentile(latencies, 50)),
+        "p95_ms": rounded(percentile(latencies, 95)),
+        "p99_ms": rounded(percentile(latencies, 99)),
+        "ttft_p50_ms": rounded(percentile(ttfts, 50)),
+        "ttft_p95_ms": rounded(percentile(ttfts, 95)),
+        "cpu_percent": rounded(cpu_seconds / wall * 100) if cpu_seconds is not None and wall else None,
+        "rss_max_mb": rounded(rss_max / 2 ** 20) if rss_max else None
+    }
+
+
+def compare(baseline, current, max_regression):
+    """
+    Find metrics that got worse than the baseline by more than max_regression percent
+
+    :param baseline: Earlier results document
+    :param current: Results document of this run
+    :return: List of human-readable regression descriptions
+    """
+    previous = {(level["endpoint"], level["concurrency"]): level for level in baseline.get("levels", [])}
+    regressions = []
+    for level in current["levels"]:
+        before = previous.get((level["endpoint"], level["concurrency"]))
+        if before is None:
+            continue
+        label = f"{level['endpoint']}@{level['concurrency']}"
+        checks = [(metric, before.get(metric), level.get(metric), True) for metric in LOWER_IS_BETTER]
+        checks.append(("rps", before.get("rps"), level.get("rps"), False))
+        for metric, old, new, lower_is_better in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            if (change if lower_is_better else -change) > max_regression:
+                regressions.append(f"{label} {metric}: {old} -> {new} ({change:+.1f}%)")
+    return regressions
+
+
+def write_results(document, output_dir):
+    """
+    Write the results as JSON and as one CSV row per endpoint and concurrency level
+
+    :return: (json path, csv path)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, f"benchmark-{document['started_at'].replace(':', '').replace('-', '')}")
+    with open(stem + ".json", "w") as f:
+        json.dump(document, f, indent=2)
+    columns = ["endpoint", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+               "ttft_p50_ms", "ttft_p95_ms", "cpu_percent", "rss_max_mb"]
+    with open(stem + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(document["levels"])
+    return stem + ".json", stem + ".csv"
+
+
+def format_level(level):
+    def value(key, unit=""):
+        return "-" if level.get(key) is None else f"{level[key]}{unit}"
+    return (f"{level['endpoint']:<11} c={level['concurrency']:<4} rps={value('rps'):<8} "
+            f"p50={value('p50_ms', 'ms'):<10} p95={value('p95_ms', 'ms'):<10} p99={value('p99_ms', 'ms'):<10} "
+            f"ttft95={value('ttft_p95_ms', 'ms'):<10} errors={level['errors']:<5} "
+            f"cpu={value('cpu_percent', '%'):<8} rss={value('rss_max_mb', 'MB')}")
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def server_environment(mock_url, providers):
+    """Environment for the backend under test: every provider on the mock, side paths switched off"""
+    env = dict(os.environ)
+    for provider_id in providers:
+        env[f"{provider_id.upper()}_API_KEY"] = "mock-key"
+    env.update({
+        "PROVIDER_BASE_URLS": ",".join(f"{provider_id}={mock_url}" for provider_id in providers),
+        "PROVIDER_RATE_LIMITS": "",
+        "RESPONSE_CACHE_ENABLED": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "HEDGE_ENABLED": "false",
+        "MODEL_REFRESH_ENABLED": "false",
+        "TRACE_EXPORTER": "",
+        "USAGE_LEDGER_ENABLED": "false",
+    })
+    return env
+
+
+def start_server(kind, port, workers, threads, env, ready_timeout=30.0):
+    """
+    Start the backend and wait until it answers
+
+    :return: subprocess.Popen of the server
+    :raises RuntimeError: If the server exits or does not answer within ready_timeout
+    """
+    command = [part.format(port=port, workers=workers, threads=threads) for part in SERVER_COMMANDS[kind]]
+    logger.info(f"Starting backend: {' '.join(command)}")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/providers", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Backend did not answer within {ready_timeout:.0f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chat API against a mock provider")
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="asgi",
+                        help="Backend to start (default: asgi)")
+    parser.add_argument("--url", help="Benchmark an already running backend instead of starting one; "
+                                      "it must be configured for the mock provider itself")
+    parser.add_argument("--port", type=int, default=5099, help="Port of the started backend")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=64, help="gunicorn threads per worker (flask)")
+    parser.add_argument("--concurrency", default="1,8,32,64",
+                        help="Comma-separated concurrency levels (default: 1,8,32,64)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per level (default: 10)")
+    parser.add_argument("--endpoints", default="completions,stream")
+    parser.add_argument("--providers", default=",".join(DEFAULT_PROVIDERS))
+    parser.add_argument("--model", default="mock-small")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--mock-port", type=int, default=0, help="Port of the mock provider (default: any)")
+    parser.add_argument("--mock-latency-ms", type=float, default=MockSettings.latency_ms)
+    parser.add_argument("--mock-jitter-ms", type=float, default=MockSettings.jitter_ms)
+    parser.add_argument("--mock-tokens-per-second", type=float, default=MockSettings.tokens_per_second)
+    parser.add_argument("--mock-error-rate", type=float, default=MockSettings.error_rate)
+    parser.add_argument("--mock-error-status", type=int, default=MockSettings.error_status)
+    parser.add_argument("--output-dir", default=os.path.join(BACKEND_DIR, "benchmarks", "results"))
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="Percent a metric may worsen against the baseline (default: 10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    providers = [p.strip() for p in args.providers.split(",") if p.strip()]
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    settings = MockSettings(latency_ms=args.mock_latency_ms, jitter_ms=args.mock_jitter_ms,
+                            tokens_per_second=args.mock_tokens_per_second, output_tokens=args.max_tokens,
+                            error_rate=args.mock_error_rate, error_status=args.mock_error_status)
+    mock = MockProviderServer(port=args.mock_port, settings=settings).start()
+    logger.info(f"Mock provider at {mock.base_url}")
+
+    process, sampler = None, None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            process = start_server(args.server, args.port, args.workers, args.threads,
+                                   server_environment(mock.base_url, providers))
+            base_url = f"http://127.0.0.1:{args.port}"
+            if ProcessSampler.available():
+                sampler = ProcessSampler(process.pid)
+
+        document = {
+            "started_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": "external" if args.url else args.server,
+            "workers": args.workers,
+            "providers": providers,
+            "mock": vars(settings),
+            "duration": args.duration,
+            "levels": []
+        }
+        for endpoint in endpoints:
+            for concurrency in levels:
+                cpu_before = sampler.start() if sampler else None
+                results, wall = run_level(base_url, endpoint, concurrency, args.duration, providers,
+                                          args.model, args.max_tokens)
+                rss_max = sampler.stop() if sampler else None
+                cpu_seconds = sampler.snapshot()[0] - cpu_before if sampler and cpu_before is not None else None
+                level = dict(endpoint=endpoint, concurrency=concurrency,
+                             **summarize(results, wall, cpu_seconds, rss_max))
+                document["levels"].append(level)
+                logger.info(format_level(level))
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mock.stop()
+
+    json_path, csv_path = write_results(document, args.output_dir)
+    logger.info(f"Results written to {json_path} and {csv_path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), document, args.max_regression)
+        for regression in regressions:
+            logger.warning(f"Regression: {regression}")
+        if regressions:
+            return 1
+        logger.info(f"No regressions beyond {args.max_regression:.0f}% against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
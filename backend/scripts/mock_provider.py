@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-compatible provider for load tests.
+Serves /v1/chat/completions (JSON and SSE streams) and /v1/models with a
+configurable time to first token, token rate and injected errors, so the
+backend can be benchmarked without calling a vendor. Point providers at it with
+PROVIDER_BASE_URLS=groq=http://127.0.0.1:9100/v1,openai=http://127.0.0.1:9100/v1
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+from dataclasses import dataclass, asdict
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+MODELS = ["mock-small", "mock-large"]
+
+
+@dataclass
+class MockSettings:
+    """Behaviour of the mock provider"""
+    latency_ms: float = 200.0          # Time to first token, or to the response without streaming
+    jitter_ms: float = 0.0             # Uniform random extra latency
+    tokens_per_second: float = 200.0   # 0 sends all tokens at once
+    output_tokens: int = 64            # Capped by the request's max_tokens
+    error_rate: float = 0.0            # Share of requests answered with error_status
+    error_status: int = 503
+    retry_after: Optional[float] = None  # Retry-After sent with injected errors
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": model, "object": "model"} for model in MODELS]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        settings = self.settings
+        self.server.count_request()
+        time.sleep((settings.latency_ms + random.uniform(0, settings.jitter_ms)) / 1000)
+        if settings.error_rate and random.random() < settings.error_rate:
+            headers = {"Retry-After": str(settings.retry_after)} if settings.retry_after is not None else None
+            self._send_json(settings.error_status, {"error": {"message": "Injected error"}}, headers)
+            return
+
+        tokens = min(settings.output_tokens, payload.get("max_tokens") or settings.output_tokens)
+        prompt_chars = sum(len(m.get("content") or "") for m in payload.get("messages") or []
+                           if isinstance(m.get("content"), str))
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": tokens,
+                 "total_tokens": prompt_chars // 4 + tokens}
+        model = payload.get("model") or MODELS[0]
+        if payload.get("stream"):
+            self._stream(model, tokens, usage, (payload.get("stream_options") or {}).get("include_usage"))
+            return
+        if settings.tokens_per_second:
+            time.sleep(tokens / settings.tokens_per_second)
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "tok " * tokens},
+                         "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    def _stream(self, model, tokens, usage, include_usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1 / self.settings.tokens_per_second if self.settings.tokens_per_second else 0
+        try:
+            for index in range(tokens):
+                if index and interval:
+                    time.sleep(interval)
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": "tok "},
+                                      "finish_reason": "stop" if index == tokens - 1 else None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            if include_usage:
+                self._write_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, e.g. a cancelled hedge
+            self.close_connection = True
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """
+    Threaded mock provider; start() serves it from a background thread
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, settings=None):
+        """
+        :param port: Port to listen on, 0 for any free port
+        """
+        super().__init__((host, port), MockProviderHandler)
+        self.settings = settings or MockSettings()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-provider", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    defaults = MockSettings()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--retry-after", type=float, default=None)
+    return parser.parse_args(argv)
+
+
+def settings_from_args(args):
+    return MockSettings(**{name: getattr(args, name) for name in asdict(MockSettings())})
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    server = MockProviderServer(args.host, args.port, settings_from_args(args))
+    logger.info(f"Mock provider listening on {server.base_url} with {asdict(server.settings)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Run a JSONL file of chat requests offline.
+Each input line is a request shaped like a /api/chat/completions body (an
+optional "id" is copied to the result). Requests go through the provider
+registry with the server's retries, circuit breakers and key rotation, at a
+bounded concurrency per provider and under client-side rate limits. Results
+are appended to the output JSONL as they finish, tagged with the input line
+number. A checkpoint next to the output records which lines are finished, so
+after a crash or Ctrl-C the same command resumes without resending them. Input
+and output are streamed, so memory use does not grow with the file size.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+# Ensure the script can find the app module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.config import Config
+from app.services.batch import BatchRunner, parse_concurrency
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    Progress of a run. Every input line before next_line (which starts at byte
+    offset) is finished, as are the lines in done; output_offset is the size of
+    the output file holding exactly those results.
+    """
+
+    def __init__(self, path, input_path):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.next_line = 0
+        self.offset = 0
+        self.done = set()
+        self.output_offset = 0
+        self.complete = False
+        self.counters = {'succeeded': 0, 'failed': 0, 'tokens': 0}
+        # End offsets of lines read but not yet below next_line
+        self._ends = {}
+
+    def load(self):
+        """
+        :return: True if a checkpoint was found
+        :raises ValueError: If it belongs to a different input file
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        if state['input'] != self.input_path:
+            raise ValueError(f"{self.path} is the checkpoint of {state['input']}, not {self.input_path}")
+        self.next_line = state['next_line']
+        self.offset = state['offset']
+        self.done = set(state['done'])
+        self.output_offset = state['output_offset']
+        self.complete = state['complete']
+        self.counters.update(state['counters'])
+        return True
+
+    def save(self, output_offset):
+        self.output_offset = output_offset
+        state = {
+            'input': self.input_path,
+            'next_line': self.next_line,
+            'offset': self.offset,
+            'done': sorted(self.done),
+            'output_offset': output_offset,
+            'complete': self.complete,
+            'counters': self.counters
+        }
+        # Replaced atomically so a crash leaves either the old or the new checkpoint
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    def track(self, line, end):
+        self._ends[line] = end
+
+    def mark(self, line):
+        """Record a line as finished and advance next_line past every finished line"""
+        self.done.add(line)
+        while self.next_line in self.done:
+            self.done.discard(self.next_line)
+            self.offset = self._ends.pop(self.next_line)
+            self.next_line += 1
+
+
+def _parse(raw):
+    try:
+        row = json.loads(raw)
+    except ValueError as e:
+        return None, f"Invalid JSON: {e}"
+    if not isinstance(row, dict):
+        return None, "Batch item must be an object"
+    return row, None
+
+
+def read_rows(f, checkpoint, pending, reject):
+    """
+    Read the unfinished rows of the input from where the checkpoint left off
+
+    :param f: Input file opened in binary mode
+    :param checkpoint: Checkpoint of the run; lines already finished are skipped
+    :param pending: Dictionary filled with line number to (row id, size in bytes) for every row yielded
+    :param reject: Called with (line number, size in bytes, message) for a line that is not a request
+    :return: Iterator of (line number, request dictionary)
+    """
+    f.seek(checkpoint.offset)
+    line, offset = checkpoint.next_line, checkpoint.offset
+    for raw in f:
+        offset += len(raw)
+        checkpoint.track(line, offset)
+        if line in checkpoint.done or not raw.strip():
+            checkpoint.mark(line)
+        else:
+            row, error = _parse(raw)
+            if error is not None:
+                reject(line, len(raw), error)
+            else:
+                pending[line] = (row.get('id'), len(raw))
+                yield line, row
+        line += 1
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class Progress:
+    """
+    Live throughput and ETA, estimated from the share of the input's bytes finished
+    """
+
+    def __init__(self, total_bytes, start_bytes=0, stream=None, interval=1.0):
+        """
+        :param total_bytes: Size of the input
+        :param start_bytes: Bytes finished by earlier runs
+        :param interval: Seconds between updates
+        """
+        self.total_bytes = total_bytes
+        self.start_bytes = start_bytes
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.interactive = self.stream.isatty()
+        self.started = time.monotonic()
+        self.printed = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.tokens = 0
+        self.failed = 0
+
+    def update(self, size, failed=False, tokens=0):
+        self.rows += 1
+        self.bytes += size
+        self.tokens += tokens
+        self.failed += failed
+        now = time.monotonic()
+        if now - self.printed >= self.interval:
+            self.printed = now
+            self._print()
+
+    def render(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        finished = min(self.total_bytes, self.start_bytes + self.bytes)
+        share = finished / self.total_bytes if self.total_bytes else 1.0
+        byte_rate = self.bytes / elapsed
+        eta = _format_duration((self.total_bytes - finished) / byte_rate) if byte_rate else '?'
+        return (f"{self.rows:,} rows ({share:.1%}) | {self.rows / elapsed:.1f} rows/s | "
+                f"{self.tokens / elapsed:,.0f} tokens/s | {self.failed:,} failed | "
+                f"elapsed {_format_duration(elapsed)} | ETA {eta}")
+
+    def _print(self):
+        if self.interactive:
+            self.stream.write('\r' + self.render().ljust(100))
+        else:
+            self.stream.write(self.render() + '\n')
+        self.stream.flush()
+
+    def finish(self):
+        self._print()
+        if self.interactive:
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+def _tokens(result):
+    response = result.get('response')
+    usage = response.get('usage') if isinstance(response, dict) else None
+    return (usage or {}).get('total_tokens') or 0
+
+
+def run_file(input_path, output_path, runner, checkpoint_path=None, restart=False, progress_interval=1.0):
+    """
+    Run every request of a JSONL file, resuming from the checkpoint if there is one
+
+    :param input_path: JSONL file of completion requests
+    :param output_path: JSONL file the results are appended to
+    :param runner: BatchRunner the requests are sent through
+    :param checkpoint_path: Checkpoint file, the output path plus .checkpoint by default
+    :param restart: Discard the checkpoint and the output of an earlier run
+    :param progress_interval: Seconds between progress lines on stderr
+    :return: Dictionary with the succeeded, failed and tokens totals of all runs
+    :raises ValueError: If the output exists without a checkpoint, or the checkpoint is for another input
+    """
+    checkpoint = Checkpoint(checkpoint_path or output_path + '.checkpoint', input_path)
+    if restart:
+        for path in (checkpoint.path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+    resumed = checkpoint.load()
+    if checkpoint.complete:
+        logger.info(f"{input_path} was already run completely into {output_path}")
+        return checkpoint.counters
+    if not resumed and os.path.exists(output_path) and os.path.getsize(output_path):
+        raise ValueError(f"{output_path} exists but has no checkpoint; pass --restart to overwrite it")
+    if resumed and (not os.path.exists(output_path) or os.path.getsize(output_path) < checkpoint.output_offset):
+        raise ValueError(f"{output_path} is missing results recorded in {checkpoint.path}; pass --restart")
+    if resumed:
+        logger.info(f"Resuming at line {checkpoint.next_line} with {len(checkpoint.done)} later lines finished")
+
+    progress = Progress(os.path.getsize(input_path), checkpoint.offset, interval=progress_interval)
+    pending = {}
+    with open(input_path, 'rb') as source, open(output_path, 'r+b' if resumed else 'wb') as out:
+        # Results written after the last checkpoint belong to lines that will be run again
+        out.truncate(checkpoint.output_offset)
+        out.seek(checkpoint.output_offset)
+
+        def write(line, size, result, row_id=None):
+            record = {'line': line, 'id': row_id} if row_id is not None else {'line': line}
+            record.update(result)
+            out.write((json.dumps(record) + '\n').encode('utf-8'))
+            out.flush()
+            failed = result['status'] != 200
+            tokens = _tokens(result)
+            checkpoint.counters['failed' if failed else 'succeeded'] += 1
+            checkpoint.counters['tokens'] += tokens
+            checkpoint.mark(line)
+            checkpoint.save(out.tell())
+            progress.update(size, failed, tokens)
+
+        def reject(line, size, message):
+            write(line, size, {'status': 400, 'error': message})
+
+        try:
+            for result in runner.run_indexed(read_rows(source, checkpoint, pending, reject)):
+                line = result.pop('index')
+                row_id, size = pending.pop(line)
+                write(line, size, result, row_id)
+            checkpoint.complete = True
+            checkpoint.save(out.tell())
+        finally:
+            progress.finish()
+    return checkpoint.counters
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help="JSONL file of completion requests")
+    parser.add_argument('output', help="JSONL file the results are written to")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument('--restart', action='store_true', help="Ignore an earlier run and start over")
+    parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once (default: 16)")
+    parser.add_argument('--provider-concurrency', default='',
+                        help="Per-provider caps such as groq=4,openai=16 (default: --concurrency)")
+    parser.add_argument('--rate-limits', default=None,
+                        help="Requests/tokens per minute per provider key such as groq=30/6000 "
+                             "(default: PROVIDER_RATE_LIMITS)")
+    parser.add_argument('--max-wait', type=float, default=300.0,
+                        help="Seconds a request may wait for rate limit capacity before failing (default: 300)")
+    parser.add_argument('--progress-interval', type=float, default=1.0, help="Seconds between progress updates")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Rate limiters read these when they are created on first use
+    if args.rate_limits is not None:
+        Config.PROVIDER_RATE_LIMITS = args.rate_limits
+    Config.RATE_LIMIT_MAX_WAIT_MS = int(args.max_wait * 1000)
+
+    from app.services.completion_service import CompletionService
+    runner = BatchRunner(CompletionService(), max_concurrency=args.concurrency,
+                         provider_limits=parse_concurrency(args.provider_concurrency),
+                         default_limit=args.concurrency)
+    try:
+        counters = run_file(args.input, args.output, runner, args.checkpoint, args.restart,
+                            args.progress_interval)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; run the same command again to resume")
+        return 130
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    logger.info(f"Batch completed: {counters['succeeded']} succeeded, {counters['failed']} failed, "
+                f"{counters['tokens']} tokens")
+    return 0 if not counters['failed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
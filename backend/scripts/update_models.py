@@ -1,46 +1,139 @@
 #!/usr/bin/env python3
 """
 Script to update the list of supported models for all AI providers.
-Intended to be run weekly to fetch the latest models from provider APIs.
+Fetches every provider's catalog concurrently within a time budget, using
+conditional requests so unchanged catalogs cost a 304. Results are written into
+the model store the server reads, and a per-provider diff is printed.
+Cheap enough to run from cron on every node.
 """
 
 import os
 import sys
+import time
+import argparse
 import logging
+import queue
+import threading
+from concurrent.futures import Future, wait
+
+# Ensure the script can find the app module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.services.ai_providers.provider_registry import provider_registry
+from app.services.model_discovery import ModelDiscoveryService
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def update_all_models():
+def _update_provider(discovery, provider_id, provider, deadline):
+    started = time.perf_counter()
+    # Providers started late only get what is left of the budget
+    result = discovery.refresh_catalog(provider_id, provider, timeout=max(0.1, deadline - time.monotonic()))
+    result['duration_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+def _run_in_daemon_threads(jobs, max_workers):
+    """
+    Run zero-argument callables on daemon threads, so fetches still running when
+    the budget is spent do not hold up the interpreter's exit
+
+    :param jobs: Dictionary of name to callable
+    :return: Dictionary of name to Future
+    """
+    futures = {name: Future() for name in jobs}
+    todo = queue.SimpleQueue()
+    for item in jobs.items():
+        todo.put(item)
+
+    def work():
+        while True:
+            try:
+                name, job = todo.get_nowait()
+            except queue.Empty:
+                return
+            future = futures[name]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job())
+            except Exception as e:
+                future.set_exception(e)
+
+    for _ in range(min(max_workers, len(jobs))):
+        threading.Thread(target=work, name='update-models', daemon=True).start()
+    return futures
+
+def format_result(provider_id, result):
+    """
+    Format one provider's update as a diff of added and removed models
+
+    :param provider_id: Lowercase provider identifier
+    :param result: Dictionary from ModelDiscoveryService.refresh_catalog plus 'duration_ms'
+    :return: Report lines
+    """
+    timing = f"{result['duration_ms']:.0f}ms"
+    if result['not_modified']:
+        return [f"{provider_id}: not modified ({timing})"]
+    previous = set(result['previous'] or [])
+    current = set(result['models'] or [])
+    added, removed = sorted(current - previous), sorted(previous - current)
+    lines = [f"{provider_id}: {len(current)} models, +{len(added)} -{len(removed)} ({timing})"]
+    lines.extend(f"  + {model}" for model in added)
+    lines.extend(f"  - {model}" for model in removed)
+    return lines
+
+def update_all_models(budget=30.0, max_workers=8, discovery=None):
     """
     Update the model lists for all registered providers.
-    Forces a refresh by clearing any cached model lists.
+
+    :param budget: Seconds allowed for the whole update; slower providers are reported as timed out
+    :param max_workers: Maximum providers fetched at the same time
+    :param discovery: ModelDiscoveryService to store results with
+    :return: Dictionary of provider id to refresh result, or None for providers that failed
     """
     logger.info("Starting model update for all providers...")
-    providers = provider_registry.get_all_providers()
-    
+    # Catalog fetches report rejected keys themselves, so skip the registry's key validation
+    providers = provider_registry.get_all_providers(validate=False)
+
     if not providers:
         logger.warning("No providers are currently registered. Ensure API keys are set in environment variables.")
-        return
-    
-    for provider_id, provider in providers.items():
+        return {}
+
+    discovery = discovery or ModelDiscoveryService()
+    deadline = time.monotonic() + budget
+    jobs = {
+        provider_id: (lambda provider_id=provider_id, provider=provider:
+                      _update_provider(discovery, provider_id, provider, deadline))
+        for provider_id, provider in providers.items()
+    }
+    futures = {future: provider_id for provider_id, future in _run_in_daemon_threads(jobs, max_workers).items()}
+    done, pending = wait(futures, timeout=budget)
+    for future in pending:
+        future.cancel()
+
+    results = {}
+    for future, provider_id in sorted(futures.items(), key=lambda item: item[1]):
+        if future in pending:
+            logger.error(f"Timed out updating models for {provider_id} after {budget:.0f}s")
+            results[provider_id] = None
+            continue
         try:
-            # Clear any cached models to force a refresh
-            if hasattr(provider, '_cached_models'):
-                provider._cached_models = None
-                logger.info(f"Cleared cached models for {provider_id}")
-            
-            # Fetch the latest models
-            models = provider.get_supported_models()
-            logger.info(f"Updated models for {provider_id}: fetched {len(models)} models")
+            results[provider_id] = future.result()
         except Exception as e:
             logger.error(f"Error updating models for {provider_id}: {str(e)}")
-    
-    logger.info("Model update completed for all providers.")
+            results[provider_id] = None
+            continue
+        for line in format_result(provider_id, results[provider_id]):
+            print(line)
+
+    updated = sum(1 for result in results.values() if result is not None)
+    logger.info(f"Model update completed: {updated}/{len(results)} providers updated.")
+    return results
 
 if __name__ == "__main__":
-    # Ensure the script can find the app module
-    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    update_all_models()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget', type=float, default=30.0, help="Seconds allowed for the whole update")
+    parser.add_argument('--workers', type=int, default=8, help="Providers fetched at the same time")
+    args = parser.parse_args()
+    results = update_all_models(args.budget, args.workers)
+    sys.exit(0 if results and all(result is not None for result in results.values()) else 1)
@@ -0,0 +1,37 @@
+import unittest
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.asgi import AsyncChatApp
+
+async def post(app, path, body):
+    messages, sent = [{'type': 'http.request', 'body': body}], []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app({'type': 'http', 'method': 'POST', 'path': path, 'headers': []}, receive, send)
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+class TestAsyncChatApp(unittest.TestCase):
+    def setUp(self):
+        self.app = AsyncChatApp(MagicMock(), registry=MagicMock())
+
+    def test_malformed_bodies_are_rejected(self):
+        for path in ('/api/chat/completions', '/api/chat/stream'):
+            for body in (b'{"provider": ', b'[{"provider": "groq"}]', b'"groq"'):
+                status, data = asyncio.run(post(self.app, path, body))
+                self.assertEqual(status, 400, (path, body))
+                self.assertTrue(data['error'].startswith('Invalid request body'))
+
+if __name__ == '__main__':
+    unittest.main()
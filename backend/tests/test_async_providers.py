@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch, MagicMock, AsyncMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.base_provider import BaseProvider
+from app.services.ai_providers.groq_provider import GroqProvider
+from app.services.ai_providers.openai_provider import OpenaiProvider
+
+COMPLETION_BODY = {
+    "choices": [{"message": {"content": "hello"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+}
+
+class SyncOnlyProvider(BaseProvider):
+    def __init__(self, api_key):
+        super().__init__(api_key)
+        self.name = "sync-only"
+
+    def get_supported_models(self):
+        return ["model1"]
+
+    def generate_completion(self, messages, model, options=None):
+        return {"text": f"{model}:{messages[-1]['content']}"}
+
+    def stream_completion(self, messages, model, options=None):
+        yield "a"
+        yield "b"
+
+class TestAsyncProviders(unittest.IsolatedAsyncioTestCase):
+    async def test_sync_provider_adapter(self):
+        provider = SyncOnlyProvider("key")
+        result = await provider.agenerate_completion([{"role": "user", "content": "hi"}], "model1")
+        self.assertEqual(result, {"text": "model1:hi"})
+
+        chunks = [chunk async for chunk in provider.astream_completion([], "model1")]
+        self.assertEqual(chunks, ["a", "b"])
+
+    async def test_openai_compatible_async_completion(self):
+        provider = GroqProvider("key")
+        response = MagicMock(status_code=200)
+        response.json.return_value = COMPLETION_BODY
+        transport = MagicMock()
+        transport.apost = AsyncMock(return_value=response)
+
+        with patch.object(GroqProvider, 'transport', transport):
+            result = await provider.agenerate_completion([{"role": "user", "content": "hi"}], "llama3-8b-8192")
+
+        self.assertEqual(result["text"], "hello")
+        self.assertEqual(result["usage"]["total_tokens"], 4)
+        payload = transport.apost.call_args.kwargs["json"]
+        self.assertEqual(payload["model"], "llama3-8b-8192")
+
+    async def test_openai_compatible_async_error(self):
+        provider = GroqProvider("key")
+        response = MagicMock(status_code=500, text="boom")
+        transport = MagicMock()
+        transport.apost = AsyncMock(return_value=response)
+
+        with patch.object(GroqProvider, 'transport', transport):
+            with self.assertRaises(Exception):
+                await provider.agenerate_completion([], "llama3-8b-8192")
+
+    async def test_openai_model_fallback_does_not_list_models(self):
+        provider = OpenaiProvider("key")
+        incompatible = MagicMock(status_code=404, text="model_not_found")
+        ok = MagicMock(status_code=200)
+        ok.json.return_value = COMPLETION_BODY
+        transport = MagicMock()
+        transport.apost = AsyncMock(side_effect=[incompatible, ok])
+        store = MagicMock()
+        store.get.return_value = None
+
+        with patch.object(OpenaiProvider, 'transport', transport), \
+             patch('app.services.ai_providers.openai_provider.get_model_store', return_value=store):
+            result = await provider.agenerate_completion([{"role": "user", "content": "hi"}], "gpt-audio")
+
+        self.assertEqual(result["text"], "hello")
+        self.assertEqual(transport.apost.call_args.kwargs["json"]["model"], "gpt-4o")
+        transport.get.assert_not_called()
+        store.get.assert_called_with("openai")
+
+if __name__ == '__main__':
+    unittest.main()
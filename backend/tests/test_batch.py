@@ -0,0 +1,165 @@
+import unittest
+import asyncio
+import os
+import sys
+import json
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.batch import BatchRunner, parse_batch, parse_concurrency
+from app.services.resilience import CircuitOpenError
+
+def item(provider, text='hi', **extra):
+    return dict({"provider": provider, "model": "m", "messages": [{"role": "user", "content": text}]}, **extra)
+
+class ConcurrencyProbe:
+    """Fake completion service recording the peak number of calls in flight per provider"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.in_flight = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def _enter(self, provider_id):
+        with self.lock:
+            self.in_flight[provider_id] = self.in_flight.get(provider_id, 0) + 1
+            self.peak[provider_id] = max(self.peak.get(provider_id, 0), self.in_flight[provider_id])
+
+    def _leave(self, provider_id):
+        with self.lock:
+            self.in_flight[provider_id] -= 1
+
+    def generate_completion(self, provider_id, model, messages, options=None, cache_mode=None, hedge=None):
+        self._enter(provider_id)
+        try:
+            time.sleep(self.delay)
+            return {"text": messages[0]["content"]}
+        finally:
+            self._leave(provider_id)
+
+    async def agenerate_completion(self, provider_id, model, messages, options=None, cache_mode=None, hedge=None):
+        self._enter(provider_id)
+        try:
+            await asyncio.sleep(self.delay)
+            return {"text": messages[0]["content"]}
+        finally:
+            self._leave(provider_id)
+
+class TestBatchRunner(unittest.TestCase):
+    def test_parse_concurrency_and_batch(self):
+        self.assertEqual(parse_concurrency("groq=4, OpenAI=16,bad,zero=0"), {'groq': 4, 'openai': 16})
+        self.assertEqual(parse_batch([item('groq')], 10), [item('groq')])
+        self.assertEqual(parse_batch({"items": [item('groq')]}, 10), [item('groq')])
+        for body in (None, [], {"items": "x"}, [item('groq')] * 3):
+            with self.assertRaises(ValueError):
+                parse_batch(body, 2)
+
+    def test_caps_concurrency_per_provider(self):
+        probe = ConcurrencyProbe()
+        runner = BatchRunner(probe, max_concurrency=6, provider_limits={'groq': 2}, default_limit=3)
+        items = [item('groq', str(i)) for i in range(6)] + [item('openai', str(i)) for i in range(6, 12)]
+
+        results = list(runner.run(items))
+
+        self.assertEqual(sorted(result['index'] for result in results), list(range(12)))
+        for result in results:
+            self.assertEqual(result['status'], 200)
+            self.assertEqual(result['response'], {"text": str(result['index'])})
+        self.assertEqual(probe.peak, {'groq': 2, 'openai': 3})
+
+    def test_results_arrive_in_completion_order(self):
+        service = MagicMock()
+        service.generate_completion.side_effect = lambda provider_id, *args: (
+            time.sleep(0.2 if provider_id == 'slow' else 0), {"text": provider_id})[1]
+        runner = BatchRunner(service, max_concurrency=4, provider_limits={}, default_limit=4)
+
+        results = list(runner.run([item('slow'), item('fast')]))
+
+        self.assertEqual([result['index'] for result in results], [1, 0])
+
+    def test_failures_are_reported_per_item(self):
+        def generate(provider_id, *args):
+            if provider_id == 'missing':
+                raise ValueError("Provider not configured")
+            if provider_id == 'broken':
+                raise CircuitOpenError('broken', 'm', 30)
+            if provider_id == 'upstream':
+                return {"error": "bad request"}
+            if provider_id == 'crash':
+                raise RuntimeError("boom")
+            return {"text": "ok"}
+
+        service = MagicMock()
+        service.generate_completion.side_effect = generate
+        runner = BatchRunner(service, max_concurrency=4, provider_limits={}, default_limit=4)
+
+        results = {r['index']: r for r in runner.run(
+            [item('groq'), item('missing'), item('broken'), item('upstream'), item('crash'), "not an item"])}
+
+        self.assertEqual(results[0], {'index': 0, 'status': 200, 'response': {"text": "ok"}})
+        self.assertEqual(results[1], {'index': 1, 'status': 400, 'error': "Provider not configured"})
+        self.assertEqual(results[2]['status'], 503)
+        self.assertEqual(results[3], {'index': 3, 'status': 400, 'error': "bad request"})
+        self.assertEqual(results[4], {'index': 4, 'status': 500, 'error': 'Internal server error'})
+        self.assertEqual(results[5], {'index': 5, 'status': 400, 'error': "Batch item must be an object"})
+
+    def test_closing_early_skips_pending_items(self):
+        service = MagicMock()
+        service.generate_completion.side_effect = lambda *args: (time.sleep(0.05), {"text": "ok"})[1]
+        runner = BatchRunner(service, max_concurrency=1, provider_limits={}, default_limit=1)
+
+        results = runner.run([item('groq')] * 10)
+        next(results)
+        results.close()
+        time.sleep(0.1)
+
+        self.assertLess(service.generate_completion.call_count, 10)
+
+    def test_async_run_caps_concurrency_per_provider(self):
+        probe = ConcurrencyProbe()
+        runner = BatchRunner(probe, max_concurrency=4, provider_limits={'groq': 1}, default_limit=3)
+        items = [item('groq', str(i)) for i in range(3)] + [item('openai', str(i)) for i in range(3, 8)]
+
+        async def collect():
+            return [result async for result in runner.arun(items)]
+
+        results = asyncio.run(collect())
+
+        self.assertEqual(sorted(result['index'] for result in results), list(range(8)))
+        self.assertEqual(probe.peak, {'groq': 1, 'openai': 3})
+
+class TestBatchRoute(unittest.TestCase):
+    def setUp(self):
+        from app.routes import chat
+        self.app = Flask(__name__)
+        self.app.register_blueprint(chat.chat_bp, url_prefix='/api/chat')
+        self.client = self.app.test_client()
+        self.runner = BatchRunner(ConcurrencyProbe(delay=0), max_concurrency=2, provider_limits={}, default_limit=2)
+        patcher = patch.object(chat, 'batch_runner', self.runner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_streams_ndjson_lines_with_summary(self):
+        response = self.client.post('/api/chat/batch', json=[item('groq', 'a'), item('openai', 'b')])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(sorted((line['index'], line['response']['text']) for line in lines[:-1]),
+                         [(0, 'a'), (1, 'b')])
+        self.assertEqual(lines[-1]['total'], 2)
+        self.assertEqual(lines[-1]['failed'], 0)
+
+    def test_rejects_invalid_batches(self):
+        self.assertEqual(self.client.post('/api/chat/batch', json={"items": []}).status_code, 400)
+        self.assertEqual(self.client.post('/api/chat/batch', data='nope').status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the load benchmark and its mock provider.
+"""
+
+import unittest
+import os
+import sys
+from unittest.mock import patch
+
+# Ensure the script can find the app module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.benchmark import percentile, summarize, compare, build_payload
+from scripts.mock_provider import MockProviderServer, MockSettings
+from app.services.ai_providers.errors import UpstreamError
+from app.services.ai_providers.openai_compatible import parse_base_urls
+from app.services.ai_providers.groq_provider import GroqProvider
+
+class TestMockProvider(unittest.TestCase):
+    def setUp(self):
+        self.server = MockProviderServer(settings=MockSettings(latency_ms=0, tokens_per_second=0,
+                                                               output_tokens=5)).start()
+        self.provider = GroqProvider('mock-key')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def configured(self):
+        return patch('app.config.Config.PROVIDER_BASE_URLS', f'groq={self.server.base_url}')
+
+    def test_base_url_override(self):
+        self.assertEqual(parse_base_urls('groq=http://localhost:9100/v1/, bad'),
+                         {'groq': 'http://localhost:9100/v1'})
+        self.provider._api_base_url = 'https://vendor.example/v1'
+        with self.configured():
+            self.assertEqual(self.provider._chat_endpoint(), f'{self.server.base_url}/chat/completions')
+        self.assertEqual(self.provider._chat_endpoint(), 'https://vendor.example/v1/chat/completions')
+
+    def test_completion_and_stream_speak_the_openai_protocol(self):
+        messages = [{'role': 'user', 'content': 'hello'}]
+        with self.configured():
+            response = self.provider.generate_completion(messages, 'mock-small', {'max_tokens': 3})
+            events = list(self.provider.stream_completion(messages, 'mock-small'))
+            self.assertTrue(self.provider.check_api_key(timeout=5))
+
+        self.assertEqual(response['usage']['completion_tokens'], 3)
+        self.assertEqual(len([e for e in events if e['type'] == 'delta']), 5)
+        self.assertEqual(events[-1]['usage']['completion_tokens'], 5)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_injected_errors(self):
+        self.server.settings.error_rate = 1.0
+        self.server.settings.retry_after = 2
+        with self.configured(), self.assertRaises(UpstreamError) as raised:
+            self.provider.generate_completion([{'role': 'user', 'content': 'hi'}], 'mock-small')
+        self.assertEqual((raised.exception.status_code, raised.exception.retry_after), (503, 2.0))
+
+class TestBenchmarkReport(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_payloads_rotate_providers_and_differ(self):
+        first, second = (build_payload(i, ['groq', 'openai'], 'mock-small', 16) for i in range(2))
+        self.assertEqual((first['provider'], second['provider']), ('groq', 'openai'))
+        self.assertNotEqual(first['messages'], second['messages'])
+
+    def test_summarize(self):
+        results = [{'ok': True, 'status': 200, 'latency': 0.1, 'ttft': 0.05},
+                   {'ok': True, 'status': 200, 'latency': 0.3, 'ttft': 0.07},
+                   {'ok': False, 'status': 503, 'latency': 0.2, 'ttft': None}]
+
+        summary = summarize(results, wall=2.0, cpu_seconds=1.0, rss_max=64 * 2 ** 20)
+
+        self.assertEqual(summary['rps'], 1.0)
+        self.assertEqual(summary['p50_ms'], 100.0)
+        self.assertEqual(summary['ttft_p95_ms'], 70.0)
+        self.assertEqual(summary['errors_by_status'], {'503': 1})
+        self.assertEqual((summary['cpu_percent'], summary['rss_max_mb']), (50.0, 64.0))
+
+    def test_compare_flags_regressions(self):
+        baseline = {'levels': [{'endpoint': 'stream', 'concurrency': 8, 'rps': 100, 'p95_ms': 200}]}
+        current = {'levels': [{'endpoint': 'stream', 'concurrency': 8, 'rps': 85, 'p95_ms': 210}]}
+
+        regressions = compare(baseline, current, max_regression=10)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('stream@8 rps', regressions[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+import unittest
+import asyncio
+import os
+import sys
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.tokens import count_tokens, count_message_tokens, count_prompt_tokens
+from app.services.context_manager import ContextManager, parse_windows, parse_model, SUMMARY_PREFIX
+from app.services.completion_service import CompletionService
+from app.services.single_flight import SingleFlight
+
+SYSTEM = {"role": "system", "content": "You are terse."}
+OPTIONS = {"max_tokens": 100}
+
+def turns(count, words=100, start=0):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn{i} " + "word " * words}
+            for i in range(start, start + count)]
+
+def manager(**overrides):
+    settings = dict(windows={('openai', 'small'): 1000}, max_input_tokens=0, keep_ratio=0.5,
+                    summary_max_tokens=50, chunk_tokens=100000, cache_size=100)
+    settings.update(overrides)
+    return ContextManager(**settings)
+
+class Summarizer:
+    """Records summarize calls and answers with a short summary naming the turns it saw"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, previous, messages):
+        self.calls.append((previous, messages))
+        return (previous or '') + ''.join(message["content"].split()[0][4:] + ';' for message in messages)
+
+class TestTokens(unittest.TestCase):
+    def test_counts_words_punctuation_and_cjk(self):
+        self.assertEqual(count_tokens(''), 0)
+        self.assertEqual(count_tokens('hello world'), 2)
+        self.assertEqual(count_tokens('Hello, world!'), 4)
+        self.assertEqual(count_tokens('internationalization'), 5)
+        self.assertEqual(count_tokens('12345'), 2)
+        self.assertEqual(count_tokens('你好'), 2)
+
+    def test_counts_messages_with_overhead_and_images(self):
+        text = {"role": "user", "content": "hello world"}
+        image = {"role": "user", "content": [{"type": "text", "text": "hello world"},
+                                             {"type": "image_url", "image_url": {"url": "data:"}}]}
+        self.assertEqual(count_message_tokens(text), 6)
+        self.assertEqual(count_message_tokens(image), 6 + 85)
+        self.assertEqual(count_prompt_tokens([text, text]), 15)
+
+class TestContextManager(unittest.TestCase):
+    def test_parses_settings(self):
+        self.assertEqual(parse_windows("openai:gpt-4o=128000, Groq:llama=8192,bad,x:y=0"),
+                         {('openai', 'gpt-4o'): 128000, ('groq', 'llama'): 8192})
+        self.assertEqual(parse_model("groq:llama-3.1-8b-instant"), ('groq', 'llama-3.1-8b-instant'))
+        self.assertEqual(parse_model(""), (None, None))
+
+    def test_budget_uses_window_reply_and_cap(self):
+        self.assertEqual(manager().budget('openai', 'small', OPTIONS), 850)
+        self.assertIsNone(manager().budget('openai', 'unknown', OPTIONS))
+        self.assertEqual(manager(max_input_tokens=300).budget('openai', 'small', OPTIONS), 300)
+        self.assertEqual(manager(max_input_tokens=300).budget('openai', 'unknown', OPTIONS), 300)
+
+    def test_fits_the_smaller_window_of_a_hedge_backup(self):
+        context = manager(windows={('openai', 'small'): 1000, ('groq', 'tiny'): 600})
+        messages = [SYSTEM] + turns(12, words=50)
+
+        self.assertEqual(context.fit('openai', 'small', messages, OPTIONS, Summarizer())[1], None)
+        fitted, report = context.fit('openai', 'small', messages, OPTIONS, Summarizer(), backup=('groq', 'tiny'))
+
+        self.assertIsNotNone(report)
+        self.assertLessEqual(report['sent_tokens'], context.budget('groq', 'tiny', OPTIONS))
+        # An unknown backup window leaves the primary's budget
+        self.assertEqual(context.fit('openai', 'small', messages, OPTIONS, Summarizer(), backup=('groq', 'x'))[1],
+                         None)
+
+    def test_leaves_requests_that_fit_alone(self):
+        summarize = Summarizer()
+        messages = [SYSTEM] + turns(3)
+
+        self.assertEqual(manager().fit('openai', 'small', messages, OPTIONS, summarize), (messages, None))
+        self.assertEqual(manager().fit('openai', 'unknown', [SYSTEM] + turns(20), OPTIONS, summarize)[1], None)
+        self.assertEqual(summarize.calls, [])
+
+    def test_summarizes_older_turns_and_keeps_recent_ones(self):
+        context, summarize = manager(), Summarizer()
+        messages = [SYSTEM] + turns(20)
+
+        fitted, report = context.fit('openai', 'small', messages, OPTIONS, summarize)
+
+        self.assertEqual(fitted[0], SYSTEM)
+        self.assertEqual(fitted[1]["role"], "system")
+        self.assertTrue(fitted[1]["content"].startswith(SUMMARY_PREFIX))
+        self.assertEqual(fitted[-1], messages[-1])
+        self.assertEqual(len(summarize.calls), 1)
+        self.assertIsNone(summarize.calls[0][0])
+        self.assertEqual(report['summarized_messages'], len(summarize.calls[0][1]))
+        self.assertEqual(fitted[2:], messages[1 + report['summarized_messages']:])
+        self.assertEqual(report['summary'], 'updated')
+        self.assertEqual(report['input_tokens'], count_prompt_tokens(messages))
+        self.assertEqual(report['sent_tokens'], count_prompt_tokens(fitted))
+        self.assertLessEqual(report['sent_tokens'], context.budget('openai', 'small', OPTIONS))
+        self.assertEqual(report['saved_tokens'], report['input_tokens'] - report['sent_tokens'])
+
+    def test_reuses_the_summary_on_following_turns(self):
+        context, summarize = manager(), Summarizer()
+        history = [SYSTEM] + turns(20)
+        first, _ = context.fit('openai', 'small', history, OPTIONS, summarize)
+
+        history += turns(2, words=5, start=20)
+        fitted, report = context.fit('openai', 'small', history, OPTIONS, summarize)
+
+        self.assertEqual(len(summarize.calls), 1)
+        self.assertEqual(report['summary'], 'cached')
+        self.assertEqual(fitted[:len(first)], first)
+        self.assertEqual(fitted[len(first):], history[-2:])
+        self.assertEqual(context.stats()['summaries_reused'], 1)
+
+    def test_folds_only_new_turns_into_the_cached_summary(self):
+        context, summarize = manager(), Summarizer()
+        history = [SYSTEM] + turns(20)
+        context.fit('openai', 'small', history, OPTIONS, summarize)
+        _, folded = summarize.calls[0]
+
+        history += turns(10, start=20)
+        fitted, report = context.fit('openai', 'small', history, OPTIONS, summarize)
+
+        self.assertEqual(len(summarize.calls), 2)
+        previous_summary, new_turns = summarize.calls[1]
+        self.assertEqual(previous_summary, summarize(None, folded))
+        self.assertEqual(new_turns[0], history[1 + len(folded)])
+        self.assertEqual(report['summarized_messages'], len(folded) + len(new_turns))
+        self.assertEqual(report['summary'], 'updated')
+        self.assertTrue(fitted[1]["content"].startswith(SUMMARY_PREFIX + '0;1;'))
+
+    def test_folds_long_histories_in_chunks(self):
+        summarize = Summarizer()
+
+        fitted, report = manager(chunk_tokens=250).fit('openai', 'small', [SYSTEM] + turns(20), OPTIONS, summarize)
+
+        self.assertGreater(len(summarize.calls), 1)
+        self.assertTrue(all(len(messages) <= 2 for _, messages in summarize.calls))
+        for (_, messages), (previous, _) in zip(summarize.calls, summarize.calls[1:]):
+            self.assertTrue(previous.endswith(messages[-1]["content"].split()[0][4:] + ';'))
+        self.assertEqual(report['summarized_messages'], sum(len(messages) for _, messages in summarize.calls))
+
+    def test_drops_older_turns_when_summarizing_fails(self):
+        context = manager()
+        messages = [SYSTEM] + turns(20)
+
+        fitted, report = context.fit('openai', 'small', messages, OPTIONS, MagicMock(side_effect=RuntimeError("down")))
+
+        self.assertEqual(report['summary'], 'dropped')
+        self.assertEqual(fitted, [SYSTEM] + messages[1 + report['summarized_messages']:])
+        self.assertEqual(context.stats()['summary_failures'], 1)
+        self.assertEqual(context.stats()['cached_summaries'], 0)
+
+    def test_async_fit_matches_sync_fit(self):
+        messages = [SYSTEM] + turns(20)
+        summarize = Summarizer()
+
+        async def asummarize(previous, turns):
+            return summarize(previous, turns)
+
+        expected = manager().fit('openai', 'small', messages, OPTIONS, Summarizer())
+        self.assertEqual(asyncio.run(manager().afit('openai', 'small', messages, OPTIONS, asummarize)), expected)
+
+class TestCompletionServiceContext(unittest.TestCase):
+    def setUp(self):
+        self.provider = MagicMock()
+        self.provider.generate_completion.return_value = {"text": "answer"}
+        self.provider.stream_completion.side_effect = lambda *args: iter(
+            [{"type": "delta", "text": "answer"}, {"type": "usage", "finish_reason": "stop", "usage": None}])
+        self.summarizer = MagicMock()
+        self.summarizer.generate_completion.return_value = {"text": "they talked"}
+        registry = MagicMock()
+        registry.get_provider.side_effect = {'openai': self.provider, 'groq': self.summarizer}.get
+        self.context = manager()
+        self.service = CompletionService(registry, coalescer=SingleFlight(), context_manager=self.context)
+        for patcher in (patch('app.services.completion_service.get_response_cache', return_value=None),
+                        patch('app.services.completion_service.get_semantic_cache', return_value=None),
+                        patch('app.config.Config.CONTEXT_SUMMARY_MODEL', 'groq:fast')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sends_fitted_messages_and_reports_savings(self):
+        messages = [SYSTEM] + turns(20)
+
+        response = self.service.generate_completion('openai', 'small', messages, dict(OPTIONS), hedge=False)
+
+        self.assertEqual(response["text"], "answer")
+        self.assertGreater(response["context"]["saved_tokens"], 0)
+        sent = self.provider.generate_completion.call_args[0][0]
+        self.assertEqual(sent[1]["content"], SUMMARY_PREFIX + "they talked")
+        self.assertEqual(sent[-1], messages[-1])
+        prompt, model, options = self.summarizer.generate_completion.call_args[0]
+        self.assertEqual(model, 'fast')
+        self.assertEqual(options, {'max_tokens': 50, 'temperature': 0})
+        self.assertIn('turn0', prompt[-1]["content"])
+
+    def test_short_requests_are_sent_unchanged(self):
+        messages = [SYSTEM] + turns(2)
+
+        response = self.service.generate_completion('openai', 'small', messages, dict(OPTIONS), hedge=False)
+
+        self.assertNotIn("context", response)
+        self.assertEqual(self.provider.generate_completion.call_args[0][0], messages)
+        self.summarizer.generate_completion.assert_not_called()
+
+    def test_falls_back_to_the_request_model_for_summaries(self):
+        with patch('app.config.Config.CONTEXT_SUMMARY_MODEL', 'missing:model'):
+            response = self.service.generate_completion('openai', 'small', [SYSTEM] + turns(20), dict(OPTIONS),
+                                                         hedge=False)
+
+        self.assertEqual(response["context"]["summary"], 'updated')
+        self.assertEqual(self.provider.generate_completion.call_count, 2)
+        self.summarizer.generate_completion.assert_not_called()
+
+    def test_summaries_use_the_request_model_by_default(self):
+        with patch('app.config.Config.CONTEXT_SUMMARY_MODEL', ''):
+            response = self.service.generate_completion('openai', 'small', [SYSTEM] + turns(20), dict(OPTIONS),
+                                                         hedge=False)
+
+        self.assertEqual(response["context"]["summary"], 'updated')
+        self.assertEqual(self.provider.generate_completion.call_args_list[0][0][1], 'small')
+        self.summarizer.generate_completion.assert_not_called()
+
+    def test_stream_starts_with_a_context_event(self):
+        events = list(self.service.stream_completion('openai', 'small', [SYSTEM] + turns(20), dict(OPTIONS),
+                                                     hedge=False))
+
+        self.assertEqual(events[0]["type"], "context")
+        self.assertGreater(events[0]["saved_tokens"], 0)
+        self.assertEqual(events[1], {"type": "delta", "text": "answer"})
+
+    def test_disabled_by_setting(self):
+        messages = [SYSTEM] + turns(20)
+        with patch('app.config.Config.CONTEXT_MANAGEMENT_ENABLED', False):
+            response = self.service.generate_completion('openai', 'small', messages, dict(OPTIONS), hedge=False)
+
+        self.assertNotIn("context", response)
+        self.assertEqual(self.provider.generate_completion.call_args[0][0], messages)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.db_models import Base
+from app.services.conversation_store import ConversationStore
+
+class TestConversationStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.engine = create_engine('sqlite:///' + os.path.join(self.temp_dir.name, 'chat.db'),
+                                    connect_args={'check_same_thread': False})
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(bind=self.engine)
+        self.store = self.new_store()
+
+    def new_store(self, cache_size=10):
+        return ConversationStore(scoped_session(sessionmaker(bind=self.engine)), cache_size=cache_size)
+
+    def test_history_includes_system_prompt_and_appended_turns(self):
+        conversation = self.store.create('groq', 'llama', system_prompt='Be brief')
+        self.assertEqual(conversation['title'], 'New Conversation')
+
+        stored = self.store.append(conversation['id'], [
+            {"role": "user", "content": "What is 2+2?\nThanks"},
+            {"role": "assistant", "content": "4", "model": "llama", "metadata": {"usage": {"total_tokens": 9}}}
+        ], 'groq', 'llama')
+
+        history = self.store.history(conversation['id'])
+        self.assertEqual(history.messages, [
+            {"role": "system", "content": "Be brief"},
+            {"role": "user", "content": "What is 2+2?\nThanks"},
+            {"role": "assistant", "content": "4"}
+        ])
+        self.assertEqual((history.provider_id, history.model), ('groq', 'llama'))
+        saved = self.store.get(conversation['id'])
+        self.assertEqual(saved['title'], 'What is 2+2?')
+        self.assertEqual([m['id'] for m in saved['messages'][1:]], [m['id'] for m in stored])
+        self.assertEqual(saved['messages'][2]['metadata'], {"usage": {"total_tokens": 9}})
+
+    def test_cached_history_picks_up_messages_from_other_workers(self):
+        conversation_id = self.store.create()['id']
+        self.store.history(conversation_id)
+        self.store.append(conversation_id, [{"role": "user", "content": "one"}])
+
+        # A second store on the same database stands in for another worker
+        self.new_store().append(conversation_id, [{"role": "user", "content": "two"}])
+        self.store.append(conversation_id, [{"role": "user", "content": "three"}])
+
+        self.assertEqual([m['content'] for m in self.store.history(conversation_id).messages],
+                         ["one", "two", "three"])
+        self.assertEqual(self.store.stats()['hits'], 1)
+        self.assertEqual(self.store.stats()['misses'], 1)
+
+    def test_cache_is_bounded(self):
+        store = self.new_store(cache_size=2)
+        ids = [store.create()['id'] for _ in range(3)]
+        for conversation_id in ids:
+            store.history(conversation_id)
+        self.assertEqual(store.stats()['cached'], 2)
+
+    def test_missing_and_deleted_conversations(self):
+        self.assertIsNone(self.store.history(42))
+        self.assertIsNone(self.store.get(42))
+        with self.assertRaises(KeyError):
+            self.store.append(42, [{"role": "user", "content": "hi"}])
+
+        conversation_id = self.store.create()['id']
+        self.store.append(conversation_id, [{"role": "user", "content": "hi"}])
+        self.assertTrue(self.store.delete(conversation_id))
+        self.assertFalse(self.store.delete(conversation_id))
+        self.assertIsNone(self.store.history(conversation_id))
+
+    def test_incremental_reads_use_the_conversation_id_index(self):
+        indexes = inspect(self.engine).get_indexes('messages')
+        self.assertIn(['conversation_id', 'id'], [index['column_names'] for index in indexes])
+
+        statement = self.store._messages_after_query(1, 5)
+        with self.engine.connect() as connection:
+            plan = ' '.join(str(row[-1]) for row in connection.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + str(statement.compile(compile_kwargs={'literal_binds': True}))))
+        self.assertIn('ix_messages_conversation_id_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+class TestConversationRoutes(unittest.TestCase):
+    def setUp(self):
+        from app.routes import chat
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        engine = create_engine('sqlite:///' + os.path.join(self.temp_dir.name, 'chat.db'),
+                               connect_args={'check_same_thread': False})
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(bind=engine)
+        self.store = ConversationStore(scoped_session(sessionmaker(bind=engine)))
+        self.service = MagicMock()
+        for target, value in (('get_conversation_store', lambda: self.store),
+                              ('completion_service', self.service)):
+            patcher = patch.object(chat, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        app = Flask(__name__)
+        app.register_blueprint(chat.chat_bp, url_prefix='/api/chat')
+        self.client = app.test_client()
+
+    def test_clients_send_only_the_new_message(self):
+        self.service.generate_completion.side_effect = [
+            {"text": "Hello!", "finish_reason": "stop", "usage": {"total_tokens": 5}},
+            {"text": "Fine.", "finish_reason": "stop", "usage": {"total_tokens": 9}}
+        ]
+        created = self.client.post('/api/chat/conversations', json={"provider": "groq", "model": "llama"})
+        self.assertEqual(created.status_code, 201)
+        url = f"/api/chat/conversations/{created.get_json()['id']}/completions"
+
+        first = self.client.post(url, json={"message": "Hi"})
+        second = self.client.post(url, json={"message": {"content": "How are you?"}, "options": {"temperature": 0}})
+
+        self.assertEqual(first.get_json()['text'], "Hello!")
+        self.assertEqual(len(second.get_json()['message_ids']), 2)
+        provider_id, model, messages, options = self.service.generate_completion.call_args.args[:4]
+        self.assertEqual((provider_id, model, options), ('groq', 'llama', {"temperature": 0}))
+        self.assertEqual(messages, [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello!"},
+            {"role": "user", "content": "How are you?"}
+        ])
+        saved = self.client.get(f"/api/chat/conversations/{created.get_json()['id']}").get_json()
+        self.assertEqual([m['content'] for m in saved['messages']], ["Hi", "Hello!", "How are you?", "Fine."])
+
+    def test_failed_turns_are_not_saved(self):
+        conversation_id = self.store.create('groq', 'llama')['id']
+        self.service.generate_completion.return_value = {"error": "upstream failed"}
+
+        response = self.client.post(f"/api/chat/conversations/{conversation_id}/completions", json={"message": "Hi"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.store.history(conversation_id).messages, [])
+
+    def test_stream_saves_reply_when_complete(self):
+        conversation_id = self.store.create('groq', 'llama')['id']
+        self.service.stream_completion.return_value = iter([
+            {"type": "delta", "text": "Hel"}, {"type": "delta", "text": "lo"},
+            {"type": "usage", "finish_reason": "stop", "usage": {"total_tokens": 3}}
+        ])
+
+        body = self.client.post(f"/api/chat/conversations/{conversation_id}/stream",
+                                json={"message": "Hi"}).get_data(as_text=True)
+
+        self.assertIn('event: conversation', body)
+        self.assertEqual(self.store.history(conversation_id).messages,
+                         [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}])
+
+    def test_rejects_missing_message_and_unknown_conversation(self):
+        conversation_id = self.store.create()['id']
+        self.assertEqual(self.client.post(f"/api/chat/conversations/{conversation_id}/completions",
+                                          json={}).status_code, 400)
+        self.assertEqual(self.client.post("/api/chat/conversations/999/completions",
+                                          json={"message": "Hi"}).status_code, 404)
+        self.assertEqual(self.client.get("/api/chat/conversations/999").status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
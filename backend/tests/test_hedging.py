@@ -0,0 +1,192 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.hedging import Hedger, LatencyTracker, parse_targets, PRIMARY, SECONDARY
+from app.services.completion_service import CompletionService
+from app.services.single_flight import SingleFlight
+
+PRIMARY_KEY = ('groq', 'llama')
+SECONDARY_KEY = ('openai', 'gpt-4o-mini')
+
+def slow(result, seconds):
+    def call():
+        time.sleep(seconds)
+        return result
+    return call
+
+def slow_stream(texts, first_delay):
+    def factory():
+        time.sleep(first_delay)
+        for text in texts:
+            yield {"type": "delta", "text": text}
+        yield {"type": "usage", "finish_reason": "stop", "usage": {"total_tokens": len(texts)}}
+    return factory
+
+class TestHedger(unittest.TestCase):
+    def setUp(self):
+        self.hedger = Hedger(min_delay=0.05, max_delay=1.0, default_delay=0.05)
+
+    def test_parse_targets(self):
+        self.assertEqual(parse_targets("groq=openai:gpt-4o-mini, openai:gpt-4o=groq,bad"), {
+            'groq': ('openai', 'gpt-4o-mini'),
+            'openai:gpt-4o': ('groq', None)
+        })
+
+    def test_percentile_delay(self):
+        tracker = LatencyTracker()
+        self.assertIsNone(tracker.percentile('groq', 'm', 95))
+        for i in range(100):
+            tracker.record('groq', 'm', i / 100)
+        self.assertAlmostEqual(tracker.percentile('groq', 'm', 95), 0.95)
+
+        self.hedger.tracker = tracker
+        self.hedger.min_samples = 10
+        self.assertEqual(self.hedger.delay_for('groq', 'm'), 0.95)
+        # Without samples the default delay is used
+        self.assertEqual(self.hedger.delay_for('openai', 'm'), 0.05)
+
+    def test_streams_and_completions_have_separate_delays(self):
+        self.hedger.min_samples = 1
+        self.hedger.run(PRIMARY_KEY, slow({'text': 'p'}, 0.3), SECONDARY_KEY, slow({'text': 's'}, 1.0))
+        list(self.hedger.stream(PRIMARY_KEY, slow_stream(['p'], 0), SECONDARY_KEY, slow_stream(['s'], 1.0))[0])
+
+        # A quick first token does not shorten the wait for a whole completion, and vice versa
+        self.assertGreaterEqual(self.hedger.delay_for(*PRIMARY_KEY), 0.3)
+        self.assertEqual(self.hedger.delay_for(*PRIMARY_KEY, stream=True), 0.05)
+
+    def test_fast_primary_is_not_hedged(self):
+        secondary = MagicMock()
+        result, outcome = self.hedger.run(PRIMARY_KEY, lambda: {'text': 'p'}, SECONDARY_KEY, secondary)
+
+        self.assertEqual(result, {'text': 'p'})
+        self.assertFalse(outcome['hedged'])
+        secondary.assert_not_called()
+
+    def test_slow_primary_loses_to_secondary(self):
+        result, outcome = self.hedger.run(
+            PRIMARY_KEY, slow({'text': 'p', 'usage': {'total_tokens': 7}}, 0.5),
+            SECONDARY_KEY, slow({'text': 's'}, 0.01)
+        )
+
+        self.assertEqual(result, {'text': 's'})
+        self.assertEqual(outcome['winner'], SECONDARY)
+        time.sleep(0.6)
+        stats = self.hedger.stats()
+        self.assertEqual(stats['hedged'], 1)
+        self.assertEqual(stats['win_rate'], 1.0)
+        # The discarded primary answer is counted as extra spend
+        self.assertEqual(stats['extra_tokens'], 7)
+
+    def test_failed_secondary_falls_back_to_primary(self):
+        def failing():
+            raise RuntimeError("secondary down")
+
+        result, outcome = self.hedger.run(PRIMARY_KEY, slow({'text': 'p'}, 0.2), SECONDARY_KEY, failing)
+
+        self.assertEqual(result, {'text': 'p'})
+        self.assertEqual(outcome['winner'], PRIMARY)
+        self.assertTrue(outcome['hedged'])
+
+    def test_stream_switches_to_first_stream_with_a_token(self):
+        events, outcome = self.hedger.stream(
+            PRIMARY_KEY, slow_stream(['slow'], 0.5), SECONDARY_KEY, slow_stream(['fast', ' reply'], 0.01)
+        )
+
+        texts = [event['text'] for event in events if event['type'] == 'delta']
+        self.assertEqual(texts, ['fast', ' reply'])
+        self.assertEqual(outcome['winner'], SECONDARY)
+        self.assertEqual(self.hedger.stats()['cancelled_losers'], 1)
+
+    def test_stream_primary_error_before_hedge_is_raised(self):
+        def failing():
+            raise RuntimeError("primary down")
+            yield
+
+        events, _ = self.hedger.stream(PRIMARY_KEY, failing, SECONDARY_KEY, slow_stream(['s'], 0))
+        with self.assertRaises(RuntimeError):
+            list(events)
+
+class TestAsyncHedger(unittest.IsolatedAsyncioTestCase):
+    async def test_loser_is_cancelled(self):
+        hedger = Hedger(min_delay=0.05, default_delay=0.05)
+        cancelled = threading.Event()
+
+        async def primary():
+            try:
+                await asyncio.sleep(1)
+                return {'text': 'p'}
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def secondary():
+            return {'text': 's'}
+
+        result, outcome = await hedger.arun(PRIMARY_KEY, primary, SECONDARY_KEY, secondary)
+        await asyncio.sleep(0)
+
+        self.assertEqual(result, {'text': 's'})
+        self.assertEqual(outcome['winner'], SECONDARY)
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(hedger.stats()['cancelled_losers'], 1)
+
+    async def test_stream_switches_to_secondary(self):
+        hedger = Hedger(min_delay=0.05, default_delay=0.05)
+
+        async def primary():
+            await asyncio.sleep(1)
+            yield {"type": "delta", "text": "slow"}
+
+        async def secondary():
+            yield {"type": "delta", "text": "fast"}
+            yield {"type": "usage", "finish_reason": "stop", "usage": None}
+
+        events, outcome = hedger.astream(PRIMARY_KEY, primary, SECONDARY_KEY, secondary)
+        received = [event async for event in events]
+
+        self.assertEqual(received[0]['text'], 'fast')
+        self.assertEqual(outcome['winner'], SECONDARY)
+
+class TestCompletionServiceHedging(unittest.TestCase):
+    def setUp(self):
+        self.primary = MagicMock()
+        self.backup = MagicMock()
+        self.registry = MagicMock()
+        self.registry.get_provider.side_effect = {'groq': self.primary, 'openai': self.backup}.get
+        self.hedger = Hedger(targets=parse_targets("groq=openai:gpt-4o-mini"), min_delay=0.05, default_delay=0.05)
+        self.service = CompletionService(self.registry, coalescer=SingleFlight(), hedger=self.hedger)
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_response_reports_the_winner(self, *_):
+        self.primary.generate_completion.side_effect = lambda *args: slow({'text': 'p'}, 0.5)()
+        self.backup.generate_completion.return_value = {'text': 's'}
+
+        response = self.service.generate_completion('groq', 'llama', [{"role": "user", "content": "hi"}], hedge=True)
+
+        self.assertEqual(response['text'], 's')
+        self.assertEqual(response['hedge']['provider'], 'openai')
+        self.assertEqual(response['hedge']['model'], 'gpt-4o-mini')
+        self.backup.generate_completion.assert_called_once_with(
+            [{"role": "user", "content": "hi"}], 'gpt-4o-mini', {})
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_hedging_is_off_by_default(self, *_):
+        self.primary.generate_completion.return_value = {'text': 'p'}
+
+        response = self.service.generate_completion('groq', 'llama', [{"role": "user", "content": "hi"}])
+
+        self.assertNotIn('hedge', response)
+        self.assertEqual(self.hedger.stats()['requests'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
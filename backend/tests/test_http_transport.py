@@ -0,0 +1,66 @@
+import unittest
+import asyncio
+import os
+import sys
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.http_transport import HttpTransport, get_http_transport
+from app.services.ai_providers.base_provider import BaseProvider
+
+class TestHttpTransport(unittest.TestCase):
+    def setUp(self):
+        self.transport = HttpTransport(pool_connections=4, pool_maxsize=8,
+                                       connect_timeout=2.0, read_timeout=15.0)
+
+    def tearDown(self):
+        self.transport.close()
+
+    def test_resolve_timeout(self):
+        self.assertEqual(self.transport._resolve_timeout(None), (2.0, 15.0))
+        self.assertEqual(self.transport._resolve_timeout(10), (2.0, 10))
+        self.assertEqual(self.transport._resolve_timeout((1, 3)), (1, 3))
+
+    def test_request_uses_pooled_session(self):
+        with patch.object(self.transport._session, 'request') as mock_request:
+            mock_request.return_value = MagicMock(status_code=200)
+            response = self.transport.post('https://example.com/v1/chat', json={'a': 1})
+
+        self.assertEqual(response.status_code, 200)
+        mock_request.assert_called_once_with('POST', 'https://example.com/v1/chat',
+                                             timeout=(2.0, 15.0), json={'a': 1})
+
+    def test_stats_empty(self):
+        stats = self.transport.stats()
+        self.assertEqual(stats['backend'], 'requests')
+        self.assertEqual(stats['totals']['requests'], 0)
+        self.assertEqual(stats['totals']['hit_ratio'], 0.0)
+
+    def test_async_clients_of_closed_loops_are_dropped(self):
+        async def client():
+            return self.transport._get_async_client()
+
+        loop = asyncio.new_event_loop()
+        first = loop.run_until_complete(client())
+        loop.close()
+        second = asyncio.run(client())
+
+        self.assertIsNot(first, second)
+        # The closed loop is still referenced here, so only the eviction on lookup drops its client
+        self.assertNotIn(loop, self.transport._async_clients)
+        self.assertEqual(len(self.transport._async_clients), 0)
+
+    def test_providers_share_transport(self):
+        class DummyProvider(BaseProvider):
+            def get_supported_models(self):
+                return []
+
+        first = DummyProvider('key-1')
+        second = DummyProvider('key-2')
+        self.assertIs(first.transport, second.transport)
+        self.assertIs(first.transport, get_http_transport())
+
+if __name__ == '__main__':
+    unittest.main()
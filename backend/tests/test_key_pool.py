@@ -0,0 +1,135 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.errors import UpstreamError
+from app.services.ai_providers.key_pool import KeyPool, split_keys
+from app.services.ai_providers.openai_compatible import OpenAICompatibleProvider
+from app.services.ai_providers.rate_limiter import get_rate_limiter
+from app.services import usage_ledger
+from app.services.usage_ledger import UsageLedger
+
+class TestKeyPool(unittest.TestCase):
+    def test_split_keys(self):
+        self.assertEqual(split_keys(" a, b,,a "), ['a', 'b'])
+        self.assertEqual(split_keys(['x', 'y']), ['x', 'y'])
+        self.assertEqual(split_keys(None), [])
+
+    def test_least_outstanding_key_is_leased(self):
+        pool = KeyPool(['a', 'b'], max_rate_limited=3, cooldown=60)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertNotEqual(first.key, second.key)
+
+        first.release()
+        first.release()
+        self.assertEqual(pool.acquire().key, first.key)
+
+    def test_remaining_quota_breaks_ties(self):
+        pool = KeyPool(['a', 'b'], max_rate_limited=3, cooldown=60)
+        quota = {'a': 0.1, 'b': 0.9}
+        self.assertEqual(pool.acquire(quota=quota.get).key, 'b')
+
+    def test_auth_errors_disable_a_key_but_never_the_last(self):
+        pool = KeyPool(['a', 'b'], max_rate_limited=3, cooldown=60)
+        pool.record('a', 401)
+        self.assertEqual({pool.acquire().key for _ in range(3)}, {'b'})
+
+        pool.record('b', 401)
+        self.assertEqual(pool.acquire().key, 'b')
+        stats = pool.stats('groq')
+        self.assertEqual(sorted(entry['state'] for entry in stats.values()), ['disabled', 'healthy'])
+
+    def test_sustained_rate_limits_rest_a_key(self):
+        pool = KeyPool(['a', 'b'], max_rate_limited=2, cooldown=60)
+        pool.record('a', 429)
+        pool.record('a', 200, tokens=50)
+        pool.record('a', 429)
+        self.assertEqual(pool.acquire(exclude={'b'}).key, 'a')
+
+        pool.record('a', 429, retry_after=120)
+        with self.assertRaises(UpstreamError) as raised:
+            pool.acquire(exclude={'b'})
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertAlmostEqual(raised.exception.retry_after, 120, delta=1)
+
+        entry = next(entry for entry in pool.stats('groq').values() if entry['state'] == 'cooling_down')
+        self.assertEqual((entry['rate_limited'], entry['tokens']), (3, 50))
+
+    def test_readding_a_key_restores_it(self):
+        pool = KeyPool(['a', 'b'], max_rate_limited=3, cooldown=60)
+        pool.record('a', 403)
+        self.assertFalse(pool.add('a'))
+        self.assertTrue(pool.add('c'))
+        self.assertEqual(len(pool), 3)
+        self.assertEqual(pool.acquire(exclude={'b', 'c'}).key, 'a')
+
+class TestProviderKeyRotation(unittest.TestCase):
+    def setUp(self):
+        self.provider = OpenAICompatibleProvider('pool-key-1, pool-key-2')
+        self.provider.name = 'pooltest'
+        self.provider._api_base_url = 'https://api.example.com/v1'
+        self.provider.logger = MagicMock()
+        self.transport = MagicMock()
+        response = MagicMock(status_code=200, headers={})
+        response.json.return_value = {
+            'choices': [{'message': {'content': 'hi'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 5, 'completion_tokens': 5, 'total_tokens': 10}
+        }
+        self.transport.post.return_value = response
+
+    def _sent_keys(self):
+        return [call.kwargs['headers']['Authorization'] for call in self.transport.post.call_args_list]
+
+    def test_requests_are_spread_across_keys(self):
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport):
+            for _ in range(4):
+                self.provider.generate_completion([{'role': 'user', 'content': 'hello'}], 'm')
+
+        self.assertEqual(sorted(self._sent_keys()), ['Bearer pool-key-1'] * 2 + ['Bearer pool-key-2'] * 2)
+        stats = self.provider.key_pool.stats('pooltest')
+        self.assertEqual([entry['tokens'] for entry in stats.values()], [20, 20])
+        self.assertEqual([entry['outstanding'] for entry in stats.values()], [0, 0])
+
+    def test_key_with_a_full_rate_limiter_is_skipped(self):
+        self.provider.name = 'pooltest-limited'
+        limiter = get_rate_limiter('pooltest-limited', 'pool-key-1')
+        limiter.requests.set_limit(1)
+        limiter.requests.level = -10
+
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport):
+            for _ in range(2):
+                self.provider.generate_completion([{'role': 'user', 'content': 'hello'}], 'm')
+
+        self.assertEqual(self._sent_keys(), ['Bearer pool-key-2'] * 2)
+
+    def test_requests_without_a_response_refund_and_count_against_the_key(self):
+        limiter = MagicMock()
+        limiter.acquire.return_value = 7
+        limiter.remaining_fraction.return_value = 1.0
+        self.transport.post.side_effect = ConnectionError("connect timeout")
+        self.transport.stream.side_effect = ConnectionError("connect timeout")
+
+        keys = UsageLedger.attribute()
+        self.addCleanup(usage_ledger._call_keys.set, None)
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport), \
+             patch.object(self.provider, '_limiter', return_value=limiter):
+            with self.assertRaises(ConnectionError):
+                self.provider.generate_completion([{'role': 'user', 'content': 'hello'}], 'm')
+            self.assertIn(keys['pooltest'], self.provider.key_pool.stats('pooltest'))
+            with self.assertRaises(ConnectionError):
+                list(self.provider.stream_completion([{'role': 'user', 'content': 'hello'}], 'm'))
+
+        self.assertEqual(limiter.reconcile.call_args_list, [((7, 0),), ((7, 0),)])
+        stats = self.provider.key_pool.stats('pooltest').values()
+        self.assertEqual(sum(entry['transport_errors'] for entry in stats), 2)
+        self.assertEqual(sum(entry['errors'] for entry in stats), 2)
+        self.assertEqual([entry['state'] for entry in stats], ['healthy', 'healthy'])
+        self.assertEqual([entry['outstanding'] for entry in stats], [0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,23 +2,30 @@ import unittest
 import os
 import sys
 import tempfile
-import json
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from app.services import model_discovery
 from app.services.model_discovery import ModelDiscoveryService
+from app.services.model_store import ModelStore
+
+def catalog(models=None, not_modified=False, etag=None):
+    return {'models': models, 'not_modified': not_modified, 'etag': etag, 'last_modified': None}
 
 class TestModelDiscoveryService(unittest.TestCase):
     def setUp(self):
         self.service = ModelDiscoveryService()
         self.temp_dir = tempfile.TemporaryDirectory()
-        self.cache_file = os.path.join(self.temp_dir.name, 'test_model_cache.json')
-        self.service.cache_file = self.cache_file
+        self.store = ModelStore(os.path.join(self.temp_dir.name, 'models.db'))
+        self.service.model_store = self.store
+        model_discovery._fallbacks.clear()
 
     def tearDown(self):
+        self.store.close()
         self.temp_dir.cleanup()
 
     def test_get_supported_models(self):
@@ -27,32 +34,143 @@ class TestModelDiscoveryService(unittest.TestCase):
         self.assertEqual(models, [])
 
         # Test with cached models
-        cache_data = {
-            'test_provider': {
-                'models': ['model1', 'model2'],
-                'timestamp': (datetime.now() - timedelta(hours=1)).isoformat()
-            }
-        }
-        with open(self.cache_file, 'w') as f:
-            json.dump(cache_data, f)
-
+        self.store.put('test_provider', ['model1', 'model2'])
         models = self.service.get_supported_models('test_provider')
         self.assertEqual(models, ['model1', 'model2'])
 
+        # Expired entries are ignored
+        with patch('app.services.model_discovery.time.time', return_value=time.time() + 25 * 60 * 60):
+            self.assertEqual(self.service.get_supported_models('test_provider'), [])
+
+    def test_stale_entries_are_served_and_refreshed_in_background(self):
+        provider = MagicMock()
+        provider.fetch_models.return_value = catalog(['fresh'])
+        self.service.provider_registry = MagicMock()
+        self.service.provider_registry.get_provider.return_value = provider
+        self.store.put('test_provider', ['stale'])
+
+        # Within the soft TTL nothing is fetched
+        self.assertEqual(self.service.get_supported_models('test_provider'), ['stale'])
+        provider.get_supported_models.assert_not_called()
+
+        # Past the soft TTL the stale list is returned while a refresh runs
+        with patch('app.services.model_discovery.time.time', return_value=time.time() + 2 * 60 * 60), \
+             patch('app.services.model_discovery._revalidation_executor') as executor:
+            self.assertEqual(self.service.get_supported_models('test_provider'), ['stale'])
+            executor.submit.assert_called_once()
+            executor.submit.call_args[0][0]()
+
+        self.assertEqual(self.store.get('test_provider')[0], ['fresh'])
+
+    def test_expired_entries_are_refreshed_before_answering(self):
+        provider = MagicMock()
+        provider.fetch_models.return_value = catalog(['fresh'])
+        self.service.provider_registry = MagicMock()
+        self.service.provider_registry.get_provider.return_value = provider
+        self.store.put('test_provider', ['stale'])
+
+        with patch('app.services.model_discovery.time.time', return_value=time.time() + 25 * 60 * 60):
+            self.assertEqual(self.service.get_supported_models('test_provider'), ['fresh'])
+
+    def test_unchanged_catalog_is_fetched_conditionally(self):
+        provider = MagicMock()
+        provider.fetch_models.return_value = catalog(['a', 'b'], etag='"v1"')
+        first = self.service.refresh_catalog('test_provider', provider)
+        self.assertEqual(first, {'models': ['a', 'b'], 'previous': None, 'not_modified': False})
+        provider.fetch_models.assert_called_with(timeout=10)
+
+        provider.fetch_models.return_value = catalog(not_modified=True, etag='"v1"')
+        second = self.service.refresh_catalog('test_provider', provider)
+        provider.fetch_models.assert_called_with(timeout=10, etag='"v1"', last_modified=None)
+        self.assertTrue(second['not_modified'])
+        self.assertEqual(second['models'], ['a', 'b'])
+
+    def test_failed_fetch_falls_back_to_stored_models(self):
+        provider = MagicMock()
+        provider.fetch_models.side_effect = Exception("timeout")
+        self.service.provider_registry = MagicMock()
+        self.service.provider_registry.get_provider.return_value = provider
+        self.store.put('test_provider', ['stored'])
+
+        self.assertEqual(self.service.fetch_latest_models('test_provider'), ['stored'])
+
+    def test_failed_fetch_without_stored_models_serves_the_static_list(self):
+        provider = MagicMock()
+        provider.fetch_models.side_effect = Exception("timeout")
+        provider.supported_models = {'chat': ['static-a'], 'speech': ['static-b']}
+        self.service.provider_registry = MagicMock()
+        self.service.provider_registry.get_provider.return_value = provider
+
+        self.assertEqual(self.service.get_supported_models('test_provider'), ['static-a', 'static-b'])
+        self.assertEqual(self.service.get_supported_models('test_provider'), ['static-a', 'static-b'])
+        provider.get_supported_models.assert_not_called()
+        self.assertEqual(provider.fetch_models.call_count, 1)
+        self.assertIsNone(self.store.get('test_provider'))
+
+        # Past the failure TTL the catalog is fetched again
+        provider.fetch_models.side_effect = None
+        provider.fetch_models.return_value = catalog(['fresh'])
+        with patch('app.services.model_discovery.time.time', return_value=time.time() + 120):
+            self.assertEqual(self.service.get_supported_models('test_provider'), ['fresh'])
+
+    def test_empty_catalog_is_not_fetched_on_every_request(self):
+        provider = MagicMock()
+        provider.fetch_models.return_value = catalog([])
+        provider.supported_models = ['static-a']
+        self.service.provider_registry = MagicMock()
+        self.service.provider_registry.get_provider.return_value = provider
+
+        self.assertEqual(self.service.get_supported_models('test_provider'), ['static-a'])
+        self.assertEqual(self.service.get_supported_models('test_provider'), ['static-a'])
+        self.assertEqual(provider.fetch_models.call_count, 1)
+        self.assertIsNone(self.store.get('test_provider'))
+
+        # A stored list past the hard TTL is kept, and not refetched, when the catalog comes back empty
+        self.store.put('test_provider', ['stored'])
+        model_discovery._fallbacks.clear()
+        with patch('app.services.model_discovery.time.time', return_value=time.time() + 25 * 60 * 60):
+            self.assertEqual(self.service.get_supported_models('test_provider'), ['stored'])
+            self.assertEqual(self.service.get_supported_models('test_provider'), ['stored'])
+        self.assertEqual(provider.fetch_models.call_count, 2)
+
     def test_update_model_cache(self):
         self.service.update_model_cache('test_provider', ['model1', 'model2'])
 
-        with open(self.cache_file, 'r') as f:
-            cache_data = json.load(f)
+        models, updated_at = self.store.get('test_provider')
+        self.assertEqual(models, ['model1', 'model2'])
+        self.assertAlmostEqual(updated_at, time.time(), delta=5)
+
+    def test_concurrent_updates_do_not_lose_providers(self):
+        provider_ids = [f'provider_{i}' for i in range(20)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda pid: self.service.update_model_cache(pid, [f'{pid}-model']), provider_ids))
+
+        self.assertEqual(self.store.provider_ids(), sorted(provider_ids))
 
-        self.assertIn('test_provider', cache_data)
-        self.assertEqual(cache_data['test_provider']['models'], ['model1', 'model2'])
-        self.assertIn('timestamp', cache_data['test_provider'])
+    def test_writes_from_another_process_invalidate_memory(self):
+        self.store.put('test_provider', ['old'])
+        self.assertEqual(self.store.get('test_provider')[0], ['old'])
+
+        # A second store has its own connection, like another worker process
+        other = ModelStore(self.store.db_path)
+        other.put('test_provider', ['new'])
+        other.close()
+
+        self.assertEqual(self.store.get('test_provider')[0], ['new'])
+
+    def test_legacy_json_cache_is_imported(self):
+        legacy_path = os.path.join(self.temp_dir.name, 'model_cache.json')
+        with open(legacy_path, 'w') as f:
+            f.write('{"groq": {"models": ["llama"], "timestamp": "2025-05-18T01:10:21.123456"}}')
+
+        store = ModelStore(os.path.join(self.temp_dir.name, 'imported.db'), legacy_json_path=legacy_path)
+        self.assertEqual(store.get('groq')[0], ['llama'])
+        store.close()
 
     @patch('app.services.model_discovery.ProviderRegistry')
     def test_fetch_latest_models(self, MockProviderRegistry):
         mock_provider = MagicMock()
-        mock_provider.get_supported_models.return_value = ['model3', 'model4']
+        mock_provider.fetch_models.return_value = catalog(['model3', 'model4'])
         MockProviderRegistry.return_value.get_provider.return_value = mock_provider
 
         # Ensure the provider registry returns the mock provider for 'test_provider'
@@ -61,11 +179,7 @@ class TestModelDiscoveryService(unittest.TestCase):
         models = self.service.fetch_latest_models('test_provider')
         self.assertEqual(models, ['model3', 'model4'])
 
-        with open(self.cache_file, 'r') as f:
-            cache_data = json.load(f)
-
-        self.assertIn('test_provider', cache_data)
-        self.assertEqual(cache_data['test_provider']['models'], ['model3', 'model4'])
+        self.assertEqual(self.store.get('test_provider')[0], ['model3', 'model4'])
 
     def test_get_all_providers(self):
         providers = self.service.get_all_providers()
@@ -0,0 +1,130 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.model_store import ModelStore
+from app.services.model_discovery import ModelDiscoveryService
+from app.services.model_refresh_scheduler import ModelRefreshScheduler, parse_intervals
+
+class TestModelRefreshScheduler(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = ModelStore(os.path.join(self.temp_dir.name, 'models.db'))
+        self.discovery = MagicMock()
+        self.discovery.model_store = self.store
+        self.discovery.provider_registry.get_all_providers.return_value = {'groq': MagicMock(), 'openai': MagicMock()}
+        self.discovery.refresh_catalog.side_effect = lambda pid, provider: {
+            'models': [f'{pid}-model'], 'previous': None, 'not_modified': False}
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def make_scheduler(self, **kwargs):
+        options = dict(interval=3600, intervals={}, jitter=0.1, max_workers=2, tick_seconds=10)
+        options.update(kwargs)
+        scheduler = ModelRefreshScheduler(self.discovery, **options)
+        self.addCleanup(scheduler._executor.shutdown)
+        return scheduler
+
+    def wait_for_refreshes(self, scheduler):
+        deadline = time.time() + 5
+        while scheduler._running and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_parse_intervals(self):
+        self.assertEqual(parse_intervals("groq=1800, OpenAI=86400,bad,x=y"), {'groq': 1800.0, 'openai': 86400.0})
+
+    def test_only_the_lease_holder_refreshes(self):
+        leader = self.make_scheduler()
+        follower = self.make_scheduler()
+
+        now = time.time()
+        # Providers without a stored list are spread over the first tick
+        self.assertEqual(leader.tick(now=now), [])
+        self.assertEqual(sorted(leader.tick(now=now + 10)), ['groq', 'openai'])
+        self.assertEqual(follower.tick(now=now + 10), [])
+        self.wait_for_refreshes(leader)
+
+        status = follower.status()
+        self.assertEqual(status['scheduler']['leader'], leader.owner)
+        self.assertFalse(status['scheduler']['is_leader'])
+        self.assertTrue(status['providers']['groq']['ok'])
+        self.assertIn('duration_ms', status['providers']['openai'])
+
+    def test_lease_is_taken_over_when_it_expires(self):
+        leader = self.make_scheduler(tick_seconds=0.01)
+        self.assertTrue(self.store.acquire_lease('model-refresh', leader.owner, 0.01))
+        time.sleep(0.05)
+
+        follower = self.make_scheduler()
+        self.assertTrue(self.store.acquire_lease('model-refresh', follower.owner, 30))
+        self.assertFalse(self.store.acquire_lease('model-refresh', leader.owner, 30))
+
+    def test_fresh_providers_are_not_refreshed_again(self):
+        scheduler = self.make_scheduler(intervals={'groq': 60})
+        self.store.put('groq', ['cached'])
+        self.store.put('openai', ['cached'])
+
+        now = time.time()
+        self.assertEqual(scheduler.tick(now=now), [])
+        # groq's own interval is much shorter than the default
+        self.assertEqual(scheduler.tick(now=now + 120), ['groq'])
+
+    def test_failing_providers_back_off(self):
+        self.discovery.provider_registry.get_all_providers.return_value = {'groq': MagicMock()}
+        self.discovery.refresh_catalog.side_effect = Exception("API down")
+        scheduler = self.make_scheduler(jitter=0)
+
+        scheduler._due['groq'] = 0
+        scheduler.tick()
+        self.wait_for_refreshes(scheduler)
+        first_delay = scheduler._due['groq'] - time.time()
+        scheduler._due['groq'] = 0
+        scheduler.tick()
+        self.wait_for_refreshes(scheduler)
+        second_delay = scheduler._due['groq'] - time.time()
+
+        self.assertGreater(second_delay, first_delay * 1.5)
+        status = self.store.refresh_statuses()['groq']
+        self.assertFalse(status['ok'])
+        self.assertEqual(status['consecutive_failures'], 2)
+        self.assertEqual(status['error'], "API down")
+
+    def test_provider_fetch_errors_count_as_failures(self):
+        provider = MagicMock()
+        provider.fetch_models.side_effect = ConnectionError("connect timeout")
+        with patch('app.services.model_discovery.get_model_store', return_value=self.store):
+            self.discovery = ModelDiscoveryService()
+        self.discovery.provider_registry = MagicMock()
+        self.discovery.provider_registry.get_all_providers.return_value = {'groq': provider}
+        scheduler = self.make_scheduler(jitter=0)
+
+        for expected in (1, 2):
+            scheduler._due['groq'] = 0
+            self.assertEqual(scheduler.tick(), ['groq'])
+            self.wait_for_refreshes(scheduler)
+            status = self.store.refresh_statuses()['groq']
+            self.assertFalse(status['ok'])
+            self.assertEqual(status['consecutive_failures'], expected)
+            self.assertEqual(status['error'], "connect timeout")
+        self.assertEqual(provider.fetch_models.call_count, 2)
+
+    def test_unregistered_providers_are_not_refreshed(self):
+        self.discovery.provider_registry.get_available_provider_ids.return_value = ['groq', 'openai', 'anthropic']
+        scheduler = self.make_scheduler()
+
+        now = time.time()
+        scheduler.tick(now=now)
+        self.assertEqual(sorted(scheduler.tick(now=now + 10)), ['groq', 'openai'])
+        self.wait_for_refreshes(scheduler)
+        self.assertNotIn('anthropic', self.store.refresh_statuses())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch, MagicMock
+
+from flask import Flask, Response, stream_with_context
+from prometheus_client import CollectorRegistry
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.monitoring import MonitoringService
+from app.services.ai_providers.errors import UpstreamError
+from app.services.completion_service import CompletionService
+from app.services.resilience import Resilience
+from app.services.single_flight import SingleFlight
+
+class TestMonitoringService(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.monitoring = MonitoringService(registry=self.registry)
+
+    def sample(self, name, **labels):
+        return self.registry.get_sample_value(name, labels) or 0
+
+    def test_flask_requests_are_timed_per_route(self):
+        app = Flask(__name__)
+        self.monitoring.init_app(app)
+
+        @app.route('/items/<item_id>')
+        def item(item_id):
+            return {'id': item_id}
+
+        client = app.test_client()
+        # Requests are observed when the server closes the response
+        for path in ('/items/1', '/items/2', '/missing'):
+            client.get(path).close()
+        response = client.get('/metrics')
+        response.close()
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count',
+                                     method='GET', route='/items/<item_id>', status='200'), 2)
+        self.assertEqual(self.sample('http_request_duration_seconds_count',
+                                     method='GET', route='unmatched', status='404'), 1)
+        self.assertEqual(self.sample('http_requests_in_flight'), 0)
+        self.assertIn(b'http_request_duration_seconds_bucket', response.data)
+
+    def test_streamed_responses_are_observed_when_the_stream_closes(self):
+        app = Flask(__name__)
+        self.monitoring.init_app(app)
+        count = lambda: self.sample('http_request_duration_seconds_count', method='GET', route='/stream', status='200')
+
+        @app.route('/stream')
+        def stream():
+            def generate():
+                yield 'a'
+                yield 'b'
+            return Response(stream_with_context(generate()))
+
+        response = app.test_client().get('/stream', buffered=False)
+        self.assertEqual(self.sample('http_requests_in_flight'), 1)
+        self.assertEqual(count(), 0)
+
+        self.assertEqual(b''.join(response.response), b'ab')
+        response.close()
+        self.assertEqual(self.sample('http_requests_in_flight'), 0)
+        self.assertEqual(count(), 1)
+
+    def test_provider_calls_record_latency_throughput_and_errors(self):
+        response = self.monitoring.call('groq', 'llama', lambda: {'usage': {'completion_tokens': 10}})
+        self.assertEqual(response['usage']['completion_tokens'], 10)
+
+        with self.assertRaises(UpstreamError):
+            self.monitoring.call('groq', 'llama', MagicMock(side_effect=UpstreamError("down", 503)))
+
+        self.assertEqual(self.sample('provider_request_duration_seconds_count', provider='groq', model='llama'), 2)
+        self.assertEqual(self.sample('provider_tokens_per_second_count', provider='groq', model='llama'), 1)
+        self.assertEqual(self.sample('errors_total', source='provider', error='UpstreamError'), 1)
+        self.assertEqual(self.sample('provider_requests_in_flight', provider='groq'), 0)
+
+    def test_streams_record_time_to_first_token(self):
+        events = iter([{'type': 'delta', 'text': 'hello'},
+                       {'type': 'usage', 'usage': {'completion_tokens': 2}}])
+
+        self.assertEqual(len(list(self.monitoring.stream('groq', 'llama', events))), 2)
+
+        self.assertEqual(self.sample('provider_time_to_first_token_seconds_count', provider='groq', model='llama'), 1)
+        self.assertEqual(self.sample('provider_tokens_per_second_count', provider='groq', model='llama'), 1)
+
+    def test_custom_metrics(self):
+        self.monitoring.track_custom_metric('queue_depth', 3)
+        self.assertEqual(self.monitoring.get_metrics()['queue_depth'], 3)
+
+class TestAsyncMonitoring(unittest.IsolatedAsyncioTestCase):
+    async def test_async_streams_are_recorded(self):
+        registry = CollectorRegistry()
+        monitoring = MonitoringService(registry=registry)
+
+        async def events():
+            yield {'type': 'delta', 'text': 'hi'}
+            yield {'type': 'usage', 'usage': {'completion_tokens': 1}}
+
+        received = [event async for event in monitoring.astream('openai', 'gpt', events())]
+
+        self.assertEqual(len(received), 2)
+        self.assertEqual(registry.get_sample_value('provider_time_to_first_token_seconds_count',
+                                                   {'provider': 'openai', 'model': 'gpt'}), 1)
+
+class TestCompletionServiceMetrics(unittest.TestCase):
+    def test_cache_hits_and_provider_calls_are_counted(self):
+        registry = CollectorRegistry()
+        provider = MagicMock()
+        provider.generate_completion.return_value = {'text': 'ok', 'usage': {'completion_tokens': 1}}
+        providers = MagicMock()
+        providers.get_provider.return_value = provider
+        cache = MagicMock(has_disk_tier=False)
+        cache.get.side_effect = [None, {'text': 'ok'}]
+        service = CompletionService(providers, coalescer=SingleFlight(), hedger=MagicMock(),
+                                    resilience=Resilience(), monitoring=MonitoringService(registry=registry))
+
+        with patch.object(CompletionService, 'response_cache', cache), \
+                patch.object(CompletionService, 'semantic_cache', None):
+            for _ in range(2):
+                service.generate_completion('groq', 'llama', [{'role': 'user', 'content': 'hi'}])
+
+        self.assertEqual(provider.generate_completion.call_count, 1)
+        for result in ('hit', 'miss'):
+            self.assertEqual(registry.get_sample_value('cache_lookups_total',
+                                                       {'cache': 'response', 'result': result}), 1)
+        self.assertEqual(registry.get_sample_value('provider_request_duration_seconds_count',
+                                                   {'provider': 'groq', 'model': 'llama'}), 1)
+
+if __name__ == '__main__':
+    unittest.main()
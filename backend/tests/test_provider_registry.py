@@ -0,0 +1,122 @@
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.provider_registry import ProviderRegistry
+from app.services.ai_providers.key_validation_cache import KeyValidationCache, key_fingerprint
+from app.services.ai_providers.key_pool import KeyPool
+
+def make_provider_class(valid):
+    provider_class = MagicMock()
+    provider_class.__abstractmethods__ = frozenset()
+    provider_class.return_value.check_api_key.return_value = valid
+
+    def create(api_key):
+        provider_class.return_value._api_key = api_key
+        provider_class.return_value.key_pool = KeyPool(api_key)
+        return provider_class.return_value
+
+    provider_class.side_effect = create
+    return provider_class
+
+class TestProviderRegistry(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.temp_dir.name, 'key_cache.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_registry(self, provider_classes):
+        registry = ProviderRegistry()
+        registry.key_cache = KeyValidationCache(self.cache_file, ttl_seconds=60)
+        registry._discover_providers = lambda: setattr(registry, '_provider_ids', list(provider_classes))
+        registry._load_provider_class = provider_classes.get
+        return registry
+
+    def test_construction_is_lazy(self):
+        with patch.object(ProviderRegistry, '_discover_providers') as mock_discover:
+            registry = ProviderRegistry()
+            mock_discover.assert_not_called()
+
+    def test_env_keys_validated_in_background(self):
+        classes = {'good': make_provider_class(True), 'bad': make_provider_class(False)}
+        registry = self.make_registry(classes)
+
+        with patch.dict(os.environ, {'GOOD_API_KEY': 'k1', 'BAD_API_KEY': 'k2'}):
+            registry.get_available_provider_ids()
+            self.assertTrue(registry.wait_for_validation(timeout=5))
+
+        self.assertIn('good', registry.providers)
+        self.assertNotIn('bad', registry.providers)
+        self.assertEqual(registry.validation_status, {'good': 'valid', 'bad': 'invalid'})
+        self.assertIn('validate', registry.startup_timings)
+
+    def test_scripts_can_skip_key_validation(self):
+        classes = {'good': make_provider_class(True)}
+        registry = self.make_registry(classes)
+
+        with patch.dict(os.environ, {'GOOD_API_KEY': 'k1'}):
+            self.assertIn('good', registry.get_all_providers(validate=False))
+
+        self.assertTrue(registry.wait_for_validation(timeout=0))
+        classes['good'].return_value.check_api_key.assert_not_called()
+        self.assertEqual(registry.validation_status, {})
+
+    def test_register_unknown_provider(self):
+        registry = self.make_registry({})
+        with self.assertRaises(ValueError):
+            registry.register_provider('missing', 'key')
+
+    def test_verdicts_cached_by_fingerprint(self):
+        provider_class = make_provider_class(True)
+        registry = self.make_registry({'good': provider_class})
+
+        registry.register_provider('good', 'secret-key')
+        registry.register_provider('good', 'secret-key')
+        self.assertEqual(provider_class.return_value.check_api_key.call_count, 1)
+
+        with open(self.cache_file) as f:
+            contents = f.read()
+        self.assertNotIn('secret-key', contents)
+        self.assertIn(key_fingerprint('good', 'secret-key'), contents)
+
+        # Revalidation bypasses the cache
+        self.assertEqual(registry.revalidate('good'), {'good': 'valid'})
+        self.assertEqual(provider_class.return_value.check_api_key.call_count, 2)
+
+    def test_unreachable_provider_is_not_cached(self):
+        provider_class = make_provider_class(True)
+        provider_class.return_value.check_api_key.side_effect = Exception("timed out")
+        registry = self.make_registry({'slow': provider_class})
+
+        with self.assertRaises(ValueError):
+            registry.register_provider('slow', 'key')
+        self.assertIsNone(registry.key_cache.get('slow', 'key'))
+
+    def test_every_pooled_key_is_validated(self):
+        provider_class = make_provider_class(True)
+        provider_class.return_value.check_api_key.side_effect = lambda timeout, api_key: api_key != 'revoked'
+        registry = self.make_registry({'pooled': provider_class})
+
+        provider = registry.register_provider('pooled', 'good-1, revoked, good-2')
+
+        checked = sorted(call.kwargs['api_key'] for call in provider_class.return_value.check_api_key.call_args_list)
+        self.assertEqual(checked, ['good-1', 'good-2', 'revoked'])
+        self.assertFalse(registry.key_cache.get('pooled', 'revoked'))
+        self.assertTrue(provider.key_pool.is_disabled('revoked'))
+        self.assertEqual(provider.key_pool.stats('pooled')[key_fingerprint('pooled', 'revoked')[:8]]['reason'],
+                         'failed validation')
+        self.assertEqual({provider.key_pool.acquire().key for _ in range(4)}, {'good-1', 'good-2'})
+
+        # A provider whose keys are all rejected is not registered
+        with self.assertRaises(ValueError):
+            registry.register_provider('pooled', 'revoked')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+import os
+import sys
+import time
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.provider_router import (
+    ProviderRouter, RouteStats, parse_candidates, requirements_for, AUTO_PROVIDER_ID
+)
+from app.services.completion_service import CompletionService
+from app.services.single_flight import SingleFlight
+
+TEXT = [{"role": "user", "content": "hi"}]
+IMAGE = [{"role": "user", "content": [
+    {"type": "text", "text": "what is this?"},
+    {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}
+]}]
+
+class TestProviderRouter(unittest.TestCase):
+    def setUp(self):
+        self.providers = {'groq': MagicMock(), 'openai': MagicMock(), 'deepseek': MagicMock()}
+        self.registry = MagicMock()
+        self.registry.get_all_providers.return_value = self.providers
+        self.candidates = [('groq', 'llama-3.3-70b-versatile'), ('openai', 'gpt-4o-mini'),
+                           ('deepseek', 'deepseek-chat'), ('xai', 'grok-2-latest')]
+        self.router = ProviderRouter(self.registry, self.candidates, RouteStats(alpha=0.5))
+
+    def test_parse_candidates(self):
+        self.assertEqual(parse_candidates("Groq:llama-3.3-70b-versatile, openai:gpt-4o-mini,bad"),
+                         [('groq', 'llama-3.3-70b-versatile'), ('openai', 'gpt-4o-mini')])
+
+    def test_requirements(self):
+        needs = requirements_for([{"role": "user", "content": "x" * 4000}], {"max_tokens": 100})
+        self.assertEqual(needs, {'context': 1100, 'output_tokens': 100, 'vision': False})
+        self.assertTrue(requirements_for(IMAGE)['vision'])
+
+    def test_picks_the_fastest_candidate(self):
+        self.router.stats.record_success('groq', 'llama-3.3-70b-versatile', ttft=0.2, tokens=500, duration=1.0)
+        self.router.stats.record_success('openai', 'gpt-4o-mini', ttft=0.8, tokens=100, duration=1.0)
+        self.router.stats.record_success('deepseek', 'deepseek-chat', ttft=1.5, tokens=100, duration=1.0)
+
+        provider_id, provider, model, decision = self.router.route(TEXT)
+
+        self.assertEqual((provider_id, model), ('groq', 'llama-3.3-70b-versatile'))
+        self.assertIs(provider, self.providers['groq'])
+        # xai is not registered
+        self.assertEqual(decision['candidates'], 3)
+        self.assertIn('decision_us', decision)
+
+    def test_errors_steer_traffic_away_until_they_decay(self):
+        for _ in range(3):
+            self.router.stats.record_success('openai', 'gpt-4o-mini', ttft=0.5, tokens=100, duration=1.0)
+            self.router.stats.record_success('deepseek', 'deepseek-chat', ttft=0.9, tokens=100, duration=1.0)
+        self.router.candidates = self.candidates[1:3]
+        self.router._eligible_for = None
+        self.assertEqual(self.router.route(TEXT)[0], 'openai')
+
+        for _ in range(4):
+            self.router.stats.record_error('openai', 'gpt-4o-mini')
+        self.assertEqual(self.router.route(TEXT)[0], 'deepseek')
+
+        # Once the failures are old enough the faster provider is tried again
+        self.router.stats.error_half_life = 0.01
+        time.sleep(0.1)
+        self.assertEqual(self.router.route(TEXT)[0], 'openai')
+
+    def test_requirements_filter_candidates(self):
+        self.router.stats.record_success('groq', 'llama-3.3-70b-versatile', ttft=0.1, tokens=1000, duration=1.0)
+        self.assertEqual(self.router.route(IMAGE)[0], 'openai')
+
+        # deepseek-chat's 64k window is too small for this prompt; groq and openai fit
+        long_prompt = [{"role": "user", "content": "x" * 400000}]
+        _, _, _, decision = self.router.route(long_prompt)
+        self.assertEqual(decision['candidates'], 2)
+
+        with self.assertRaises(ValueError):
+            self.router.route([{"role": "user", "content": "x" * 4000000}])
+
+    def test_eligible_candidates_follow_registered_providers(self):
+        self.assertEqual(self.router.route(TEXT)[3]['candidates'], 3)
+        del self.providers['groq']
+        del self.providers['deepseek']
+        self.assertEqual(self.router.route(TEXT)[0], 'openai')
+
+class TestCompletionServiceRouting(unittest.TestCase):
+    def setUp(self):
+        self.provider = MagicMock()
+        self.registry = MagicMock()
+        self.registry.get_all_providers.return_value = {'groq': self.provider}
+        self.registry.get_provider.side_effect = {'groq': self.provider}.get
+        self.registry.router = ProviderRouter(self.registry, [('groq', 'llama-3.3-70b-versatile')])
+        self.registry.route.side_effect = self.registry.router.route
+        self.service = CompletionService(self.registry, coalescer=SingleFlight(), hedger=MagicMock())
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_auto_response_reports_the_route(self, *_):
+        self.provider.generate_completion.return_value = {
+            'text': 'hello', 'usage': {'completion_tokens': 40}
+        }
+
+        response = self.service.generate_completion(AUTO_PROVIDER_ID, None, TEXT)
+
+        self.provider.generate_completion.assert_called_once_with(TEXT, 'llama-3.3-70b-versatile', {})
+        self.assertEqual(response['route']['provider'], 'groq')
+        self.assertEqual(response['route']['model'], 'llama-3.3-70b-versatile')
+        self.assertEqual(self.registry.router.stats.estimate(('groq', 'llama-3.3-70b-versatile'))[3], 1)
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_streams_record_time_to_first_token(self, *_):
+        def stream(*args):
+            time.sleep(0.05)
+            yield {"type": "delta", "text": "hello"}
+            yield {"type": "usage", "finish_reason": "stop", "usage": {"completion_tokens": 10}}
+        self.provider.stream_completion.side_effect = stream
+
+        events = list(self.service.stream_completion('groq', 'llama-3.3-70b-versatile', TEXT))
+
+        self.assertNotIn('route', events[-1])
+        ttft, _, error_rate, samples = self.registry.router.stats.estimate(('groq', 'llama-3.3-70b-versatile'))
+        self.assertGreaterEqual(ttft, 0.05)
+        self.assertLess(ttft, 0.5)
+        self.assertEqual((error_rate, samples), (0.0, 1))
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_failures_are_recorded(self, *_):
+        self.provider.generate_completion.side_effect = Exception("upstream down")
+
+        with self.assertRaises(Exception):
+            self.service.generate_completion(AUTO_PROVIDER_ID, None, TEXT)
+
+        self.assertAlmostEqual(self.registry.router.stats.estimate(('groq', 'llama-3.3-70b-versatile'))[2], 1.0, places=3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import os
+import sys
+import time
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.rate_limiter import (
+    RateLimiter, RateLimitExceeded, parse_limits, estimate_tokens, get_rate_limiter
+)
+from app.services.ai_providers.openai_compatible import OpenAICompatibleProvider
+from app.services.resilience import is_transient
+
+class TestRateLimiter(unittest.TestCase):
+    def test_parse_limits(self):
+        self.assertEqual(parse_limits("groq=30/6000, OpenAI=/200000,bad=x/y,empty=/"), {
+            'groq': (30.0, 6000.0),
+            'openai': (None, 200000.0)
+        })
+
+    def test_estimate_tokens(self):
+        payload = {'messages': [{'role': 'user', 'content': 'x' * 400}], 'max_tokens': 50}
+        self.assertEqual(estimate_tokens(payload), 150)
+
+    def test_requests_queue_instead_of_exceeding_the_limit(self):
+        # Two requests per second
+        limiter = RateLimiter('groq:test', rpm=120, max_wait=1.0)
+        limiter.requests.level = 1
+
+        started = time.perf_counter()
+        limiter.acquire(10)
+        limiter.acquire(10)
+        waited = time.perf_counter() - started
+
+        self.assertGreaterEqual(waited, 0.45)
+        stats = limiter.stats()
+        self.assertEqual(stats['queued'], 1)
+        self.assertGreater(stats['wait_ms_p95'], 400)
+
+    def test_waits_beyond_the_deadline_are_rejected(self):
+        limiter = RateLimiter('groq:test', tpm=600, max_wait=0.5)
+
+        limiter.acquire(600)
+        with self.assertRaises(RateLimitExceeded) as raised:
+            limiter.acquire(100)
+
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertAlmostEqual(raised.exception.retry_after, 10, delta=0.5)
+        self.assertFalse(is_transient(raised.exception))
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    def test_usage_reconciles_the_estimate(self):
+        limiter = RateLimiter('groq:test', tpm=1000)
+        reserved = limiter.acquire(800)
+        limiter.reconcile(reserved, 100)
+        self.assertAlmostEqual(limiter.tokens.level, 900, delta=1)
+
+    def test_limits_are_learned_from_headers(self):
+        limiter = RateLimiter('openai:test')
+        self.assertEqual(limiter.acquire(10 ** 9), 10 ** 9)
+
+        limiter.observe({
+            'x-ratelimit-limit-requests': '500',
+            'x-ratelimit-remaining-requests': '3',
+            'x-ratelimit-limit-tokens': '30000',
+            'x-ratelimit-remaining-tokens': '29000',
+            'x-ratelimit-reset-requests': '6m0s'
+        })
+
+        self.assertEqual((limiter.requests.per_minute, limiter.tokens.per_minute), (500, 30000))
+        self.assertAlmostEqual(limiter.requests.level, 3, delta=0.1)
+        self.assertAlmostEqual(limiter.tokens.level, 29000, delta=1)
+
+    def test_daily_request_limits_are_not_taken_as_per_minute(self):
+        limiter = get_rate_limiter('groq', 'daily-limit-test-key')
+        self.assertFalse(limiter.learn_request_limit)
+
+        limiter.observe({
+            'x-ratelimit-limit-requests': '14400',
+            'x-ratelimit-remaining-requests': '14370',
+            'x-ratelimit-limit-tokens': '6000',
+            'x-ratelimit-remaining-tokens': '5997'
+        })
+
+        self.assertIsNone(limiter.requests.per_minute)
+        self.assertEqual(limiter.tokens.per_minute, 6000)
+
+class TestProviderRateLimiting(unittest.TestCase):
+    def setUp(self):
+        self.provider = OpenAICompatibleProvider('rate-limit-test-key')
+        self.provider.name = 'ratetest'
+        self.provider._api_base_url = 'https://api.example.com/v1'
+        self.transport = MagicMock()
+
+    def test_completion_reconciles_usage_and_learns_headers(self):
+        response = MagicMock(status_code=200, headers={'x-ratelimit-limit-tokens': '10000'})
+        response.json.return_value = {
+            'choices': [{'message': {'content': 'hi'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 5, 'completion_tokens': 5, 'total_tokens': 10}
+        }
+        self.transport.post.return_value = response
+
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport):
+            self.provider.generate_completion([{'role': 'user', 'content': 'hello'}], 'm', {'max_tokens': 100})
+
+        limiter = get_rate_limiter('ratetest', 'rate-limit-test-key')
+        self.assertIs(self.provider._limiter('rate-limit-test-key'), limiter)
+        self.assertEqual(limiter.tokens.per_minute, 10000)
+        self.assertEqual(limiter.stats()['admitted'], 1)
+        self.assertNotIn('rate-limit-test-key', limiter.name)
+
+    def test_malformed_completion_is_still_settled(self):
+        response = MagicMock(status_code=200, headers={})
+        response.json.return_value = {'choices': []}
+        self.transport.post.return_value = response
+        self.provider.logger = MagicMock()
+        limiter = get_rate_limiter('ratetest', 'rate-limit-test-key')
+        limiter.tokens.set_limit(10000)
+        level = limiter.tokens.level
+
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport), \
+                patch.object(self.provider.key_pool, 'record') as record:
+            with self.assertRaises(IndexError):
+                self.provider.generate_completion([{'role': 'user', 'content': 'hello'}], 'm', {'max_tokens': 100})
+
+        record.assert_called_once_with('rate-limit-test-key', 200, 0, None)
+        self.assertAlmostEqual(limiter.tokens.level, level, delta=1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import unittest
+import os
+import sys
+import time
+from unittest.mock import patch, MagicMock
+
+import requests
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.errors import UpstreamError, parse_retry_after
+from app.services.resilience import (
+    Resilience, CircuitBreaker, CircuitOpenError, is_transient, CLOSED, OPEN, HALF_OPEN
+)
+from app.services.completion_service import CompletionService
+from app.services.single_flight import SingleFlight
+
+KEY = ('groq', 'llama')
+
+def failing_then(result, errors):
+    """Callable raising the given errors in turn, then returning result"""
+    errors = list(errors)
+    calls = []
+
+    def call():
+        calls.append(time.perf_counter())
+        if errors:
+            raise errors.pop(0)
+        return result
+    call.calls = calls
+    return call
+
+class TestRetries(unittest.TestCase):
+    def setUp(self):
+        self.resilience = Resilience(max_attempts=3, base_delay=0.01, max_delay=0.5, failure_threshold=5)
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient(UpstreamError("busy", 429)))
+        self.assertTrue(is_transient(UpstreamError("down", 503)))
+        self.assertTrue(is_transient(requests.ConnectionError("reset")))
+        self.assertTrue(is_transient(requests.Timeout("slow")))
+        self.assertFalse(is_transient(UpstreamError("bad request", 400)))
+        self.assertFalse(is_transient(CircuitOpenError('groq', 'llama', 10)))
+        self.assertFalse(is_transient(ValueError("bug")))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("2"), 2.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertGreater(parse_retry_after("Fri, 01 Jan 2100 00:00:00 GMT"), 0)
+
+    def test_transient_errors_are_retried(self):
+        call = failing_then('ok', [UpstreamError("down", 502), requests.ConnectionError("reset")])
+
+        self.assertEqual(self.resilience.call(KEY, call), 'ok')
+        self.assertEqual(len(call.calls), 3)
+        self.assertEqual(self.resilience.stats()['retries'], 2)
+        self.assertEqual(self.resilience.breaker(*KEY).failures, 0)
+
+    def test_permanent_errors_are_not_retried(self):
+        call = failing_then('ok', [UpstreamError("bad request", 400)])
+
+        with self.assertRaises(UpstreamError):
+            self.resilience.call(KEY, call)
+        self.assertEqual(len(call.calls), 1)
+
+    def test_retries_stop_after_max_attempts(self):
+        call = failing_then('ok', [UpstreamError("down", 503)] * 3)
+
+        with self.assertRaises(UpstreamError):
+            self.resilience.call(KEY, call)
+        self.assertEqual(len(call.calls), 3)
+
+    def test_retry_after_is_honoured(self):
+        call = failing_then('ok', [UpstreamError("slow down", 429, retry_after=0.2)])
+
+        self.assertEqual(self.resilience.call(KEY, call), 'ok')
+        self.assertGreaterEqual(call.calls[1] - call.calls[0], 0.2)
+
+    def test_retry_after_longer_than_max_delay_is_not_waited_for(self):
+        call = failing_then('ok', [UpstreamError("slow down", 429, retry_after=60)])
+
+        with self.assertRaises(UpstreamError):
+            self.resilience.call(KEY, call)
+        self.assertEqual(len(call.calls), 1)
+
+    def test_streams_are_only_retried_before_the_first_event(self):
+        attempts = []
+
+        def factory():
+            attempts.append(True)
+            if len(attempts) == 1:
+                raise requests.ConnectionError("reset")
+            yield {"type": "delta", "text": "a"}
+            raise requests.ConnectionError("reset mid-stream")
+
+        events = self.resilience.stream(KEY, factory)
+        self.assertEqual(next(events), {"type": "delta", "text": "a"})
+        with self.assertRaises(requests.ConnectionError):
+            next(events)
+        self.assertEqual(len(attempts), 2)
+
+class TestAsyncRetries(unittest.IsolatedAsyncioTestCase):
+    async def test_acall_retries(self):
+        resilience = Resilience(base_delay=0.01)
+        errors = [UpstreamError("down", 500)]
+
+        async def call():
+            if errors:
+                raise errors.pop()
+            return 'ok'
+
+        self.assertEqual(await resilience.acall(KEY, call), 'ok')
+        self.assertEqual(resilience.stats()['retries'], 1)
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_consecutive_failures_and_probes_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, half_open_trials=1)
+        breaker.record_failure(now=100)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure(now=100)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow(now=105))
+        self.assertEqual(breaker.retry_after(now=105), 5)
+
+        # After the reset timeout one trial is let through
+        self.assertTrue(breaker.allow(now=111))
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow(now=111))
+
+        # A failed trial opens the breaker again, a successful one closes it
+        breaker.record_failure(now=111)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertTrue(breaker.allow(now=122))
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow(now=122))
+
+    def test_abandoned_trial_is_released(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure(now=100)
+        self.assertTrue(breaker.allow(now=111))
+        breaker.release()
+        self.assertTrue(breaker.allow(now=111))
+
+    def test_open_breaker_fails_fast(self):
+        resilience = Resilience(max_attempts=1, failure_threshold=2, reset_timeout=30)
+        call = failing_then('ok', [requests.Timeout("slow")] * 2)
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                resilience.call(KEY, call)
+
+        with self.assertRaises(CircuitOpenError) as raised:
+            resilience.call(KEY, call)
+
+        self.assertEqual(len(call.calls), 2)
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(resilience.open_circuits(), {KEY})
+        stats = resilience.stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['breakers']['groq:llama']['state'], OPEN)
+
+class TestCompletionServiceResilience(unittest.TestCase):
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_provider_calls_are_retried(self, *_):
+        provider = MagicMock()
+        provider.generate_completion.side_effect = [UpstreamError("down", 503), {'text': 'ok'}]
+        registry = MagicMock()
+        registry.get_provider.return_value = provider
+        service = CompletionService(registry, coalescer=SingleFlight(), hedger=MagicMock(),
+                                    resilience=Resilience(base_delay=0.01))
+
+        response = service.generate_completion('groq', 'llama', [{"role": "user", "content": "hi"}])
+
+        self.assertEqual(response['text'], 'ok')
+        self.assertEqual(provider.generate_completion.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
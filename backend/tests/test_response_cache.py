@@ -0,0 +1,93 @@
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.response_cache import ResponseCache, completion_cache_key
+from app.services.completion_service import CompletionService
+
+MESSAGES = [{"role": "user", "content": "What is 2 + 2?"}]
+RESPONSE = {"text": "4", "finish_reason": "stop",
+            "usage": {"prompt_tokens": 8, "completion_tokens": 1, "total_tokens": 9}}
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_cache_key_is_canonical(self):
+        key = completion_cache_key('groq', 'm', MESSAGES, {'temperature': 0, 'max_tokens': 10})
+        self.assertEqual(key, completion_cache_key('groq', 'm', MESSAGES, {'max_tokens': 10, 'temperature': 0}))
+        # Options that do not change the output are ignored
+        self.assertEqual(key, completion_cache_key('groq', 'm', MESSAGES,
+                                                   {'temperature': 0, 'max_tokens': 10, 'stream': True}))
+        self.assertNotEqual(key, completion_cache_key('groq', 'm', MESSAGES, {'temperature': 1, 'max_tokens': 10}))
+        self.assertNotEqual(key, completion_cache_key('openai', 'm', MESSAGES, {'temperature': 0, 'max_tokens': 10}))
+
+    def test_memory_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put('a', {'text': 'a'})
+        cache.put('b', {'text': 'b'})
+        cache.get('a')
+        cache.put('c', {'text': 'c'})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'text': 'a'})
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertGreater(stats['bytes_saved'], 0)
+
+    def test_disk_tier_survives_restart_and_is_bounded(self):
+        cache = ResponseCache(max_entries=1, cache_dir=self.temp_dir.name, max_disk_bytes=400)
+        for i in range(10):
+            cache.put(f'key{i}', {'text': 'x' * 50})
+        self.assertLessEqual(cache.stats()['disk_bytes'], 400)
+
+        restarted = ResponseCache(max_entries=1, cache_dir=self.temp_dir.name, max_disk_bytes=400)
+        self.assertEqual(restarted.get('key9'), {'text': 'x' * 50})
+        self.assertEqual(restarted.stats()['disk_hits'], 1)
+
+class TestCompletionServiceCache(unittest.TestCase):
+    def setUp(self):
+        self.provider = MagicMock()
+        self.provider.generate_completion.return_value = RESPONSE
+        registry = MagicMock()
+        registry.get_provider.return_value = self.provider
+        self.service = CompletionService(registry)
+        self.cache = ResponseCache(max_entries=10)
+        patcher = patch('app.services.completion_service.get_response_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_bypass_and_refresh(self):
+        first = self.service.generate_completion('groq', 'm', MESSAGES)
+        second = self.service.generate_completion('groq', 'm', MESSAGES)
+        self.assertNotIn('cached', first)
+        self.assertTrue(second['cached'])
+        self.assertEqual(self.provider.generate_completion.call_count, 1)
+
+        self.service.generate_completion('groq', 'm', MESSAGES, cache_mode='bypass')
+        self.service.generate_completion('groq', 'm', MESSAGES, cache_mode='refresh')
+        self.assertEqual(self.provider.generate_completion.call_count, 3)
+
+        with self.assertRaises(ValueError):
+            self.service.generate_completion('groq', 'm', MESSAGES, cache_mode='sometimes')
+
+    def test_cached_response_replays_through_stream(self):
+        self.service.generate_completion('groq', 'm', MESSAGES)
+        events = list(self.service.stream_completion('groq', 'm', MESSAGES))
+
+        self.provider.stream_completion.assert_not_called()
+        self.assertEqual(events[0], {"type": "delta", "text": "4"})
+        self.assertEqual(events[-1]["type"], "usage")
+        self.assertTrue(events[-1]["cached"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import os
+import sys
+import io
+import json
+import tempfile
+from unittest.mock import MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.batch import BatchRunner
+from scripts.run_batch import Checkpoint, Progress, run_file
+
+def request(text, **extra):
+    return dict({"provider": "groq", "model": "m", "messages": [{"role": "user", "content": text}]}, **extra)
+
+def answer(provider_id, model, messages, *args):
+    text = messages[0]["content"]
+    return {"text": text.upper(), "usage": {"total_tokens": len(text)}}
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.input = os.path.join(self.temp_dir.name, 'requests.jsonl')
+        self.output = os.path.join(self.temp_dir.name, 'results.jsonl')
+
+    def write_input(self, lines):
+        with open(self.input, 'w', encoding='utf-8') as f:
+            f.writelines(line + '\n' for line in lines)
+
+    def run_batch(self, generate, concurrency=4):
+        service = MagicMock()
+        service.generate_completion.side_effect = generate
+        runner = BatchRunner(service, max_concurrency=concurrency, provider_limits={}, default_limit=concurrency)
+        return run_file(self.input, self.output, runner, progress_interval=60), service
+
+    def results(self):
+        with open(self.output, encoding='utf-8') as f:
+            return {row['line']: row for row in map(json.loads, f)}
+
+    def test_runs_every_line_and_records_failures(self):
+        self.write_input([json.dumps(request('a', id='first')), '', 'not json', json.dumps(request('b'))])
+
+        counters, _ = self.run_batch(answer)
+
+        results = self.results()
+        self.assertEqual(sorted(results), [0, 2, 3])
+        self.assertEqual(results[0], {'line': 0, 'id': 'first', 'status': 200,
+                                      'response': {'text': 'A', 'usage': {'total_tokens': 1}}})
+        self.assertEqual(results[2]['status'], 400)
+        self.assertIn('Invalid JSON', results[2]['error'])
+        self.assertEqual(counters, {'succeeded': 2, 'failed': 1, 'tokens': 2})
+
+        # A finished run is not repeated
+        _, service = self.run_batch(answer)
+        service.generate_completion.assert_not_called()
+
+    def test_resumes_without_resending_finished_lines(self):
+        self.write_input([json.dumps(request(str(i))) for i in range(10)])
+
+        def interrupted(provider_id, model, messages, *args):
+            if messages[0]["content"] == '6':
+                raise KeyboardInterrupt
+            return answer(provider_id, model, messages)
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_batch(interrupted, concurrency=1)
+        self.assertEqual(sorted(self.results()), list(range(6)))
+
+        # A result written after the last checkpoint is discarded and its line run again
+        with open(self.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'line': 6, 'status': 200}) + '\n')
+
+        counters, service = self.run_batch(answer)
+
+        sent = sorted(call.args[2][0]["content"] for call in service.generate_completion.call_args_list)
+        self.assertEqual(sent, ['6', '7', '8', '9'])
+        with open(self.output, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 10)
+        self.assertEqual(self.results()[6]['response']['text'], '6')
+        self.assertEqual(counters['succeeded'], 10)
+
+    def test_refuses_to_overwrite_output_without_checkpoint(self):
+        self.write_input([json.dumps(request('a'))])
+        with open(self.output, 'w') as f:
+            f.write('{}\n')
+        with self.assertRaises(ValueError):
+            self.run_batch(answer)
+
+    def test_checkpoint_advances_past_contiguous_lines(self):
+        checkpoint = Checkpoint(os.path.join(self.temp_dir.name, 'cp'), self.input)
+        for line, end in enumerate((10, 25, 40)):
+            checkpoint.track(line, end)
+        checkpoint.mark(1)
+        self.assertEqual((checkpoint.next_line, checkpoint.offset, checkpoint.done), (0, 0, {1}))
+        checkpoint.mark(0)
+        self.assertEqual((checkpoint.next_line, checkpoint.offset, checkpoint.done), (2, 25, set()))
+
+    def test_progress_reports_throughput_and_eta(self):
+        progress = Progress(total_bytes=1000, start_bytes=500, stream=io.StringIO(), interval=60)
+        progress.update(100, tokens=50)
+        progress.update(100, failed=True)
+        line = progress.render()
+        self.assertIn('2 rows (70.0%)', line)
+        self.assertIn('1 failed', line)
+        self.assertIn('ETA 0:00:00', line)
+
+if __name__ == '__main__':
+    unittest.main()
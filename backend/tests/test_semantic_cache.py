@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.semantic_cache import SemanticCache, HashedNgramEmbedder
+from app.services.completion_service import CompletionService
+
+SYSTEM = {"role": "system", "content": "You are a support assistant."}
+
+def ask(question, system=SYSTEM):
+    return [system, {"role": "user", "content": question}]
+
+class TestSemanticCache(unittest.TestCase):
+    def test_embedding_is_normalised(self):
+        vector = HashedNgramEmbedder(dim=256).embed("How do I reset my password?")
+        self.assertEqual(vector.dtype, np.float32)
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+
+    def test_near_duplicate_hit(self):
+        cache = SemanticCache(threshold=0.8)
+        cache.store('groq', 'm', ask("How do I reset my password?"), {}, {"text": "Use the reset link."})
+
+        match = cache.lookup('groq', 'm', ask("how do i reset my password"))
+        self.assertIsNotNone(match)
+        self.assertEqual(match[0]["text"], "Use the reset link.")
+        self.assertIsNone(cache.lookup('groq', 'm', ask("What are your opening hours?")))
+        # Other models and other conversation contexts never match
+        self.assertIsNone(cache.lookup('groq', 'other', ask("How do I reset my password?")))
+        self.assertIsNone(cache.lookup('groq', 'm', ask("How do I reset my password?",
+                                                        {"role": "system", "content": "Be terse."})))
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 3)
+        self.assertIn('p99', stats['lookup_ms'])
+
+    def test_eviction_keeps_max_entries(self):
+        cache = SemanticCache(threshold=0.99, max_entries=3)
+        for i in range(5):
+            cache.store('groq', 'm', ask(f"question number {i} about topic {i * 7}"), {}, {"text": str(i)})
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertIsNone(cache.lookup('groq', 'm', ask("question number 0 about topic 0")))
+        self.assertEqual(cache.lookup('groq', 'm', ask("question number 4 about topic 28"))[0]["text"], "4")
+
+class TestCompletionServiceSemanticCache(unittest.TestCase):
+    def test_semantic_hit_skips_provider(self):
+        provider = MagicMock()
+        provider.generate_completion.return_value = {"text": "Use the reset link."}
+        registry = MagicMock()
+        registry.get_provider.return_value = provider
+        service = CompletionService(registry)
+        cache = SemanticCache(threshold=0.75)
+
+        with patch('app.services.completion_service.get_response_cache', return_value=None), \
+                patch('app.services.completion_service.get_semantic_cache', return_value=cache):
+            service.generate_completion('groq', 'm', ask("How do I reset my password?"))
+            response = service.generate_completion('groq', 'm', ask("How can I reset my password?"))
+
+        self.assertEqual(provider.generate_completion.call_count, 1)
+        self.assertTrue(response["cached"])
+        self.assertGreaterEqual(response["similarity"], 0.75)
+
+if __name__ == '__main__':
+    unittest.main()
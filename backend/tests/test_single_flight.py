@@ -0,0 +1,177 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.single_flight import SingleFlight
+from app.services.completion_service import CompletionService
+
+MESSAGES = [{"role": "user", "content": "Tell me a joke"}]
+RESPONSE = {"text": "Knock knock", "finish_reason": "stop", "usage": {"total_tokens": 5}}
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_upstream_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return RESPONSE
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flight.do, 'key', upstream) for _ in range(4)]
+            # Wait until every follower has attached before releasing the leader
+            while flight.stats()['coalesced'] < 3:
+                threading.Event().wait(0.01)
+            release.set()
+            results = [future.result(5) for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([leader for _, leader in results].count(True), 1)
+        self.assertTrue(all(result is RESPONSE for result, _ in results))
+        stats = flight.stats()
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertAlmostEqual(stats['coalesced_ratio'], 0.75)
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def upstream():
+            release.wait(5)
+            raise RuntimeError("upstream failed")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(flight.do, 'key', upstream) for _ in range(2)]
+            while flight.stats()['coalesced'] < 1:
+                threading.Event().wait(0.01)
+            release.set()
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result(5)
+
+    def test_late_stream_joiner_gets_prefix_and_tail(self):
+        flight = SingleFlight()
+        first_sent, release = threading.Event(), threading.Event()
+
+        def upstream():
+            yield 'a'
+            first_sent.set()
+            release.wait(5)
+            yield 'b'
+            yield 'c'
+
+        leader_events, leader = flight.stream('key', upstream)
+        self.assertTrue(leader)
+        self.assertEqual(next(leader_events), 'a')
+        first_sent.wait(5)
+
+        joiner_events, joined_leader = flight.stream('key', upstream)
+        self.assertFalse(joined_leader)
+        release.set()
+
+        self.assertEqual(list(joiner_events), ['a', 'b', 'c'])
+        self.assertEqual(list(leader_events), ['b', 'c'])
+        self.assertEqual(flight.stats()['stream_joins'], 1)
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_upstream_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return RESPONSE
+
+        results = await asyncio.gather(*(flight.ado('key', upstream) for _ in range(5)))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([leader for _, leader in results].count(True), 1)
+        self.assertEqual(flight.stats()['coalesced'], 4)
+
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        flight = SingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.05)
+            return RESPONSE
+
+        first = asyncio.ensure_future(flight.ado('key', upstream))
+        second = asyncio.ensure_future(flight.ado('key', upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        result, leader = await second
+        self.assertIs(result, RESPONSE)
+        self.assertFalse(leader)
+
+    async def test_late_stream_joiner_gets_prefix_and_tail(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def upstream():
+            yield 'a'
+            await release.wait()
+            yield 'b'
+
+        leader_events, _ = flight.astream('key', upstream)
+        self.assertEqual(await leader_events.__anext__(), 'a')
+
+        joiner_events, leader = flight.astream('key', upstream)
+        self.assertFalse(leader)
+        release.set()
+
+        self.assertEqual([event async for event in joiner_events], ['a', 'b'])
+        self.assertEqual([event async for event in leader_events], ['b'])
+
+class TestCompletionServiceCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.provider = MagicMock()
+        self.registry = MagicMock()
+        self.registry.get_provider.return_value = self.provider
+        self.service = CompletionService(self.registry, coalescer=SingleFlight())
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_followers_get_a_marked_copy(self, *_):
+        release = threading.Event()
+
+        def generate(messages, model, options):
+            release.wait(5)
+            return dict(RESPONSE)
+
+        self.provider.generate_completion.side_effect = generate
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(self.service.generate_completion, 'groq', 'm', MESSAGES)
+                       for _ in range(3)]
+            while self.service.coalescer.stats()['coalesced'] < 2:
+                threading.Event().wait(0.01)
+            release.set()
+            results = [future.result(5) for future in futures]
+
+        self.assertEqual(self.provider.generate_completion.call_count, 1)
+        self.assertEqual(sum(1 for result in results if result.get('coalesced')), 2)
+        self.assertTrue(all(result['text'] == RESPONSE['text'] for result in results))
+
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_coalescing_can_be_disabled(self, *_):
+        self.provider.generate_completion.return_value = dict(RESPONSE)
+        with patch('app.services.completion_service.Config.COALESCE_REQUESTS', False):
+            response = self.service.generate_completion('groq', 'm', MESSAGES)
+
+        self.assertEqual(response, RESPONSE)
+        self.assertEqual(self.service.coalescer.stats()['calls'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import os
+import sys
+import json
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ai_providers.deepseek_provider import DeepseekProvider
+from app.services.ai_providers.errors import UpstreamError
+from app.services.ai_providers.http_transport import StreamedResponse
+from app.utils.utils import stream_event_to_sse
+
+UPSTREAM_LINES = [
+    'data: ' + json.dumps({"choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]}),
+    '',
+    'data: ' + json.dumps({"choices": [{"delta": {"content": "Hel"}, "finish_reason": None}]}),
+    ': keep-alive',
+    'data: ' + json.dumps({"choices": [{"delta": {"content": "lo"}, "finish_reason": "stop"}]}),
+    'data: ' + json.dumps({"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}}),
+    'data: [DONE]'
+]
+
+def fake_transport(status_code=200, lines=UPSTREAM_LINES, text=''):
+    transport = MagicMock()
+
+    @contextmanager
+    def stream(method, url, **kwargs):
+        transport.stream_kwargs = kwargs
+        yield StreamedResponse(status_code, lambda: iter(lines), lambda: text)
+
+    transport.stream = stream
+    return transport
+
+class TestStreaming(unittest.TestCase):
+    def test_stream_completion_relays_deltas_and_usage(self):
+        provider = DeepseekProvider("key")
+        transport = fake_transport()
+
+        with patch.object(DeepseekProvider, 'transport', transport):
+            events = list(provider.stream_completion([{"role": "user", "content": "hi"}], "deepseek-chat"))
+
+        self.assertEqual(events, [
+            {"type": "delta", "text": "Hel"},
+            {"type": "delta", "text": "lo"},
+            {"type": "usage", "finish_reason": "stop",
+             "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}}
+        ])
+        payload = transport.stream_kwargs["json"]
+        self.assertTrue(payload["stream"])
+        self.assertEqual(payload["stream_options"], {"include_usage": True})
+
+    def test_stream_completion_error_status(self):
+        provider = DeepseekProvider("key")
+        with patch.object(DeepseekProvider, 'transport', fake_transport(401, [], 'bad key')):
+            with self.assertRaises(Exception) as ctx:
+                list(provider.stream_completion([], "deepseek-chat"))
+        self.assertIn("401", str(ctx.exception))
+
+    def test_in_stream_error_chunk_raises_upstream_error(self):
+        provider = DeepseekProvider("key")
+        provider.logger = MagicMock()
+        lines = UPSTREAM_LINES[:3] + ['data: ' + json.dumps({"error": {"message": "overloaded", "code": 503}})]
+        with patch.object(DeepseekProvider, 'transport', fake_transport(lines=lines)):
+            with self.assertRaises(UpstreamError) as ctx:
+                list(provider.stream_completion([], "deepseek-chat"))
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertIn("overloaded", str(ctx.exception))
+
+    def test_sse_frames(self):
+        self.assertEqual(stream_event_to_sse({"type": "delta", "text": "Hi"}), 'data: {"text": "Hi"}\n\n')
+        frame = stream_event_to_sse({"type": "usage", "finish_reason": "stop", "usage": None})
+        self.assertTrue(frame.startswith("event: usage\ndata: "))
+
+if __name__ == '__main__':
+    unittest.main()
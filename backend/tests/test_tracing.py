@@ -0,0 +1,168 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+from unittest.mock import patch, MagicMock
+
+from flask import Flask, Response, stream_with_context
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.tracing import Tracer, JsonFileExporter, OTLPExporter, trace_span
+from app.services.completion_service import CompletionService
+from app.services.resilience import Resilience
+from app.services.single_flight import SingleFlight
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        self.tracer = Tracer(self.exporter, sample_rate=1.0, flush_interval=0.01)
+
+    def finished(self):
+        self.assertTrue(self.tracer.flush())
+        return {span.name: span for span in self.exporter.spans}
+
+    def test_child_spans_nest_under_the_root(self):
+        root = self.tracer.start_trace('POST /api/chat/completions')
+        with self.tracer.span('resolve_provider', provider='groq') as outer:
+            with self.tracer.span('provider.call'):
+                pass
+        self.tracer.finish_trace(root)
+
+        spans = self.finished()
+        self.assertEqual(spans['resolve_provider'].parent_id, root.span_id)
+        self.assertEqual(spans['provider.call'].parent_id, outer.span_id)
+        self.assertEqual({span.trace_id for span in spans.values()}, {root.trace_id})
+        self.assertIsNone(self.tracer.current())
+
+    def test_errors_are_recorded_on_the_span(self):
+        root = self.tracer.start_trace('request')
+        with self.assertRaises(ValueError):
+            with self.tracer.span('parse_request'):
+                raise ValueError("bad json")
+        self.tracer.finish_trace(root)
+
+        self.assertEqual(self.finished()['parse_request'].error, "ValueError: bad json")
+
+    def test_incoming_traceparent_is_continued(self):
+        parent = '00-' + 'a' * 32 + '-' + 'b' * 16 + '-01'
+        root = self.tracer.start_trace('request', parent)
+        self.tracer.finish_trace(root)
+
+        self.assertEqual((root.trace_id, root.parent_id), ('a' * 32, 'b' * 16))
+        self.assertTrue(root.traceparent.startswith('00-' + 'a' * 32))
+
+    def test_unsampled_traces_record_nothing(self):
+        tracer = Tracer(self.exporter, sample_rate=0.0)
+        root = tracer.start_trace('request')
+        with tracer.span('parse_request') as span:
+            self.assertIsNone(span)
+        tracer.finish_trace(root)
+
+        self.assertTrue(root.traceparent.endswith('-00'))
+        self.assertTrue(tracer.flush())
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_flask_responses_carry_the_trace_id(self):
+        app = Flask(__name__)
+        self.tracer.init_app(app)
+
+        @app.route('/hello')
+        def hello():
+            with self.tracer.span('serialize'):
+                return {'ok': True}
+
+        response = app.test_client().get('/hello')
+        response.close()
+
+        spans = self.finished()
+        root = spans['GET /hello']
+        self.assertEqual(response.headers['X-Trace-Id'], root.trace_id)
+        self.assertEqual(root.attributes['http.status_code'], 200)
+        self.assertEqual(spans['serialize'].parent_id, root.span_id)
+
+    def test_streamed_responses_end_their_span_when_the_stream_closes(self):
+        app = Flask(__name__)
+        self.tracer.init_app(app)
+
+        @app.route('/stream')
+        def stream():
+            def generate():
+                yield 'a'
+                yield 'b'
+            return Response(stream_with_context(generate()))
+
+        response = app.test_client().get('/stream', buffered=False)
+        self.assertEqual(self.finished(), {})
+
+        self.assertEqual(b''.join(response.response), b'ab')
+        response.close()
+        self.assertIn('GET /stream', self.finished())
+
+class TestExporters(unittest.TestCase):
+    def make_span(self):
+        tracer = Tracer(MagicMock(), sample_rate=1.0)
+        root = tracer.start_trace('request', **{'http.status_code': 200})
+        root.add_event('first_token')
+        tracer.finish_trace(root)
+        return root
+
+    def test_json_file_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            JsonFileExporter(path).export([self.make_span(), self.make_span()])
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['events'][0]['name'], 'first_token')
+
+    @patch('app.services.tracing.requests.post')
+    def test_otlp_exporter(self, post):
+        span = self.make_span()
+        OTLPExporter('http://collector:4318/').export([span])
+
+        url, payload = post.call_args.args[0], post.call_args.kwargs['json']
+        encoded = payload['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual(url, 'http://collector:4318/v1/traces')
+        self.assertEqual(encoded['traceId'], span.trace_id)
+        self.assertEqual(encoded['attributes'], [{'key': 'http.status_code', 'value': {'intValue': '200'}}])
+
+class TestCompletionServiceSpans(unittest.TestCase):
+    @patch('app.services.completion_service.get_semantic_cache', return_value=None)
+    @patch('app.services.completion_service.get_response_cache', return_value=None)
+    def test_stream_attempts_record_time_to_first_token(self, *_):
+        exporter = ListExporter()
+        tracer = Tracer(exporter, sample_rate=1.0, flush_interval=0.01)
+        provider = MagicMock()
+        provider.stream_completion.return_value = iter([{'type': 'delta', 'text': 'hi'},
+                                                        {'type': 'usage', 'usage': {}}])
+        registry = MagicMock()
+        registry.get_provider.return_value = provider
+        service = CompletionService(registry, coalescer=SingleFlight(), hedger=MagicMock(),
+                                    resilience=Resilience(), monitoring=MagicMock())
+        service.monitoring.stream.side_effect = lambda provider_id, model, events: events
+
+        with patch('app.services.tracing._tracer', tracer), patch('app.config.Config.COALESCE_REQUESTS', False):
+            root = tracer.start_trace('POST /api/chat/stream')
+            with trace_span('stream'):
+                list(service.stream_completion('groq', 'llama', [{'role': 'user', 'content': 'hi'}], hedge=False))
+            tracer.finish_trace(root)
+
+        self.assertTrue(tracer.flush())
+        spans = {span.name: span for span in exporter.spans}
+        self.assertIn('resolve_provider', spans)
+        self.assertIn('ttft_ms', spans['provider.stream'].attributes)
+        self.assertEqual(spans['provider.stream'].parent_id, spans['stream'].span_id)
+
+if __name__ == '__main__':
+    unittest.main()
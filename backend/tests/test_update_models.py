@@ -6,49 +6,84 @@ Unit tests for the model update functionality.
 import unittest
 import os
 import sys
+import tempfile
+import time
+import threading
 import logging
 from unittest.mock import patch, MagicMock
 
 # Ensure the script can find the app module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app.services.ai_providers.provider_registry import provider_registry
-from scripts.update_models import update_all_models
+from app.services.ai_providers.openai_compatible import OpenAICompatibleProvider
+from app.services.model_discovery import ModelDiscoveryService
+from app.services.model_store import ModelStore
+from scripts.update_models import update_all_models, format_result
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def catalog(models=None, not_modified=False, etag=None):
+    return {'models': models, 'not_modified': not_modified, 'etag': etag, 'last_modified': None}
+
 class TestUpdateModels(unittest.TestCase):
     def setUp(self):
         """Set up test environment before each test."""
         self.provider_registry = provider_registry
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = ModelStore(os.path.join(self.temp_dir.name, 'models.db'))
+        self.discovery = ModelDiscoveryService()
+        self.discovery.model_store = self.store
         self.providers = {
             'openai': MagicMock(),
             'groq': MagicMock()
         }
         for provider in self.providers.values():
-            provider.get_supported_models.return_value = ['model1', 'model2']
-            provider._cached_models = None
+            provider.fetch_models.return_value = catalog(['model1', 'model2'], etag='"v1"')
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
 
     @patch('app.services.ai_providers.provider_registry.provider_registry.get_all_providers')
     def test_update_all_models_success(self, mock_get_all_providers):
         """Test successful update of models for all providers."""
         mock_get_all_providers.return_value = self.providers
-        
+
         with patch('logging.Logger.info') as mock_info, patch('logging.Logger.error') as mock_error:
-            update_all_models()
-            
+            results = update_all_models(discovery=self.discovery)
+
             for provider_id, provider in self.providers.items():
-                self.assertIsNone(provider._cached_models, f"Cached models should be cleared for {provider_id}")
-                provider.get_supported_models.assert_called_once()
+                provider.fetch_models.assert_called_once()
+                self.assertEqual(self.store.get(provider_id)[0], ['model1', 'model2'])
+                self.assertEqual(results[provider_id]['models'], ['model1', 'model2'])
             mock_info.assert_called()
             mock_error.assert_not_called()
+        mock_get_all_providers.assert_called_with(validate=False)
+        for provider in self.providers.values():
+            self.assertLessEqual(provider.fetch_models.call_args.kwargs['timeout'], 30.0)
+
+    @patch('app.services.ai_providers.provider_registry.provider_registry.get_all_providers')
+    def test_unchanged_catalogs_are_not_rewritten(self, mock_get_all_providers):
+        """Test that a second run sends the stored ETag and keeps the stored list."""
+        mock_get_all_providers.return_value = self.providers
+        update_all_models(discovery=self.discovery)
+        for provider in self.providers.values():
+            provider.fetch_models.return_value = catalog(not_modified=True, etag='"v1"')
+
+        results = update_all_models(discovery=self.discovery)
+
+        for provider_id, provider in self.providers.items():
+            self.assertEqual(provider.fetch_models.call_args.kwargs['etag'], '"v1"')
+            self.assertTrue(results[provider_id]['not_modified'])
+            self.assertEqual(self.store.get(provider_id)[0], ['model1', 'model2'])
 
     @patch('app.services.ai_providers.provider_registry.provider_registry.get_all_providers')
     def test_update_all_models_empty_providers(self, mock_get_all_providers):
         """Test update models when no providers are registered."""
         mock_get_all_providers.return_value = {}
-        
+
         with patch('logging.Logger.warning') as mock_warning:
             update_all_models()
             mock_warning.assert_called_with("No providers are currently registered. Ensure API keys are set in environment variables.")
@@ -57,13 +92,68 @@ class TestUpdateModels(unittest.TestCase):
     def test_update_all_models_error(self, mock_get_all_providers):
         """Test update models when fetching models raises an exception."""
         error_provider = MagicMock()
-        error_provider.get_supported_models.side_effect = Exception("API error")
-        error_provider._cached_models = None
+        error_provider.fetch_models.side_effect = Exception("API error")
         mock_get_all_providers.return_value = {'error_provider': error_provider}
-        
+
         with patch('logging.Logger.error') as mock_error:
-            update_all_models()
+            results = update_all_models(discovery=self.discovery)
             mock_error.assert_called_with("Error updating models for error_provider: API error")
+        self.assertIsNone(results['error_provider'])
+
+    @patch('app.services.ai_providers.provider_registry.provider_registry.get_all_providers')
+    def test_slow_providers_do_not_exceed_the_budget(self, mock_get_all_providers):
+        """Test that the update returns once the time budget is spent."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_fetch(**kwargs):
+            release.wait(5)
+            raise Exception("cancelled")
+
+        slow_provider = MagicMock()
+        slow_provider.fetch_models.side_effect = slow_fetch
+        mock_get_all_providers.return_value = {'groq': self.providers['groq'], 'slow': slow_provider}
+
+        started = time.perf_counter()
+        with patch('logging.Logger.error') as mock_error:
+            results = update_all_models(budget=0.2, discovery=self.discovery)
+
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertIsNone(results['slow'])
+        self.assertEqual(results['groq']['models'], ['model1', 'model2'])
+        mock_error.assert_called_once()
+
+    def test_format_result_lists_added_and_removed_models(self):
+        lines = format_result('groq', {'models': ['a', 'c'], 'previous': ['a', 'b'],
+                                       'not_modified': False, 'duration_ms': 12.3})
+        self.assertEqual(lines, ["groq: 2 models, +1 -1 (12ms)", "  + c", "  - b"])
+
+class TestConditionalCatalogFetch(unittest.TestCase):
+    def setUp(self):
+        self.provider = OpenAICompatibleProvider('test-key')
+        self.provider._api_base_url = 'https://api.example.com/v1'
+        self.transport = MagicMock()
+
+    def test_sends_validators_and_handles_not_modified(self):
+        self.transport.get.return_value = MagicMock(status_code=304)
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport):
+            result = self.provider.fetch_models(etag='"v1"', last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+
+        headers = self.transport.get.call_args.kwargs['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(headers['If-Modified-Since'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertTrue(result['not_modified'])
+        self.assertIsNone(result['models'])
+
+    def test_returns_models_and_new_validators(self):
+        response = MagicMock(status_code=200, headers={'ETag': '"v2"'})
+        response.json.return_value = {'data': [{'id': 'a'}, {'id': 'b'}]}
+        self.transport.get.return_value = response
+        with patch.object(OpenAICompatibleProvider, 'transport', self.transport):
+            result = self.provider.fetch_models()
+
+        self.assertNotIn('If-None-Match', self.transport.get.call_args.kwargs['headers'])
+        self.assertEqual(result, {'models': ['a', 'b'], 'not_modified': False, 'etag': '"v2"', 'last_modified': None})
 
 if __name__ == '__main__':
     unittest.main()
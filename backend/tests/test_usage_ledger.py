@@ -0,0 +1,281 @@
+import unittest
+import os
+import sys
+import datetime
+import tempfile
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+# Add the parent directory to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models.db_models import Base, UsageRecord, UsageRollup
+from app.services.usage_ledger import (
+    UsageLedger, UsageEntry, cover, parse_prices, parse_time, estimate_usage, note_key, set_current_user
+)
+from app.services.completion_service import CompletionService
+from app.services.single_flight import SingleFlight
+
+T0 = datetime.datetime(2024, 3, 1, 22, 58, 30)
+MESSAGES = [{"role": "user", "content": "Tell me a joke"}]
+
+def entry(created_at, provider='groq', model='llama', user='alice', key='k1', prompt=10, completion=5,
+          latency=100.0, cost=0.001, estimated=False, error=False):
+    return UsageEntry(created_at, provider, model, user, key, prompt, completion, latency, cost, estimated, error)
+
+class TestUsageHelpers(unittest.TestCase):
+    def test_parse_prices(self):
+        self.assertEqual(parse_prices("openai:gpt-4o=2.5/10, Groq:llama=0.05,bad,x:y=a/b"),
+                         {('openai', 'gpt-4o'): (2.5, 10.0), ('groq', 'llama'): (0.05, 0.05)})
+
+    def test_cover_uses_the_coarsest_buckets(self):
+        start, end = datetime.datetime(2024, 3, 1, 22, 58), datetime.datetime(2024, 3, 4, 1, 3)
+        self.assertEqual(cover(start, end), [
+            ('minute', start, datetime.datetime(2024, 3, 1, 23, 0)),
+            ('hour', datetime.datetime(2024, 3, 1, 23, 0), datetime.datetime(2024, 3, 2)),
+            ('day', datetime.datetime(2024, 3, 2), datetime.datetime(2024, 3, 4)),
+            ('hour', datetime.datetime(2024, 3, 4), datetime.datetime(2024, 3, 4, 1, 0)),
+            ('minute', datetime.datetime(2024, 3, 4, 1, 0), end)
+        ])
+        self.assertEqual(cover(start, start + datetime.timedelta(minutes=1)),
+                         [('minute', start, start + datetime.timedelta(minutes=1))])
+        self.assertEqual(cover(end, start), [])
+
+    def test_parse_time(self):
+        now = datetime.datetime(2024, 3, 2, 12, 0)
+        self.assertEqual(parse_time('24h', now), datetime.datetime(2024, 3, 1, 12, 0))
+        self.assertEqual(parse_time('30m', now), datetime.datetime(2024, 3, 2, 11, 30))
+        self.assertEqual(parse_time('2024-03-01T10:00:00+02:00'), datetime.datetime(2024, 3, 1, 8, 0))
+        self.assertIsNone(parse_time(''))
+        with self.assertRaises(ValueError):
+            parse_time('yesterday')
+
+    def test_estimate_usage_fills_in_missing_counts(self):
+        reported = {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}
+        self.assertEqual(estimate_usage(MESSAGES, "Why?", reported), (reported, False))
+
+        usage, estimated = estimate_usage(MESSAGES, "Why did the chicken cross the road?", None)
+        self.assertTrue(estimated)
+        self.assertEqual(usage, {"prompt_tokens": 11, "completion_tokens": 9, "total_tokens": 20})
+
+        usage, estimated = estimate_usage(MESSAGES, "Why?", {"total_tokens": 20})
+        self.assertTrue(estimated)
+        self.assertEqual(usage, {"prompt_tokens": 11, "completion_tokens": 9, "total_tokens": 20})
+
+class TestUsageLedger(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.engine = create_engine('sqlite:///' + os.path.join(self.temp_dir.name, 'usage.db'),
+                                    connect_args={'check_same_thread': False})
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(bind=self.engine)
+        self.sessions = scoped_session(sessionmaker(bind=self.engine))
+        self.ledger = self.new_ledger()
+
+    def new_ledger(self, **overrides):
+        settings = dict(prices={('groq', 'llama'): (1.0, 2.0)}, batch_size=100, flush_interval=0.01,
+                        max_queue=100, retention_days=0)
+        settings.update(overrides)
+        return UsageLedger(self.sessions, **settings)
+
+    def count(self, model, **where):
+        with self.sessions() as session:
+            return session.scalar(select(func.count()).select_from(model).filter_by(**where))
+
+    def test_rollups_match_raw_rows(self):
+        entries = [entry(T0 + datetime.timedelta(minutes=17 * i), user='alice' if i % 3 else 'bob')
+                   for i in range(300)]
+        self.ledger._write(entries[:150])
+        self.ledger._write(entries[150:])
+
+        self.assertEqual(self.count(UsageRecord), 300)
+        for granularity in ('minute', 'hour', 'day'):
+            with self.sessions() as session:
+                self.assertEqual(session.scalar(select(func.sum(UsageRollup.requests))
+                                                .where(UsageRollup.granularity == granularity)), 300)
+        since, until = T0 + datetime.timedelta(minutes=40), T0 + datetime.timedelta(days=2, minutes=7)
+        expected = [e for e in entries if since.replace(second=0) <= e.created_at < until.replace(second=0)]
+
+        totals = self.ledger.totals(since, until)[0]
+
+        self.assertEqual(totals['requests'], len(expected))
+        self.assertEqual(totals['prompt_tokens'], 10 * len(expected))
+        self.assertEqual(totals['total_tokens'], 15 * len(expected))
+        self.assertEqual(totals['avg_latency_ms'], 100.0)
+        self.assertAlmostEqual(totals['cost'], 0.001 * len(expected))
+
+    def test_concurrent_writers_add_to_the_same_rollup(self):
+        self.ledger._write([entry(T0)])
+        sessions = sessionmaker(bind=self.engine, autoflush=False)
+        first, second = sessions(), sessions()
+
+        # The second writer runs while the first one's transaction is still open
+        UsageLedger._rollup(first, [entry(T0)])
+        writer = threading.Thread(target=lambda: (UsageLedger._rollup(second, [entry(T0)]), second.commit()))
+        writer.start()
+        time.sleep(0.1)
+        first.commit()
+        writer.join(timeout=5)
+        first.close()
+        second.close()
+
+        with self.sessions() as session:
+            self.assertEqual(list(session.scalars(select(UsageRollup.requests))), [3, 3, 3])
+
+    def test_totals_group_and_filter_by_dimension(self):
+        self.ledger._write([entry(T0, user='alice'), entry(T0, user='alice', model='big', error=True),
+                            entry(T0, user='bob', key='k2', estimated=True)])
+
+        by_user = self.ledger.totals(T0 - datetime.timedelta(hours=1), T0 + datetime.timedelta(hours=1), ['user'])
+        self.assertEqual([(row['user'], row['requests'], row['errors']) for row in by_user],
+                         [('alice', 2, 1), ('bob', 1, 0)])
+        self.assertEqual(self.ledger.totals(group_by=['model'], user='alice', key='k1')[1]['model'], 'llama')
+        self.assertEqual(self.ledger.totals(key='k2')[0]['estimated'], 1)
+        self.assertEqual(self.ledger.totals(user='nobody')[0]['requests'], 0)
+        with self.assertRaises(ValueError):
+            self.ledger.totals(group_by=['colour'])
+
+    def test_series_per_hour(self):
+        self.ledger._write([entry(T0), entry(T0 + datetime.timedelta(minutes=2)),
+                            entry(T0 + datetime.timedelta(hours=2))])
+
+        series = self.ledger.series('hour', T0, T0 + datetime.timedelta(hours=3))
+
+        self.assertEqual([(row['bucket'], row['requests']) for row in series],
+                         [('2024-03-01T22:00:00', 1), ('2024-03-01T23:00:00', 1), ('2024-03-02T00:00:00', 1)])
+        with self.assertRaises(ValueError):
+            self.ledger.series('week', T0)
+
+    def test_record_writes_in_the_background_with_user_key_and_cost(self):
+        set_current_user('carol')
+        self.addCleanup(set_current_user, None)
+        keys = self.ledger.attribute()
+        note_key('groq', 'abcd1234')
+
+        self.ledger.record('groq', 'llama', {"prompt_tokens": 1000, "completion_tokens": 500}, 0.25, keys=keys)
+        self.assertTrue(self.ledger.flush())
+
+        row = self.ledger.totals(group_by=['user', 'key'])[0]
+        self.assertEqual((row['user'], row['key'], row['requests']), ('carol', 'abcd1234', 1))
+        self.assertAlmostEqual(row['cost'], (1000 * 1.0 + 500 * 2.0) / 1_000_000)
+        self.assertEqual(row['latency_ms'], 250.0)
+        self.assertEqual(self.ledger.stats()['written'], 1)
+
+    def test_drops_records_when_the_queue_is_full(self):
+        ledger = self.new_ledger(max_queue=1)
+        ledger._worker = MagicMock()  # Keep the queue from draining
+
+        ledger.record('groq', 'llama')
+        ledger.record('groq', 'llama')
+
+        self.assertEqual(ledger.stats()['dropped'], 1)
+        self.assertEqual(ledger.stats()['queued'], 1)
+
+    def test_prunes_raw_rows_past_retention(self):
+        ledger = self.new_ledger(retention_days=30)
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=40)
+
+        ledger._write([entry(old), entry(datetime.datetime.utcnow())])
+
+        self.assertEqual(self.count(UsageRecord), 1)
+        self.assertEqual(ledger.totals(old - datetime.timedelta(days=1))[0]['requests'], 2)
+
+class TestCompletionServiceUsage(unittest.TestCase):
+    def setUp(self):
+        self.provider = MagicMock()
+        registry = MagicMock()
+        registry.get_provider.return_value = self.provider
+        self.ledger = MagicMock()
+        self.ledger.attribute.return_value = {'groq': 'k1'}
+        self.service = CompletionService(registry, coalescer=SingleFlight(), usage_ledger=self.ledger)
+        for patcher in (patch('app.services.completion_service.get_response_cache', return_value=None),
+                        patch('app.services.completion_service.get_semantic_cache', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_records_reported_usage(self):
+        usage = {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}
+        self.provider.generate_completion.return_value = {"text": "Hi", "usage": usage}
+
+        response = self.service.generate_completion('groq', 'llama', MESSAGES, hedge=False)
+
+        self.assertNotIn("usage_estimated", response)
+        args, kwargs = self.ledger.record.call_args
+        self.assertEqual(args[:3], ('groq', 'llama', usage))
+        self.assertFalse(args[4])
+        self.assertEqual(kwargs['keys'], {'groq': 'k1'})
+
+    def test_estimates_missing_usage(self):
+        self.provider.generate_completion.return_value = {"text": "Why did the chicken cross the road?"}
+
+        response = self.service.generate_completion('groq', 'llama', MESSAGES, hedge=False)
+
+        self.assertTrue(response["usage_estimated"])
+        self.assertEqual(response["usage"], {"prompt_tokens": 11, "completion_tokens": 9, "total_tokens": 20})
+        self.assertTrue(self.ledger.record.call_args[0][4])
+
+    def test_records_failed_calls(self):
+        self.provider.generate_completion.side_effect = RuntimeError("down")
+
+        with self.assertRaises(RuntimeError):
+            self.service.generate_completion('groq', 'llama', MESSAGES, hedge=False)
+
+        self.assertTrue(self.ledger.record.call_args[1]['error'])
+
+    def test_fills_in_stream_usage(self):
+        self.provider.stream_completion.side_effect = lambda *args: iter([
+            {"type": "delta", "text": "Why did the chicken "}, {"type": "delta", "text": "cross the road?"},
+            {"type": "usage", "finish_reason": "stop", "usage": None}])
+
+        events = list(self.service.stream_completion('groq', 'llama', MESSAGES, hedge=False))
+
+        self.assertEqual(events[-1]["usage"], {"prompt_tokens": 11, "completion_tokens": 9, "total_tokens": 20})
+        self.assertTrue(events[-1]["usage_estimated"])
+        self.assertEqual(self.ledger.record.call_count, 1)
+
+    def test_records_streams_closed_early(self):
+        self.provider.stream_completion.side_effect = lambda *args: iter([
+            {"type": "delta", "text": "Why"}, {"type": "delta", "text": " did"},
+            {"type": "usage", "finish_reason": "stop", "usage": None}])
+
+        with patch('app.services.completion_service.Config.COALESCE_REQUESTS', False):
+            events = self.service.stream_completion('groq', 'llama', MESSAGES, hedge=False)
+            next(events)
+            events.close()
+
+        self.assertEqual(self.ledger.record.call_count, 1)
+        self.assertEqual(self.ledger.record.call_args[0][2]['completion_tokens'], 1)
+
+class TestUsageRoutes(unittest.TestCase):
+    def setUp(self):
+        from app.routes import providers
+        self.app = Flask(__name__)
+        self.app.register_blueprint(providers.providers_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        self.ledger = MagicMock()
+        self.ledger.totals.return_value = [{"user": "alice", "requests": 2}]
+        patcher = patch.object(providers, 'get_usage_ledger', return_value=self.ledger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_usage_totals(self):
+        response = self.client.get('/api/usage?since=2024-03-01T00:00:00&group_by=user&provider=groq')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["usage"], [{"user": "alice", "requests": 2}])
+        self.ledger.totals.assert_called_once_with(datetime.datetime(2024, 3, 1), None, ['user'], provider='groq')
+
+    def test_invalid_queries_are_rejected(self):
+        self.ledger.totals.side_effect = ValueError("Invalid group_by: colour")
+
+        self.assertEqual(self.client.get('/api/usage?group_by=colour').status_code, 400)
+        self.assertEqual(self.client.get('/api/usage/series?since=soon').status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -108,16 +108,37 @@ export const streamMessage = async (data, onChunk) => {
     const reader = response.body.getReader();
     const decoder = new TextDecoder();
     let result = '';
+    let usage = null;
+    let buffer = '';
 
+    // The backend sends Server-Sent Events: text deltas as default events,
+    // then a final "usage" event (or an "error" event)
     while (true) {
       const { done, value } = await reader.read();
       if (done) break;
-      const chunk = decoder.decode(value, { stream: true });
-      result += chunk;
-      onChunk(chunk);
+      buffer += decoder.decode(value, { stream: true });
+      const frames = buffer.split('\n\n');
+      buffer = frames.pop();
+      for (const frame of frames) {
+        let event = 'message';
+        let payload = '';
+        for (const line of frame.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) payload += line.slice(5).trim();
+        }
+        if (!payload) continue;
+        const data = JSON.parse(payload);
+        if (event === 'error') throw new Error(data.error);
+        if (event === 'usage') {
+          usage = data.usage;
+        } else if (data.text) {
+          result += data.text;
+          onChunk(data.text);
+        }
+      }
     }
 
-    return { content: result };
+    return { content: result, usage };
   } catch (error) {
     console.error('Error streaming message:', error);
     return { error: error.message };